@@ -0,0 +1,96 @@
+"""
+Lettura diretta dei file delle risorse dal volume condiviso del Resource Manager.
+
+Se lo storage del Resource Manager è montato in sola lettura (RESOURCE_MANAGER_SHARED_STORAGE_ROOT),
+l'endpoint interno /handoff/ restituisce il percorso relativo del file e il suo SHA-256: il
+file viene aperto sul posto, senza trasferirlo via HTTP né copiarlo. Se il passaggio locale
+non è disponibile il chiamante usa l'endpoint /content/ come prima.
+"""
+import hashlib
+import logging
+from pathlib import Path
+
+import pandas as pd
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_shared_resource_path(resource_id):
+    """
+    Restituisce il percorso locale del file di una risorsa nel volume condiviso.
+
+    Args:
+        resource_id: ID della risorsa nel Resource Manager
+
+    Returns:
+        Path | None: Percorso del file (sola lettura), o None per ripiegare sull'HTTP
+    """
+    root = getattr(settings, 'RESOURCE_MANAGER_SHARED_STORAGE_ROOT', '')
+    if not root or not Path(root).is_dir():
+        return None
+
+    headers = {}
+    if settings.INTERNAL_API_SECRET_VALUE:
+        headers[settings.INTERNAL_API_SECRET_HEADER_NAME] = settings.INTERNAL_API_SECRET_VALUE
+
+    try:
+        response = requests.get(
+            f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/resources/{resource_id}/handoff/",
+            headers=headers, timeout=10
+        )
+        if response.status_code != 200:
+            return None
+        handoff = response.json()
+
+        root = Path(root).resolve()
+        path = (root / handoff['storage_path']).resolve()
+        # Il percorso non deve uscire dal volume condiviso
+        if root not in path.parents or not path.is_file():
+            return None
+        if handoff.get('size') is not None and path.stat().st_size != handoff['size']:
+            return None
+        if getattr(settings, 'SHARED_STORAGE_VERIFY_CHECKSUM', True) and handoff.get('sha256'):
+            if _file_sha256(path) != handoff['sha256']:
+                logger.warning("Shared storage: checksum mismatch for resource %s, falling back to HTTP.", resource_id)
+                return None
+        return path
+    except (requests.exceptions.RequestException, KeyError, ValueError, OSError) as e:
+        logger.warning("Shared storage handoff unavailable for resource %s: %s", resource_id, e)
+        return None
+
+
+def read_shared_csv(resource_id):
+    """
+    Legge il CSV di una risorsa direttamente dal volume condiviso.
+
+    Un file che non si riesce a decodificare o a interpretare (encoding diverso da UTF-8,
+    CSV malformato) non è un errore definitivo: si restituisce None e il chiamante ripiega
+    sull'endpoint /content/, che decodifica il contenuto come fa response.text.
+
+    Args:
+        resource_id: ID della risorsa nel Resource Manager
+
+    Returns:
+        DataFrame | None: Dataset letto dal volume condiviso, o None per ripiegare sull'HTTP
+    """
+    path = get_shared_resource_path(resource_id)
+    if path is None:
+        return None
+    try:
+        return pd.read_csv(path)
+    except (OSError, ValueError) as e:
+        # UnicodeDecodeError, ParserError ed EmptyDataError sono tutte sottoclassi di ValueError
+        logger.warning("Could not read shared storage file %s for resource %s, falling back to HTTP: %s", path, resource_id, e)
+        return None
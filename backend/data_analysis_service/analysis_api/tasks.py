@@ -31,6 +31,7 @@ from .ml_utils import (
     generate_regression_plot_data, generate_classification_plot_data, analyze_dataframe_for_potential_uses
 )
 import requests # Per chiamare Resource Manager
+from .storage_handoff import read_shared_csv
 import traceback # Per loggare stack trace completi in caso di errore
 
 # Costanti per header interno
@@ -111,6 +112,11 @@ def run_analysis_task(self, analysis_job_id_str):
         else:
             print(f"{task_id_log_prefix}   Warning: No analysis_session_id found in job input_parameters. Will try resource_id.")
 
+        if df is None and analysis_job.resource_id:
+            df = read_shared_csv(analysis_job.resource_id)
+            if df is not None:
+                print(f"{task_id_log_prefix}   Dataset read from shared storage. Shape: {df.shape}")
+
         if df is None and analysis_job.resource_id:
             print(f"{task_id_log_prefix}   Dataset not loaded from cache. Fetching from RM for resource_id: {analysis_job.resource_id}")
             resource_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/resources/{analysis_job.resource_id}/content/"
@@ -1,3 +1,84 @@
-from django.test import TestCase
+import hashlib
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from .storage_handoff import get_shared_resource_path, read_shared_csv
+
+
+class SharedStorageHandoffTests(SimpleTestCase):
+    """Catena di ripiego del passaggio locale: volume condiviso -> None (HTTP)."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        settings_override = override_settings(
+            RESOURCE_MANAGER_SHARED_STORAGE_ROOT=str(self.root),
+            RESOURCE_MANAGER_INTERNAL_URL='http://rm.test',
+            SHARED_STORAGE_VERIFY_CHECKSUM=True,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _write(self, name, data):
+        path = self.root / name
+        path.write_bytes(data)
+        return path
+
+    def _handoff(self, storage_path, data, **overrides):
+        payload = {
+            'storage_path': storage_path,
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+        payload.update(overrides)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = payload
+        return mock.patch('analysis_api.storage_handoff.requests.get', return_value=response)
+
+    def test_reads_csv_from_shared_volume(self):
+        data = b"a,b\n1,2\n3,4\n"
+        self._write('ok.csv', data)
+        with self._handoff('ok.csv', data):
+            df = read_shared_csv(1)
+        self.assertEqual(df.shape, (2, 2))
+        self.assertEqual(list(df.columns), ['a', 'b'])
+
+    def test_undecodable_file_falls_back(self):
+        data = "città,prezzo\nRoma,1\n".encode('latin-1')
+        self._write('latin1.csv', data)
+        with self._handoff('latin1.csv', data):
+            with self.assertLogs('analysis_api.storage_handoff', level='WARNING'):
+                self.assertIsNone(read_shared_csv(1))
+
+    def test_empty_file_falls_back(self):
+        self._write('empty.csv', b"")
+        with self._handoff('empty.csv', b""):
+            with self.assertLogs('analysis_api.storage_handoff', level='WARNING'):
+                self.assertIsNone(read_shared_csv(1))
+
+    def test_checksum_mismatch_falls_back(self):
+        data = b"a\n1\n"
+        self._write('changed.csv', data)
+        with self._handoff('changed.csv', data, sha256='0' * 64):
+            with self.assertLogs('analysis_api.storage_handoff', level='WARNING'):
+                self.assertIsNone(get_shared_resource_path(1))
+
+    def test_path_outside_root_falls_back(self):
+        data = b"a\n1\n"
+        with self._handoff('../outside.csv', data):
+            self.assertIsNone(get_shared_resource_path(1))
+
+    def test_handoff_endpoint_error_falls_back(self):
+        response = mock.Mock(status_code=404)
+        with mock.patch('analysis_api.storage_handoff.requests.get', return_value=response):
+            self.assertIsNone(read_shared_csv(1))
+
+    def test_missing_shared_root_skips_handoff(self):
+        with override_settings(RESOURCE_MANAGER_SHARED_STORAGE_ROOT=str(self.root / 'missing')):
+            with mock.patch('analysis_api.storage_handoff.requests.get') as get:
+                self.assertIsNone(read_shared_csv(1))
+        get.assert_not_called()
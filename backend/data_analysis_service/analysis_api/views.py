@@ -32,6 +32,7 @@ from .serializers import (
 )
 from .authentication import JWTCustomAuthentication
 from .tasks import run_analysis_task, generate_synthetic_csv_task
+from .storage_handoff import read_shared_csv
 
 # Costanti per header interno
 INTERNAL_API_HEADER = settings.INTERNAL_API_SECRET_HEADER_NAME
@@ -68,14 +69,16 @@ class SuggestAlgorithmView(views.APIView):
         if resource_id_from_data:
             actual_resource_id_used = str(resource_id_from_data) # Usiamo la stringa per la chiamata API
             print(f"Suggest Algo: Fetching dataset from Resource Manager for resource_id: {actual_resource_id_used}")
-            resource_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/resources/{actual_resource_id_used}/content/"
-            headers = {'Accept': 'text/csv'}
-            if INTERNAL_API_SECRET: headers[INTERNAL_API_HEADER] = INTERNAL_API_SECRET
-            
-            response = requests.get(resource_url, headers=headers, timeout=30)
-            response.raise_for_status()
-            csv_content = response.text
-            df = pd.read_csv(StringIO(csv_content))
+            df = read_shared_csv(actual_resource_id_used)
+            if df is None:
+                resource_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/resources/{actual_resource_id_used}/content/"
+                headers = {'Accept': 'text/csv'}
+                if INTERNAL_API_SECRET: headers[INTERNAL_API_HEADER] = INTERNAL_API_SECRET
+
+                response = requests.get(resource_url, headers=headers, timeout=30)
+                response.raise_for_status()
+                csv_content = response.text
+                df = pd.read_csv(StringIO(csv_content))
             # TODO: Recuperare original_filename dal Resource Manager se _get_dataframe_from_request lo usa
             # Per ora, non è critico per il flusso di suggestion.
             source_type = "resource_manager"
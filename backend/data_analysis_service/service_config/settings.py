@@ -97,4 +97,8 @@ if not OPENAI_API_KEY and DEBUG: # Avviso se manca in debug
 # Resource Manager Access
 RESOURCE_MANAGER_INTERNAL_URL = os.getenv('RESOURCE_MANAGER_INTERNAL_URL')
 INTERNAL_API_SECRET_HEADER_NAME = 'X-Internal-Secret'
-INTERNAL_API_SECRET_VALUE = os.getenv('INTERNAL_API_SECRET')
\ No newline at end of file
+INTERNAL_API_SECRET_VALUE = os.getenv('INTERNAL_API_SECRET')
+# Storage del Resource Manager montato in sola lettura: i CSV delle risorse vengono letti
+# direttamente dal volume condiviso invece che via HTTP (vuoto: sempre HTTP)
+RESOURCE_MANAGER_SHARED_STORAGE_ROOT = os.getenv('RESOURCE_MANAGER_SHARED_STORAGE_ROOT', '')
+SHARED_STORAGE_VERIFY_CHECKSUM = os.getenv('SHARED_STORAGE_VERIFY_CHECKSUM', 'True') == 'True'
@@ -1,15 +1,95 @@
 """
 Client per l'interazione con l'API OpenAI
 """
+import time
+import random
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+import openai
 from openai import OpenAI
 from django.conf import settings
 from .secrets_reader import get_openai_api_key
+from .tokenizer import get_token_counter
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Limiti dell'API embeddings OpenAI per singola richiesta
+EMBEDDING_MAX_INPUTS_PER_REQUEST = 2048
+EMBEDDING_MAX_TOKENS_PER_INPUT = 8191
+# Testi per richiesta embeddings usati di default da create_embeddings_batch
+EMBEDDING_TEXTS_PER_REQUEST = 100
+
+# Token aggiunti dal formato chat per ogni messaggio e per l'avvio della risposta
+CHAT_TOKENS_PER_MESSAGE = 3
+CHAT_TOKENS_REPLY_PRIMING = 3
+
+RAG_SYSTEM_PROMPT = """Sei un assistente intelligente e utile. La tua priorità è fornire risposte accurate e utili agli utenti.
+
+REGOLE PER LE RISPOSTE:
+1. Se viene fornito un contesto rilevante, utilizzalo come base primaria per la risposta e cita le fonti
+2. Per domande generali di conoscenza comune (saluti, definizioni basilari, concetti generali), puoi rispondere usando la tua conoscenza anche senza contesto specifico
+3. Per domande specifiche su documenti o argomenti tecnici dettagliati, se il contesto non contiene informazioni sufficienti, indica chiaramente questa limitazione
+4. Mantieni sempre un tono professionale, amichevole e utile
+5. Rispondi sempre in italiano
+6. Se non sei sicuro di una risposta, sii onesto e suggerisci alternative
+
+Ricorda: l'obiettivo è essere utile all'utente, bilanciando accuratezza e disponibilità."""
+
+RAG_CONTEXT_HINT = """
+
+Il contesto dai documenti sarà fornito nel messaggio dell'utente preceduto da "CONTESTO:"."""
+
+
+def build_rag_messages(context: str, question: str, stream: bool = False) -> List[Dict[str, str]]:
+    """
+    Messaggi (system + user) inviati a OpenAI per una risposta RAG.
+
+    Args:
+        context (str): Il contesto estratto dai documenti
+        question (str): La domanda dell'utente
+        stream (bool): Prompt della variante in streaming
+    """
+    system_prompt = RAG_SYSTEM_PROMPT if stream else RAG_SYSTEM_PROMPT + RAG_CONTEXT_HINT
+    user_message = f"""CONTESTO:
+{context}
+
+DOMANDA:
+{question}"""
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": user_message
+        }
+    ]
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """
+    Conta i token di prompt di una lista di messaggi chat (contenuti più formato dei messaggi).
+
+    Args:
+        messages (List[Dict[str, str]]): Messaggi nel formato dell'API chat
+        model (str): Modello di cui usare il tokenizer (default: OPENAI_CHAT_MODEL_NAME)
+    """
+    counter = get_token_counter(model or getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo'))
+    content_tokens = counter.count_many([message["content"] for message in messages])
+    return sum(content_tokens) + CHAT_TOKENS_PER_MESSAGE * len(messages) + CHAT_TOKENS_REPLY_PRIMING
+
+
+def count_rag_prompt_tokens(context: str, question: str, model: Optional[str] = None,
+                            stream: bool = False) -> int:
+    """
+    Token di prompt di una richiesta RAG (system prompt, contesto e domanda).
+    """
+    return count_message_tokens(build_rag_messages(context, question, stream=stream), model)
+
 class OpenAIClient:
     """
     Client per interagire con l'API OpenAI ChatCompletion
@@ -44,36 +124,7 @@ class OpenAIClient:
             Exception: In caso di errore nella chiamata API
         """
         try:
-            system_prompt = """Sei un assistente intelligente e utile. La tua priorità è fornire risposte accurate e utili agli utenti.
-
-REGOLE PER LE RISPOSTE:
-1. Se viene fornito un contesto rilevante, utilizzalo come base primaria per la risposta e cita le fonti
-2. Per domande generali di conoscenza comune (saluti, definizioni basilari, concetti generali), puoi rispondere usando la tua conoscenza anche senza contesto specifico
-3. Per domande specifiche su documenti o argomenti tecnici dettagliati, se il contesto non contiene informazioni sufficienti, indica chiaramente questa limitazione
-4. Mantieni sempre un tono professionale, amichevole e utile
-5. Rispondi sempre in italiano
-6. Se non sei sicuro di una risposta, sii onesto e suggerisci alternative
-
-Ricorda: l'obiettivo è essere utile all'utente, bilanciando accuratezza e disponibilità.
-
-Il contesto dai documenti sarà fornito nel messaggio dell'utente preceduto da "CONTESTO:"."""
-
-            user_message = f"""CONTESTO:
-{context}
-
-DOMANDA:
-{question}"""
-
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user", 
-                    "content": user_message
-                }
-            ]
+            messages = build_rag_messages(context, question)
             
             logger.info(f"Chiamata OpenAI API con modello: {self.model_name}")
             
@@ -110,34 +161,7 @@ DOMANDA:
             Exception: In caso di errore nella chiamata API
         """
         try:
-            system_prompt = """Sei un assistente intelligente e utile. La tua priorità è fornire risposte accurate e utili agli utenti.
-
-REGOLE PER LE RISPOSTE:
-1. Se viene fornito un contesto rilevante, utilizzalo come base primaria per la risposta e cita le fonti
-2. Per domande generali di conoscenza comune (saluti, definizioni basilari, concetti generali), puoi rispondere usando la tua conoscenza anche senza contesto specifico
-3. Per domande specifiche su documenti o argomenti tecnici dettagliati, se il contesto non contiene informazioni sufficienti, indica chiaramente questa limitazione
-4. Mantieni sempre un tono professionale, amichevole e utile
-5. Rispondi sempre in italiano
-6. Se non sei sicuro di una risposta, sii onesto e suggerisci alternative
-
-Ricorda: l'obiettivo è essere utile all'utente, bilanciando accuratezza e disponibilità."""
-
-            user_message = f"""CONTESTO:
-{context}
-
-DOMANDA:
-{question}"""
-
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_message
-                }
-            ]
+            messages = build_rag_messages(context, question, stream=True)
             
             logger.info(f"Chiamata OpenAI API in streaming con modello: {self.model_name}")
             
@@ -151,7 +175,7 @@ DOMANDA:
             )
             
             for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
                     yield chunk.choices[0].delta.content
                     
         except Exception as e:
@@ -163,17 +187,22 @@ class OpenAIEmbeddingClient:
     Client specifico per gli embeddings OpenAI con i nuovi modelli.
     """
     
-    def __init__(self):
+    def __init__(self, model: Optional[str] = None, dimensions: Optional[int] = None):
         """
         Inizializza il client per embeddings OpenAI.
+        
+        Args:
+            model (str): Modello di embedding (default: OPENAI_EMBEDDING_MODEL)
+            dimensions (int): Dimensioni dei vettori (default: OPENAI_EMBEDDING_DIMENSIONS)
         """
         try:
             self.api_key = get_openai_api_key()
-            self.client = OpenAI(api_key=self.api_key)
+            # I retry sono gestiti da _request_embeddings (backoff e Retry-After)
+            self.client = OpenAI(api_key=self.api_key, max_retries=0)
             
             # Configurazioni per i nuovi modelli di embedding
-            self.embedding_model = getattr(settings, 'OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
-            self.embedding_dimensions = getattr(settings, 'OPENAI_EMBEDDING_DIMENSIONS', None)
+            self.embedding_model = model or getattr(settings, 'OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+            self.embedding_dimensions = dimensions or getattr(settings, 'OPENAI_EMBEDDING_DIMENSIONS', None)
             
             # Mapping delle dimensioni predefinite per i modelli
             self.model_dimensions = {
@@ -182,6 +211,12 @@ class OpenAIEmbeddingClient:
                 'text-embedding-ada-002': 1536,  # Legacy model
             }
             
+            # Batching concorrente e limiti di rate
+            self.max_workers = int(getattr(settings, 'OPENAI_EMBEDDING_MAX_WORKERS', 4))
+            self.batch_max_tokens = int(getattr(settings, 'OPENAI_EMBEDDING_BATCH_MAX_TOKENS', 100000))
+            self.max_retries = int(getattr(settings, 'OPENAI_EMBEDDING_MAX_RETRIES', 5))
+            self.token_counter = get_token_counter(self.embedding_model)
+            
             logger.info(f"OpenAI Embedding Client inizializzato con modello: {self.embedding_model}")
             
             if self.embedding_dimensions:
@@ -194,6 +229,83 @@ class OpenAIEmbeddingClient:
             logger.error(f"Errore nell'inizializzazione del client OpenAI Embeddings: {str(e)}")
             raise
     
+    def _count_tokens(self, text: str) -> int:
+        """
+        Conta i token di un testo con tiktoken (stima caratteri/4 se non disponibile).
+        """
+        return self.token_counter.count(text)
+    
+    def _build_batches(self, texts: List[str], batch_size: int) -> List[Tuple[int, int]]:
+        """
+        Divide i testi in batch contigui rispettando numero di input e token per richiesta.
+        
+        Returns:
+            List[Tuple[int, int]]: Intervalli (inizio, fine) degli indici dei testi
+        """
+        max_inputs = min(batch_size, EMBEDDING_MAX_INPUTS_PER_REQUEST)
+        batches = []
+        start = 0
+        batch_tokens = 0
+        
+        for i, text in enumerate(texts):
+            tokens = min(self._count_tokens(text), EMBEDDING_MAX_TOKENS_PER_INPUT)
+            if i > start and (i - start >= max_inputs or batch_tokens + tokens > self.batch_max_tokens):
+                batches.append((start, i))
+                start = i
+                batch_tokens = 0
+            batch_tokens += tokens
+        
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+    
+    def _request_embeddings(self, inputs) -> List[List[float]]:
+        """
+        Esegue una richiesta all'API embeddings con retry e backoff esponenziale.
+        
+        Vengono ritentati i rate limit (429), gli errori 5xx, i timeout e gli errori di
+        connessione; se il server indica Retry-After si attende il tempo richiesto.
+        
+        Returns:
+            List[List[float]]: Embeddings nell'ordine degli input
+        """
+        params = {
+            'model': self.embedding_model,
+            'input': inputs,
+            'encoding_format': 'float'
+        }
+        
+        # Aggiungi dimensioni personalizzate se supportate
+        if (self.embedding_dimensions and 
+            self.embedding_model in ['text-embedding-3-small', 'text-embedding-3-large']):
+            params['dimensions'] = self.embedding_dimensions
+        
+        attempt = 0
+        while True:
+            try:
+                response = self.client.embeddings.create(**params)
+                # L'API restituisce l'indice di ogni input: riordina per sicurezza
+                return [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+            
+            except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                    openai.InternalServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                
+                delay = min(2 ** attempt, 60) * (0.5 + random.random() / 2)
+                response = getattr(e, 'response', None)
+                retry_after = response.headers.get('retry-after') if response is not None else None
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                
+                logger.warning(f"Richiesta embeddings fallita ({type(e).__name__}), "
+                               f"tentativo {attempt}/{self.max_retries} tra {delay:.1f}s")
+                time.sleep(delay)
+    
     def create_embedding(self, text: str) -> List[float]:
         """
         Crea un embedding per un singolo testo.
@@ -205,20 +317,7 @@ class OpenAIEmbeddingClient:
             List[float]: L'embedding del testo
         """
         try:
-            # Prepara i parametri per la chiamata API
-            params = {
-                'model': self.embedding_model,
-                'input': text,
-                'encoding_format': 'float'
-            }
-            
-            # Aggiungi dimensioni personalizzate se supportate
-            if (self.embedding_dimensions and 
-                self.embedding_model in ['text-embedding-3-small', 'text-embedding-3-large']):
-                params['dimensions'] = self.embedding_dimensions
-            
-            response = self.client.embeddings.create(**params)
-            embedding = response.data[0].embedding
+            embedding = self._request_embeddings(text)[0]
             
             logger.debug(f"Embedding creato: dimensioni {len(embedding)}")
             return embedding
@@ -227,42 +326,50 @@ class OpenAIEmbeddingClient:
             logger.error(f"Errore nella creazione dell'embedding: {str(e)}")
             raise Exception(f"Errore nella creazione dell'embedding: {str(e)}")
     
-    def create_embeddings_batch(self, texts: List[str], batch_size: int = 100) -> List[List[float]]:
+    def create_embeddings_batch(self, texts: List[str], batch_size: int = EMBEDDING_TEXTS_PER_REQUEST) -> List[List[float]]:
         """
         Crea embeddings per una lista di testi in batch.
         
+        I batch sono dimensionati per numero di testi e di token e vengono inviati in
+        parallelo (al massimo OPENAI_EMBEDDING_MAX_WORKERS richieste contemporanee);
+        il risultato mantiene sempre l'ordine dei testi in input.
+        
         Args:
             texts (List[str]): Lista di testi da processare
-            batch_size (int): Numero di testi per batch
+            batch_size (int): Numero massimo di testi per batch
             
         Returns:
             List[List[float]]: Lista di embeddings
         """
         try:
-            all_embeddings = []
+            if not texts:
+                return []
             
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                
-                # Prepara i parametri per la chiamata API
-                params = {
-                    'model': self.embedding_model,
-                    'input': batch,
-                    'encoding_format': 'float'
-                }
-                
-                # Aggiungi dimensioni personalizzate se supportate
-                if (self.embedding_dimensions and 
-                    self.embedding_model in ['text-embedding-3-small', 'text-embedding-3-large']):
-                    params['dimensions'] = self.embedding_dimensions
-                
-                response = self.client.embeddings.create(**params)
-                batch_embeddings = [data.embedding for data in response.data]
-                all_embeddings.extend(batch_embeddings)
-                
-                logger.debug(f"Batch {i//batch_size + 1}: {len(batch)} embeddings creati")
+            batches = self._build_batches(texts, batch_size)
+            results: List[Optional[List[List[float]]]] = [None] * len(batches)
+            
+            def embed_batch(position: int):
+                start, end = batches[position]
+                results[position] = self._request_embeddings(texts[start:end])
+                logger.debug(f"Batch {position + 1}/{len(batches)}: {end - start} embeddings creati")
             
-            logger.info(f"Totale embeddings creati: {len(all_embeddings)}")
+            workers = min(self.max_workers, len(batches))
+            if workers <= 1:
+                for position in range(len(batches)):
+                    embed_batch(position)
+            else:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='openai-embeddings') as executor:
+                    futures = [executor.submit(embed_batch, position) for position in range(len(batches))]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except Exception:
+                        for future in futures:
+                            future.cancel()
+                        raise
+            
+            all_embeddings = [embedding for batch_embeddings in results for embedding in batch_embeddings]
+            logger.info(f"Totale embeddings creati: {len(all_embeddings)} in {len(batches)} batch")
             return all_embeddings
             
         except Exception as e:
@@ -305,7 +412,8 @@ class OpenAIEmbeddingClient:
 
 # Istanze globali dei client (singleton pattern)
 _openai_client = None
-_openai_embedding_client = None
+_openai_embedding_clients = {}
+_openai_embedding_clients_lock = threading.Lock()
 
 def get_openai_client() -> OpenAIClient:
     """
@@ -319,14 +427,20 @@ def get_openai_client() -> OpenAIClient:
         _openai_client = OpenAIClient()
     return _openai_client
 
-def get_openai_embedding_client() -> OpenAIEmbeddingClient:
+def get_openai_embedding_client(model: Optional[str] = None,
+                                dimensions: Optional[int] = None) -> OpenAIEmbeddingClient:
     """
-    Ottieni l'istanza del client OpenAI per embeddings (singleton)
+    Ottieni l'istanza del client OpenAI per embeddings (una per modello e dimensioni)
+    
+    Args:
+        model (str): Modello di embedding (default: OPENAI_EMBEDDING_MODEL)
+        dimensions (int): Dimensioni dei vettori (default: OPENAI_EMBEDDING_DIMENSIONS)
     
     Returns:
         OpenAIEmbeddingClient: L'istanza del client per embeddings
     """
-    global _openai_embedding_client
-    if _openai_embedding_client is None:
-        _openai_embedding_client = OpenAIEmbeddingClient()
-    return _openai_embedding_client
\ No newline at end of file
+    key = (model, dimensions)
+    with _openai_embedding_clients_lock:
+        if key not in _openai_embedding_clients:
+            _openai_embedding_clients[key] = OpenAIEmbeddingClient(model, dimensions)
+        return _openai_embedding_clients[key]
\ No newline at end of file
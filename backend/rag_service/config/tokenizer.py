@@ -0,0 +1,95 @@
+"""
+Conteggio dei token condiviso tra client LLM, chunking e costruzione del contesto.
+
+Usa tiktoken con l'encoding del modello indicato (cl100k_base se il modello non è noto);
+se tiktoken o i suoi file BPE non sono disponibili ripiega su una stima per caratteri.
+"""
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Caratteri medi per token usati nella stima senza tiktoken
+CHARS_PER_TOKEN = 4
+
+DEFAULT_ENCODING = 'cl100k_base'
+
+
+class TokenCounter:
+    """
+    Contatore di token per un modello, con caricamento pigro dell'encoding.
+
+    Args:
+        model (str): Modello di cui usare il tokenizer (None per l'encoding di default)
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self._encoding = None
+        self._lock = threading.Lock()
+
+    def _get_encoding(self):
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    try:
+                        import tiktoken
+                        try:
+                            self._encoding = tiktoken.encoding_for_model(self.model) if self.model else \
+                                tiktoken.get_encoding(DEFAULT_ENCODING)
+                        except KeyError:
+                            self._encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+                    except Exception as e:
+                        logger.warning(f"tiktoken non disponibile, stima dei token per caratteri: {str(e)}")
+                        self._encoding = False
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        """
+        Indica se i conteggi sono esatti (tiktoken) o stimati.
+        """
+        return self._get_encoding() is not False
+
+    def count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is False:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(encoding.encode_ordinary(text))
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """
+        Conta i token di più testi (in parallelo con tiktoken).
+        """
+        encoding = self._get_encoding()
+        if encoding is False:
+            return [len(text) // CHARS_PER_TOKEN + 1 for text in texts]
+        return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Tronca il testo a ``max_tokens`` token.
+        """
+        encoding = self._get_encoding()
+        if encoding is False:
+            return text[:max_tokens * CHARS_PER_TOKEN]
+        tokens = encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+
+
+_counters: Dict[Optional[str], TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: Optional[str] = None) -> TokenCounter:
+    """
+    Restituisce il contatore di token (singleton per modello).
+    """
+    with _counters_lock:
+        counter = _counters.get(model)
+        if counter is None:
+            counter = _counters[model] = TokenCounter(model)
+        return counter
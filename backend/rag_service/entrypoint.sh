@@ -48,6 +48,13 @@ pika.BlockingConnection(connection_params)
     echo "RabbitMQ pronto!"
 }
 
+# Metriche Prometheus dei processi figli (worker gunicorn, prefork Celery): i file dell'avvio
+# precedente vanno eliminati, altrimenti i contatori ripartirebbero dai valori vecchi
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 # Determina il tipo di processo e avvia il servizio appropriato
 if [ "$SERVICE_PROCESS_TYPE" = "worker" ]; then
     echo "Avviando Celery worker per RAG..."
@@ -65,7 +72,8 @@ SentenceTransformer(model_name)
 print('Modello caricato con successo!')
 "
     
-    exec celery -A service_config worker --loglevel=INFO -Q rag_tasks -c 1
+    # Concorrenza configurabile: le importazioni in blocco processano più documenti in parallelo
+    exec celery -A service_config worker --loglevel=INFO -Q rag_tasks -c "${RAG_WORKER_CONCURRENCY:-2}"
 else
     echo "Avviando il servizio RAG web..."
     
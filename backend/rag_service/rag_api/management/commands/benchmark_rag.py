@@ -0,0 +1,127 @@
+"""
+Benchmark offline del retrieval RAG (ingestione, indici, latenza, recall, memoria).
+
+Esempi:
+    python manage.py benchmark_rag --documents 500 --output bench.json
+    python manage.py benchmark_rag --output bench.json --baseline bench-previous.json
+"""
+import json
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_api.utils.benchmark import RetrievalBenchmark, SyntheticCorpus, compare_results
+from rag_api.utils.vector_index import INDEX_TYPES
+
+
+class Command(BaseCommand):
+    help = ("Benchmark offline del retrieval RAG su un corpus sintetico con embeddings locali: "
+            "scrive i risultati in JSON per confrontarli tra release")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=200, help='Documenti del corpus sintetico')
+        parser.add_argument('--sentences', type=int, default=80, help='Frasi per documento')
+        parser.add_argument('--topics', type=int, default=20, help='Temi del corpus')
+        parser.add_argument('--queries', type=int, default=200, help='Query misurate')
+        parser.add_argument('--top-k', type=int, default=10, help='Risultati per query (k della recall)')
+        parser.add_argument('--dimension', type=int, default=384, help='Dimensione degli embeddings locali')
+        parser.add_argument('--index-types', default=','.join(INDEX_TYPES),
+                            help='Tipi di indice separati da virgola')
+        parser.add_argument('--embedding-latency-ms', type=float, default=0.0,
+                            help="Latenza simulata di ogni richiesta all'API di embedding")
+        parser.add_argument('--nprobe', type=int, default=None, help='Liste IVF visitate per query')
+        parser.add_argument('--ef-search', type=int, default=None, help='Ampiezza di ricerca HNSW')
+        parser.add_argument('--seed', type=int, default=0, help='Seme del corpus sintetico')
+        parser.add_argument('--work-dir', default=None,
+                            help='Directory di lavoro da conservare (default: temporanea, eliminata alla fine)')
+        parser.add_argument('--output', default=None, help='File JSON dei risultati (default: stdout)')
+        parser.add_argument('--baseline', default=None, help='Risultati di riferimento da confrontare')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Peggioramento relativo oltre cui una metrica è una regressione')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Esce con errore se il confronto con --baseline trova regressioni')
+
+    def handle(self, *args, **options):
+        index_types = [t.strip() for t in options['index_types'].split(',') if t.strip()]
+        unknown = [t for t in index_types if t not in INDEX_TYPES]
+        if unknown:
+            raise CommandError(f"Tipi di indice non supportati: {', '.join(unknown)} "
+                               f"(disponibili: {', '.join(INDEX_TYPES)})")
+        if options['documents'] < 1 or options['queries'] < 1:
+            raise CommandError('Servono almeno un documento e una query')
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], 'r', encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Impossibile leggere i risultati di riferimento: {str(e)}")
+
+        corpus = SyntheticCorpus(
+            options['documents'],
+            sentences_per_document=options['sentences'],
+            num_topics=options['topics'],
+            seed=options['seed']
+        )
+
+        def run(work_dir):
+            return RetrievalBenchmark(
+                Path(work_dir), corpus,
+                num_queries=options['queries'],
+                top_k=options['top_k'],
+                dimension=options['dimension'],
+                index_types=index_types,
+                embedding_latency_ms=options['embedding_latency_ms'],
+                nprobe=options['nprobe'],
+                ef_search=options['ef_search']
+            ).run()
+
+        self.stderr.write(f"Benchmark su {corpus.num_documents} documenti e {options['queries']} query...")
+        if options['work_dir']:
+            results = run(options['work_dir'])
+        else:
+            with tempfile.TemporaryDirectory(prefix='rag-benchmark-') as work_dir:
+                results = run(work_dir)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n', encoding='utf-8')
+            self.stderr.write(self.style.SUCCESS(f"Risultati scritti in {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+        self._write_summary(results)
+
+        if baseline is not None:
+            comparison = compare_results(baseline, results, tolerance=options['tolerance'])
+            regressions = self._write_comparison(comparison)
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{regressions} metriche peggiorate oltre la tolleranza")
+
+    def _write_summary(self, results):
+        ingestion = results['ingestion']
+        self.stderr.write(
+            f"Ingestione: {ingestion['documents_per_second']} documenti/s, "
+            f"{ingestion['chunks_per_second']} chunk/s ({ingestion['chunks']} chunk)"
+        )
+        for index_type, metrics in results['indices'].items():
+            latency = metrics['search_latency_ms']
+            self.stderr.write(
+                f"{index_type:>9}: build {metrics['build_seconds']}s, "
+                f"ricerca p50/p95/p99 {latency.get('p50')}/{latency.get('p95')}/{latency.get('p99')} ms, "
+                f"recall@{results['config']['top_k']} {metrics['recall_at_k']}"
+            )
+
+    def _write_comparison(self, comparison):
+        regressions = 0
+        for item in comparison:
+            line = (f"{item['metric']}: {item['baseline']} -> {item['current']} "
+                    f"({item['change'] * 100:+.1f}%)")
+            if item['regression']:
+                regressions += 1
+                self.stderr.write(self.style.ERROR(f"REGRESSIONE {line}"))
+            else:
+                self.stderr.write(line)
+        return regressions
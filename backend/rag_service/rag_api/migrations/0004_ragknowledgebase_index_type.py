@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0003_merge_20250624_1134'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragknowledgebase',
+            name='index_type',
+            field=models.CharField(choices=[('flat', 'Flat (esatto)'), ('ivf_flat', 'IVF-Flat'), ('hnsw', 'HNSW'), ('ivf_pq', 'IVF-PQ')], default='flat', max_length=20),
+        ),
+    ]
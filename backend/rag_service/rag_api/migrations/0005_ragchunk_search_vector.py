@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-16 20:54
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def populate_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    RAGChunk = apps.get_model('rag_api', 'RAGChunk')
+    config = getattr(settings, 'RAG_TEXT_SEARCH_CONFIG', 'italian')
+    RAGChunk.objects.filter(search_vector__isnull=True).update(
+        search_vector=SearchVector('text', config=config)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0004_ragknowledgebase_index_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragchunk',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ragchunk',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='rag_chunk_search_gin'),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0005_ragchunk_search_vector'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ragprocessinglog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0006_ragprocessinglog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RAGImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'In attesa'), ('running', 'In corso'), ('completed', 'Completato'), ('completed_with_errors', 'Completato con errori'), ('failed', 'Fallito')], default='pending', max_length=30)),
+                ('items', models.JSONField(default=list)),
+                ('total_items', models.IntegerField(default=0)),
+                ('dispatched_items', models.IntegerField(default=0)),
+                ('succeeded_items', models.IntegerField(default=0)),
+                ('failed_items', models.IntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('knowledge_base', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='rag_api.ragknowledgebase')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='ragdocument',
+            name='import_job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='documents', to='rag_api.ragimportjob'),
+        ),
+        migrations.AddIndex(
+            model_name='ragimportjob',
+            index=models.Index(fields=['user_id', 'status'], name='rag_api_rag_user_id_faacfc_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0007_ragimportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragknowledgebase',
+            name='rerank_candidates',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ragknowledgebase',
+            name='rerank_enabled',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ragknowledgebase',
+            name='rerank_model',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+    ]
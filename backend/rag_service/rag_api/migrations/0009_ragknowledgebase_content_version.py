@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0008_ragknowledgebase_rerank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragknowledgebase',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0009_ragknowledgebase_content_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragdocument',
+            name='embedding_engine',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='ragknowledgebase',
+            name='embedding_engine',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_api', '0010_embedding_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragdocument',
+            name='content_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
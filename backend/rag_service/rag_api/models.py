@@ -4,6 +4,8 @@ Modelli per il RAG service.
 import os
 import uuid
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
 from django.utils import timezone
 from pathlib import Path
@@ -33,6 +35,8 @@ class RAGDocument(models.Model):
     file_path = models.CharField(max_length=500)
     file_size = models.BigIntegerField()  # Dimensione in bytes
     file_type = models.CharField(max_length=100)  # MIME type
+    # SHA-256 del contenuto, noto per le risorse del Resource Manager (vuoto = da calcolare)
+    content_sha256 = models.CharField(max_length=64, blank=True)
     
     # Contenuto estratto
     extracted_text = models.TextField(blank=True)
@@ -47,6 +51,13 @@ class RAGDocument(models.Model):
     # Statistiche embedding
     num_chunks = models.IntegerField(default=0)
     embeddings_created = models.BooleanField(default=False)
+    # Motore di embedding (provider:modello:dimensioni) che ha creato i vettori (vuoto = non ancora noto)
+    embedding_engine = models.CharField(max_length=255, blank=True, db_index=True)
+    
+    # Job di importazione in blocco che ha creato il documento (se presente)
+    import_job = models.ForeignKey(
+        'RAGImportJob', on_delete=models.SET_NULL, null=True, blank=True, related_name='documents'
+    )
     
     # Timestamp
     created_at = models.DateTimeField(auto_now_add=True)
@@ -75,25 +86,63 @@ class RAGDocument(models.Model):
         return None
     
     def delete_file(self):
-        """Elimina il file fisico dal disco."""
+        """Elimina il file fisico dal disco (non quelli letti dal volume condiviso del Resource Manager)."""
+        from .utils.storage_handoff import is_shared_path
         try:
+            if is_shared_path(self.file_path):
+                return
             if self.file_path and os.path.exists(self.file_path):
                 os.remove(self.file_path)
         except Exception:
             pass  # Ignora errori nella cancellazione del file
     
+    def get_embedding_engine(self):
+        """
+        Motore di embedding dei vettori del documento.
+        
+        Per i documenti processati prima della registrazione del motore lo ricava dal
+        manifest degli embeddings e lo salva; senza vettori restituisce il motore predefinito.
+        """
+        from .utils.embedding_utils import get_engine_registry, engine_config_from_document
+        registry = get_engine_registry()
+        if not self.embedding_engine:
+            config = engine_config_from_document(self.id)
+            if config is None:
+                return registry.default()
+            self.embedding_engine = config.key
+            RAGDocument.objects.filter(id=self.id, embedding_engine='').update(embedding_engine=config.key)
+        return registry.get(self.embedding_engine)
+    
+    @classmethod
+    def group_by_engine(cls, document_ids):
+        """
+        Raggruppa i documenti per motore di embedding.
+        
+        Returns:
+            Dict[str, List[int]]: ID dei documenti per identificativo del motore
+        """
+        groups = {}
+        for document in cls.objects.filter(id__in=list(document_ids)).only('id', 'embedding_engine'):
+            groups.setdefault(document.get_embedding_engine().key, []).append(document.id)
+        return groups
+    
     def delete(self, *args, **kwargs):
         """Override del metodo delete per rimuovere anche il file."""
         self.delete_file()
         
-        # Elimina anche gli embeddings
-        from .utils.embedding_utils import get_embedding_manager
+        # Elimina anche gli embeddings e rimuove il documento dagli indici persistenti
         try:
-            embedding_manager = get_embedding_manager()
-            embedding_manager.delete_embeddings(self.id)
+            embedding_manager = self.get_embedding_engine()
+            scopes = [embedding_manager.user_scope(self.user_id)]
+            scopes += [
+                embedding_manager.kb_scope(kb_id)
+                for kb_id in self.ragknowledgebase_set.values_list('id', flat=True)
+            ]
+            embedding_manager.delete_embeddings(self.id, scopes=scopes)
         except Exception:
             pass  # Ignora errori nella cancellazione degli embeddings
         
+        RAGKnowledgeBase.bump_content_version_for_documents([self.id])
         super().delete(*args, **kwargs)
 
 class RAGChunk(models.Model):
@@ -113,6 +162,9 @@ class RAGChunk(models.Model):
     end_position = models.IntegerField(default=0)    # Posizione di fine nel testo originale
     text_length = models.IntegerField()
     
+    # Indice full-text (tsvector) per la ricerca lessicale, popolato in ingestione
+    search_vector = SearchVectorField(null=True, blank=True)
+    
     # Informazioni embedding
     embedding_created = models.BooleanField(default=False)
     embedding_dimension = models.IntegerField(null=True, blank=True)
@@ -125,6 +177,7 @@ class RAGChunk(models.Model):
         indexes = [
             models.Index(fields=['document', 'chunk_index']),
             models.Index(fields=['document', 'embedding_created']),
+            GinIndex(fields=['search_vector'], name='rag_chunk_search_gin'),
         ]
         unique_together = ['document', 'chunk_index']
     
@@ -161,8 +214,8 @@ class RAGProcessingLog(models.Model):
     # Dati aggiuntivi (JSON serialized)
     extra_data = models.JSONField(default=dict, blank=True)
     
-    # Timestamp
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Timestamp (default invece di auto_now_add: i log bufferizzati conservano l'ora dell'evento)
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-created_at']
@@ -180,6 +233,13 @@ class RAGKnowledgeBase(models.Model):
     Modello per gestire le knowledge base (collezioni di documenti).
     """
     
+    INDEX_TYPE_CHOICES = [
+        ('flat', 'Flat (esatto)'),
+        ('ivf_flat', 'IVF-Flat'),
+        ('hnsw', 'HNSW'),
+        ('ivf_pq', 'IVF-PQ'),
+    ]
+    
     # Proprietario - usa IntegerField per compatibilità con auth service
     user_id = models.IntegerField(null=True, blank=True)
     
@@ -194,6 +254,19 @@ class RAGKnowledgeBase(models.Model):
     chunk_size = models.IntegerField(default=1000)
     chunk_overlap = models.IntegerField(default=200)
     embedding_model = models.CharField(max_length=100, default='all-MiniLM-L6-v2')
+    # Motore di embedding (provider:modello:dimensioni) con cui è costruita la KB: le ricerche
+    # e i nuovi documenti della KB usano sempre questo (vuoto = non ancora assegnato)
+    embedding_engine = models.CharField(max_length=255, blank=True)
+    index_type = models.CharField(max_length=20, choices=INDEX_TYPE_CHOICES, default='flat')
+    
+    # Rerank dei chunk recuperati con un cross-encoder (None/vuoto = default del servizio)
+    rerank_enabled = models.BooleanField(null=True, blank=True)
+    rerank_model = models.CharField(max_length=200, blank=True)
+    rerank_candidates = models.PositiveIntegerField(null=True, blank=True)
+    
+    # Versione dei contenuti: aumenta quando cambiano documenti o configurazione
+    # (le risposte in cache delle versioni precedenti non vengono più usate)
+    content_version = models.PositiveIntegerField(default=0)
     
     # Statistiche
     total_documents = models.IntegerField(default=0)
@@ -212,6 +285,63 @@ class RAGKnowledgeBase(models.Model):
     def __str__(self):
         return self.name
     
+    @classmethod
+    def bump_content_version(cls, knowledge_base_ids):
+        """
+        Aumenta la versione dei contenuti delle knowledge base indicate e ne elimina
+        le risposte in cache.
+        """
+        from .utils.answer_cache import get_answer_cache
+        
+        knowledge_base_ids = list(knowledge_base_ids)
+        if not knowledge_base_ids:
+            return
+        cls.objects.filter(id__in=knowledge_base_ids).update(content_version=models.F('content_version') + 1)
+        try:
+            answer_cache = get_answer_cache()
+            for kb_id in knowledge_base_ids:
+                answer_cache.invalidate(f"kb:{kb_id}:")
+        except Exception:
+            pass  # Le risposte delle versioni precedenti non vengono comunque più trovate
+    
+    @classmethod
+    def bump_content_version_for_documents(cls, document_ids):
+        """
+        Aumenta la versione dei contenuti delle knowledge base che contengono i documenti indicati.
+        """
+        cls.bump_content_version(
+            cls.objects.filter(documents__in=list(document_ids)).values_list('id', flat=True).distinct()
+        )
+    
+    def get_embedding_engine(self):
+        """
+        Motore di embedding della knowledge base.
+        
+        Le knowledge base create prima della registrazione del motore vengono legate a
+        quello dei loro documenti già processati (o al motore predefinito) al primo uso.
+        """
+        from .utils.embedding_utils import get_engine_registry
+        registry = get_engine_registry()
+        if not self.embedding_engine:
+            document = self.documents.filter(status='processed', embeddings_created=True).first()
+            engine_key = document.get_embedding_engine().key if document else registry.default().key
+            # Con più richieste concorrenti vince la prima assegnazione
+            if not RAGKnowledgeBase.objects.filter(id=self.id, embedding_engine='').update(embedding_engine=engine_key):
+                engine_key = RAGKnowledgeBase.objects.values_list('embedding_engine', flat=True).get(id=self.id)
+            self.embedding_engine = engine_key
+        return registry.get(self.embedding_engine)
+    
+    def engine_documents(self, engine=None):
+        """
+        Documenti processati della KB con vettori del suo motore (o di motore non ancora noto).
+        """
+        engine = engine or self.get_embedding_engine()
+        return self.documents.filter(
+            status='processed',
+            embeddings_created=True,
+            embedding_engine__in=[engine.key, '']
+        )
+    
     def update_statistics(self):
         """Aggiorna le statistiche della knowledge base."""
         self.total_documents = self.documents.count()
@@ -234,6 +364,62 @@ class RAGKnowledgeBase(models.Model):
         return self.documents.filter(status='failed').count()
 
 
+class RAGImportJob(models.Model):
+    """
+    Job di importazione in blocco di documenti (file caricati o risorse del Resource Manager)
+    in una knowledge base. Il client ne interroga lo stato per seguire l'avanzamento.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'In attesa'),
+        ('running', 'In corso'),
+        ('completed', 'Completato'),
+        ('completed_with_errors', 'Completato con errori'),
+        ('failed', 'Fallito'),
+    ]
+    
+    # Proprietario - usa IntegerField per compatibilità con auth service
+    user_id = models.IntegerField(null=True, blank=True)
+    knowledge_base = models.ForeignKey(RAGKnowledgeBase, on_delete=models.CASCADE, related_name='import_jobs')
+    status = models.CharField(max_length=30, choices=STATUS_CHOICES, default='pending')
+    
+    # Elementi da importare: {'document_id': ...} per i file già caricati, {'resource_id': ...} per le risorse
+    items = models.JSONField(default=list)
+    
+    # Avanzamento (aggiornato dai task sotto lock della riga)
+    total_items = models.IntegerField(default=0)
+    dispatched_items = models.IntegerField(default=0)
+    succeeded_items = models.IntegerField(default=0)
+    failed_items = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    
+    # Timestamp
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user_id', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"Import {self.id} ({self.status}) - KB {self.knowledge_base_id}"
+    
+    @property
+    def finished_items(self):
+        """Numero di elementi completati (con successo o meno)."""
+        return self.succeeded_items + self.failed_items
+    
+    @property
+    def progress(self):
+        """Avanzamento percentuale del job."""
+        if not self.total_items:
+            return 100.0
+        return round(100.0 * self.finished_items / self.total_items, 1)
+
+
 class RAGChatSession(models.Model):
     """
     Modello per rappresentare una sessione di chat RAG.
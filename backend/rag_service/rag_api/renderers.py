@@ -0,0 +1,21 @@
+"""
+Renderer aggiuntivi per l'API RAG.
+"""
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Permette la negoziazione di ``Accept: text/event-stream`` sugli endpoint in streaming.
+
+    Il corpo della risposta è prodotto direttamente da uno StreamingHttpResponse;
+    il renderer viene usato solo per eventuali risposte di errore.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data, default=str)}\n\n".encode(self.charset)
@@ -3,7 +3,10 @@ Serializers per l'API RAG.
 """
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import RAGDocument, RAGChunk, RAGProcessingLog, RAGKnowledgeBase, RAGChatSession, RAGChatMessage
+from django.conf import settings
+from .models import (
+    RAGDocument, RAGChunk, RAGProcessingLog, RAGKnowledgeBase, RAGChatSession, RAGChatMessage, RAGImportJob
+)
 
 class RAGDocumentSerializer(serializers.ModelSerializer):
     """
@@ -33,6 +36,7 @@ class RAGDocumentSerializer(serializers.ModelSerializer):
             'processing_error',
             'num_chunks',
             'embeddings_created',
+            'embedding_engine',
             'has_content',
             'user_id',
             'created_at',
@@ -51,6 +55,7 @@ class RAGDocumentSerializer(serializers.ModelSerializer):
             'processing_error',
             'num_chunks',
             'embeddings_created',
+            'embedding_engine',
             'has_content',
             'created_at',
             'updated_at',
@@ -155,6 +160,12 @@ class RAGKnowledgeBaseSerializer(serializers.ModelSerializer):
             'chunk_size',
             'chunk_overlap',
             'embedding_model',
+            'embedding_engine',
+            'index_type',
+            'rerank_enabled',
+            'rerank_model',
+            'rerank_candidates',
+            'content_version',
             'total_documents',
             'total_chunks',
             'processed_documents_count',
@@ -166,6 +177,8 @@ class RAGKnowledgeBaseSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = [
             'id',
+            'embedding_engine',
+            'content_version',
             'total_documents',
             'total_chunks',
             'created_at',
@@ -182,6 +195,28 @@ class RAGKnowledgeBaseDetailSerializer(RAGKnowledgeBaseSerializer):
     class Meta(RAGKnowledgeBaseSerializer.Meta):
         fields = RAGKnowledgeBaseSerializer.Meta.fields + ['documents']
 
+def validate_rag_file(value):
+    """
+    Valida dimensione ed estensione di un file da caricare nel RAG.
+    """
+    # Controlla la dimensione del file (massimo 10MB per default)
+    max_size = 10 * 1024 * 1024  # 10MB
+    if value.size > max_size:
+        raise serializers.ValidationError(
+            f"Il file {value.name} è troppo grande. Dimensione massima: {max_size / (1024*1024):.1f}MB"
+        )
+    
+    # Controlla l'estensione del file
+    allowed_extensions = ['.pdf', '.docx', '.doc', '.txt', '.md', '.rtf']
+    file_extension = value.name.lower()
+    
+    if not any(file_extension.endswith(ext) for ext in allowed_extensions):
+        raise serializers.ValidationError(
+            f"Formato file non supportato per RAG. Formati consentiti: {', '.join(allowed_extensions)}"
+        )
+    
+    return value
+
 class RAGDocumentUploadSerializer(serializers.Serializer):
     """
     Serializer per l'upload di documenti o per il processing da Resource Manager.
@@ -216,24 +251,7 @@ class RAGDocumentUploadSerializer(serializers.Serializer):
         """
         if value is None:
             return value
-            
-        # Controlla la dimensione del file (massimo 10MB per default)
-        max_size = 10 * 1024 * 1024  # 10MB
-        if value.size > max_size:
-            raise serializers.ValidationError(
-                f"Il file è troppo grande. Dimensione massima: {max_size / (1024*1024):.1f}MB"
-            )
-        
-        # Controlla l'estensione del file
-        allowed_extensions = ['.pdf', '.docx', '.doc', '.txt', '.md', '.rtf']
-        file_extension = value.name.lower()
-        
-        if not any(file_extension.endswith(ext) for ext in allowed_extensions):
-            raise serializers.ValidationError(
-                f"Formato file non supportato per RAG. Formati consentiti: {', '.join(allowed_extensions)}"
-            )
-        
-        return value
+        return validate_rag_file(value)
     
     def validate_resource_id(self, value):
         """
@@ -277,6 +295,26 @@ class RAGChatSerializer(serializers.Serializer):
     )
     top_k = serializers.IntegerField(default=5, min_value=1, max_value=20)
     max_tokens = serializers.IntegerField(default=1000, min_value=100, max_value=2000)
+    nprobe = serializers.IntegerField(
+        required=False, min_value=1, max_value=1024,
+        help_text="Liste visitate negli indici IVF (più alto = recall maggiore, query più lenta)"
+    )
+    ef_search = serializers.IntegerField(
+        required=False, min_value=1, max_value=4096,
+        help_text="Ampiezza di ricerca negli indici HNSW (più alto = recall maggiore, query più lenta)"
+    )
+    rerank = serializers.BooleanField(
+        required=False, allow_null=True, default=None,
+        help_text="Riordina i candidati con il cross-encoder (se omesso vale la configurazione della knowledge base)"
+    )
+    rerank_candidates = serializers.IntegerField(
+        required=False, min_value=1, max_value=200,
+        help_text="Candidati recuperati prima del rerank"
+    )
+    debug = serializers.BooleanField(
+        required=False, default=False,
+        help_text="Aggiunge alla risposta il dettaglio dei tempi per fase (trace)"
+    )
     
     def validate_message(self, value):
         """
@@ -418,6 +456,60 @@ class KnowledgeBaseDocumentsSerializer(serializers.Serializer):
         
         return value
 
+class RAGBulkImportSerializer(serializers.Serializer):
+    """
+    Serializer per l'importazione in blocco di file e/o risorse in una knowledge base.
+    """
+    
+    files = serializers.ListField(child=serializers.FileField(), required=False, default=list)
+    resource_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    
+    def validate_files(self, value):
+        return [validate_rag_file(f) for f in value]
+    
+    def validate(self, data):
+        """
+        Valida che ci sia almeno un elemento e che non si superi il limite per job.
+        """
+        total = len(data['files']) + len(data['resource_ids'])
+        if total == 0:
+            raise serializers.ValidationError("Indicare almeno uno tra 'files' e 'resource_ids'")
+        
+        max_items = getattr(settings, 'RAG_IMPORT_MAX_ITEMS', 500)
+        if total > max_items:
+            raise serializers.ValidationError(f"Troppi elementi per un'importazione: massimo {max_items}")
+        
+        if len(set(data['resource_ids'])) != len(data['resource_ids']):
+            raise serializers.ValidationError("resource_ids contiene duplicati")
+        
+        return data
+
+class RAGImportJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer per lo stato di un job di importazione in blocco.
+    """
+    
+    finished_items = serializers.ReadOnlyField()
+    progress = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = RAGImportJob
+        fields = [
+            'id',
+            'knowledge_base',
+            'status',
+            'total_items',
+            'succeeded_items',
+            'failed_items',
+            'finished_items',
+            'progress',
+            'errors',
+            'created_at',
+            'started_at',
+            'completed_at',
+        ]
+        read_only_fields = fields
+
 # ===== CHAT SERIALIZERS =====
 
 class RAGChatSessionSerializer(serializers.ModelSerializer):
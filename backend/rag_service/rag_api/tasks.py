@@ -4,41 +4,71 @@ Task Celery per il processamento asincrono dei documenti RAG.
 import os
 import logging
 import time
-from typing import List, Dict, Any
-from celery import shared_task
+import tempfile
+import contextvars
+from collections import deque
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+import numpy as np
+from celery import group, shared_task
 from django.utils import timezone
 from django.conf import settings
+from django.db import transaction
 
-from .models import RAGDocument, RAGChunk, RAGProcessingLog
+from .models import RAGDocument, RAGChunk, RAGKnowledgeBase, RAGImportJob
 from .utils.text_extraction import TextExtractor, extract_text
+from .utils.chunking import Chunk, TextChunker
 from .utils.embedding_utils import get_embedding_manager
+from .utils.ingestion_persistence import ProcessingLogBuffer, replace_document_chunks
+from .utils.shared_extraction import compute_file_sha256, fetch_cached_segments
+from .utils.document_import import import_resource_document
+from .utils.tracing import start_trace, current_trace, record_stage, span, traced
 from config.llm_clients import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# Caratteri del testo estratto tenuti in memoria durante la pipeline prima di passare su file
+TEXT_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
 @shared_task(bind=True)
-def process_rag_document_task(self, document_id: int):
+def process_rag_document_task(self, document_id: int, update_indices: bool = True):
     """
     Task principale per processare un documento RAG.
     
-    Questo task coordina:
-    1. Estrazione del testo
+    Questo task coordina, in una pipeline a stream:
+    1. Estrazione del testo (pagina per pagina)
     2. Chunking del testo
-    3. Creazione degli embeddings
-    4. Salvataggio dei chunk nel database
+    3. Creazione degli embeddings (a batch, in parallelo all'estrazione)
+    4. Salvataggio incrementale di vettori e chunk
     
     Args:
         document_id (int): ID del documento da processare
+        update_indices (bool): Se False gli indici persistenti non vengono aggiornati
+            (l'importazione in blocco li aggiorna una volta sola alla fine)
         
     Returns:
         dict: Risultato del processamento
     """
+    # Le fasi del processamento finiscono nelle metriche e nel log di completamento
+    with start_trace('process_document') as trace:
+        result = _process_document(document_id, update_indices)
+        trace.failed = not result.get('success')
+        return result
+
+def _process_document(document_id: int, update_indices: bool) -> Dict[str, Any]:
+    """
+    Processamento di un documento (corpo di ``process_rag_document_task``).
+    """
     start_time = time.time()
     document = None
+    logs = None
     
     try:
         # Recupera il documento
         document = RAGDocument.objects.get(id=document_id)
+        # I log vengono scritti in blocco alla fine di ogni gruppo di step
+        logs = ProcessingLogBuffer(document)
         
         logger.info(f"Inizio processamento documento {document_id}: {document.original_filename}")
         
@@ -49,46 +79,42 @@ def process_rag_document_task(self, document_id: int):
         document.save(update_fields=['status', 'processing_started_at', 'processing_error'])
         
         # Log iniziale
-        _create_processing_log(document, 'info', 'Inizio processamento', 'initialization')
-        
-        # Step 1: Estrazione del testo
-        extracted_text = _extract_text_from_document(document)
+        logs.add('info', 'Inizio processamento', 'initialization')
         
-        # Step 2: Chunking del testo
-        chunks = _chunk_document_text(document, extracted_text)
-        
-        # Step 3: Creazione degli embeddings
-        _create_and_save_embeddings(document, chunks)
-        
-        # Step 4: Salvataggio dei chunk nel database
-        _save_chunks_to_database(document, chunks)
+        # Step 1-4: Estrazione, chunking, embeddings e salvataggio in pipeline
+        extracted_text, num_chunks = _run_ingestion_pipeline(document, logs)
         
         # Aggiorna le statistiche del documento
         document.extracted_text = extracted_text
         document.text_length = len(extracted_text)
-        document.num_chunks = len(chunks)
+        document.num_chunks = num_chunks
         document.embeddings_created = True
         document.status = 'processed'
         document.processing_completed_at = timezone.now()
         document.save(update_fields=[
             'extracted_text', 'text_length', 'num_chunks', 
-            'embeddings_created', 'status', 'processing_completed_at'
+            'embeddings_created', 'embedding_engine', 'status', 'processing_completed_at'
         ])
         
+        # Step 5: Aggiornamento incrementale degli indici persistenti
+        if update_indices:
+            _update_document_indices(document, logs)
+        
         processing_time = time.time() - start_time
         
         # Log finale
-        _create_processing_log(
-            document, 
+        logs.add(
             'info', 
             f'Processamento completato con successo in {processing_time:.2f}s', 
             'completion',
             extra_data={
                 'processing_time': processing_time,
                 'text_length': len(extracted_text),
-                'num_chunks': len(chunks)
+                'num_chunks': num_chunks,
+                'stages': current_trace().stage_totals() if current_trace() else {}
             }
         )
+        logs.flush()
         
         logger.info(f"Documento {document_id} processato con successo in {processing_time:.2f}s")
         
@@ -97,7 +123,7 @@ def process_rag_document_task(self, document_id: int):
             'document_id': document_id,
             'processing_time': processing_time,
             'text_length': len(extracted_text),
-            'num_chunks': len(chunks)
+            'num_chunks': num_chunks
         }
         
     except RAGDocument.DoesNotExist:
@@ -117,126 +143,186 @@ def process_rag_document_task(self, document_id: int):
                 document.processing_completed_at = timezone.now()
                 document.save(update_fields=['status', 'processing_error', 'processing_completed_at'])
                 
-                _create_processing_log(document, 'error', str(e), 'error')
+                logs.add('error', str(e), 'error')
+                logs.flush()
                 
             except Exception as save_error:
                 logger.error(f"Errore nel salvataggio dello stato di errore: {str(save_error)}")
         
         return {'success': False, 'error': str(e)}
 
-def _extract_text_from_document(document: RAGDocument) -> str:
+def _open_text_stream(document: RAGDocument, extractor: TextExtractor,
+                      logs: ProcessingLogBuffer) -> Iterator[str]:
     """
-    Estrae il testo dal file del documento.
+    Verifica il file del documento e apre lo stream dei segmenti di testo.
     
     Args:
         document (RAGDocument): Documento da processare
+        extractor (TextExtractor): Estrattore di testo
+        logs (ProcessingLogBuffer): Log di processamento del documento
         
     Returns:
-        str: Testo estratto
+        Iterator[str]: Segmenti di testo (pagine, paragrafi, blocchi)
         
     Raises:
-        Exception: Se l'estrazione fallisce
+        Exception: Se il file non esiste o il formato non è supportato
     """
     try:
-        _create_processing_log(document, 'info', 'Inizio estrazione testo', 'text_extraction')
+        logs.add('info', 'Inizio estrazione testo', 'text_extraction')
         
         # Verifica che il file esista
         if not os.path.exists(document.file_path):
             raise FileNotFoundError(f"File non trovato: {document.file_path}")
         
-        # Inizializza l'estrattore di testo
-        extractor = TextExtractor()
-        
         # Verifica se il formato è supportato
         if not extractor.is_supported_format(document.file_path):
             raise Exception(f"Formato file non supportato: {document.file_type}")
         
-        # Estrai il testo
-        extracted_text = extractor.extract_text(document.file_path)
-        
-        if not extracted_text.strip():
-            raise Exception("Nessun testo estratto dal documento")
+        # I file importati dal Resource Manager sono già stati estratti lì
+        if document.resource_id:
+            content_hash = document.content_sha256 or compute_file_sha256(document.file_path)
+            segments = fetch_cached_segments(content_hash)
+            if segments is not None:
+                logs.add(
+                    'info', 'Testo recuperato dalla cache di estrazione condivisa', 'text_extraction',
+                    extra_data={'content_sha256': content_hash}
+                )
+                return segments
         
-        _create_processing_log(
-            document, 
-            'info', 
-            f'Testo estratto con successo: {len(extracted_text)} caratteri', 
-            'text_extraction',
-            extra_data={'text_length': len(extracted_text)}
-        )
-        
-        return extracted_text
+        return extractor.iter_text(document.file_path)
         
     except Exception as e:
         error_msg = f"Errore nell'estrazione del testo: {str(e)}"
-        _create_processing_log(document, 'error', error_msg, 'text_extraction')
+        logs.add('error', error_msg, 'text_extraction')
         raise Exception(error_msg)
 
-def _chunk_document_text(document: RAGDocument, text: str) -> List[str]:
+def _iter_chunk_batches(chunks: Iterable[Chunk], batch_size: int) -> Iterator[List[Chunk]]:
+    """
+    Raggruppa uno stream di chunk in batch di dimensione fissa.
+    """
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _engine_for_document(document: RAGDocument):
     """
-    Divide il testo in chunk.
+    Motore con cui embeddare un documento: quello della sua knowledge base (anche di
+    destinazione di un'importazione in corso), altrimenti il motore predefinito.
+    """
+    kb = document.ragknowledgebase_set.order_by('id').first()
+    if kb is None and document.import_job_id:
+        kb = document.import_job.knowledge_base
+    if kb is not None:
+        return kb.get_embedding_engine()
+    return get_embedding_manager()
+
+def _run_ingestion_pipeline(document: RAGDocument, logs: ProcessingLogBuffer) -> Tuple[str, int]:
+    """
+    Estrae, divide, embedda e salva il documento come pipeline a stream.
+    
+    Il testo viene letto pagina per pagina e diviso in chunk man mano; ogni batch di
+    chunk viene embeddato in un thread mentre l'estrazione prosegue, e i vettori dei
+    batch completati vengono scritti subito su disco (shard). Un batch è grande almeno
+    quanto le richieste parallele del client embeddings (vedi
+    ``EmbeddingManager.ingestion_batch_size``), così la concorrenza del client viene usata
+    anche in ingestione. Le righe dei chunk vengono sostituite nel database alla fine, in
+    un'unica transazione, e la nuova generazione dei vettori viene pubblicata solo dopo
+    il commit. Il motore usato viene registrato in ``document.embedding_engine`` (salvato
+    dal chiamante).
+    
+    Durante lo stream restano in memoria solo i batch in volo: il testo estratto viene
+    accodato a un file temporaneo e dei chunk si tengono solo le posizioni. Il testo
+    completo viene caricato una volta alla fine, perché va comunque salvato in
+    ``extracted_text``; i testi dei chunk sono sue slice create a blocchi durante l'INSERT.
     
     Args:
-        document (RAGDocument): Documento
-        text (str): Testo da dividere
+        document (RAGDocument): Documento da processare
+        logs (ProcessingLogBuffer): Log di processamento (scritti alla fine della pipeline)
         
     Returns:
-        List[str]: Lista di chunk
+        Tuple[str, int]: Testo estratto e numero di chunk creati
     """
+    max_pending = max(1, getattr(settings, 'RAG_INGESTION_MAX_PENDING_BATCHES', 2))
+    
+    extractor = TextExtractor()
+    chunker = TextChunker()
+    embedding_manager = _engine_for_document(document)
+    batch_size = embedding_manager.ingestion_batch_size(getattr(settings, 'RAG_INGESTION_BATCH_SIZE', 128))
+    
+    text_spool = tempfile.SpooledTemporaryFile(max_size=TEXT_SPOOL_MAX_MEMORY, mode='w+', encoding='utf-8')
+    
+    def text_segments():
+        # L'estrazione è intercalata al chunking: se ne misura solo il tempo proprio
+        extraction_time = 0.0
+        started = time.perf_counter()
+        segments = _open_text_stream(document, extractor, logs)
+        while True:
+            segment = next(segments, None)
+            extraction_time += time.perf_counter() - started
+            if segment is None:
+                break
+            text_spool.write(segment)
+            yield segment
+            started = time.perf_counter()
+        record_stage('text_extraction', extraction_time)
+    
+    # Le posizioni dei chunk si riferiscono al testo estratto senza spazi iniziali (extracted_text)
+    chunks = chunker.iter_chunks(text_segments())
+    
+    writer = embedding_manager.open_document_writer(document.id)
+    stats = {'num_chunks': 0, 'reused_chunks': 0, 'dimension': None}
+    chunk_spans: List[Tuple[int, int]] = []
+    pending = deque()
+    
+    def persist_next():
+        batch, future = pending.popleft()
+        embeddings, reused = future.result()
+        with span('vector_write'):
+            _store_chunk_batch(writer, batch, embeddings, stats, chunk_spans)
+        stats['reused_chunks'] += reused
+    
     try:
-        _create_processing_log(document, 'info', 'Inizio chunking del testo', 'chunking')
-        
-        # Usa le configurazioni dalle impostazioni o valori di default
-        chunk_size = getattr(settings, 'RAG_MAX_CHUNK_SIZE', 1000)
-        chunk_overlap = getattr(settings, 'RAG_CHUNK_OVERLAP', 200)
-        
-        # Inizializza l'estrattore e crea i chunk
-        extractor = TextExtractor()
-        chunks = extractor.chunk_text(text, chunk_size, chunk_overlap)
-        
-        if not chunks:
-            raise Exception("Nessun chunk creato dal testo")
-        
-        _create_processing_log(
-            document,
-            'info',
-            f'Chunking completato: {len(chunks)} chunk creati',
-            'chunking',
+        logs.add(
+            'info', 'Inizio chunking e creazione embeddings', 'embedding_creation',
             extra_data={
-                'num_chunks': len(chunks),
-                'chunk_size': chunk_size,
-                'chunk_overlap': chunk_overlap
+                'max_tokens': chunker.max_tokens,
+                'overlap_tokens': chunker.overlap_tokens,
+                'exact_tokens': chunker.token_counter.exact,
+                'batch_size': batch_size
             }
         )
         
-        return chunks
-        
-    except Exception as e:
-        error_msg = f"Errore nel chunking del testo: {str(e)}"
-        _create_processing_log(document, 'error', error_msg, 'chunking')
-        raise Exception(error_msg)
-
-def _create_and_save_embeddings(document: RAGDocument, chunks: List[str]):
-    """
-    Crea e salva gli embeddings per i chunk.
-    
-    Args:
-        document (RAGDocument): Documento
-        chunks (List[str]): Lista di chunk di testo
-    """
-    try:
-        _create_processing_log(document, 'info', 'Inizio creazione embeddings', 'embedding_creation')
-        
-        # Ottieni il manager degli embeddings
-        embedding_manager = get_embedding_manager()
-        
-        # Crea gli embeddings
-        embeddings = embedding_manager.create_embeddings(chunks)
-        
-        if embeddings.size == 0:
-            raise Exception("Nessun embedding creato")
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='rag-embed') as executor:
+            try:
+                for batch in _iter_chunk_batches(chunks, batch_size):
+                    texts = [chunk.text for chunk in batch]
+                    # Il contesto copiato porta la traccia del task nel thread degli embeddings
+                    pending.append((batch, executor.submit(
+                        contextvars.copy_context().run, embedding_manager.create_chunk_embeddings, texts
+                    )))
+                    # Limita i batch in volo: chunk ed embeddings in memoria non crescono col documento
+                    while len(pending) >= max_pending:
+                        persist_next()
+                
+                while pending:
+                    persist_next()
+            except BaseException:
+                for _, future in pending:
+                    future.cancel()
+                raise
+        
+        text_spool.seek(0)
+        extracted_text = text_spool.read().strip()
+        text_spool.close()
+        
+        if not extracted_text or stats['num_chunks'] == 0:
+            raise Exception("Nessun testo estratto dal documento")
         
-        # Prepara i metadati
         metadata = {
             'document_id': document.id,
             'filename': document.original_filename,
@@ -244,96 +330,416 @@ def _create_and_save_embeddings(document: RAGDocument, chunks: List[str]):
             'model_name': embedding_manager.model_name,
             'created_at': timezone.now().isoformat()
         }
-        
-        # Salva gli embeddings su disco
-        embedding_manager.save_embeddings(document.id, embeddings, chunks, metadata)
-        
-        _create_processing_log(
-            document,
+        # Chunk e indice full-text in un'unica transazione; i vettori vengono pubblicati solo
+        # dopo il commit (se il commit fallisce, abort scarta la generazione non pubblicata)
+        with span('chunk_persist'):
+            with transaction.atomic():
+                replace_document_chunks(document, _iter_chunk_rows(
+                    document, extracted_text, chunk_spans, stats['dimension']
+                ))
+            writer.close(metadata)
+        chunk_spans.clear()
+        document.embedding_engine = embedding_manager.key
+        
+        logs.add(
             'info',
-            f'Embeddings creati e salvati: {embeddings.shape}',
+            f"Pipeline completata: {len(extracted_text)} caratteri, {stats['num_chunks']} chunk",
             'embedding_creation',
             extra_data={
-                'embedding_shape': embeddings.shape,
-                'model_name': embedding_manager.model_name
+                'text_length': len(extracted_text),
+                'num_chunks': stats['num_chunks'],
+                'embedding_dimension': stats['dimension'],
+                'model_name': embedding_manager.model_name,
+                'embedding_engine': embedding_manager.key,
+                'reused_chunks': stats['reused_chunks'],
+                'embedded_chunks': stats['num_chunks'] - stats['reused_chunks']
             }
         )
         
+        return extracted_text, stats['num_chunks']
+        
     except Exception as e:
-        error_msg = f"Errore nella creazione degli embeddings: {str(e)}"
-        _create_processing_log(document, 'error', error_msg, 'embedding_creation')
+        # La nuova generazione dei vettori viene scartata (se non ancora pubblicata); il
+        # documento fallito non è ricercabile, quindi vengono rimossi anche i suoi chunk
+        writer.abort()
+        RAGChunk.objects.filter(document=document).delete()
+        error_msg = f"Errore nella pipeline di ingestione: {str(e)}"
+        logs.add('error', error_msg, 'embedding_creation')
         raise Exception(error_msg)
+    
+    finally:
+        text_spool.close()
+        logs.flush()
 
-def _save_chunks_to_database(document: RAGDocument, chunks: List[str]):
+def _store_chunk_batch(writer, chunks: List[Chunk], embeddings: np.ndarray,
+                       stats: Dict[str, Any], chunk_spans: List[Tuple[int, int]]):
     """
-    Salva i chunk nel database.
+    Scrive su disco (shard) i vettori di un batch di chunk e ne registra le posizioni.
     
     Args:
-        document (RAGDocument): Documento
-        chunks (List[str]): Lista di chunk di testo
+        writer (DocumentWriter): Writer degli embeddings del documento
+        chunks (List[Chunk]): Chunk del batch, con le posizioni nel testo estratto
+        embeddings (np.ndarray): Embeddings dei chunk
+        stats (Dict): Contatori della pipeline (aggiornati in place)
+        chunk_spans (List[Tuple[int, int]]): Posizioni (start, end) dei chunk (aggiornate in place)
+    """
+    if embeddings.size == 0:
+        raise Exception("Nessun embedding creato")
+    
+    writer.append(embeddings, [chunk.text for chunk in chunks])
+    dimension = int(embeddings.shape[1])
+    stats['dimension'] = dimension
+    
+    for chunk in chunks:
+        chunk_spans.append((chunk.start, chunk.end))
+        stats['num_chunks'] += 1
+
+def _iter_chunk_rows(document: RAGDocument, extracted_text: str, chunk_spans: List[Tuple[int, int]],
+                     dimension: int) -> Iterator[RAGChunk]:
+    """
+    Righe dei chunk da inserire, con i testi ricavati dalle posizioni nel testo estratto.
+    """
+    for chunk_index, (start, end) in enumerate(chunk_spans):
+        text = extracted_text[start:end]
+        yield RAGChunk(
+            document=document,
+            text=text,
+            chunk_index=chunk_index,
+            start_position=start,
+            end_position=end,
+            text_length=len(text),
+            embedding_created=True,
+            embedding_dimension=dimension
+        )
+
+@traced('index_update')
+def _update_document_indices(document: RAGDocument, logs: ProcessingLogBuffer):
+    """
+    Aggiunge il documento agli indici persistenti del suo utente e delle sue knowledge base.
+    
+    Gli indici sono quelli del motore del documento; le knowledge base costruite con un
+    altro motore non lo includono (va riprocessato). Un errore qui non invalida il
+    processamento: gli indici vengono comunque riallineati alla prima ricerca.
+    
+    Args:
+        document (RAGDocument): Documento processato
+        logs (ProcessingLogBuffer): Log di processamento del documento
     """
     try:
-        _create_processing_log(document, 'info', 'Salvataggio chunk nel database', 'database_save')
-        
-        # Elimina eventuali chunk esistenti
-        RAGChunk.objects.filter(document=document).delete()
+        embedding_manager = document.get_embedding_engine()
+        scope_types = {embedding_manager.user_scope(document.user_id): None}
+        kb_ids = []
+        for kb in document.ragknowledgebase_set.all():
+            kb_ids.append(kb.id)
+            if kb.get_embedding_engine().key != embedding_manager.key:
+                logs.add(
+                    'warning',
+                    f'Knowledge base {kb.id} costruita con un altro motore di embedding: documento non indicizzato',
+                    'index_update',
+                    extra_data={'knowledge_base_engine': kb.embedding_engine, 'document_engine': embedding_manager.key}
+                )
+                continue
+            scope_types[embedding_manager.kb_scope(kb.id)] = kb.index_type
+        scopes = list(scope_types)
+        
+        for scope, index_type in scope_types.items():
+            embedding_manager.add_documents_to_index(scope, [document.id], index_type=index_type)
+        
+        # Il documento (ri)processato cambia i contenuti delle sue knowledge base
+        RAGKnowledgeBase.bump_content_version(kb_ids)
+        
+        logs.add(
+            'info',
+            f'Documento aggiunto a {len(scopes)} indici',
+            'index_update',
+            extra_data={'scopes': scopes}
+        )
         
-        # Crea i nuovi chunk
-        chunk_objects = []
-        current_position = 0
+    except Exception as e:
+        logger.warning(f"Errore nell'aggiornamento degli indici per documento {document.id}: {str(e)}")
+        logs.add('warning', f"Errore nell'aggiornamento degli indici: {str(e)}", 'index_update')
+
+@shared_task
+def rebuild_knowledge_base_index_task(knowledge_base_id: int):
+    """
+    Allinea l'indice persistente di una knowledge base al suo tipo di indice.
+    
+    Args:
+        knowledge_base_id (int): ID della knowledge base
         
-        for i, chunk_text in enumerate(chunks):
-            chunk_obj = RAGChunk(
-                document=document,
-                text=chunk_text,
-                chunk_index=i,
-                start_position=current_position,
-                end_position=current_position + len(chunk_text),
-                text_length=len(chunk_text),
-                embedding_created=True,
-                embedding_dimension=384  # Dimensione tipica per all-MiniLM-L6-v2
-            )
-            chunk_objects.append(chunk_obj)
-            current_position += len(chunk_text)
+    Returns:
+        dict: Risultato della ricostruzione
+    """
+    try:
+        kb = RAGKnowledgeBase.objects.get(id=knowledge_base_id)
+        embedding_manager = kb.get_embedding_engine()
+        scope = embedding_manager.kb_scope(kb.id)
         
-        # Salvataggio in batch
-        RAGChunk.objects.bulk_create(chunk_objects)
+        index = embedding_manager.sync_index(scope, list(
+            kb.engine_documents(embedding_manager).values_list('id', flat=True)
+        ), index_type=kb.index_type)
         
-        _create_processing_log(
-            document,
-            'info',
-            f'{len(chunk_objects)} chunk salvati nel database',
-            'database_save',
-            extra_data={'num_chunks_saved': len(chunk_objects)}
-        )
+        return {
+            'success': True,
+            'index_type': index.index_type,
+            'built_type': index.built_type,
+            'vectors': index.ntotal
+        }
         
+    except RAGKnowledgeBase.DoesNotExist:
+        return {'success': False, 'error': f'Knowledge base {knowledge_base_id} non trovata'}
     except Exception as e:
-        error_msg = f"Errore nel salvataggio dei chunk: {str(e)}"
-        _create_processing_log(document, 'error', error_msg, 'database_save')
-        raise Exception(error_msg)
+        logger.error(f"Errore nella ricostruzione dell'indice della KB {knowledge_base_id}: {str(e)}")
+        return {'success': False, 'error': str(e)}
 
-def _create_processing_log(document: RAGDocument, level: str, message: str, 
-                          step: str = '', extra_data: Dict[str, Any] = None):
+def dispatch_import_items(user_id: int):
     """
-    Crea un log di processamento.
+    Invia ai worker gli elementi in attesa dei job di importazione dell'utente.
+    
+    Gli elementi in corso per utente restano entro RAG_IMPORT_MAX_CONCURRENCY_PER_USER:
+    ogni elemento completato richiama questa funzione per liberare il proprio posto,
+    così un'importazione grande non monopolizza i worker degli altri utenti.
     
     Args:
-        document (RAGDocument): Documento
-        level (str): Livello del log ('debug', 'info', 'warning', 'error')
-        message (str): Messaggio del log
-        step (str): Step del processamento
-        extra_data (Dict): Dati aggiuntivi
+        user_id (int): ID dell'utente
+    """
+    limit = max(1, getattr(settings, 'RAG_IMPORT_MAX_CONCURRENCY_PER_USER', 2))
+    to_dispatch = []
+    
+    for job_id in _release_stale_import_items(user_id):
+        _finalize_import_job(job_id)
+    
+    with transaction.atomic():
+        jobs = list(RAGImportJob.objects.select_for_update().filter(
+            user_id=user_id,
+            status__in=['pending', 'running']
+        ).order_by('created_at'))
+        
+        slots = limit - sum(job.dispatched_items - job.finished_items for job in jobs)
+        dispatched_at = timezone.now().isoformat()
+        for job in jobs:
+            count = min(slots, job.total_items - job.dispatched_items)
+            if count <= 0:
+                continue
+            indices = range(job.dispatched_items, job.dispatched_items + count)
+            to_dispatch.extend((job.id, index) for index in indices)
+            for index in indices:
+                job.items[index]['dispatched_at'] = dispatched_at
+            job.dispatched_items += count
+            slots -= count
+            
+            update_fields = ['dispatched_items', 'items']
+            if job.status == 'pending':
+                job.status = 'running'
+                job.started_at = timezone.now()
+                update_fields += ['status', 'started_at']
+            job.save(update_fields=update_fields)
+    
+    if to_dispatch:
+        transaction.on_commit(lambda: group(
+            import_job_item_task.s(job_id, index) for job_id, index in to_dispatch
+        ).apply_async())
+
+def _release_stale_import_items(user_id: int) -> List[int]:
+    """
+    Segna come falliti gli elementi in corso da più di RAG_IMPORT_ITEM_STALE_SECONDS senza
+    esito (task perso con il worker), liberando il loro posto nella concorrenza dell'utente.
+    
+    Returns:
+        List[int]: Job rimasti senza elementi in corso, da chiudere
+    """
+    stale_seconds = getattr(settings, 'RAG_IMPORT_ITEM_STALE_SECONDS', 3600)
+    cutoff = (timezone.now() - timedelta(seconds=stale_seconds)).isoformat()
+    finished_jobs = []
+    
+    with transaction.atomic():
+        jobs = RAGImportJob.objects.select_for_update().filter(user_id=user_id, status='running')
+        for job in jobs:
+            released = False
+            for index in range(job.dispatched_items):
+                item = job.items[index]
+                last_seen = item.get('started_at') or item.get('dispatched_at')
+                if item.get('status') or not last_seen or last_seen > cutoff:
+                    continue
+                logger.warning(f"Elemento {index} del job {job.id} senza esito dal {last_seen}: segnato come fallito")
+                _apply_import_item_result(job, index, item.get('document_id'),
+                                          'Importazione interrotta (worker terminato o tempo scaduto)')
+                released = True
+            if released:
+                job.save(update_fields=['items', 'succeeded_items', 'failed_items', 'errors'])
+                if job.finished_items >= job.total_items:
+                    finished_jobs.append(job.id)
+    return finished_jobs
+
+def _start_import_item(job_id: int, item_index: int):
+    """
+    Segna l'avvio di un elemento (sotto lock) e ne restituisce lo stato corrente.
+    """
+    with transaction.atomic():
+        job = RAGImportJob.objects.select_for_update().get(id=job_id)
+        item = job.items[item_index]
+        if not item.get('status'):
+            item['started_at'] = timezone.now().isoformat()
+            job.save(update_fields=['items'])
+        return job, dict(item)
+
+def _claim_import_document(job_id: int, item_index: int, document_id: int) -> int:
+    """
+    Salva sull'elemento il documento appena creato, prima del processamento: un task
+    riconsegnato dal broker (acks_late) riusa lo stesso documento invece di crearne un altro.
+    
+    Returns:
+        int: Documento dell'elemento (quello già registrato da una consegna concorrente, se c'è)
+    """
+    with transaction.atomic():
+        job = RAGImportJob.objects.select_for_update().get(id=job_id)
+        item = job.items[item_index]
+        if item.get('document_id') is not None:
+            return item['document_id']
+        item['document_id'] = document_id
+        job.save(update_fields=['items'])
+        return document_id
+
+@shared_task(
+    soft_time_limit=getattr(settings, 'RAG_IMPORT_ITEM_TIME_LIMIT', 1800),
+    time_limit=getattr(settings, 'RAG_IMPORT_ITEM_TIME_LIMIT', 1800) + 60
+)
+def import_job_item_task(job_id: int, item_index: int):
+    """
+    Importa e processa un elemento di un job di importazione in blocco.
+    
+    Oltre RAG_IMPORT_ITEM_TIME_LIMIT secondi il task viene interrotto e l'elemento
+    registrato come fallito.
+    
+    Args:
+        job_id (int): ID del job
+        item_index (int): Indice dell'elemento in job.items
+        
+    Returns:
+        dict: Risultato dell'elemento
     """
     try:
-        RAGProcessingLog.objects.create(
-            document=document,
-            level=level,
-            message=message,
-            step=step,
-            extra_data=extra_data or {}
-        )
+        job, item = _start_import_item(job_id, item_index)
+    except RAGImportJob.DoesNotExist:
+        return {'success': False, 'error': f'Job di importazione {job_id} non trovato'}
+    
+    document_id = item.get('document_id')
+    if item.get('status'):
+        # Consegna ripetuta di un elemento già concluso
+        dispatch_import_items(job.user_id)
+        return {'success': item['status'] == 'succeeded', 'document_id': document_id, 'error': None}
+    
+    error = None
+    
+    try:
+        if document_id is None:
+            document = import_resource_document(job.user_id, item['resource_id'], import_job=job)
+            document_id = _claim_import_document(job_id, item_index, document.id)
+            if document_id != document.id:
+                document.delete()
+        
+        # Gli indici vengono aggiornati una volta sola alla fine del job
+        result = process_rag_document_task(document_id, update_indices=False)
+        if not result.get('success'):
+            error = result.get('error', 'Errore sconosciuto')
     except Exception as e:
-        logger.error(f"Errore nella creazione del log: {str(e)}")
+        logger.error(f"Errore nell'importazione dell'elemento {item_index} del job {job_id}: {str(e)}")
+        error = str(e)
+    
+    _record_import_item(job_id, item_index, document_id, error)
+    dispatch_import_items(job.user_id)
+    
+    return {'success': error is None, 'document_id': document_id, 'error': error}
+
+def _record_import_item(job_id: int, item_index: int, document_id: int, error: str = None):
+    """
+    Registra l'esito di un elemento sul job (sotto lock) e chiude il job all'ultimo elemento.
+    """
+    with transaction.atomic():
+        job = RAGImportJob.objects.select_for_update().get(id=job_id)
+        
+        # Un task riconsegnato dal broker non conta due volte lo stesso elemento
+        if job.items[item_index].get('status'):
+            return
+        
+        _apply_import_item_result(job, item_index, document_id, error)
+        job.save(update_fields=['items', 'succeeded_items', 'failed_items', 'errors'])
+        finished = job.finished_items >= job.total_items
+    
+    if finished:
+        _finalize_import_job(job_id)
+
+def _apply_import_item_result(job: RAGImportJob, item_index: int, document_id: int, error: str = None):
+    """
+    Aggiorna elemento e contatori del job (bloccato dal chiamante) con l'esito dell'elemento.
+    """
+    item = job.items[item_index]
+    item['document_id'] = document_id
+    item['status'] = 'failed' if error else 'succeeded'
+    if error:
+        job.failed_items += 1
+        job.errors.append({
+            'item': item_index,
+            'resource_id': item.get('resource_id'),
+            'document_id': document_id,
+            'error': error
+        })
+    else:
+        job.succeeded_items += 1
+
+def _finalize_import_job(job_id: int):
+    """
+    Aggiunge alla knowledge base i documenti importati con successo e aggiorna gli indici
+    con un'unica operazione incrementale per indice.
+    
+    I documenti degli elementi falliti restano dell'utente (con il loro errore) ma non
+    entrano nella knowledge base.
+    """
+    job = RAGImportJob.objects.select_related('knowledge_base').get(id=job_id)
+    kb = job.knowledge_base
+    
+    succeeded_ids = [
+        item['document_id'] for item in job.items
+        if item.get('status') == 'succeeded' and item.get('document_id') is not None
+    ]
+    processed_ids = list(RAGDocument.objects.filter(
+        id__in=succeeded_ids, status='processed', embeddings_created=True
+    ).values_list('id', flat=True))
+    
+    kb.documents.add(*processed_ids)
+    kb.update_statistics()
+    RAGKnowledgeBase.bump_content_version([kb.id])
+    
+    if processed_ids:
+        try:
+            # Ogni documento va negli indici del suo motore; nella KB solo quelli del motore della KB
+            kb_engine = kb.get_embedding_engine()
+            by_engine = RAGDocument.group_by_engine(processed_ids)
+            for engine_key, engine_document_ids in by_engine.items():
+                embedding_manager = get_embedding_manager(engine_key)
+                embedding_manager.add_documents_to_index(embedding_manager.user_scope(job.user_id), engine_document_ids)
+            kb_document_ids = by_engine.get(kb_engine.key, [])
+            if kb_document_ids:
+                kb_engine.add_documents_to_index(
+                    kb_engine.kb_scope(kb.id), kb_document_ids, index_type=kb.index_type
+                )
+        except Exception as e:
+            # Gli indici vengono comunque riallineati alla prima ricerca
+            logger.warning(f"Errore nell'aggiornamento degli indici per il job {job_id}: {str(e)}")
+    
+    if not job.failed_items:
+        job.status = 'completed'
+    elif job.succeeded_items:
+        job.status = 'completed_with_errors'
+    else:
+        job.status = 'failed'
+    job.completed_at = timezone.now()
+    job.save(update_fields=['status', 'completed_at'])
+    
+    logger.info(
+        f"Job di importazione {job_id} terminato: {job.succeeded_items} documenti importati, "
+        f"{job.failed_items} errori"
+    )
 
 @shared_task
 def cleanup_failed_documents():
@@ -390,13 +796,14 @@ def reprocess_document_task(document_id: int, force: bool = False):
         
         # Elimina embeddings esistenti se presenti
         try:
-            embedding_manager = get_embedding_manager()
+            embedding_manager = document.get_embedding_engine()
             embedding_manager.delete_embeddings(document_id)
         except Exception as e:
             logger.warning(f"Errore nell'eliminazione degli embeddings esistenti: {str(e)}")
         
         # Elimina chunk esistenti
         RAGChunk.objects.filter(document=document).delete()
+        RAGKnowledgeBase.bump_content_version_for_documents([document.id])
         
         # Reset dello stato del documento
         document.status = 'uploaded'
@@ -407,6 +814,7 @@ def reprocess_document_task(document_id: int, force: bool = False):
         document.text_length = 0
         document.num_chunks = 0
         document.embeddings_created = False
+        document.embedding_engine = ''
         document.save()
         
         # Avvia il processamento
@@ -508,25 +916,11 @@ def process_query(query_id):
         query.save()
         raise
 
-def split_text_into_chunks(text, chunk_size=1000, overlap=200):
+def split_text_into_chunks(text, max_tokens=None, overlap_tokens=None):
     """
-    Divide il testo in chunk sovrapposti.
+    Divide il testo in chunk sovrapposti di token (vedi utils.chunking.TextChunker).
     """
-    chunks = []
-    start = 0
-    text_length = len(text)
-
-    while start < text_length:
-        end = start + chunk_size
-        if end > text_length:
-            end = text_length
-        
-        chunk = text[start:end]
-        chunks.append(chunk)
-        
-        start = end - overlap
-
-    return chunks
+    return [chunk.text for chunk in TextChunker(max_tokens, overlap_tokens).chunk(text)]
 
 def find_relevant_chunks(query_embedding, top_k=5):
     """
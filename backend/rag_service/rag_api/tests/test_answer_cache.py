@@ -0,0 +1,72 @@
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from rag_api.utils.answer_cache import AnswerCache, knowledge_base_corpus, make_namespace
+
+
+def fake_embed(query):
+    # Stesso vettore per ogni domanda: qualsiasi domanda è "simile" alle altre
+    return np.ones(8, dtype=np.float32)
+
+
+class AnswerCacheNamespaceTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.path = tmp / 'answers.sqlite3'
+        self.cache = AnswerCache(self.path)
+
+    def namespace(self, kb_id, content_version, **params):
+        kb = SimpleNamespace(id=kb_id, content_version=content_version)
+        params = {'top_k': 5, 'max_tokens': 500, 'rerank': False, **params}
+        return make_namespace(knowledge_base_corpus(kb), **params)
+
+    def test_exact_match_ignores_case_and_punctuation(self):
+        namespace = self.namespace(1, 1)
+        self.cache.store(namespace, "Come si configura il timeout?", {'answer': 'a'})
+
+        cached = self.cache.lookup(namespace, "  come si configura   il TIMEOUT ")
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached.match, 'exact')
+        self.assertEqual(cached.payload, {'answer': 'a'})
+
+    def test_content_version_bump_misses_previous_answers(self):
+        self.cache.store(self.namespace(1, 1), "domanda", {'answer': 'vecchia'})
+
+        self.assertIsNone(self.cache.lookup(self.namespace(1, 2), "domanda"))
+        self.assertIsNotNone(self.cache.lookup(self.namespace(1, 1), "domanda"))
+
+    def test_request_parameters_are_part_of_the_namespace(self):
+        self.cache.store(self.namespace(1, 1), "domanda", {'answer': 'a'})
+
+        self.assertIsNone(self.cache.lookup(self.namespace(1, 1, top_k=10), "domanda"))
+        self.assertIsNone(self.cache.lookup(self.namespace(1, 1, rerank=True), "domanda"))
+        self.assertEqual(self.namespace(1, 1, top_k=5, rerank=False), self.namespace(1, 1, rerank=False, top_k=5))
+
+    def test_invalidate_removes_only_the_knowledge_base(self):
+        self.cache.store(self.namespace(1, 1), "domanda", {'answer': 'kb1 v1'})
+        self.cache.store(self.namespace(1, 2), "domanda", {'answer': 'kb1 v2'})
+        self.cache.store(self.namespace(12, 1), "domanda", {'answer': 'kb12'})
+
+        self.assertEqual(self.cache.invalidate("kb:1:"), 2)
+
+        self.assertIsNone(self.cache.lookup(self.namespace(1, 1), "domanda"))
+        self.assertIsNone(self.cache.lookup(self.namespace(1, 2), "domanda"))
+        self.assertEqual(self.cache.lookup(self.namespace(12, 1), "domanda").payload, {'answer': 'kb12'})
+
+    def test_semantic_match_is_opt_in(self):
+        namespace = self.namespace(1, 1)
+        self.cache.store(namespace, "aumentare il timeout", {'answer': 'a'}, embed=fake_embed)
+        self.assertIsNone(self.cache.lookup(namespace, "ridurre il timeout", embed=fake_embed))
+
+        semantic_cache = AnswerCache(self.path, semantic=True)
+        semantic_cache.store(namespace, "aumentare il timeout", {'answer': 'a'}, embed=fake_embed)
+        cached = semantic_cache.lookup(namespace, "ridurre il timeout", embed=fake_embed)
+        self.assertEqual(cached.match, 'semantic')
+        self.assertIsNone(semantic_cache.lookup(self.namespace(1, 2), "ridurre il timeout", embed=fake_embed))
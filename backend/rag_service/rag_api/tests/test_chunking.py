@@ -0,0 +1,85 @@
+from django.test import SimpleTestCase
+
+from config.tokenizer import TokenCounter
+from rag_api.utils.chunking import TextChunker
+
+
+class WordCounter(TokenCounter):
+    """
+    Contatore deterministico (un token per parola), indipendente da tiktoken.
+    """
+
+    def count(self, text):
+        return len(text.split())
+
+    def count_many(self, texts):
+        return [self.count(text) for text in texts]
+
+
+class TextChunkerTests(SimpleTestCase):
+
+    def make_chunker(self, max_tokens=24, overlap_tokens=8):
+        return TextChunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens, token_counter=WordCounter())
+
+    def sample_text(self):
+        sentences = [
+            f"Frase numero {i} con alcune parole di riempimento." for i in range(20)
+        ]
+        return "\n\n   " + " ".join(sentences[:10]) + "\n" + " ".join(sentences[10:])
+
+    def test_offsets_match_source_text(self):
+        text = self.sample_text()
+        chunks = self.make_chunker().chunk(text)
+        self.assertGreater(len(chunks), 1)
+        stripped = text.lstrip()
+        for chunk in chunks:
+            self.assertEqual(stripped[chunk.start:chunk.end], chunk.text)
+
+    def test_chunks_respect_token_limit(self):
+        chunker = self.make_chunker()
+        for chunk in chunker.chunk(self.sample_text()):
+            self.assertLessEqual(chunk.tokens, chunker.max_tokens)
+            self.assertEqual(chunk.tokens, len(chunk.text.split()))
+
+    def test_consecutive_chunks_overlap(self):
+        chunks = self.make_chunker().chunk(self.sample_text())
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertLess(current.start, previous.end)
+            self.assertGreater(current.end, previous.end)
+
+    def test_without_overlap_chunks_are_disjoint_and_cover_text(self):
+        text = self.sample_text().lstrip()
+        chunks = self.make_chunker(overlap_tokens=0).chunk(text)
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertGreaterEqual(current.start, previous.end)
+        covered = " ".join(chunk.text for chunk in chunks)
+        self.assertEqual(covered.split(), text.split())
+
+    def test_long_sentence_is_split(self):
+        text = " ".join(f"parola{i}" for i in range(100)) + "."
+        chunker = self.make_chunker(max_tokens=10, overlap_tokens=0)
+        chunks = chunker.chunk(text)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.tokens, chunker.max_tokens)
+            self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+
+    def test_mixed_density_unit_is_split_within_limit(self):
+        # Un'unica frase: parole lunghe (poca densità di token) seguite da parole di una lettera
+        text = " ".join(["parolamoltolungasenzaspazi" * 2] * 10 + ["a"] * 120)
+        chunker = self.make_chunker(max_tokens=24, overlap_tokens=0)
+        chunks = chunker.chunk(text)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.text.split()), chunker.max_tokens)
+            self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+        self.assertEqual(" ".join(chunk.text for chunk in chunks).split(), text.split())
+
+    def test_streamed_segments_match_single_text(self):
+        text = self.sample_text()
+        chunker = self.make_chunker()
+        segments = [text[i:i + 7] for i in range(0, len(text), 7)]
+        self.assertEqual(list(chunker.iter_chunks(segments)), chunker.chunk(text))
+
+    def test_invalid_overlap_rejected(self):
+        with self.assertRaises(ValueError):
+            self.make_chunker(max_tokens=10, overlap_tokens=10)
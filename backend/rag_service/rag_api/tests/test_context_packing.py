@@ -0,0 +1,81 @@
+from django.test import SimpleTestCase
+
+from rag_api.utils.context_packing import ContextPacker, CONTEXT_SEPARATOR
+from rag_api.utils.embedding_utils import ChunkHit
+
+from .test_chunking import WordCounter
+
+
+class TruncatingWordCounter(WordCounter):
+
+    def truncate(self, text, max_tokens):
+        return ' '.join(text.split()[:max_tokens])
+
+
+def words(start, end):
+    return ' '.join(f"w{i:03d}" for i in range(start, end))
+
+
+def hit(text, document_id=1, chunk_index=0, score=1.0):
+    return ChunkHit(text, score, document_id, chunk_index)
+
+
+LABELS = {1: "[Fonte: uno]", 2: "[Fonte: due]"}
+
+
+class ContextPackerTests(SimpleTestCase):
+
+    def pack(self, hits, budget=1000):
+        return ContextPacker(budget, token_counter=TruncatingWordCounter()).pack(hits, LABELS)
+
+    def test_stays_within_budget_in_relevance_order(self):
+        hits = [hit(words(i * 100, i * 100 + 40), document_id=2, chunk_index=i * 10) for i in range(5)]
+
+        packed = self.pack(hits, budget=100)
+
+        self.assertLessEqual(packed.tokens, packed.budget)
+        self.assertEqual(packed.hits, hits[:2])
+        self.assertEqual(packed.dropped, 3)
+        self.assertFalse(packed.truncated)
+        self.assertEqual(packed.text.count(CONTEXT_SEPARATOR), 1)
+
+    def test_adjacent_chunks_are_merged_without_repeating_the_overlap(self):
+        # Sovrapposizione di 10 parole, come la produce il chunker
+        first = hit(words(0, 20), chunk_index=0)
+        second = hit(words(10, 30), chunk_index=1)
+
+        packed = self.pack([second, first])
+
+        self.assertEqual(packed.text, f"{LABELS[1]}\n{words(0, 30)}")
+        self.assertEqual(packed.tokens, 2 + 30)
+        self.assertEqual(len(packed.hits), 2)
+
+    def test_chunk_filling_a_gap_joins_both_blocks(self):
+        hits = [
+            hit(words(0, 20), chunk_index=0),
+            hit(words(100, 110), document_id=2, chunk_index=0),
+            hit(words(20, 40), chunk_index=2),
+            hit(words(10, 30), chunk_index=1),
+        ]
+
+        packed = self.pack(hits)
+
+        blocks = packed.text.split(CONTEXT_SEPARATOR)
+        self.assertEqual(blocks, [f"{LABELS[1]}\n{words(0, 40)}", f"{LABELS[2]}\n{words(100, 110)}"])
+        self.assertEqual(packed.tokens, 2 + 40 + 1 + 2 + 10)
+
+    def test_duplicate_texts_are_included_once(self):
+        hits = [hit(words(0, 10), document_id=1), hit(words(0, 10) + "  ", document_id=2, chunk_index=5)]
+
+        packed = self.pack(hits)
+
+        self.assertEqual(packed.hits, hits[:1])
+        self.assertEqual(packed.dropped, 1)
+
+    def test_oversized_first_chunk_is_truncated(self):
+        packed = self.pack([hit(words(0, 200)), hit(words(300, 310), chunk_index=7)], budget=50)
+
+        self.assertTrue(packed.truncated)
+        self.assertEqual(packed.tokens, 50)
+        self.assertEqual(packed.text, f"{LABELS[1]}\n{words(0, 48)}")
+        self.assertEqual(packed.dropped, 1)
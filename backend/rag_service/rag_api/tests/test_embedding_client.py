@@ -0,0 +1,96 @@
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import openai
+from django.test import SimpleTestCase
+
+from config.llm_clients import OpenAIEmbeddingClient
+
+from .test_chunking import WordCounter
+
+
+def rate_limit_error():
+    request = httpx.Request('POST', 'https://api.openai.com/v1/embeddings')
+    response = httpx.Response(429, request=request, headers={'retry-after': '0'})
+    return openai.RateLimitError('rate limited', response=response, body=None)
+
+
+class FakeEmbeddings:
+    """
+    API embeddings finta: il primo batch termina per ultimo e alcuni input ricevono
+    un 429 prima di riuscire.
+    """
+
+    def __init__(self, batch_count, rate_limited=()):
+        self.batch_count = batch_count
+        self.rate_limited = set(rate_limited)
+        self.completed = []
+        self.others_done = threading.Event()
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def create(self, model, input, encoding_format, **kwargs):
+        with self.lock:
+            self.calls += 1
+            first = input[0]
+            if first in self.rate_limited:
+                self.rate_limited.discard(first)
+                raise rate_limit_error()
+
+        if first == 't0':
+            # Aspetta che tutti gli altri batch siano conclusi
+            self.others_done.wait(timeout=5)
+
+        # Risposta in ordine inverso: il client deve riordinare per indice
+        data = [SimpleNamespace(index=i, embedding=[float(text[1:])]) for i, text in enumerate(input)]
+        with self.lock:
+            self.completed.append(first)
+            if len(self.completed) == self.batch_count - 1:
+                self.others_done.set()
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+def make_client(embeddings, max_workers=4, max_retries=3):
+    client = OpenAIEmbeddingClient.__new__(OpenAIEmbeddingClient)
+    client.client = SimpleNamespace(embeddings=embeddings)
+    client.embedding_model = 'text-embedding-3-small'
+    client.embedding_dimensions = None
+    client.max_workers = max_workers
+    client.batch_max_tokens = 100000
+    client.max_retries = max_retries
+    client.token_counter = WordCounter()
+    return client
+
+
+@mock.patch('config.llm_clients.time.sleep')
+class CreateEmbeddingsBatchTests(SimpleTestCase):
+
+    def test_out_of_order_batches_keep_input_order(self, sleep):
+        texts = [f"t{i}" for i in range(10)]
+        embeddings = FakeEmbeddings(batch_count=5)
+
+        result = make_client(embeddings).create_embeddings_batch(texts, batch_size=2)
+
+        self.assertEqual(result, [[float(i)] for i in range(10)])
+        self.assertEqual(embeddings.completed[-1], 't0')
+        self.assertEqual(embeddings.calls, 5)
+
+    def test_rate_limited_batches_are_retried(self, sleep):
+        texts = [f"t{i}" for i in range(10)]
+        embeddings = FakeEmbeddings(batch_count=5, rate_limited={'t2', 't6'})
+
+        result = make_client(embeddings).create_embeddings_batch(texts, batch_size=2)
+
+        self.assertEqual(result, [[float(i)] for i in range(10)])
+        self.assertEqual(embeddings.calls, 7)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_gives_up_after_max_retries(self, sleep):
+        embeddings = mock.Mock()
+        embeddings.create.side_effect = [rate_limit_error() for _ in range(3)]
+
+        with self.assertRaises(Exception):
+            make_client(embeddings, max_retries=2).create_embeddings_batch(['t0', 't1'])
+        self.assertEqual(embeddings.create.call_count, 3)
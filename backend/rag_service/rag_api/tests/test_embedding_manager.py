@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from rag_api.utils import embedding_store
+from rag_api.utils.embedding_utils import EmbeddingManager, EngineConfig
+
+DIMENSION = 8
+
+
+def random_vectors(seed, count, dimension=DIMENSION):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+class EmbeddingManagerSearchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        settings_override = override_settings(RAG_EMBEDDINGS_ROOT=str(self.root))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.manager = EmbeddingManager(EngineConfig('openai', 'test', DIMENSION), embedding_client=mock.Mock())
+
+    def write(self, doc_id, vectors):
+        chunks = [f"doc {doc_id} chunk {i}" for i in range(len(vectors))]
+        embedding_store.write_document(self.root / str(doc_id), vectors, chunks, {})
+
+    def test_unindexable_documents_are_not_retried_until_they_change(self):
+        self.write(1, random_vectors(1, 5))
+        self.write(2, random_vectors(2, 5, dimension=4))
+
+        index = self.manager.sync_index('user_1', [1, 2, 3])
+        self.assertEqual(index.document_ids, {1})
+        self.assertEqual(set(index.skipped), {2, 3})
+
+        with mock.patch.object(self.manager, 'add_documents_to_index') as add:
+            self.manager.sync_index('user_1', [1, 2, 3])
+        add.assert_not_called()
+
+        # Nuova generazione con la dimensione giusta: il documento viene indicizzato
+        self.write(2, random_vectors(2, 5))
+        index = self.manager.sync_index('user_1', [1, 2, 3])
+        self.assertEqual(index.document_ids, {1, 2})
+        self.assertEqual(set(index.skipped), {3})
+
+        index = self.manager.sync_index('user_1', [1, 2])
+        self.assertEqual(index.skipped, {})
+
+    def test_explicit_documents_are_searched_exactly(self):
+        vectors = {doc_id: random_vectors(doc_id, 20) for doc_id in (1, 2, 3)}
+        for doc_id, doc_vectors in vectors.items():
+            self.write(doc_id, doc_vectors)
+
+        query = vectors[2][7]
+        with mock.patch.object(self.manager, 'get_embedding', return_value=query.tolist()):
+            hits = self.manager.search_similar_chunks("domanda", [1, 2], top_k=3)
+
+        self.assertEqual((hits[0].document_id, hits[0].chunk_index, hits[0].text), (2, 7, "doc 2 chunk 7"))
+        self.assertEqual(len(hits), 3)
+        self.assertTrue(all(hit.document_id in (1, 2) for hit in hits))
+        scores = [hit.score for hit in hits]
+        self.assertEqual(scores, sorted(scores, reverse=True))
@@ -0,0 +1,164 @@
+import json
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from rag_api.utils import chunk_store, embedding_store
+
+
+def random_vectors(seed, count, dimension=8):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+def normalized(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class EmbeddingStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.doc_dir = Path(tempfile.mkdtemp()) / '42'
+        self.addCleanup(shutil.rmtree, self.doc_dir.parent, ignore_errors=True)
+        self.chunks = [f"chunk {i} – testo àccentato" for i in range(10)]
+        self.vectors = random_vectors(1, 10)
+
+    def data_files(self):
+        return sorted(p.name for p in self.doc_dir.iterdir() if p.name != embedding_store.LOCK_NAME)
+
+    def test_round_trip(self):
+        embedding_store.write_document(self.doc_dir, self.vectors, self.chunks, {'filename': 'a.pdf'},
+                                       model='m', provider='p')
+
+        vectors, chunks, manifest = embedding_store.read_document(self.doc_dir)
+        np.testing.assert_allclose(vectors, normalized(self.vectors), rtol=1e-6)
+        self.assertEqual(chunks, self.chunks)
+        self.assertEqual(manifest['count'], 10)
+        self.assertEqual(manifest['dimension'], 8)
+        self.assertEqual(manifest['metadata'], {'filename': 'a.pdf'})
+        self.assertEqual((manifest['model'], manifest['provider']), ('m', 'p'))
+        self.assertEqual(embedding_store.read_chunks(self.doc_dir, [9, 3, 3, 99]),
+                         {3: self.chunks[3], 9: self.chunks[9]})
+
+    def test_incremental_shards(self):
+        writer = embedding_store.DocumentWriter(self.doc_dir, dtype='float16')
+        writer.append(self.vectors[:4], self.chunks[:4])
+        writer.append(self.vectors[4:], self.chunks[4:])
+        writer.close()
+
+        manifest = embedding_store.read_manifest(self.doc_dir)
+        self.assertEqual([shard['count'] for shard in manifest['shards']], [10])
+        vectors = embedding_store.load_vectors(self.doc_dir)
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(vectors, normalized(self.vectors), atol=1e-3)
+
+    def test_shards_are_compacted_into_one_memmap(self):
+        writer = embedding_store.DocumentWriter(self.doc_dir)
+        for start in range(0, 10, 3):
+            writer.append(self.vectors[start:start + 3], self.chunks[start:start + 3])
+        writer.close()
+
+        manifest = embedding_store.read_manifest(self.doc_dir)
+        self.assertEqual(manifest['shards'], [{'file': f"vectors-{writer.generation}.npy", 'count': 10}])
+        self.assertEqual([name for name in self.data_files() if name.startswith('vectors-')],
+                         [manifest['shards'][0]['file']])
+        vectors = embedding_store.load_vectors(self.doc_dir)
+        self.assertIsInstance(vectors, np.memmap)
+        np.testing.assert_allclose(vectors, normalized(self.vectors), rtol=1e-6)
+
+    def test_mismatched_append_rejected(self):
+        writer = embedding_store.DocumentWriter(self.doc_dir)
+        with self.assertRaises(ValueError):
+            writer.append(self.vectors, self.chunks[:3])
+        writer.abort()
+
+    def test_previous_generation_readable_until_close(self):
+        embedding_store.write_document(self.doc_dir, self.vectors, self.chunks)
+        mapped = embedding_store.load_vectors(self.doc_dir)
+        first_files = self.data_files()
+
+        new_vectors = random_vectors(2, 3)
+        writer = embedding_store.DocumentWriter(self.doc_dir)
+        writer.append(new_vectors, ['a', 'b', 'c'])
+        _, chunks, _ = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, self.chunks)
+
+        writer.close()
+        _, chunks, manifest = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, ['a', 'b', 'c'])
+        self.assertEqual(manifest['count'], 3)
+        # I file della generazione precedente sono stati rimossi, il memmap resta valido
+        self.assertFalse((set(first_files) - {embedding_store.MANIFEST_NAME}) & set(self.data_files()))
+        np.testing.assert_allclose(mapped, normalized(self.vectors), rtol=1e-6)
+
+    def test_abort_keeps_published_generation(self):
+        embedding_store.write_document(self.doc_dir, self.vectors, self.chunks)
+        files = self.data_files()
+
+        writer = embedding_store.DocumentWriter(self.doc_dir)
+        writer.append(random_vectors(3, 2), ['x', 'y'])
+        writer.abort()
+
+        self.assertEqual(self.data_files(), files)
+        _, chunks, _ = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, self.chunks)
+
+    def test_abort_after_close_is_noop(self):
+        writer = embedding_store.DocumentWriter(self.doc_dir)
+        writer.append(self.vectors, self.chunks)
+        writer.close()
+        writer.abort()
+        _, chunks, _ = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, self.chunks)
+
+    def test_concurrent_writer_files_survive_other_close(self):
+        slow = embedding_store.DocumentWriter(self.doc_dir)
+        slow.append(self.vectors, self.chunks)
+
+        embedding_store.write_document(self.doc_dir, random_vectors(4, 2), ['x', 'y'])
+
+        slow.close()
+        _, chunks, _ = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, self.chunks)
+
+    def test_upgrade_legacy(self):
+        self.doc_dir.mkdir(parents=True)
+        np.save(self.doc_dir / embedding_store.LEGACY_EMBEDDINGS_NAME, self.vectors)
+        with open(self.doc_dir / chunk_store.LEGACY_CHUNKS_NAME, 'wb') as f:
+            pickle.dump(self.chunks, f)
+        with open(self.doc_dir / embedding_store.LEGACY_METADATA_NAME, 'wb') as f:
+            pickle.dump({'model_name': 'legacy-model'}, f)
+
+        self.assertTrue(embedding_store.is_legacy(self.doc_dir))
+        embedding_store.upgrade_legacy(self.doc_dir)
+        # Una seconda conversione (altro processo arrivato dopo il lock) non fa nulla
+        embedding_store.upgrade_legacy(self.doc_dir)
+
+        self.assertFalse(embedding_store.is_legacy(self.doc_dir))
+        vectors, chunks, manifest = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, self.chunks)
+        self.assertEqual(manifest['model'], 'legacy-model')
+        np.testing.assert_allclose(vectors, normalized(self.vectors), rtol=1e-6)
+        for legacy_name in (embedding_store.LEGACY_EMBEDDINGS_NAME, embedding_store.LEGACY_METADATA_NAME,
+                            chunk_store.LEGACY_CHUNKS_NAME):
+            self.assertFalse((self.doc_dir / legacy_name).exists())
+
+    def test_reads_manifests_without_chunk_generation(self):
+        self.doc_dir.mkdir(parents=True)
+        writer = chunk_store.ChunkWriter(self.doc_dir, chunk_store.DEFAULT_FILES)
+        writer.append(self.chunks)
+        writer.close()
+        np.save(self.doc_dir / 'vectors-00000.npy', normalized(self.vectors))
+        manifest = {'format_version': 2, 'dimension': 8, 'dtype': 'float32', 'count': 10,
+                    'shards': [{'file': 'vectors-00000.npy', 'count': 10}], 'metadata': {}}
+        (self.doc_dir / embedding_store.MANIFEST_NAME).write_text(json.dumps(manifest))
+
+        _, chunks, _ = embedding_store.read_document(self.doc_dir)
+        self.assertEqual(chunks, self.chunks)
+
+        embedding_store.write_document(self.doc_dir, self.vectors[:2], self.chunks[:2])
+        self.assertFalse((self.doc_dir / 'vectors-00000.npy').exists())
+        self.assertFalse(chunk_store.has_chunk_store(self.doc_dir))
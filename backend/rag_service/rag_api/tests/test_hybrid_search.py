@@ -0,0 +1,91 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from rag_api.models import RAGChunk, RAGDocument
+from rag_api.utils.embedding_utils import ChunkHit
+from rag_api.utils.hybrid_search import (
+    RRF_K, hybrid_search, lexical_search, reciprocal_rank_fusion, update_search_vectors,
+)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+
+    def test_scores_sum_over_rankings(self):
+        fused = dict(reciprocal_rank_fusion([[(1, 0), (1, 1)], [(1, 1), (2, 0)]]))
+        self.assertAlmostEqual(fused[(1, 1)], 1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+        self.assertAlmostEqual(fused[(1, 0)], 1 / (RRF_K + 1))
+        self.assertAlmostEqual(fused[(2, 0)], 1 / (RRF_K + 2))
+
+    def test_items_in_both_rankings_come_first(self):
+        fused = reciprocal_rank_fusion([[(1, 0), (1, 1), (1, 2)], [(1, 2), (3, 0)]])
+        self.assertEqual(fused[0][0], (1, 2))
+        self.assertEqual([score for _, score in fused], sorted((score for _, score in fused), reverse=True))
+
+    def test_empty_rankings(self):
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+
+class FakeEmbeddingManager:
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.scored = None
+
+    def search_similar_chunks(self, query, document_ids, top_k=5, **kwargs):
+        return self.hits[:top_k]
+
+    def score_chunks(self, query, chunk_refs):
+        self.scored = list(chunk_refs)
+        return {ref: 0.25 for ref in self.scored}
+
+
+class HybridSearchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vector_hits = [
+            ChunkHit('vettore a', 0.9, 1, 0),
+            ChunkHit('vettore b', 0.8, 1, 1),
+            ChunkHit('vettore c', 0.7, 2, 0),
+        ]
+
+    def test_vector_only_without_lexical_hits(self):
+        manager = FakeEmbeddingManager(self.vector_hits)
+        with mock.patch('rag_api.utils.hybrid_search.lexical_search', return_value=[]):
+            self.assertEqual(hybrid_search(manager, 'query', [1, 2], top_k=2), self.vector_hits[:2])
+
+    def test_lexical_failure_falls_back_to_vectors(self):
+        manager = FakeEmbeddingManager(self.vector_hits)
+        with mock.patch('rag_api.utils.hybrid_search.lexical_search', side_effect=RuntimeError('no fts')):
+            self.assertEqual(hybrid_search(manager, 'query', [1, 2], top_k=3), self.vector_hits)
+
+    def test_fusion_keeps_cosine_scores_and_scores_lexical_only_hits(self):
+        manager = FakeEmbeddingManager(self.vector_hits)
+        lexical = [(2, 0, 'vettore c'), (3, 4, 'solo lessicale')]
+        with mock.patch('rag_api.utils.hybrid_search.lexical_search', return_value=lexical):
+            results = hybrid_search(manager, 'query', [1, 2, 3], top_k=4)
+
+        self.assertEqual(results[0], self.vector_hits[2])
+        by_key = {(hit.document_id, hit.chunk_index): hit for hit in results}
+        self.assertEqual(by_key[(1, 0)].score, 0.9)
+        self.assertEqual(by_key[(3, 4)], ChunkHit('solo lessicale', 0.25, 3, 4))
+        self.assertEqual(manager.scored, [(3, 4)])
+
+
+class LexicalSearchTests(TestCase):
+
+    def test_finds_chunks_by_term(self):
+        document = RAGDocument.objects.create(
+            filename='doc.txt', original_filename='doc.txt', file_path='doc.txt', file_size=100,
+            file_type='text/plain'
+        )
+        texts = ['Il protocollo XJ-42 regola le spedizioni.', 'Le fatture sono archiviate ogni mese.']
+        RAGChunk.objects.bulk_create([
+            RAGChunk(document=document, text=text, chunk_index=i, text_length=len(text))
+            for i, text in enumerate(texts)
+        ])
+        update_search_vectors(document.id)
+
+        self.assertEqual(lexical_search('fatture archiviate', [document.id], 5), [(document.id, 1, texts[1])])
+        self.assertEqual(lexical_search('fatture', [document.id + 1], 5), [])
+        self.assertEqual(lexical_search('a', [document.id], 5), [])
@@ -0,0 +1,180 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from rag_api import tasks
+from rag_api.models import RAGDocument, RAGImportJob, RAGKnowledgeBase
+
+
+class FakeEngine:
+    key = 'fake:model:4'
+
+    def __init__(self):
+        self.indexed = {}
+
+    @staticmethod
+    def user_scope(user_id):
+        return f"user_{user_id}"
+
+    @staticmethod
+    def kb_scope(kb_id):
+        return f"kb_{kb_id}"
+
+    def add_documents_to_index(self, scope, document_ids, index_type=None):
+        self.indexed[scope] = sorted(document_ids)
+
+
+class WorkerLost(BaseException):
+    """Simula la terminazione del processo worker durante il task."""
+
+
+class ImportJobTests(TestCase):
+
+    def setUp(self):
+        self.kb = RAGKnowledgeBase.objects.create(user_id=7, name='KB')
+        self.documents = [self.make_document(i) for i in range(3)]
+        self.job = RAGImportJob.objects.create(
+            user_id=7, knowledge_base=self.kb, total_items=3,
+            items=[{'document_id': document.id} for document in self.documents]
+        )
+        for document in self.documents:
+            document.import_job = self.job
+            document.save(update_fields=['import_job'])
+
+        self.engine = FakeEngine()
+        patches = [
+            mock.patch.object(RAGKnowledgeBase, 'get_embedding_engine', return_value=self.engine),
+            mock.patch.object(RAGDocument, 'group_by_engine',
+                              side_effect=lambda ids: {FakeEngine.key: sorted(ids)} if ids else {}),
+            mock.patch.object(tasks, 'get_embedding_manager', return_value=self.engine),
+            mock.patch.object(tasks, 'dispatch_import_items'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def make_document(self, i):
+        return RAGDocument.objects.create(
+            user_id=7, filename=f'doc{i}.txt', original_filename=f'doc{i}.txt', file_path=f'doc{i}.txt',
+            file_size=10, file_type='text/plain', num_chunks=i + 1
+        )
+
+    def run_item(self, index, success):
+        document = self.documents[index]
+        if success:
+            document.status = 'processed'
+            document.embeddings_created = True
+        else:
+            document.status = 'failed'
+        document.save(update_fields=['status', 'embeddings_created'])
+        result = {'success': True} if success else {'success': False, 'error': 'estrazione fallita'}
+        with mock.patch.object(tasks, 'process_rag_document_task', return_value=result):
+            return tasks.import_job_item_task(self.job.id, index)
+
+    def test_counts_and_completes_with_errors(self):
+        self.run_item(0, True)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.succeeded_items, self.job.failed_items), (1, 0))
+        self.assertEqual(self.job.progress, 33.3)
+        self.assertIsNone(self.job.completed_at)
+
+        self.run_item(1, False)
+        self.run_item(2, True)
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.succeeded_items, self.job.failed_items), (2, 1))
+        self.assertEqual(self.job.status, 'completed_with_errors')
+        self.assertIsNotNone(self.job.completed_at)
+        self.assertEqual([item['status'] for item in self.job.items], ['succeeded', 'failed', 'succeeded'])
+        self.assertEqual(self.job.errors, [{
+            'item': 1, 'resource_id': None, 'document_id': self.documents[1].id, 'error': 'estrazione fallita'
+        }])
+
+    def test_only_succeeded_documents_join_the_knowledge_base(self):
+        self.run_item(0, True)
+        self.run_item(1, False)
+        self.run_item(2, True)
+
+        expected = sorted([self.documents[0].id, self.documents[2].id])
+        self.assertEqual(sorted(self.kb.documents.values_list('id', flat=True)), expected)
+        self.kb.refresh_from_db()
+        self.assertEqual((self.kb.total_documents, self.kb.total_chunks), (2, 4))
+        self.assertEqual(self.engine.indexed, {'user_7': expected, f'kb_{self.kb.id}': expected})
+
+    def test_redelivered_item_is_counted_once(self):
+        self.run_item(0, True)
+        self.run_item(0, True)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.succeeded_items, self.job.failed_items), (1, 0))
+
+    def test_all_failed(self):
+        for index in range(3):
+            self.run_item(index, False)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'failed')
+        self.assertFalse(self.kb.documents.exists())
+        self.assertEqual(self.engine.indexed, {})
+
+    def test_all_succeeded(self):
+        for index in range(3):
+            self.run_item(index, True)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'completed')
+        self.assertEqual(self.job.progress, 100.0)
+
+    def test_redelivered_resource_item_reuses_claimed_document(self):
+        job = RAGImportJob.objects.create(user_id=7, knowledge_base=self.kb, total_items=1,
+                                          dispatched_items=1, items=[{'resource_id': 99}])
+        created = self.make_document(9)
+
+        with mock.patch.object(tasks, 'import_resource_document', return_value=created) as importer:
+            with mock.patch.object(tasks, 'process_rag_document_task', side_effect=WorkerLost):
+                with self.assertRaises(WorkerLost):
+                    tasks.import_job_item_task(job.id, 0)
+            job.refresh_from_db()
+            self.assertEqual(job.items[0]['document_id'], created.id)
+
+            with mock.patch.object(tasks, 'process_rag_document_task', return_value={'success': True}) as process:
+                result = tasks.import_job_item_task(job.id, 0)
+
+        importer.assert_called_once()
+        process.assert_called_once_with(created.id, update_indices=False)
+        self.assertEqual(result['document_id'], created.id)
+        self.assertEqual(RAGDocument.objects.count(), 4)
+
+    def test_stale_items_are_released(self):
+        old = (timezone.now() - timedelta(hours=2)).isoformat()
+        recent = timezone.now().isoformat()
+        self.job.status = 'running'
+        self.job.dispatched_items = 2
+        self.job.items[0]['started_at'] = old
+        self.job.items[1]['dispatched_at'] = recent
+        self.job.save()
+
+        self.assertEqual(tasks._release_stale_import_items(7), [])
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.succeeded_items, self.job.failed_items), (0, 1))
+        self.assertEqual(self.job.items[0]['status'], 'failed')
+        self.assertNotIn('status', self.job.items[1])
+
+        # L'esito tardivo dell'elemento rilasciato non viene contato di nuovo
+        self.run_item(0, True)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.succeeded_items, self.job.failed_items), (0, 1))
+
+    def test_job_with_only_stale_items_left_is_finalized(self):
+        old = (timezone.now() - timedelta(hours=2)).isoformat()
+        self.run_item(0, True)
+        self.run_item(1, True)
+        self.job.refresh_from_db()
+        self.job.status = 'running'
+        self.job.dispatched_items = 3
+        self.job.items[2]['dispatched_at'] = old
+        self.job.save()
+
+        self.assertEqual(tasks._release_stale_import_items(7), [self.job.id])
+        tasks._finalize_import_job(self.job.id)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'completed_with_errors')
@@ -0,0 +1,27 @@
+from django.test import SimpleTestCase, override_settings
+
+from rag_api.utils.tracing import metrics_available
+
+
+@override_settings(INTERNAL_API_SECRET_VALUE='segreto', RAG_METRICS_ALLOWED_IPS=['10.0.0.5'])
+class MetricsViewAccessTests(SimpleTestCase):
+
+    def test_rejects_requests_without_secret(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_rejects_wrong_secret(self):
+        response = self.client.get('/metrics', HTTP_X_INTERNAL_SECRET='sbagliato')
+        self.assertEqual(response.status_code, 403)
+
+    def test_accepts_internal_secret(self):
+        response = self.client.get('/metrics', HTTP_X_INTERNAL_SECRET='segreto')
+        self.assertEqual(response.status_code, 200 if metrics_available() else 503)
+
+    def test_accepts_allowed_address(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200 if metrics_available() else 503)
+
+    @override_settings(INTERNAL_API_SECRET_VALUE=None, RAG_METRICS_ALLOWED_IPS=[])
+    def test_unconfigured_secret_denies_access(self):
+        response = self.client.get('/metrics', HTTP_X_INTERNAL_SECRET='')
+        self.assertEqual(response.status_code, 403)
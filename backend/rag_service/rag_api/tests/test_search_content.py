@@ -0,0 +1,64 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from rag_api.models import RAGChunk, RAGDocument
+from rag_api.utils.embedding_utils import ChunkHit
+from rag_api.views import RAGDocumentViewSet
+
+
+class LoadChunkWindowsTests(TestCase):
+
+    def setUp(self):
+        self.text = (
+            "Introduzione al documento. " * 20
+            + "Il protocollo XJ-42 regola le spedizioni. "
+            + "Conclusione del documento. " * 20
+        ).strip()
+        self.document = RAGDocument.objects.create(
+            filename='doc.txt', original_filename='doc.txt', file_path='doc.txt', file_size=len(self.text),
+            file_type='text/plain', extracted_text=self.text, text_length=len(self.text)
+        )
+        self.spans = [(0, 54), (self.text.index('Il protocollo'), self.text.index('Conclusione')), (len(self.text) - 26, len(self.text))]
+        RAGChunk.objects.bulk_create([
+            RAGChunk(document=self.document, text=self.text[start:end], chunk_index=i,
+                     start_position=start, end_position=end, text_length=end - start)
+            for i, (start, end) in enumerate(self.spans)
+        ])
+        self.view = RAGDocumentViewSet()
+
+    def hit(self, chunk_index, text=None, document_id=None):
+        start, end = self.spans[chunk_index]
+        return ChunkHit(text if text is not None else self.text[start:end], 0.5,
+                        document_id or self.document.id, chunk_index)
+
+    def test_positions_and_snippets_from_offsets(self):
+        windows = self.view._load_chunk_windows(self.document, [self.hit(0), self.hit(1), self.hit(2)], 30)
+
+        start, end = self.spans[1]
+        self.assertEqual(windows[1]['start'], start)
+        self.assertEqual(windows[1]['end'], end)
+        self.assertEqual(windows[1]['snippet'], '...' + self.text[start - 30:end + 30] + '...')
+        # Nessun indicatore di troncamento all'inizio e alla fine del documento
+        self.assertEqual(windows[0]['snippet'], self.text[:54 + 30] + '...')
+        self.assertEqual(windows[2]['snippet'], '...' + self.text[self.spans[2][0] - 30:])
+
+    def test_without_context(self):
+        windows = self.view._load_chunk_windows(self.document, [self.hit(1)], 0)
+        start, end = self.spans[1]
+        self.assertEqual(windows[1]['snippet'], '...' + self.text[start:end] + '...')
+
+    def test_stale_offsets_are_ignored(self):
+        windows = self.view._load_chunk_windows(self.document, [self.hit(1, text='testo non corrispondente')], 30)
+        self.assertEqual(windows, {})
+
+    def test_hits_of_other_documents_are_ignored(self):
+        self.assertEqual(self.view._load_chunk_windows(self.document, [self.hit(1, document_id=self.document.id + 1)]), {})
+
+    def test_extracted_text_is_only_read_in_windows(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.view._load_chunk_windows(self.document, [self.hit(0), self.hit(1), self.hit(2)])
+        self.assertEqual(len(queries), 2)
+        for query in queries.captured_queries:
+            sql = query['sql'].upper()
+            self.assertEqual(sql.count('EXTRACTED_TEXT'), sql.count('SUBSTRING(') + sql.count('SUBSTR('))
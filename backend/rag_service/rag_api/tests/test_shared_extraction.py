@@ -0,0 +1,114 @@
+import sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from rag_api.utils import parallel_extraction, shared_extraction
+from rag_api.utils.text_extraction import TextExtractor
+
+FIXTURE_PDF = Path(__file__).parent / 'fixtures' / 'sample.pdf'
+
+# Sorgenti del Resource Manager nello stesso repository (assenti nell'immagine del servizio)
+RESOURCE_MANAGER_DIR = Path(__file__).resolve().parents[3] / 'resource_manager_service'
+
+
+def resource_manager_extraction_cache():
+    if str(RESOURCE_MANAGER_DIR) not in sys.path:
+        sys.path.append(str(RESOURCE_MANAGER_DIR))
+    from resources_api import extraction_cache
+    return extraction_cache
+
+
+@unittest.skipUnless(RESOURCE_MANAGER_DIR.is_dir(), 'sorgenti del Resource Manager non disponibili')
+class SharedPdfExtractionTests(SimpleTestCase):
+    """
+    I segmenti salvati dal Resource Manager devono coincidere con quelli estratti qui.
+    """
+
+    def setUp(self):
+        self.extraction_cache = resource_manager_extraction_cache()
+        with open(FIXTURE_PDF, 'rb') as f:
+            self.resource_manager_segments = self.extraction_cache.extract_pdf_segments(f)
+
+    def test_same_extractor_and_format(self):
+        self.assertEqual(self.extraction_cache.PDF_EXTRACTOR, shared_extraction.PDF_EXTRACTOR)
+        self.assertEqual(self.extraction_cache.FORMAT_VERSION, shared_extraction.EXTRACTION_FORMAT_VERSION)
+
+    def test_sequential_extraction_matches_resource_manager(self):
+        segments = list(TextExtractor().iter_text(str(FIXTURE_PDF)))
+        self.assertEqual(len(segments), 4)
+        self.assertIn('protocollo XJ-42', segments[0])
+        self.assertEqual(segments, self.resource_manager_segments)
+
+    @override_settings(RAG_EXTRACTION_MAX_WORKERS=2, RAG_EXTRACTION_PAGES_PER_TASK=1)
+    def test_parallel_extraction_matches_resource_manager(self):
+        self.addCleanup(parallel_extraction.shutdown_process_pool)
+        segments = list(parallel_extraction.iter_pdf_pages(str(FIXTURE_PDF)))
+        self.assertEqual(segments, self.resource_manager_segments)
+
+    @override_settings(EXTRACTION_MAX_WORKERS=2, EXTRACTION_PAGES_PER_TASK=1)
+    def test_resource_manager_parallel_extraction_matches_sequential(self):
+        self.addCleanup(self.extraction_cache.shutdown_process_pool)
+        segments = self.extraction_cache.extract_pdf_file_segments(str(FIXTURE_PDF))
+        self.assertEqual(segments, self.resource_manager_segments)
+
+
+@unittest.skipUnless(RESOURCE_MANAGER_DIR.is_dir(), 'sorgenti del Resource Manager non disponibili')
+class SharedExtractionStreamingTests(SimpleTestCase):
+    """
+    Le voci JSON-lines scritte dal Resource Manager vengono lette qui un segmento alla volta.
+    """
+
+    HASH = 'ab' * 32
+
+    def setUp(self):
+        self.extraction_cache = resource_manager_extraction_cache()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(
+            EXTRACTION_CACHE_ROOT=root, RESOURCE_MANAGER_INTERNAL_URL='http://rm.test'
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def served_response(self):
+        """Risposta dell'endpoint interno: il file della voce inviato così com'è."""
+        opened = self.extraction_cache.open_entry(self.HASH)
+        response = requests.Response()
+        if opened is None:
+            response.status_code = 404
+            response.raw = mock.Mock()
+            return response
+        _, entry_file = opened
+        entry_file.seek(0)
+        response.status_code = 200
+        response.raw = entry_file
+        return response
+
+    def fetch(self):
+        with mock.patch.object(shared_extraction.requests, 'get', side_effect=lambda *a, **k: self.served_response()):
+            return shared_extraction.fetch_cached_segments(self.HASH)
+
+    def test_segments_round_trip(self):
+        segments = ["pagina 1\ncon a capo\r\n", "", "città – “virgolette”\n", "x" * 200000]
+        self.extraction_cache.put_segments(self.HASH, 'application/pdf', iter(segments))
+
+        fetched = self.fetch()
+
+        self.assertNotIsInstance(fetched, list)
+        self.assertEqual(next(fetched), segments[0])
+        self.assertEqual(list(fetched), segments[1:])
+        self.assertEqual(self.extraction_cache.get_segments(self.HASH), segments)
+
+    def test_missing_entry(self):
+        self.assertIsNone(self.fetch())
+
+    def test_other_pdf_extractor_is_not_reused(self):
+        with mock.patch.object(self.extraction_cache, 'PDF_EXTRACTOR', 'PyPDF2/0.0.0'):
+            self.extraction_cache.put_segments(self.HASH, 'application/pdf', ["testo"])
+        self.assertIsNone(self.extraction_cache.open_entry(self.HASH))
@@ -0,0 +1,148 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from rag_api.utils.vector_index import (
+    INDEX_FLAT, INDEX_HNSW, INDEX_TYPES, PersistentFaissIndex, VectorIndexStore,
+    decode_chunk_id, encode_chunk_id,
+)
+
+DIMENSION = 16
+
+
+def random_vectors(seed, count):
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+
+
+class VectorIndexTestMixin:
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        # Documenti 1..4 con 60 chunk ciascuno: 240 vettori, sopra la soglia ANN dei test
+        self.vectors = {doc_id: random_vectors(doc_id, 60) for doc_id in range(1, 5)}
+
+    def load_vectors(self, document_id):
+        return self.vectors[document_id]
+
+    def make_store(self, ann_min_vectors=100):
+        return VectorIndexStore(self.root, vector_loader=self.load_vectors, ann_min_vectors=ann_min_vectors,
+                                default_nprobe=1024, default_ef_search=256)
+
+
+class ChunkIdTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(decode_chunk_id(encode_chunk_id(123456, 789)), (123456, 789))
+
+
+class PersistentFaissIndexTests(VectorIndexTestMixin, SimpleTestCase):
+
+    def test_add_save_load_search(self):
+        index = PersistentFaissIndex(self.root / 'scope')
+        index.add_document(1, self.vectors[1])
+        index.add_document(2, self.vectors[2])
+        index.save()
+
+        loaded = PersistentFaissIndex(self.root / 'scope')
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.document_ids, {1, 2})
+        self.assertEqual(loaded.ntotal, 120)
+
+        query = self.vectors[2][7:8].copy()
+        document_id, chunk_index, _ = loaded.search(query / np.linalg.norm(query), 1)[0]
+        self.assertEqual((document_id, chunk_index), (2, 7))
+
+    def test_replace_document(self):
+        index = PersistentFaissIndex(self.root / 'scope')
+        index.add_document(1, self.vectors[1])
+        index.add_document(1, self.vectors[2][:5])
+        self.assertEqual(index.documents, {1: 5})
+        self.assertEqual(index.ntotal, 5)
+
+    def test_dimension_mismatch_rejected(self):
+        index = PersistentFaissIndex(self.root / 'scope')
+        index.add_document(1, self.vectors[1])
+        with self.assertRaises(ValueError):
+            index.add_document(2, np.ones((3, DIMENSION + 1), dtype=np.float32))
+
+    def test_unknown_index_type_rejected(self):
+        with self.assertRaises(ValueError):
+            PersistentFaissIndex(self.root / 'scope').set_index_type('lsh')
+
+
+class VectorIndexStoreTests(VectorIndexTestMixin, SimpleTestCase):
+
+    def build_scope(self, store, index_type):
+        with store.update('kb_1') as index:
+            index.set_index_type(index_type)
+            for doc_id, vectors in self.vectors.items():
+                index.add_document(doc_id, vectors)
+        return store.get('kb_1')
+
+    def assert_finds_own_vectors(self, index):
+        for doc_id in index.document_ids:
+            query = self.vectors[doc_id][3:4].copy()
+            query /= np.linalg.norm(query)
+            top = index.search(query, 5)
+            self.assertIn((doc_id, 3), [(d, c) for d, c, _ in top])
+
+    def test_add_remove_rebuild_for_each_index_type(self):
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type):
+                store = self.make_store()
+                index = self.build_scope(store, index_type)
+                self.assertEqual(index.index_type, index_type)
+                self.assertEqual(index.built_type, index_type)
+                self.assertEqual(index.live_count, 240)
+                self.assert_finds_own_vectors(index)
+
+                with store.update('kb_1') as index:
+                    index.remove_documents([2])
+                index = store.get('kb_1')
+                self.assertEqual(index.document_ids, {1, 3, 4})
+                self.assertEqual(index.live_count, 180)
+                # HNSW non rimuove: l'indice deve essere stato ricostruito senza vettori obsoleti
+                self.assertFalse(index.stale)
+                self.assertEqual(index.ntotal, 180)
+                query = self.vectors[2][0:1] / np.linalg.norm(self.vectors[2][0:1])
+                self.assertNotIn(2, {d for d, _, _ in index.search(query, 20)})
+                self.assert_finds_own_vectors(index)
+
+                store.drop('kb_1')
+
+    def test_small_scope_stays_flat(self):
+        store = self.make_store(ann_min_vectors=1000)
+        index = self.build_scope(store, INDEX_HNSW)
+        self.assertEqual(index.index_type, INDEX_HNSW)
+        self.assertEqual(index.built_type, INDEX_FLAT)
+        self.assert_finds_own_vectors(index)
+
+    def test_falls_back_to_flat_below_threshold(self):
+        store = self.make_store(ann_min_vectors=200)
+        self.build_scope(store, INDEX_HNSW)
+        with store.update('kb_1') as index:
+            index.remove_documents([1, 2, 3])
+        index = store.get('kb_1')
+        self.assertEqual(index.built_type, INDEX_FLAT)
+        self.assertEqual(index.document_ids, {4})
+
+    def test_get_reloads_after_update_from_other_store(self):
+        reader = self.make_store()
+        writer = self.make_store()
+        self.build_scope(writer, INDEX_FLAT)
+        self.assertEqual(reader.get('kb_1').live_count, 240)
+        with writer.update('kb_1') as index:
+            index.remove_documents([4])
+        self.assertEqual(reader.get('kb_1').document_ids, {1, 2, 3})
+
+    def test_scopes_containing(self):
+        store = self.make_store()
+        self.build_scope(store, INDEX_FLAT)
+        with store.update('user_7') as index:
+            index.add_document(3, self.vectors[3])
+        self.assertEqual(sorted(store.scopes_containing(3)), ['kb_1', 'user_7'])
+        self.assertEqual(store.scopes_containing(1), ['kb_1'])
@@ -4,7 +4,7 @@ URL configuration per l'API RAG.
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    RAGChatView, RAGDocumentViewSet, RAGStatusView, RAGClearKnowledgeBaseView,
+    RAGChatView, RAGChatStreamView, RAGDocumentViewSet, RAGStatusView, RAGClearKnowledgeBaseView,
     RAGKnowledgeBaseViewSet, RAGChatSessionViewSet, RAGChatSessionListView,
     RAGEmbeddingInfoView, RAGEmbeddingBenchmarkView, RAGResourceManagerView,
     RAGTaggedResourcesView, RAGTagsView, RAGResourceTagsUpdateView
@@ -19,6 +19,7 @@ router.register(r'chat-sessions', RAGChatSessionViewSet, basename='chat-sessions
 urlpatterns = [
     # Endpoint principale per la chat RAG
     path('chat/', RAGChatView.as_view(), name='rag-chat'),
+    path('chat/stream/', RAGChatStreamView.as_view(), name='rag-chat-stream'),
     
     # Endpoint per lo stato del sistema
     path('status/', RAGStatusView.as_view(), name='rag-status'),
@@ -62,6 +63,9 @@ urlpatterns = [
 # DELETE /api/knowledge-bases/{id}/ - Elimina knowledge base
 # POST   /api/knowledge-bases/{id}/add_documents/ - Aggiungi documenti alla KB
 # POST   /api/knowledge-bases/{id}/remove_documents/ - Rimuovi documenti dalla KB
+# POST   /api/knowledge-bases/{id}/bulk_import/ - Importazione in blocco (file e/o resource_ids)
+# GET    /api/knowledge-bases/{id}/import_jobs/ - Job di importazione recenti
+# GET    /api/knowledge-bases/{id}/import_jobs/{job_id}/ - Avanzamento di un job di importazione
 # GET    /api/knowledge-bases/{id}/statistics/ - Statistiche dettagliate KB
 # POST   /api/knowledge-bases/{id}/chat/ - Chat specifica per KB
 #
@@ -0,0 +1,357 @@
+"""
+Cache delle risposte della chat RAG.
+
+Le risposte (con chunk di contesto e fonti) sono salvate per namespace: il corpus
+interrogato (knowledge base + ``content_version``, oppure l'insieme dei documenti e la
+loro ultima modifica) più i parametri che cambiano la risposta (top_k, max_tokens,
+rerank, modelli). Quando una knowledge base cambia, la sua versione aumenta e le
+risposte precedenti non vengono più trovate.
+
+La ricerca avviene in due passi:
+- corrispondenza esatta sulla domanda normalizzata (hash, nessun embedding)
+- solo con RAG_ANSWER_CACHE_SEMANTIC: la domanda più simile nello stesso namespace, se la
+  similarità coseno degli embeddings supera RAG_ANSWER_CACHE_SIMILARITY
+
+La ricerca semantica è disattivata di default: domande quasi identiche possono chiedere cose
+opposte e riceverebbero una risposta salvata per un'altra domanda.
+
+Le voci stanno in un file SQLite condiviso tra i worker (come la cache degli embeddings)
+con TTL ed eliminazione delle meno usate oltre RAG_ANSWER_CACHE_MAX_ENTRIES.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Ogni quanti inserimenti si controllano scadenze e dimensione del file SQLite
+PRUNE_EVERY = 100
+
+
+class CachedAnswer(NamedTuple):
+    """
+    Risposta trovata in cache.
+    """
+    payload: Dict[str, Any]
+    match: str          # 'exact' o 'semantic'
+    similarity: float
+
+
+def normalize_query(query: str) -> str:
+    """
+    Forma canonica della domanda per la corrispondenza esatta.
+    """
+    return ' '.join(query.lower().split()).rstrip('?!. ')
+
+
+def knowledge_base_corpus(knowledge_base) -> str:
+    """
+    Corpus di una knowledge base alla sua versione corrente dei contenuti.
+    """
+    return f"kb:{knowledge_base.id}:v{knowledge_base.content_version}"
+
+
+def documents_corpus(document_ids: Iterable[int]) -> str:
+    """
+    Corpus di un insieme di documenti: cambia se cambia l'insieme o se uno dei documenti
+    viene modificato (riprocessamento, cambio di stato).
+    """
+    from django.db.models import Max
+    from ..models import RAGDocument
+
+    ids = sorted(set(document_ids))
+    latest = RAGDocument.objects.filter(id__in=ids).aggregate(latest=Max('updated_at'))['latest']
+    digest = hashlib.sha256(f"{ids}|{latest.isoformat() if latest else ''}".encode('utf-8')).hexdigest()
+    return f"docs:{digest[:32]}"
+
+
+def make_namespace(corpus: str, **params) -> str:
+    """
+    Namespace delle risposte per un corpus e i parametri che influenzano la risposta.
+    """
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return f"{corpus}|{hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]}"
+
+
+class AnswerCache:
+    """
+    Cache delle risposte su file SQLite condiviso.
+
+    Args:
+        path (Path): File SQLite (None disattiva la cache)
+        max_entries (int): Numero massimo di risposte salvate
+        ttl_seconds (int): Durata di una risposta (0 = nessuna scadenza)
+        similarity_threshold (float): Similarità minima per una corrispondenza semantica
+            (>= 1 disattiva la ricerca semantica)
+        max_candidates (int): Domande più recenti del namespace confrontate per similarità
+        semantic (bool): Cerca anche le domande simili oltre a quelle identiche
+    """
+
+    def __init__(self, path: Optional[Path], max_entries: int = 20000, ttl_seconds: int = 24 * 3600,
+                 similarity_threshold: float = 0.95, max_candidates: int = 1000, semantic: bool = False):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic and similarity_threshold < 1
+        self.similarity_threshold = similarity_threshold
+        self.max_candidates = max_candidates
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inserts_since_prune = 0
+        self._stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                connection = self._connection()
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS answers ("
+                    " key TEXT PRIMARY KEY,"
+                    " namespace TEXT NOT NULL,"
+                    " query TEXT NOT NULL,"
+                    " embedding BLOB,"
+                    " payload TEXT NOT NULL,"
+                    " hits INTEGER NOT NULL DEFAULT 0,"
+                    " expires_at REAL NOT NULL,"
+                    " accessed_at REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS answers_namespace ON answers (namespace, accessed_at)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers (accessed_at)")
+            except sqlite3.Error as e:
+                logger.warning(f"Cache delle risposte non disponibile ({self.path}): {str(e)}")
+                self.path = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connessione SQLite del thread corrente (le connessioni non sono condivisibili tra thread).
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    @staticmethod
+    def _key(namespace: str, query: str) -> str:
+        return hashlib.sha256(f"{namespace}\x00{normalize_query(query)}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _unit_vector(vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+
+    def _hit(self, key: str, payload: str, match: str, similarity: float, now: float) -> CachedAnswer:
+        self._connection().execute(
+            "UPDATE answers SET hits = hits + 1, accessed_at = ? WHERE key = ?", (now, key)
+        )
+        self._count('exact_hits' if match == 'exact' else 'semantic_hits')
+        return CachedAnswer(json.loads(payload), match, round(similarity, 4))
+
+    def lookup(self, namespace: str, query: str,
+               embed: Optional[Callable[[str], Any]] = None) -> Optional[CachedAnswer]:
+        """
+        Cerca una risposta per la domanda: prima per corrispondenza esatta, poi (se la
+        ricerca semantica è attiva) per similarità.
+
+        Args:
+            namespace (str): Namespace della richiesta (vedi ``make_namespace``)
+            query (str): Domanda dell'utente
+            embed (callable): Funzione che calcola l'embedding della domanda (solo se serve)
+
+        Returns:
+            Optional[CachedAnswer]: Risposta in cache, o None
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        try:
+            connection = self._connection()
+            key = self._key(namespace, query)
+            row = connection.execute(
+                "SELECT payload FROM answers WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                return self._hit(key, row[0], 'exact', 1.0, now)
+
+            if embed is None or not self.semantic:
+                self._count('misses')
+                return None
+
+            rows = connection.execute(
+                "SELECT key, embedding, payload FROM answers "
+                "WHERE namespace = ? AND expires_at > ? AND embedding IS NOT NULL "
+                "ORDER BY accessed_at DESC LIMIT ?",
+                (namespace, now, self.max_candidates)
+            ).fetchall()
+            query_vector = self._unit_vector(embed(query)) if rows else None
+            if query_vector is not None:
+                candidates = [row for row in rows if len(row[1]) == query_vector.nbytes]
+                if candidates:
+                    matrix = np.frombuffer(b''.join(row[1] for row in candidates), dtype=np.float32)
+                    similarities = matrix.reshape(len(candidates), -1) @ query_vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        key, _, payload = candidates[best]
+                        return self._hit(key, payload, 'semantic', float(similarities[best]), now)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Errore nella lettura della cache delle risposte: {str(e)}")
+
+        self._count('misses')
+        return None
+
+    def store(self, namespace: str, query: str, payload: Dict[str, Any],
+              embed: Optional[Callable[[str], Any]] = None):
+        """
+        Salva la risposta a una domanda.
+
+        Args:
+            namespace (str): Namespace della richiesta
+            query (str): Domanda dell'utente
+            payload (Dict): Risposta, chunk di contesto e fonti (serializzabili in JSON)
+            embed (callable): Funzione che calcola l'embedding della domanda (usata solo con
+                la ricerca semantica attiva)
+        """
+        if not self.enabled:
+            return
+
+        try:
+            vector = self._unit_vector(embed(query)) if embed is not None and self.semantic else None
+        except Exception as e:
+            logger.warning(f"Embedding non disponibile per la cache delle risposte: {str(e)}")
+            vector = None
+
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else 1e18
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO answers (key, namespace, query, embedding, payload, hits, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                (self._key(namespace, query), namespace, query,
+                 vector.tobytes() if vector is not None else None,
+                 json.dumps(payload, default=str), expires_at, now)
+            )
+            self._count('stores')
+            self._inserts_since_prune += 1
+            if self._inserts_since_prune >= PRUNE_EVERY:
+                self._inserts_since_prune = 0
+                self.prune()
+        except sqlite3.Error as e:
+            logger.warning(f"Errore nella scrittura della cache delle risposte: {str(e)}")
+
+    def invalidate(self, corpus_prefix: str) -> int:
+        """
+        Elimina le risposte dei namespace che iniziano con il prefisso indicato
+        (es. ``kb:12:`` per tutte le versioni di una knowledge base).
+        """
+        if not self.enabled:
+            return 0
+        try:
+            escaped = corpus_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            cursor = self._connection().execute(
+                "DELETE FROM answers WHERE namespace LIKE ? ESCAPE '\\'", (escaped + '%',)
+            )
+            self._count('evictions', cursor.rowcount)
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Errore nell'invalidazione della cache delle risposte: {str(e)}")
+            return 0
+
+    def prune(self):
+        """
+        Elimina le risposte scadute e quelle meno usate oltre il limite di dimensione.
+        """
+        if not self.enabled:
+            return
+
+        connection = self._connection()
+        expired = connection.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),)).rowcount
+        (count,) = connection.execute("SELECT COUNT(*) FROM answers").fetchone()
+        excess = max(0, count - self.max_entries)
+        if excess:
+            connection.execute(
+                "DELETE FROM answers WHERE key IN "
+                "(SELECT key FROM answers ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+        self._count('evictions', expired + excess)
+
+    def clear(self):
+        """
+        Svuota la cache.
+        """
+        if self.enabled:
+            try:
+                self._connection().execute("DELETE FROM answers")
+            except sqlite3.Error as e:
+                logger.warning(f"Errore nello svuotamento della cache delle risposte: {str(e)}")
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Contatori di hit/miss del processo corrente e occupazione della cache.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['exact_hits'] + stats['semantic_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['exact_hits'] + stats['semantic_hits']) / lookups, 4) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        stats['semantic'] = self.semantic
+        stats['similarity_threshold'] = self.similarity_threshold
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['max_entries'] = self.max_entries
+        stats['path'] = str(self.path) if self.path else None
+
+        if self.enabled:
+            try:
+                (stats['entries'], stats['stored_hits']) = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answers"
+                ).fetchone()
+            except sqlite3.Error:
+                stats['entries'] = None
+        return stats
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Restituisce la cache delle risposte configurata (singleton per processo).
+    """
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                enabled = getattr(settings, 'RAG_ANSWER_CACHE_ENABLED', True)
+                _answer_cache = AnswerCache(
+                    getattr(settings, 'RAG_ANSWER_CACHE_PATH', None) if enabled else None,
+                    max_entries=getattr(settings, 'RAG_ANSWER_CACHE_MAX_ENTRIES', 20000),
+                    ttl_seconds=getattr(settings, 'RAG_ANSWER_CACHE_TTL', 24 * 3600),
+                    similarity_threshold=getattr(settings, 'RAG_ANSWER_CACHE_SIMILARITY', 0.95),
+                    max_candidates=getattr(settings, 'RAG_ANSWER_CACHE_MAX_CANDIDATES', 1000),
+                    semantic=getattr(settings, 'RAG_ANSWER_CACHE_SEMANTIC', False)
+                )
+    return _answer_cache
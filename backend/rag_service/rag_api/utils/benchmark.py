@@ -0,0 +1,498 @@
+"""
+Benchmark offline della pipeline di retrieval (comando ``manage.py benchmark_rag``).
+
+Il benchmark non tocca dati, indici né provider del servizio in esecuzione: usa un
+EmbeddingManager dedicato, con tutti i file in una directory di lavoro temporanea, un
+corpus sintetico riproducibile e un client di embedding locale al posto dell'API
+OpenAI (vettori deterministici da bag-of-words, latenza simulata opzionale).
+
+Misure raccolte:
+- ingestione (chunking, embeddings, scrittura di shard e chunk): documenti/s e chunk/s
+- costruzione degli indici persistenti per ogni tipo (flat, IVF-Flat, HNSW, IVF-PQ)
+- latenza p50/p95/p99 della sola ricerca sull'indice e della ricerca completa
+  (embedding della query, ricerca, risoluzione dei testi)
+- recall@k degli indici approssimati rispetto all'indice esatto
+- spazio su disco di indici, vettori e testi per 100k chunk, picco di memoria del processo
+
+I risultati sono un dict serializzabile in JSON con chiavi stabili, da confrontare
+tra una release e l'altra (vedi ``compare_results``).
+"""
+import os
+import sys
+import time
+import zlib
+import random
+import logging
+import platform
+import resource
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import faiss
+from django.test.utils import override_settings
+
+from .chunking import TextChunker
+from .embedding_utils import EmbeddingManager, EngineConfig
+from .vector_index import INDEX_FLAT, INDEX_TYPES
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FORMAT_VERSION = 1
+
+# Sillabe per le parole del vocabolario sintetico
+SYLLABLES = (
+    'ba', 'be', 'bi', 'bo', 'ca', 'ce', 'ci', 'co', 'da', 'de', 'di', 'do', 'fa', 'fe', 'fi',
+    'la', 'le', 'li', 'lo', 'ma', 'me', 'mi', 'mo', 'na', 'ne', 'ni', 'no', 'pa', 'pe', 'pi',
+    'ra', 're', 'ri', 'ro', 'sa', 'se', 'si', 'so', 'ta', 'te', 'ti', 'to', 'va', 've', 'vi',
+)
+
+# Quota di parole di una frase prese dal vocabolario del tema del documento
+TOPIC_WORD_RATIO = 0.6
+
+# Query eseguite prima delle misure di latenza (caricamento indici, cache della CPU)
+WARMUP_QUERIES = 5
+
+# Metriche confrontate da compare_results: (percorso, True se un valore più alto è migliore)
+COMPARED_METRICS = (
+    (('ingestion', 'documents_per_second'), True),
+    (('ingestion', 'chunks_per_second'), True),
+    (('storage', 'vector_bytes_per_100k_chunks'), False),
+    (('peak_rss_mb',), False),
+)
+COMPARED_INDEX_METRICS = (
+    (('build_seconds',), False),
+    (('search_latency_ms', 'p95'), False),
+    (('end_to_end_latency_ms', 'p95'), False),
+    (('recall_at_k',), True),
+    (('index_bytes_per_100k_vectors',), False),
+)
+
+
+class SyntheticCorpus:
+    """
+    Corpus sintetico riproducibile: documenti su temi diversi e query estratte dai documenti.
+
+    Ogni documento ha un tema; le frasi mescolano parole del tema e parole comuni, così
+    i documenti dello stesso tema sono semanticamente vicini anche per l'embedder locale.
+
+    Args:
+        num_documents (int): Numero di documenti
+        sentences_per_document (int): Frasi per documento
+        num_topics (int): Numero di temi
+        seed (int): Seme del generatore casuale
+    """
+
+    def __init__(self, num_documents: int, sentences_per_document: int = 80,
+                 num_topics: int = 20, seed: int = 0):
+        self.num_documents = num_documents
+        self.sentences_per_document = sentences_per_document
+        self.num_topics = num_topics
+        self.seed = seed
+
+        rng = random.Random(seed)
+        vocabulary = sorted({
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(num_topics * 60 + 400)
+        })
+        rng.shuffle(vocabulary)
+        self.common_words = vocabulary[:400]
+        self.topic_words = [
+            vocabulary[400 + topic * 60:400 + (topic + 1) * 60] for topic in range(num_topics)
+        ]
+
+    def _sentence(self, rng: random.Random, topic: int) -> str:
+        words = [
+            rng.choice(self.topic_words[topic]) if rng.random() < TOPIC_WORD_RATIO
+            else rng.choice(self.common_words)
+            for _ in range(rng.randint(8, 18))
+        ]
+        return ' '.join(words).capitalize() + '.'
+
+    def document(self, index: int) -> str:
+        """
+        Testo del documento ``index`` (sempre uguale a parità di seme).
+        """
+        rng = random.Random(f"{self.seed}-doc-{index}")
+        topic = index % self.num_topics
+        paragraphs = []
+        sentences = [self._sentence(rng, topic) for _ in range(self.sentences_per_document)]
+        for start in range(0, len(sentences), 6):
+            paragraphs.append(' '.join(sentences[start:start + 6]))
+        return '\n\n'.join(paragraphs)
+
+    def queries(self, count: int) -> List[str]:
+        """
+        Query brevi con parole prese da frasi dei documenti.
+        """
+        rng = random.Random(f"{self.seed}-queries")
+        queries = []
+        for _ in range(count):
+            words = self.document(rng.randrange(self.num_documents)).replace('.', '').split()
+            start = rng.randrange(max(1, len(words) - 8))
+            queries.append(' '.join(words[start:start + rng.randint(4, 8)]).lower())
+        return queries
+
+
+class LocalEmbeddingClient:
+    """
+    Sostituto locale del client OpenAI per gli embeddings (stessa interfaccia usata da EmbeddingManager).
+
+    Il vettore di un testo è la somma di vettori gaussiani deterministici delle sue parole,
+    normalizzata. ``latency_ms`` simula il tempo di risposta dell'API per ogni richiesta.
+
+    Args:
+        dimension (int): Dimensione dei vettori
+        latency_ms (float): Latenza simulata per richiesta
+        batch_size (int): Testi per richiesta nelle chiamate batch
+    """
+
+    def __init__(self, dimension: int = 384, latency_ms: float = 0.0, batch_size: int = 100):
+        self.embedding_model = 'local-benchmark'
+        self.dimension = dimension
+        self.latency = latency_ms / 1000.0
+        self.batch_size = batch_size
+        self.requests = 0
+        self.texts = 0
+        self._word_vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode('utf-8')))
+            vector = rng.standard_normal(self.dimension).astype(np.float32)
+            self._word_vectors[word] = vector
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().replace('.', ' ').split():
+            vector += self._word_vector(word)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def _request(self, texts: Sequence[str]) -> List[List[float]]:
+        with self._lock:
+            self.requests += 1
+            self.texts += len(texts)
+            embeddings = [self._embed(text) for text in texts]
+        if self.latency:
+            time.sleep(self.latency)
+        return embeddings
+
+    def create_embedding(self, text: str) -> List[float]:
+        return self._request([text])[0]
+
+    def create_embeddings_batch(self, texts: List[str], batch_size: int = 100) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._request(texts[start:start + self.batch_size]))
+        return embeddings
+
+    def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
+        vec1 = np.array(vec1)
+        vec2 = np.array(vec2)
+        return float(np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2)))
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {
+            'model': self.embedding_model,
+            'dimensions': self.dimension,
+            'default_dimensions': self.dimension,
+            'supports_custom_dimensions': False,
+            'api_version': 'local'
+        }
+
+
+def latency_summary(samples: Sequence[float]) -> Dict[str, float]:
+    """
+    Percentili (in millisecondi) di una lista di durate in secondi.
+    """
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        'count': int(values.size),
+        'mean': round(float(values.mean()), 4),
+        'p50': round(float(np.percentile(values, 50)), 4),
+        'p95': round(float(np.percentile(values, 95)), 4),
+        'p99': round(float(np.percentile(values, 99)), 4),
+        'max': round(float(values.max()), 4),
+    }
+
+
+def _directory_bytes(path: Path, pattern: str = '*') -> int:
+    return sum(entry.stat().st_size for entry in Path(path).rglob(pattern) if entry.is_file())
+
+
+def _per_100k(total: int, count: int) -> Optional[int]:
+    return int(total * 100000 / count) if count else None
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class RetrievalBenchmark:
+    """
+    Esegue il benchmark di retrieval in una directory di lavoro isolata.
+
+    Args:
+        work_dir (Path): Directory per embeddings, indici e cache del benchmark
+        corpus (SyntheticCorpus): Corpus da indicizzare
+        num_queries (int): Numero di query misurate
+        top_k (int): Risultati per query (k della recall)
+        dimension (int): Dimensione degli embeddings locali
+        index_types (Sequence[str]): Tipi di indice da misurare (flat è sempre incluso)
+        embedding_latency_ms (float): Latenza simulata dell'API di embedding
+        nprobe (int): Liste IVF visitate (None = RAG_ANN_NPROBE)
+        ef_search (int): Ampiezza di ricerca HNSW (None = RAG_ANN_EF_SEARCH)
+    """
+
+    def __init__(self, work_dir: Path, corpus: SyntheticCorpus, num_queries: int = 200, top_k: int = 10,
+                 dimension: int = 384, index_types: Sequence[str] = INDEX_TYPES,
+                 embedding_latency_ms: float = 0.0, nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None):
+        self.work_dir = Path(work_dir)
+        self.corpus = corpus
+        self.num_queries = num_queries
+        self.top_k = top_k
+        self.dimension = dimension
+        self.index_types = [INDEX_FLAT] + [t for t in index_types if t != INDEX_FLAT]
+        self.embedding_latency_ms = embedding_latency_ms
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+    def _isolated_settings(self) -> override_settings:
+        """
+        Impostazioni che confinano il benchmark nella directory di lavoro.
+        """
+        return override_settings(
+            EMBEDDING_PROVIDER='sentence_transformers',
+            RAG_EMBEDDINGS_ROOT=str(self.work_dir / 'embeddings'),
+            RAG_QUERY_EMBEDDING_CACHE_PATH='',
+            RAG_CHUNK_EMBEDDING_STORE_PATH=str(self.work_dir / 'chunk_embeddings.sqlite3'),
+            # Gli indici approssimati vengono costruiti a prescindere dalla dimensione del corpus
+            RAG_ANN_MIN_VECTORS=0,
+        )
+
+    def _create_manager(self) -> Tuple[EmbeddingManager, LocalEmbeddingClient]:
+        """
+        EmbeddingManager dedicato al benchmark, collegato al client di embedding locale.
+        """
+        (self.work_dir / 'embeddings').mkdir(parents=True, exist_ok=True)
+        client = LocalEmbeddingClient(self.dimension, self.embedding_latency_ms)
+        manager = EmbeddingManager(
+            EngineConfig('openai', client.embedding_model, self.dimension), embedding_client=client
+        )
+        return manager, client
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Esegue tutte le misure e restituisce i risultati.
+        """
+        with self._isolated_settings():
+            manager, client = self._create_manager()
+            document_ids, ingestion, storage = self._measure_ingestion(manager, client)
+            queries = self.corpus.queries(self.num_queries)
+            indices = self._measure_indices(manager, document_ids, queries)
+
+        return {
+            'format_version': RESULTS_FORMAT_VERSION,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'config': {
+                'documents': self.corpus.num_documents,
+                'sentences_per_document': self.corpus.sentences_per_document,
+                'topics': self.corpus.num_topics,
+                'seed': self.corpus.seed,
+                'queries': self.num_queries,
+                'top_k': self.top_k,
+                'dimension': self.dimension,
+                'embedding_latency_ms': self.embedding_latency_ms,
+                'nprobe': self.nprobe,
+                'ef_search': self.ef_search,
+                'index_types': self.index_types,
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'numpy': np.__version__,
+                'faiss': getattr(faiss, '__version__', 'unknown'),
+                'faiss_threads': faiss.omp_get_max_threads(),
+            },
+            'ingestion': ingestion,
+            'storage': storage,
+            'indices': indices,
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+
+    def _measure_ingestion(self, manager: EmbeddingManager,
+                           client: LocalEmbeddingClient) -> Tuple[List[int], Dict[str, Any], Dict[str, Any]]:
+        """
+        Ingestione dei documenti come nella pipeline di process_rag_document_task, senza database.
+        """
+        chunker = TextChunker()
+        document_ids = list(range(1, self.corpus.num_documents + 1))
+        total_chunks = 0
+        total_chars = 0
+        reused = 0
+        chunking_time = 0.0
+        embedding_time = 0.0
+
+        start = time.perf_counter()
+        for document_id in document_ids:
+            text = self.corpus.document(document_id - 1)
+            total_chars += len(text)
+
+            step = time.perf_counter()
+            chunks = [chunk.text for chunk in chunker.iter_chunks([text])]
+            chunking_time += time.perf_counter() - step
+
+            step = time.perf_counter()
+            embeddings, doc_reused = manager.create_chunk_embeddings(chunks)
+            embedding_time += time.perf_counter() - step
+
+            writer = manager.open_document_writer(document_id)
+            writer.append(embeddings, chunks)
+            writer.close({'num_chunks': len(chunks), 'benchmark': True})
+
+            total_chunks += len(chunks)
+            reused += doc_reused
+        elapsed = time.perf_counter() - start
+
+        embeddings_root = Path(manager.embeddings_root)
+        vector_bytes = _directory_bytes(embeddings_root, 'vectors-*.npy')
+        text_bytes = _directory_bytes(embeddings_root, 'chunks.txt')
+
+        ingestion = {
+            'documents': len(document_ids),
+            'chunks': total_chunks,
+            'characters': total_chars,
+            'seconds': round(elapsed, 4),
+            'documents_per_second': round(len(document_ids) / elapsed, 2) if elapsed else None,
+            'chunks_per_second': round(total_chunks / elapsed, 2) if elapsed else None,
+            'chunking_seconds': round(chunking_time, 4),
+            'embedding_seconds': round(embedding_time, 4),
+            'embedding_requests': client.requests,
+            'embedded_texts': client.texts,
+            'reused_chunk_embeddings': reused,
+        }
+        storage = {
+            'vector_bytes': vector_bytes,
+            'vector_bytes_per_100k_chunks': _per_100k(vector_bytes, total_chunks),
+            'chunk_text_bytes': text_bytes,
+            'chunk_text_bytes_per_100k_chunks': _per_100k(text_bytes, total_chunks),
+            'storage_dtype': manager.storage_dtype,
+        }
+        return document_ids, ingestion, storage
+
+    def _measure_indices(self, manager: EmbeddingManager, document_ids: List[int],
+                         queries: List[str]) -> Dict[str, Any]:
+        """
+        Costruzione, latenza e recall di ogni tipo di indice sullo stesso corpus e le stesse query.
+        """
+        query_vectors = np.ascontiguousarray(manager.get_embeddings_batch(queries), dtype=np.float32)
+        faiss.normalize_L2(query_vectors)
+
+        results = {}
+        exact_hits = None
+        for index_type in self.index_types:
+            scope = f"benchmark_{index_type}"
+
+            start = time.perf_counter()
+            manager.add_documents_to_index(scope, document_ids, index_type=index_type)
+            build_seconds = time.perf_counter() - start
+
+            index = manager.index_store.get(scope)
+            search_options = {'nprobe': self.nprobe, 'ef_search': self.ef_search}
+
+            for query_vector in query_vectors[:WARMUP_QUERIES]:
+                index.search(query_vector[None, :], self.top_k, **search_options)
+
+            hits = []
+            search_samples = []
+            for query_vector in query_vectors:
+                step = time.perf_counter()
+                found = index.search(query_vector[None, :], self.top_k, **search_options)
+                search_samples.append(time.perf_counter() - step)
+                hits.append({(doc_id, chunk_index) for doc_id, chunk_index, _ in found})
+
+            # Ricerca completa: embedding della query (senza cache), ricerca e testi dei chunk
+            manager.query_cache.clear()
+            end_to_end_samples = []
+            for query in queries:
+                step = time.perf_counter()
+                manager.search_similar_chunks(query, document_ids, self.top_k, scope=scope, **search_options)
+                end_to_end_samples.append(time.perf_counter() - step)
+
+            if exact_hits is None:
+                exact_hits = hits
+            recall = [
+                len(found & expected) / len(expected)
+                for found, expected in zip(hits, exact_hits) if expected
+            ]
+
+            index_bytes = _directory_bytes(manager.index_store.root / scope, '*.faiss')
+            results[index_type] = {
+                'built_type': index.built_type,
+                'vectors': index.ntotal,
+                'build_seconds': round(build_seconds, 4),
+                'search_latency_ms': latency_summary(search_samples),
+                'end_to_end_latency_ms': latency_summary(end_to_end_samples),
+                'recall_at_k': round(float(np.mean(recall)), 4) if recall else None,
+                'index_bytes': index_bytes,
+                'index_bytes_per_100k_vectors': _per_100k(index_bytes, index.ntotal),
+            }
+            logger.info(f"Benchmark indice {index_type}: build {build_seconds:.2f}s, "
+                        f"p95 {results[index_type]['search_latency_ms'].get('p95')} ms, "
+                        f"recall@{self.top_k} {results[index_type]['recall_at_k']}")
+        return results
+
+
+def _lookup(data: Dict[str, Any], path: Tuple[str, ...]):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    tolerance: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    Confronta due risultati del benchmark sulle metriche principali.
+
+    Args:
+        baseline (Dict): Risultati di riferimento (es. release precedente)
+        current (Dict): Risultati correnti
+        tolerance (float): Variazione relativa oltre la quale una metrica peggiorata è una regressione
+
+    Returns:
+        List[Dict]: Per ogni metrica: nome, valori, variazione relativa e se è una regressione
+    """
+    metrics = [('.'.join(path), path, higher_is_better) for path, higher_is_better in COMPARED_METRICS]
+    for index_type in sorted(set(current.get('indices', {})) & set(baseline.get('indices', {}))):
+        for path, higher_is_better in COMPARED_INDEX_METRICS:
+            full_path = ('indices', index_type) + path
+            metrics.append(('.'.join(full_path), full_path, higher_is_better))
+
+    comparison = []
+    for name, path, higher_is_better in metrics:
+        before, after = _lookup(baseline, path), _lookup(current, path)
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        comparison.append({
+            'metric': name,
+            'baseline': before,
+            'current': after,
+            'change': round(change, 4),
+            'regression': worse > tolerance,
+        })
+    return comparison
@@ -0,0 +1,155 @@
+"""
+Archivio su disco dei testi dei chunk con accesso O(1) per (document_id, chunk_index).
+
+Per ogni documento vengono scritti due file nella sua directory degli embeddings:
+- ``chunks-<generazione>.txt``: tutti i chunk concatenati in un unico blob UTF-8
+- ``chunk_offsets-<generazione>.npy``: offset in byte (int64, n+1 valori) di inizio/fine di ogni chunk
+
+I nomi dei file di ogni generazione sono univoci e vengono pubblicati dal manifest del
+documento (vedi embedding_store), che è l'unico punto di commit: blob e offset non
+vengono mai riscritti sul posto. I documenti salvati prima delle generazioni usano
+i nomi fissi ``chunks.txt`` e ``chunk_offsets.npy``.
+
+Gli offset vengono letti in memory-map, quindi risolvere un hit costa una seek e una
+read sul blob invece di deserializzare l'intera lista dei chunk.
+"""
+import pickle
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHUNKS_BLOB_NAME = 'chunks.txt'
+CHUNK_OFFSETS_NAME = 'chunk_offsets.npy'
+LEGACY_CHUNKS_NAME = 'chunks.pkl'
+
+
+class ChunkFiles(NamedTuple):
+    """
+    Nomi dei file (blob e offset) di una generazione dei chunk di un documento.
+    """
+    blob: str
+    offsets: str
+
+    @classmethod
+    def for_generation(cls, generation: str) -> 'ChunkFiles':
+        return cls(f"chunks-{generation}.txt", f"chunk_offsets-{generation}.npy")
+
+
+# Nomi fissi dei documenti salvati prima delle generazioni
+DEFAULT_FILES = ChunkFiles(CHUNKS_BLOB_NAME, CHUNK_OFFSETS_NAME)
+
+
+class ChunkWriter:
+    """
+    Scrive i chunk di un documento in modo incrementale nel formato blob + offset.
+
+    I chunk vengono accodati al blob della generazione man mano che arrivano; i file
+    diventano visibili ai lettori solo quando il manifest del documento li referenzia.
+    """
+
+    def __init__(self, doc_dir: Path, files: ChunkFiles):
+        self.doc_dir = Path(doc_dir)
+        self.files = files
+        self._file = open(self.doc_dir / files.blob, 'wb')
+        self._offsets = [0]
+
+    @property
+    def count(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, chunks: Iterable[str]):
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            self._file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._file.close()
+        np.save(self.doc_dir / self.files.offsets, np.asarray(self._offsets, dtype=np.int64))
+
+    def abort(self):
+        """
+        Chiude il writer ed elimina i file (non ancora pubblicati) della generazione.
+        """
+        self._file.close()
+        for name in self.files:
+            try:
+                (self.doc_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def has_chunk_store(doc_dir: Path, files: ChunkFiles = DEFAULT_FILES) -> bool:
+    """
+    Indica se il documento ha i chunk nel formato blob + offset.
+    """
+    doc_dir = Path(doc_dir)
+    return (doc_dir / files.blob).exists() and (doc_dir / files.offsets).exists()
+
+
+def count_chunks(doc_dir: Path, files: ChunkFiles = DEFAULT_FILES) -> int:
+    """
+    Restituisce il numero di chunk memorizzati per il documento.
+    """
+    offsets = np.load(Path(doc_dir) / files.offsets, mmap_mode='r')
+    return max(len(offsets) - 1, 0)
+
+
+def read_chunks(doc_dir: Path, chunk_indices: Iterable[int], files: ChunkFiles = DEFAULT_FILES) -> Dict[int, str]:
+    """
+    Legge solo i chunk richiesti di un documento.
+
+    Il file dei testi viene aperto una volta sola per tutti gli indici richiesti.
+
+    Args:
+        doc_dir (Path): Directory degli embeddings del documento
+        chunk_indices (Iterable[int]): Indici dei chunk da leggere
+        files (ChunkFiles): File della generazione pubblicata nel manifest
+
+    Returns:
+        Dict[int, str]: Mappa chunk_index -> testo (gli indici non validi vengono ignorati)
+    """
+    doc_dir = Path(doc_dir)
+    wanted = sorted(set(int(i) for i in chunk_indices))
+    result = {}
+
+    if not has_chunk_store(doc_dir, files):
+        raise FileNotFoundError(f"Chunk non trovati in {doc_dir}")
+
+    offsets = np.load(doc_dir / files.offsets, mmap_mode='r')
+    num_chunks = len(offsets) - 1
+
+    with open(doc_dir / files.blob, 'rb') as f:
+        for i in wanted:
+            if not 0 <= i < num_chunks:
+                continue
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            f.seek(start)
+            result[i] = f.read(end - start).decode('utf-8')
+
+    return result
+
+
+def read_all_chunks(doc_dir: Path, files: ChunkFiles = DEFAULT_FILES) -> List[str]:
+    """
+    Legge tutti i chunk di un documento, nell'ordine dell'indice.
+
+    Il pickle legacy viene letto solo per convertire i documenti salvati prima
+    dell'introduzione del blob (vedi embedding_store.upgrade_legacy).
+    """
+    doc_dir = Path(doc_dir)
+    if not has_chunk_store(doc_dir, files):
+        with open(doc_dir / LEGACY_CHUNKS_NAME, 'rb') as f:
+            return pickle.load(f)
+
+    offsets = np.load(doc_dir / files.offsets)
+    with open(doc_dir / files.blob, 'rb') as f:
+        blob = f.read()
+    return [
+        blob[int(offsets[i]):int(offsets[i + 1])].decode('utf-8')
+        for i in range(len(offsets) - 1)
+    ]
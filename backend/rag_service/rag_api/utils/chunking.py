@@ -0,0 +1,207 @@
+"""
+Chunking del testo per token, in un solo passaggio.
+
+Il testo (anche come stream di segmenti, vedi TextExtractor.iter_text) viene diviso in
+unità alle fini di frase e di riga con un'unica scansione ``re.finditer``; le unità sono
+poi raggruppate in chunk di al più ``max_tokens`` token, con una sovrapposizione di circa
+``overlap_tokens`` token ottenuta ripetendo le ultime unità del chunk precedente.
+
+Ogni unità entra ed esce una sola volta dalla finestra corrente, quindi il costo è lineare
+nella lunghezza del testo. Ogni chunk riporta la propria posizione esatta nel testo
+estratto (senza spazi iniziali): ``text == testo[start:end]``.
+"""
+import re
+from collections import deque
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from config.tokenizer import TokenCounter, get_token_counter
+
+# Fine di frase (punteggiatura seguita da spazio) o di riga/paragrafo
+BOUNDARY_RE = re.compile(r'[.!?]+(?=\s)|\n+')
+
+# Caratteri che possono far parte di una fine di frase ancora incompleta alla fine di un segmento
+BOUNDARY_CHARS = frozenset('.!?') | frozenset(' \t\r\n\f\v')
+
+# Unità di cui contare i token in un'unica chiamata al tokenizer
+COUNT_BATCH_SIZE = 256
+
+# Margine sulla lunghezza dei pezzi in cui si spezzano le frasi più lunghe di un chunk
+LONG_UNIT_SAFETY = 0.9
+
+
+class Chunk(NamedTuple):
+    """
+    Chunk di testo con la sua posizione nel testo estratto.
+    """
+    text: str
+    start: int
+    end: int
+    tokens: int
+
+
+class _Unit(NamedTuple):
+    text: str
+    start: int
+    tokens: int
+
+
+def _iter_spans(segments: Iterable[str]) -> Iterator[Tuple[str, int]]:
+    """
+    Divide lo stream in unità contigue (frasi o righe), restituendo (testo, offset).
+
+    Gli offset sono relativi al testo senza spazi iniziali; le unità fatte di soli
+    spazi vengono accorpate all'unità successiva.
+    """
+    buffer = ""     # testo non ancora emesso, a partire dall'offset assoluto ``base``
+    base = 0
+    scanned = 0     # posizione del buffer fino a cui sono già state cercate le fini di frase
+                    # (i match non possono iniziare prima: il carattere precedente non è un separatore)
+    started = False
+
+    def cut(limit: int, final: bool):
+        nonlocal buffer, base, scanned
+        unit_start = 0
+        for match in BOUNDARY_RE.finditer(buffer, scanned, limit):
+            unit_end = match.end()
+            if unit_end <= unit_start or not buffer[unit_start:unit_end].strip():
+                continue
+            yield buffer[unit_start:unit_end], base + unit_start
+            unit_start = unit_end
+        if final:
+            if buffer[unit_start:].strip():
+                yield buffer[unit_start:], base + unit_start
+            return
+        buffer = buffer[unit_start:]
+        base += unit_start
+        scanned = limit - unit_start
+
+    for segment in segments:
+        if not started:
+            segment = segment.lstrip()
+            if not segment:
+                continue
+            started = True
+        buffer += segment
+        # Esclude la coda di punteggiatura e spazi: potrebbe continuare nel segmento successivo
+        limit = len(buffer)
+        while limit > scanned and buffer[limit - 1] in BOUNDARY_CHARS:
+            limit -= 1
+        yield from cut(limit, final=False)
+
+    yield from cut(len(buffer), final=True)
+
+
+class TextChunker:
+    """
+    Divide il testo in chunk di token con sovrapposizione e posizioni esatte.
+
+    Args:
+        max_tokens (int): Token massimi per chunk (default: RAG_CHUNK_MAX_TOKENS)
+        overlap_tokens (int): Token ripetuti tra chunk consecutivi (default: RAG_CHUNK_OVERLAP_TOKENS)
+        token_counter (TokenCounter): Contatore di token (default: cl100k_base)
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None,
+                 token_counter: Optional[TokenCounter] = None):
+        self.max_tokens = max_tokens or getattr(settings, 'RAG_CHUNK_MAX_TOKENS', 256)
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else \
+            getattr(settings, 'RAG_CHUNK_OVERLAP_TOKENS', 48)
+        if not 0 <= self.overlap_tokens < self.max_tokens:
+            raise ValueError(f"Overlap ({self.overlap_tokens}) non valido per chunk di {self.max_tokens} token")
+        self.token_counter = token_counter or get_token_counter()
+
+    def _split_long_unit(self, text: str, start: int, tokens: int) -> Iterator[Tuple[str, int]]:
+        """
+        Spezza su uno spazio un'unità più lunga di un chunk in pezzi di circa ``max_tokens`` token.
+        """
+        piece_chars = max(1, int(len(text) * self.max_tokens * LONG_UNIT_SAFETY / tokens))
+        pos = 0
+        while pos < len(text):
+            end = min(len(text), pos + piece_chars)
+            if end < len(text):
+                space = text.rfind(' ', pos + piece_chars // 2, end)
+                if space > pos:
+                    end = space
+            yield text[pos:end], start + pos
+            pos = end
+
+    def _fit_unit(self, text: str, start: int, tokens: int) -> Iterator[_Unit]:
+        """
+        Unità entro ``max_tokens``: i pezzi stimati dalla densità media dell'unità vengono
+        ricontati e, se più densi della media (testo CJK accanto a testo latino, URL lunghi),
+        spezzati di nuovo con la loro densità.
+        """
+        if tokens <= self.max_tokens or len(text) <= 1:
+            yield _Unit(text, start, tokens)
+            return
+        pieces = list(self._split_long_unit(text, start, tokens))
+        piece_counts = self.token_counter.count_many([piece for piece, _ in pieces])
+        for (piece, piece_start), piece_tokens in zip(pieces, piece_counts):
+            yield from self._fit_unit(piece, piece_start, piece_tokens)
+
+    def _iter_units(self, segments: Iterable[str]) -> Iterator[_Unit]:
+        """
+        Unità del testo con il relativo numero di token (contati a blocchi).
+        """
+        pending: List[Tuple[str, int]] = []
+
+        def flush():
+            counts = self.token_counter.count_many([text for text, _ in pending])
+            for (text, start), tokens in zip(pending, counts):
+                yield from self._fit_unit(text, start, tokens)
+            pending.clear()
+
+        for span in _iter_spans(segments):
+            pending.append(span)
+            if len(pending) >= COUNT_BATCH_SIZE:
+                yield from flush()
+        yield from flush()
+
+    @staticmethod
+    def _make_chunk(window: deque, tokens: int) -> Chunk:
+        text = "".join(unit.text for unit in window)
+        stripped = text.strip()
+        start = window[0].start + len(text) - len(text.lstrip())
+        return Chunk(stripped, start, start + len(stripped), tokens)
+
+    def iter_chunks(self, segments: Iterable[str]) -> Iterator[Chunk]:
+        """
+        Divide in chunk uno stream di segmenti di testo man mano che arrivano.
+
+        Args:
+            segments (Iterable[str]): Segmenti di testo, nell'ordine del documento
+
+        Yields:
+            Chunk: Chunk con testo, posizione (start, end) e numero di token
+        """
+        window: deque = deque()
+        total = 0
+        fresh = 0   # unità della finestra non ancora emesse in un chunk
+
+        for unit in self._iter_units(segments):
+            if window and total + unit.tokens > self.max_tokens:
+                yield self._make_chunk(window, total)
+                # Tiene le ultime unità entro l'overlap (e compatibili con l'unità in arrivo)
+                while window and (total > self.overlap_tokens or total + unit.tokens > self.max_tokens):
+                    total -= window.popleft().tokens
+                fresh = 0
+            window.append(unit)
+            total += unit.tokens
+            fresh += 1
+
+        if fresh:
+            yield self._make_chunk(window, total)
+
+    def chunk(self, text: str) -> List[Chunk]:
+        """
+        Divide un testo completo in chunk.
+        """
+        return list(self.iter_chunks([text]))
+
+
+def get_chunker() -> TextChunker:
+    """
+    Chunker configurato dalle impostazioni.
+    """
+    return TextChunker()
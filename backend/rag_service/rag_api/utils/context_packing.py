@@ -0,0 +1,237 @@
+"""
+Costruzione del contesto RAG entro un budget di token.
+
+I chunk recuperati vengono aggiunti al contesto nell'ordine di rilevanza finché c'è
+spazio nel budget del modello:
+- i chunk con lo stesso testo vengono inclusi una sola volta;
+- i chunk adiacenti dello stesso documento (chunk_index consecutivi) vengono uniti in un
+  unico blocco sotto la stessa fonte, togliendo il testo ripetuto dalla sovrapposizione
+  del chunker;
+- i chunk che non entrano nel budget vengono scartati (il primo, se da solo lo supera,
+  viene troncato).
+
+Il budget è il minimo tra RAG_CONTEXT_MAX_TOKENS e lo spazio lasciato nella finestra di
+contesto del modello da system prompt, domanda e token della risposta.
+"""
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+
+from config.llm_clients import count_rag_prompt_tokens
+from config.tokenizer import TokenCounter, get_token_counter
+from .embedding_utils import ChunkHit
+
+logger = logging.getLogger(__name__)
+
+# Finestra di contesto (token) per prefisso del nome del modello, dal più specifico
+MODEL_CONTEXT_WINDOWS = (
+    ('gpt-4.1', 1047576),
+    ('gpt-4o', 128000),
+    ('gpt-4-turbo', 128000),
+    ('gpt-4-1106', 128000),
+    ('gpt-4-0125', 128000),
+    ('gpt-4-32k', 32768),
+    ('gpt-4', 8192),
+    ('gpt-3.5-turbo-instruct', 4096),
+    ('gpt-3.5-turbo', 16385),
+    ('o1', 128000),
+    ('o3', 200000),
+    ('o4', 200000),
+)
+DEFAULT_CONTEXT_WINDOW = 4096
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# Token minimi perché abbia senso includere un chunk troncato
+MIN_TRUNCATED_TOKENS = 32
+
+# Caratteri iniziali di un chunk cercati nel chunk precedente per trovare la sovrapposizione
+OVERLAP_PROBE_CHARS = 32
+
+
+class PackedContext(NamedTuple):
+    """
+    Contesto costruito per il prompt.
+    """
+    text: str
+    hits: List[ChunkHit]    # chunk inclusi, nell'ordine di rilevanza
+    tokens: int             # token del contesto
+    budget: int             # budget di token del contesto
+    dropped: int            # chunk esclusi (duplicati o fuori budget)
+    truncated: bool         # il primo chunk è stato troncato
+
+
+class _Block:
+    """
+    Blocco del contesto: chunk consecutivi di un documento uniti sotto una fonte.
+    """
+
+    def __init__(self, document_id: int, chunk_index: int, text: str):
+        self.document_id = document_id
+        self.first_index = chunk_index
+        self.last_index = chunk_index
+        self.text = text
+
+
+def context_window(model: str) -> int:
+    """
+    Finestra di contesto del modello (RAG_CONTEXT_WINDOW_TOKENS se impostata).
+    """
+    configured = getattr(settings, 'RAG_CONTEXT_WINDOW_TOKENS', 0)
+    if configured:
+        return configured
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if model.startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def context_budget(question: str, max_tokens: int, model: Optional[str] = None) -> int:
+    """
+    Token disponibili per il contesto di una domanda.
+
+    Args:
+        question (str): Domanda dell'utente
+        max_tokens (int): Token riservati alla risposta
+        model (str): Modello chat (default: OPENAI_CHAT_MODEL_NAME)
+    """
+    model = model or getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+    available = context_window(model) - max_tokens - count_rag_prompt_tokens('', question, model)
+    return max(0, min(getattr(settings, 'RAG_CONTEXT_MAX_TOKENS', 3000), available))
+
+
+def _overlap(previous: str, following: str) -> int:
+    """
+    Lunghezza del suffisso di ``previous`` con cui inizia ``following``.
+    """
+    probe = following[:OVERLAP_PROBE_CHARS]
+    if not probe:
+        return 0
+    pos = previous.find(probe)
+    while pos != -1:
+        if following.startswith(previous[pos:]):
+            return len(previous) - pos
+        pos = previous.find(probe, pos + 1)
+    return 0
+
+
+def _join(previous: str, following: str) -> str:
+    """
+    Unisce due chunk consecutivi dello stesso documento senza ripetere la sovrapposizione.
+    """
+    if following in previous:
+        return previous
+    overlap = _overlap(previous, following)
+    if overlap:
+        return previous + following[overlap:]
+    return previous + "\n" + following
+
+
+class ContextPacker:
+    """
+    Impacchetta i chunk recuperati in un contesto entro un budget di token.
+
+    Args:
+        budget (int): Token massimi del contesto
+        token_counter (TokenCounter): Contatore di token (default: tokenizer di OPENAI_CHAT_MODEL_NAME)
+    """
+
+    def __init__(self, budget: int, token_counter: Optional[TokenCounter] = None):
+        self.budget = budget
+        self.token_counter = token_counter or get_token_counter(
+            getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+        )
+
+    def _render(self, blocks: List[_Block], source_labels: Dict[int, str]) -> str:
+        return CONTEXT_SEPARATOR.join(
+            f"{source_labels.get(block.document_id, f'[Fonte: Documento {block.document_id}]')}\n{block.text}"
+            for block in blocks
+        )
+
+    def pack(self, hits: List[ChunkHit], source_labels: Dict[int, str]) -> PackedContext:
+        """
+        Costruisce il contesto dai chunk, nell'ordine di rilevanza.
+
+        Args:
+            hits (List[ChunkHit]): Chunk recuperati, dal più rilevante
+            source_labels (Dict[int, str]): Intestazione della fonte per document_id
+
+        Returns:
+            PackedContext: Contesto, chunk inclusi e token usati
+        """
+        count = self.token_counter.count
+        blocks: List[_Block] = []
+        included: List[ChunkHit] = []
+        seen_texts = set()
+        used = 0
+        dropped = 0
+        truncated = False
+
+        for hit in hits:
+            text = hit.text.strip()
+            if not text or text in seen_texts:
+                dropped += 1
+                continue
+
+            # Blocco dello stesso documento di cui il chunk è il precedente o il successivo
+            block = next((
+                candidate for candidate in blocks
+                if candidate.document_id == hit.document_id
+                and hit.chunk_index in (candidate.first_index - 1, candidate.last_index + 1)
+            ), None)
+
+            if block is not None:
+                if hit.chunk_index == block.last_index + 1:
+                    merged = _join(block.text, text)
+                else:
+                    merged = _join(text, block.text)
+                cost = count(merged) - count(block.text)
+            else:
+                label = source_labels.get(hit.document_id, f'[Fonte: Documento {hit.document_id}]')
+                cost = count(f"{label}\n{text}") + (count(CONTEXT_SEPARATOR) if blocks else 0)
+
+            if used + cost > self.budget:
+                if included or self.budget - used < MIN_TRUNCATED_TOKENS:
+                    dropped += 1
+                    continue
+                # Nemmeno il chunk più rilevante entra: se ne tiene l'inizio
+                label_tokens = cost - count(text)
+                text = self.token_counter.truncate(text, self.budget - used - label_tokens)
+                cost = self.budget - used
+                truncated = True
+
+            seen_texts.add(hit.text.strip())
+            included.append(hit)
+            used += cost
+
+            if block is None:
+                blocks.append(_Block(hit.document_id, hit.chunk_index, text))
+                continue
+
+            block.text = merged
+            block.first_index = min(block.first_index, hit.chunk_index)
+            block.last_index = max(block.last_index, hit.chunk_index)
+
+            # Il chunk può aver colmato il buco con un altro blocco dello stesso documento
+            for other in [candidate for candidate in blocks
+                          if candidate is not block and candidate.document_id == block.document_id]:
+                if other.first_index == block.last_index + 1:
+                    block.text = _join(block.text, other.text)
+                    block.last_index = other.last_index
+                elif other.last_index == block.first_index - 1:
+                    block.text = _join(other.text, block.text)
+                    block.first_index = other.first_index
+                else:
+                    continue
+                position = min(blocks.index(block), blocks.index(other))
+                blocks.remove(other)
+                blocks.remove(block)
+                blocks.insert(position, block)
+
+        context = self._render(blocks, source_labels)
+        tokens = count(context) if context else 0
+        if dropped:
+            logger.debug(f"Contesto: {len(included)} chunk inclusi, {dropped} esclusi "
+                         f"({tokens}/{self.budget} token)")
+        return PackedContext(context, included, tokens, self.budget, dropped, truncated)
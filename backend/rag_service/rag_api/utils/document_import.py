@@ -0,0 +1,218 @@
+"""
+Creazione dei documenti RAG da file caricati o da risorse del Resource Manager.
+
+Usato sia dall'upload singolo (RAGDocumentViewSet.upload) sia dall'importazione in
+blocco nelle knowledge base, che recupera le risorse nei worker Celery.
+"""
+import os
+import time
+import uuid
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+
+import requests
+from django.conf import settings
+
+from .storage_handoff import open_shared_file
+
+logger = logging.getLogger(__name__)
+
+# Tipi di file del Resource Manager compatibili con il RAG
+RAG_COMPATIBLE_TYPES = {
+    'application/pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/msword',
+    'text/plain',
+    'text/markdown',
+    'text/rtf',
+    'application/rtf',
+    'text/x-markdown',
+}
+
+
+def save_uploaded_file(uploaded_file) -> str:
+    """
+    Salva il file caricato nella directory di upload.
+
+    Args:
+        uploaded_file (UploadedFile): File caricato
+
+    Returns:
+        str: Percorso del file salvato
+    """
+    # Crea la directory di upload se non esiste
+    upload_dir = Path(settings.RAG_UPLOADS_ROOT)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    # Genera un nome file unico (più file con lo stesso nome possono arrivare insieme)
+    timestamp = int(time.time())
+    filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{uploaded_file.name}"
+    file_path = upload_dir / filename
+
+    # Salva il file
+    with open(file_path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+
+    return str(file_path)
+
+
+def create_uploaded_document(user_id: Optional[int], uploaded_file, import_job=None):
+    """
+    Salva un file caricato direttamente e crea il documento RAG corrispondente.
+
+    Args:
+        user_id (int): Utente proprietario
+        uploaded_file (UploadedFile): File caricato
+        import_job (RAGImportJob): Job di importazione in blocco (opzionale)
+
+    Returns:
+        RAGDocument: Documento creato (stato 'uploaded')
+    """
+    from ..models import RAGDocument
+
+    file_path = save_uploaded_file(uploaded_file)
+
+    return RAGDocument.objects.create(
+        user_id=user_id,
+        resource_id=None,  # Nessuna risorsa del Resource Manager
+        filename=os.path.basename(file_path),
+        original_filename=uploaded_file.name,
+        file_path=file_path,
+        file_size=uploaded_file.size,
+        file_type=uploaded_file.content_type or 'application/octet-stream',
+        status='uploaded',
+        import_job=import_job
+    )
+
+
+def download_to_upload_dir(response, filename: str) -> Tuple[str, int, str]:
+    """
+    Scrive su disco una risposta HTTP in streaming, a blocchi, direttamente nel file finale,
+    calcolandone lo SHA-256 durante la scrittura.
+
+    Args:
+        response (requests.Response): Risposta aperta con ``stream=True``
+        filename (str): Nome originale (per l'estensione)
+
+    Returns:
+        Tuple[str, int, str]: Percorso del file salvato, byte scritti e SHA-256
+    """
+    upload_dir = Path(settings.RAG_UPLOADS_ROOT)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    file_path = upload_dir / f"{uuid.uuid4()}{Path(filename).suffix}"
+    block_size = getattr(settings, 'RAG_RESOURCE_DOWNLOAD_BLOCK_SIZE', 1024 * 1024)
+
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, 'wb') as f:
+            for block in response.iter_content(chunk_size=block_size):
+                f.write(block)
+                digest.update(block)
+                size += len(block)
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
+
+    return str(file_path), size, digest.hexdigest()
+
+
+def import_resource_document(user_id: Optional[int], resource_id: int, import_job=None):
+    """
+    Recupera una risorsa dal Resource Manager e crea il documento RAG corrispondente.
+
+    I metadati arrivano dall'endpoint della singola risorsa. Se il Resource Manager indica
+    il percorso del file e lo storage è montato anche qui, il documento punta al file nel
+    volume condiviso (sola lettura, nessuna copia); altrimenti il contenuto viene scaricato
+    in streaming direttamente nella directory di upload, senza tenerlo in memoria. In
+    entrambi i casi lo SHA-256 del contenuto resta sul documento per la cache di estrazione.
+
+    Args:
+        user_id (int): Utente proprietario
+        resource_id (int): ID della risorsa nel Resource Manager
+        import_job (RAGImportJob): Job di importazione in blocco (opzionale)
+
+    Returns:
+        RAGDocument: Documento creato (stato 'uploaded')
+    """
+    from ..models import RAGDocument
+
+    # Costanti per header interno
+    INTERNAL_API_HEADER = settings.INTERNAL_API_SECRET_HEADER_NAME
+    INTERNAL_API_SECRET = settings.INTERNAL_API_SECRET_VALUE
+
+    try:
+        logger.info(f"Recupero risorsa {resource_id} dal Resource Manager per utente {user_id}")
+
+        internal_headers = {}
+        if INTERNAL_API_SECRET:
+            internal_headers[INTERNAL_API_HEADER] = INTERNAL_API_SECRET
+
+        # Metadati della singola risorsa (verifica anche che appartenga all'utente)
+        resource_info_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/rag/resources/{resource_id}/"
+        info_response = requests.get(
+            resource_info_url, headers=internal_headers, params={'user_id': user_id}, timeout=30
+        )
+        if info_response.status_code == 404:
+            raise Exception(f"Resource {resource_id} not found or not accessible")
+        info_response.raise_for_status()
+        resource_info = info_response.json()
+
+        # Verifica che sia compatibile con RAG (dovrebbe già essere filtrata, ma double-check)
+        if resource_info['mime_type'] not in RAG_COMPATIBLE_TYPES:
+            raise Exception(f"Resource type '{resource_info['mime_type']}' is not compatible with RAG")
+
+        # Con il volume condiviso il file si usa sul posto, altrimenti si scarica
+        # in streaming direttamente nella directory di upload del RAG
+        shared_file = open_shared_file(resource_info.get('storage_handoff'))
+        if shared_file is not None:
+            final_file_path, file_size, content_sha256 = shared_file
+        else:
+            resource_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/rag/resources/{resource_id}/content/"
+            with requests.get(resource_url, headers=internal_headers, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                final_file_path, file_size, content_sha256 = download_to_upload_dir(
+                    response, resource_info['original_filename']
+                )
+
+        # Crea il documento nel database
+        document = RAGDocument.objects.create(
+            user_id=user_id,
+            resource_id=resource_id,  # Referenzia la risorsa del Resource Manager
+            filename=os.path.basename(final_file_path),
+            original_filename=resource_info['original_filename'],
+            file_path=final_file_path,
+            file_size=file_size,
+            file_type=resource_info['mime_type'],
+            content_sha256=content_sha256,
+            status='uploaded',
+            import_job=import_job
+        )
+
+        logger.info(f"Documento RAG creato dal Resource Manager: {document.id} (risorsa {resource_id})")
+
+        return document
+
+    except requests.exceptions.HTTPError as http_err:
+        error_msg = f"HTTP error accessing Resource Manager: {http_err.response.status_code if http_err.response else 'N/A'}"
+        if http_err.response:
+            try:
+                error_data = http_err.response.json()
+                error_msg += f" - {error_data.get('error', 'Unknown error')}"
+            except:
+                error_msg += f" - {http_err.response.text[:200]}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+    except requests.exceptions.RequestException as req_exc:
+        error_msg = f"Request error accessing Resource Manager: {req_exc}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+    except Exception as e:
+        error_msg = f"Unexpected error processing resource from Resource Manager: {e}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
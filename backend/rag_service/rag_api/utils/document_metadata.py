@@ -0,0 +1,56 @@
+"""
+Risoluzione dei metadati dei documenti citati nelle risposte RAG.
+
+Costruire il contesto e le fonti di una risposta richiede solo nome, tipo e data dei
+documenti: il resolver li recupera con una sola query leggera (senza ``extracted_text``)
+per tutti i documenti referenziati, e non rilegge quelli già risolti nella richiesta.
+"""
+import logging
+from typing import Dict, Iterable, NamedTuple
+
+from .tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentMetadata(NamedTuple):
+    id: int
+    original_filename: str
+    file_type: str
+    created_at: object
+    updated_at: object
+
+
+class DocumentMetadataResolver:
+    """
+    Resolver dei metadati dei documenti valido per una singola richiesta.
+
+    I documenti già risolti nella richiesta non vengono riletti; gli altri vengono
+    caricati tutti insieme con una sola query sulle sole colonne necessarie.
+    """
+
+    def __init__(self):
+        self._resolved: Dict[int, DocumentMetadata] = {}
+
+    @traced('document_metadata')
+    def get_many(self, document_ids: Iterable[int]) -> Dict[int, DocumentMetadata]:
+        """
+        Restituisce i metadati dei documenti indicati (i documenti inesistenti sono omessi).
+        """
+        from ..models import RAGDocument
+
+        wanted = set(document_ids)
+        missing = wanted - self._resolved.keys()
+
+        if missing:
+            rows = RAGDocument.objects.filter(id__in=missing).values_list(
+                'id', 'original_filename', 'file_type', 'created_at', 'updated_at'
+            )
+            for row in rows:
+                metadata = DocumentMetadata(*row)
+                self._resolved[metadata.id] = metadata
+
+        return {doc_id: self._resolved[doc_id] for doc_id in wanted if doc_id in self._resolved}
+
+    def get(self, document_id: int):
+        return self.get_many([document_id]).get(document_id)
@@ -0,0 +1,251 @@
+"""
+Cache degli embeddings indirizzata per contenuto.
+
+Le chiavi sono l'hash di (provider, modello, dimensioni, testo), così lo stesso testo
+non viene mai ri-embeddato con lo stesso modello. La cache ha due livelli:
+- un LRU in-process con TTL, per le query ripetute nello stesso worker
+- un file SQLite condiviso (sul volume degli embeddings), visto da tutti i worker
+
+Il livello SQLite è opzionale: se il file non è configurato o non è accessibile la
+cache continua a funzionare solo in memoria.
+"""
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ogni quanti inserimenti si controllano scadenze e dimensione del file SQLite
+PRUNE_EVERY = 200
+
+# Scadenza usata per le voci senza TTL
+NO_EXPIRY = 1e18
+
+
+def make_cache_key(provider: str, model: str, dimensions: Optional[int], text: str) -> str:
+    """
+    Chiave di cache per il testo embeddato con un certo provider/modello/dimensioni.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{provider}\x00{model}\x00{dimensions or ''}\x00".encode('utf-8'))
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Cache a due livelli (LRU in memoria + SQLite condiviso) di vettori float32.
+
+    Args:
+        path (Path): File SQLite condiviso (None per la sola cache in memoria)
+        max_memory_entries (int): Numero massimo di vettori nel livello in memoria
+        max_disk_entries (int): Numero massimo di vettori nel file SQLite
+        ttl_seconds (int): Durata di una voce (0 = nessuna scadenza)
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_memory_entries: int = 2048,
+                 max_disk_entries: int = 200000, ttl_seconds: int = 7 * 24 * 3600):
+        self.path = Path(path) if path else None
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()  # key -> (vettore, scadenza)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inserts_since_prune = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._connection().execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    " key TEXT PRIMARY KEY,"
+                    " dims INTEGER NOT NULL,"
+                    " vector BLOB NOT NULL,"
+                    " expires_at REAL NOT NULL,"
+                    " accessed_at REAL NOT NULL)"
+                )
+                self._connection().execute(
+                    "CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)"
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Cache embeddings su disco non disponibile ({self.path}): {str(e)}")
+                self.path = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connessione SQLite del thread corrente (le connessioni non sono condivisibili tra thread).
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _expiry(self, now: float) -> float:
+        return now + self.ttl_seconds if self.ttl_seconds else NO_EXPIRY
+
+    def _remember(self, key: str, vector: np.ndarray, expires_at: float):
+        """
+        Inserisce una voce nel livello in memoria, rimuovendo le meno recenti oltre il limite.
+        """
+        with self._lock:
+            self._memory[key] = (vector, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Restituisce i vettori in cache per le chiavi indicate (le chiavi mancanti sono omesse).
+        """
+        now = time.time()
+        found = {}
+        pending = []
+
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._memory.get(key)
+                if entry is not None and entry[1] > now:
+                    self._memory.move_to_end(key)
+                    found[key] = entry[0]
+                    self._stats['memory_hits'] += 1
+                else:
+                    if entry is not None:
+                        del self._memory[key]
+                    pending.append(key)
+
+        if pending and self.path is not None:
+            try:
+                connection = self._connection()
+                for start in range(0, len(pending), 500):
+                    batch = pending[start:start + 500]
+                    placeholders = ','.join('?' * len(batch))
+                    rows = connection.execute(
+                        f"SELECT key, vector, expires_at FROM embeddings "
+                        f"WHERE key IN ({placeholders}) AND expires_at > ?",
+                        (*batch, now)
+                    ).fetchall()
+                    for key, blob, expires_at in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[key] = vector
+                        self._remember(key, vector, expires_at)
+                        self._stats['disk_hits'] += 1
+                    if rows:
+                        connection.execute(
+                            f"UPDATE embeddings SET accessed_at = ? WHERE key IN ({','.join('?' * len(rows))})",
+                            (now, *[row[0] for row in rows])
+                        )
+            except sqlite3.Error as e:
+                logger.warning(f"Errore nella lettura della cache embeddings: {str(e)}")
+
+        self._stats['misses'] += len(pending) - sum(1 for key in pending if key in found)
+        return found
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """
+        Salva i vettori indicati in entrambi i livelli.
+        """
+        if not items:
+            return
+
+        now = time.time()
+        expires_at = self._expiry(now)
+        rows = []
+        for key, vector in items.items():
+            vector = np.array(vector, dtype=np.float32).ravel()
+            vector.setflags(write=False)
+            self._remember(key, vector, expires_at)
+            rows.append((key, int(vector.shape[0]), vector.tobytes(), expires_at, now))
+        self._stats['stores'] += len(rows)
+
+        if self.path is None:
+            return
+
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dims, vector, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+            self._inserts_since_prune += len(rows)
+            if self._inserts_since_prune >= PRUNE_EVERY:
+                self._inserts_since_prune = 0
+                self.prune()
+        except sqlite3.Error as e:
+            logger.warning(f"Errore nella scrittura della cache embeddings: {str(e)}")
+
+    def put(self, key: str, vector: np.ndarray):
+        self.put_many({key: vector})
+
+    def prune(self):
+        """
+        Elimina dal file SQLite le voci scadute e quelle meno usate oltre il limite di dimensione.
+        """
+        if self.path is None:
+            return
+
+        connection = self._connection()
+        connection.execute("DELETE FROM embeddings WHERE expires_at <= ?", (time.time(),))
+        (count,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+            self._stats['evictions'] += excess
+
+    def clear(self):
+        """
+        Svuota entrambi i livelli della cache.
+        """
+        with self._lock:
+            self._memory.clear()
+        if self.path is not None:
+            try:
+                self._connection().execute("DELETE FROM embeddings")
+            except sqlite3.Error as e:
+                logger.warning(f"Errore nello svuotamento della cache embeddings: {str(e)}")
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Contatori di hit/miss del processo corrente e occupazione della cache.
+        """
+        stats = dict(self._stats)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self._memory)
+        stats['max_memory_entries'] = self.max_memory_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['disk_path'] = str(self.path) if self.path else None
+
+        if self.path is not None:
+            try:
+                (stats['disk_entries'],) = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            except sqlite3.Error:
+                stats['disk_entries'] = None
+        return stats
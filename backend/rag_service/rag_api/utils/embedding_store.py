@@ -0,0 +1,413 @@
+"""
+Formato su disco degli embeddings di un documento, leggibile in memory-map.
+
+Struttura della directory di un documento::
+
+    manifest.json                dimensioni, dtype, modello, shard, file dei chunk e metadati
+    vectors-<gen>.npy            vettori normalizzati L2, float32 (o float16), in un unico shard
+    chunks-<gen>.txt             testi dei chunk (vedi chunk_store)
+    chunk_offsets-<gen>.npy      offset dei chunk (vedi chunk_store)
+
+Ogni scrittura del documento produce una nuova generazione di file con nomi univoci,
+senza mai sovrascrivere file che un lettore può avere in memory-map; il manifest,
+sostituito con ``os.replace``, è l'unico punto di commit. I file della generazione
+precedente vengono rimossi solo dopo la pubblicazione del nuovo manifest, e i lettori
+che li trovano già rimossi rileggono il manifest.
+
+Gli shard si leggono con ``np.load(mmap_mode='r')``: più worker sullo stesso host
+condividono la page cache invece di tenere ciascuno la propria copia dei vettori,
+e il percorso di lettura non usa pickle.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import pickle
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from . import chunk_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+FORMAT_VERSION = 3
+LOCK_NAME = '.lock'
+SUPPORTED_DTYPES = ('float32', 'float16')
+
+LEGACY_EMBEDDINGS_NAME = 'embeddings.npy'
+LEGACY_METADATA_NAME = 'metadata.pkl'
+
+# File di generazioni mai pubblicate (writer terminati senza abort) più vecchi di così vengono rimossi
+ORPHAN_MAX_AGE_SECONDS = 24 * 3600
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Normalizza L2 le righe (copia float32), così la ricerca coseno non deve modificare i dati in mmap.
+    """
+    vectors = np.array(vectors, dtype=np.float32, copy=True)
+    if vectors.size == 0:
+        return vectors
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+# Directory di cui il thread corrente detiene già il lock (il lock è rientrante)
+_held_locks = threading.local()
+
+
+@contextmanager
+def document_lock(doc_dir: Path):
+    """
+    Lock di file esclusivo e rientrante sulla directory di un documento (pubblicazione e conversione).
+    """
+    doc_dir = Path(doc_dir)
+    held = _held_locks.__dict__.setdefault('dirs', set())
+    key = str(doc_dir.resolve())
+    if key in held:
+        yield
+        return
+
+    doc_dir.mkdir(parents=True, exist_ok=True)
+    with open(doc_dir / LOCK_NAME, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def chunk_files(manifest: Dict[str, Any]) -> chunk_store.ChunkFiles:
+    """
+    File dei chunk pubblicati dal manifest (nomi fissi per i manifest precedenti alle generazioni).
+    """
+    chunks = manifest.get('chunks')
+    if not chunks:
+        return chunk_store.DEFAULT_FILES
+    return chunk_store.ChunkFiles(chunks['blob'], chunks['offsets'])
+
+
+def _manifest_files(manifest: Optional[Dict[str, Any]]) -> set:
+    """
+    Nomi di tutti i file referenziati da un manifest.
+    """
+    if not manifest:
+        return set()
+    return {shard['file'] for shard in manifest.get('shards', [])} | set(chunk_files(manifest))
+
+
+class ShardWriter:
+    """
+    Scrive gli embeddings di una generazione del documento shard per shard.
+
+    Permette di salvare i vettori a blocchi man mano che vengono prodotti; ogni shard
+    ha un nome nuovo, e diventa visibile ai lettori solo col manifest della generazione.
+    """
+
+    def __init__(self, doc_dir: Path, generation: str, dtype: str = 'float32'):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"dtype non supportato: {dtype}")
+        self.doc_dir = Path(doc_dir)
+        self.generation = generation
+        self.dtype = dtype
+        self.dimension = None
+        self.count = 0
+        self.shards: List[Dict[str, Any]] = []
+
+    def append(self, vectors: np.ndarray):
+        """
+        Aggiunge un blocco di vettori come nuovo shard.
+        """
+        vectors = np.asarray(vectors)
+        if vectors.size == 0:
+            return
+        if vectors.ndim != 2:
+            raise ValueError(f"Shape embeddings non valida: {vectors.shape}")
+        if self.dimension is None:
+            self.dimension = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Dimensione {vectors.shape[1]} diversa da {self.dimension}")
+
+        shard_name = f"vectors-{self.generation}-{len(self.shards):05d}.npy"
+        data = np.ascontiguousarray(_normalize(vectors), dtype=self.dtype)
+        np.save(self.doc_dir / shard_name, data)
+        self.shards.append({'file': shard_name, 'count': int(data.shape[0])})
+        self.count += int(data.shape[0])
+
+    def abort(self):
+        """
+        Elimina gli shard (non ancora pubblicati) della generazione.
+        """
+        for shard in self.shards:
+            try:
+                (self.doc_dir / shard['file']).unlink()
+            except FileNotFoundError:
+                pass
+        self.shards = []
+
+    def compact(self):
+        """
+        Riunisce gli shard scritti in un unico file prima della pubblicazione.
+
+        Così la generazione pubblicata si legge come un solo memmap, senza copie
+        per concatenare gli shard in ogni lettore.
+        """
+        if len(self.shards) <= 1:
+            return
+        name = f"vectors-{self.generation}.npy"
+        merged = np.lib.format.open_memmap(self.doc_dir / name, mode='w+', dtype=self.dtype,
+                                           shape=(self.count, self.dimension))
+        offset = 0
+        for shard in self.shards:
+            data = np.load(self.doc_dir / shard['file'], mmap_mode='r')
+            merged[offset:offset + len(data)] = data
+            offset += len(data)
+        merged.flush()
+        del merged
+
+        self.abort()
+        self.shards = [{'file': name, 'count': self.count}]
+
+
+class DocumentWriter:
+    """
+    Scrive in modo incrementale vettori e chunk di una nuova generazione di un documento.
+
+    Durante la scrittura la generazione precedente (se esiste) resta leggibile e coerente;
+    ``close`` pubblica la nuova sostituendo il manifest, ``abort`` la scarta lasciando
+    la directory com'era.
+    """
+
+    def __init__(self, doc_dir: Path, dtype: str = 'float32', model: str = '', provider: str = ''):
+        self.doc_dir = Path(doc_dir)
+        self.doc_dir.mkdir(parents=True, exist_ok=True)
+        self.generation = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self.model = model
+        self.provider = provider
+
+        self.published = False
+
+        self.shards = ShardWriter(self.doc_dir, self.generation, dtype=dtype)
+        self.chunks = chunk_store.ChunkWriter(self.doc_dir, chunk_store.ChunkFiles.for_generation(self.generation))
+
+    @property
+    def count(self) -> int:
+        return self.shards.count
+
+    def append(self, embeddings: np.ndarray, chunks: List[str]):
+        """
+        Aggiunge un blocco di vettori con i chunk corrispondenti.
+        """
+        if len(embeddings) != len(chunks):
+            raise ValueError(f"Numero di vettori ({len(embeddings)}) diverso dal numero di chunk ({len(chunks)})")
+        self.shards.append(embeddings)
+        self.chunks.append(chunks)
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None):
+        """
+        Pubblica la generazione sostituendo il manifest, poi rimuove i file non più referenziati.
+        """
+        self.chunks.close()
+        self.shards.compact()
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'generation': self.generation,
+            'dimension': self.shards.dimension or 0,
+            'dtype': self.shards.dtype,
+            'normalized': True,
+            'model': self.model,
+            'provider': self.provider,
+            'count': self.shards.count,
+            'shards': self.shards.shards,
+            'chunks': dict(self.chunks.files._asdict(), count=self.chunks.count),
+            'metadata': metadata or {},
+        }
+
+        with document_lock(self.doc_dir):
+            try:
+                previous = read_manifest(self.doc_dir)
+            except (OSError, ValueError):
+                previous = None
+
+            tmp_path = self.doc_dir / f"{MANIFEST_NAME}.{self.generation}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, default=str)
+            os.replace(tmp_path, self.doc_dir / MANIFEST_NAME)
+            self.published = True
+
+            # Solo i file della generazione sostituita (e quelli orfani): le generazioni
+            # ancora in scrittura da altri writer non sono referenziate ma vanno lasciate
+            current = _manifest_files(manifest)
+            obsolete = _manifest_files(previous) - current
+            obsolete |= {LEGACY_EMBEDDINGS_NAME, LEGACY_METADATA_NAME, chunk_store.LEGACY_CHUNKS_NAME}
+            _remove_files(self.doc_dir, obsolete)
+            _remove_orphans(self.doc_dir, current)
+
+    def abort(self):
+        """
+        Scarta la generazione in scrittura; il manifest (e la generazione pubblicata) non cambiano.
+
+        Dopo ``close`` non ha effetto: la generazione è ormai quella pubblicata.
+        """
+        if self.published:
+            return
+        self.chunks.abort()
+        self.shards.abort()
+
+
+def _remove_files(doc_dir: Path, names: Iterable[str]):
+    for name in names:
+        try:
+            (doc_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _remove_orphans(doc_dir: Path, current: set):
+    """
+    Rimuove i file di generazioni mai pubblicate lasciati da writer interrotti.
+    """
+    cutoff = time.time() - ORPHAN_MAX_AGE_SECONDS
+    for pattern in ('vectors-*.npy', 'chunks-*.txt', 'chunk_offsets-*.npy', f"{MANIFEST_NAME}.*.tmp"):
+        for path in doc_dir.glob(pattern):
+            try:
+                if path.name not in current and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def write_document(doc_dir: Path, embeddings: np.ndarray, chunks: List[str],
+                   metadata: Optional[Dict[str, Any]] = None, dtype: str = 'float32',
+                   model: str = '', provider: str = ''):
+    """
+    Salva embeddings, chunk e metadati di un documento nel formato a shard.
+    """
+    writer = DocumentWriter(doc_dir, dtype=dtype, model=model, provider=provider)
+    try:
+        writer.append(embeddings, chunks)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close(metadata)
+
+
+def has_manifest(doc_dir: Path) -> bool:
+    return (Path(doc_dir) / MANIFEST_NAME).exists()
+
+
+def is_legacy(doc_dir: Path) -> bool:
+    """
+    Indica se il documento è ancora nel formato embeddings.npy + pickle.
+    """
+    doc_dir = Path(doc_dir)
+    return not has_manifest(doc_dir) and (doc_dir / LEGACY_EMBEDDINGS_NAME).exists()
+
+
+def upgrade_legacy(doc_dir: Path, dtype: str = 'float32'):
+    """
+    Converte una volta sola un documento dal formato legacy al formato a shard.
+
+    La conversione avviene sotto il lock del documento: se più processi trovano lo stesso
+    documento legacy, solo il primo lo converte e gli altri usano il risultato.
+    È l'unico punto in cui vengono ancora letti i pickle scritti dalle versioni precedenti.
+    """
+    doc_dir = Path(doc_dir)
+    with document_lock(doc_dir):
+        if not is_legacy(doc_dir):
+            return
+
+        embeddings = np.load(doc_dir / LEGACY_EMBEDDINGS_NAME)
+        chunks = chunk_store.read_all_chunks(doc_dir)
+
+        metadata = {}
+        metadata_path = doc_dir / LEGACY_METADATA_NAME
+        if metadata_path.exists():
+            with open(metadata_path, 'rb') as f:
+                metadata = pickle.load(f)
+
+        write_document(doc_dir, embeddings, chunks, metadata, dtype=dtype,
+                       model=metadata.get('model_name', ''))
+        # I file chunk a nomi fissi (pre-generazioni) non sono referenziati dal nuovo manifest
+        _remove_files(doc_dir, chunk_store.DEFAULT_FILES)
+    logger.info(f"Embeddings convertiti al formato a shard: {doc_dir}")
+
+
+def read_manifest(doc_dir: Path) -> Dict[str, Any]:
+    """
+    Legge il manifest di un documento.
+    """
+    with open(Path(doc_dir) / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _read_published(doc_dir: Path, read: Callable[[Dict[str, Any]], Any]):
+    """
+    Esegue ``read(manifest)`` sulla generazione pubblicata.
+
+    Se nel frattempo un writer ha pubblicato una nuova generazione e rimosso i file
+    della precedente, il manifest viene riletto e la lettura ripetuta una volta.
+    """
+    try:
+        return read(read_manifest(doc_dir))
+    except FileNotFoundError:
+        return read(read_manifest(doc_dir))
+
+
+def _load_shards(doc_dir: Path, manifest: Dict[str, Any]) -> np.ndarray:
+    shards = [np.load(doc_dir / shard['file'], mmap_mode='r') for shard in manifest['shards']]
+
+    if not shards:
+        return np.empty((0, manifest.get('dimension', 0)), dtype=np.float32)
+    if len(shards) == 1 and shards[0].dtype == np.float32:
+        return shards[0]
+    return np.concatenate([np.asarray(shard, dtype=np.float32) for shard in shards])
+
+
+def load_vectors(doc_dir: Path) -> np.ndarray:
+    """
+    Restituisce i vettori (normalizzati) di un documento.
+
+    Per i vettori float32 il risultato è direttamente il memmap in sola lettura
+    (che resta valido anche se una nuova generazione rimuove il file); con float16,
+    o con più shard (solo manifest scritti prima della compattazione), viene prodotta
+    una copia float32.
+    """
+    doc_dir = Path(doc_dir)
+    return _read_published(doc_dir, lambda manifest: _load_shards(doc_dir, manifest))
+
+
+def read_document(doc_dir: Path) -> Tuple[np.ndarray, List[str], Dict[str, Any]]:
+    """
+    Legge vettori, testi dei chunk e manifest della stessa generazione di un documento.
+    """
+    doc_dir = Path(doc_dir)
+
+    def read(manifest):
+        vectors = _load_shards(doc_dir, manifest)
+        chunks = chunk_store.read_all_chunks(doc_dir, chunk_files(manifest))
+        return vectors, chunks, manifest
+
+    return _read_published(doc_dir, read)
+
+
+def read_chunks(doc_dir: Path, chunk_indices: Iterable[int]) -> Dict[int, str]:
+    """
+    Legge solo i chunk richiesti dalla generazione pubblicata di un documento.
+    """
+    doc_dir = Path(doc_dir)
+    chunk_indices = list(chunk_indices)
+    return _read_published(
+        doc_dir, lambda manifest: chunk_store.read_chunks(doc_dir, chunk_indices, chunk_files(manifest))
+    )
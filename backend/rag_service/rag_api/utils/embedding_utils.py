@@ -1,82 +1,194 @@
 """
 Utility per la gestione degli embeddings usando OpenAI e Sentence Transformers.
+
+Ogni motore di embedding (EmbeddingManager) ha una configurazione immutabile
+(provider, modello, dimensioni) e i propri indici persistenti: i motori vengono creati
+una sola volta per configurazione dal registro (get_engine_registry) e condivisi tra i
+thread. Cambiare il provider cambia solo il motore predefinito per i nuovi documenti e
+le nuove knowledge base, che restano legati al motore con cui sono stati costruiti.
 """
 import os
+import re
 import logging
-import pickle
+import threading
 import numpy as np
-from typing import List, Tuple, Optional, Dict, Any
+from typing import List, Tuple, Optional, Dict, Any, NamedTuple, Iterable
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 from django.conf import settings
 import faiss
-from config.llm_clients import get_openai_client, get_openai_embedding_client
+from config.llm_clients import get_openai_client, get_openai_embedding_client, EMBEDDING_TEXTS_PER_REQUEST
+from .vector_index import VectorIndexStore
+from . import embedding_store
+from .embedding_cache import EmbeddingCache, make_cache_key
+from .tracing import span, traced
 
 logger = logging.getLogger(__name__)
 
+class ChunkHit(NamedTuple):
+    """
+    Risultato di una ricerca di similarità.
+    """
+    text: str
+    score: float
+    document_id: int
+    chunk_index: int
+
+PROVIDERS = ('openai', 'sentence_transformers')
+
+
+class EngineConfig(NamedTuple):
+    """
+    Configurazione (immutabile) di un motore di embedding.
+    """
+    provider: str
+    model: str
+    dimension: int
+    
+    @property
+    def key(self) -> str:
+        """
+        Identificativo del motore, salvato su documenti e knowledge base.
+        """
+        return f"{self.provider}:{self.model}:{self.dimension}"
+    
+    @property
+    def namespace(self) -> str:
+        """
+        Nome della directory degli indici persistenti del motore.
+        """
+        return re.sub(r'[^A-Za-z0-9_.-]+', '_', self.key.replace(':', '__'))
+    
+    @classmethod
+    def from_key(cls, key: str) -> 'EngineConfig':
+        provider, rest = key.split(':', 1)
+        model, dimension = rest.rsplit(':', 1)
+        return cls(provider, model, int(dimension))
+
+
+def engine_config_for_provider(provider: str) -> EngineConfig:
+    """
+    Configurazione del motore per un provider, dai settings.
+    
+    Raises:
+        ValueError: Se il provider non è supportato
+        Exception: Se il client OpenAI non è disponibile
+    """
+    if provider == 'openai':
+        model_info = get_openai_embedding_client().get_model_info()
+        return EngineConfig('openai', model_info['model'], model_info['dimensions'])
+    if provider == 'sentence_transformers':
+        return EngineConfig(
+            'sentence_transformers',
+            getattr(settings, 'SENTENCE_TRANSFORMER_MODEL_NAME', 'all-MiniLM-L6-v2'),
+            getattr(settings, 'EMBEDDING_DIMENSION', 384)
+        )
+    raise ValueError(f"Provider non supportato: {provider}")
+
+
 class EmbeddingManager:
     """
-    Gestisce la generazione e il recupero degli embedding con supporto per OpenAI e Sentence Transformers.
+    Motore di embedding: generazione degli embedding, archivio dei vettori e indici di ricerca
+    per una configurazione (provider, modello, dimensioni) che non cambia mai.
+    
+    Args:
+        config (EngineConfig): Configurazione del motore (default: motore predefinito dei settings)
+        embedding_client: Client di embedding da usare al posto di quello OpenAI
+            (con provider 'openai'; es. client locale del benchmark)
     """
-    def __init__(self):
-        # Configurazione provider di embeddings
-        self.provider = getattr(settings, 'EMBEDDING_PROVIDER', 'openai')  # 'openai' o 'sentence_transformers'
+    def __init__(self, config: Optional[EngineConfig] = None, embedding_client=None):
+        if config is None:
+            config = default_engine_config()
+        self.config = config
+        self.provider = config.provider
+        self.dimension = config.dimension
+        self.model_name = config.model
+        self.key = config.key
         
-        # Client OpenAI per embeddings
+        # Client OpenAI per embeddings, per il modello e le dimensioni del motore
         self.openai_embedding_client = None
         if self.provider == 'openai':
-            try:
-                self.openai_embedding_client = get_openai_embedding_client()
-                model_info = self.openai_embedding_client.get_model_info()
-                self.dimension = model_info['dimensions']
-                logger.info(f"EmbeddingManager inizializzato con OpenAI: {model_info['model']} ({self.dimension}D)")
-            except Exception as e:
-                logger.warning(f"Fallback a Sentence Transformers per errore OpenAI: {str(e)}")
-                self.provider = 'sentence_transformers'
+            self.openai_embedding_client = embedding_client or get_openai_embedding_client(
+                config.model, config.dimension
+            )
         
-        # Configurazione Sentence Transformers (sempre inizializzata per fallback)
-        self.model_name = getattr(settings, 'SENTENCE_TRANSFORMER_MODEL_NAME', 'all-MiniLM-L6-v2')
+        # Modello Sentence Transformers (caricato al primo uso)
         self.model_instance = None
-        
-        if self.provider == 'sentence_transformers':
-            self.dimension = getattr(settings, 'EMBEDDING_DIMENSION', 384)
-            logger.info(f"EmbeddingManager inizializzato con Sentence Transformers: {self.model_name}")
+        self._model_lock = threading.Lock()
         
         # Configurazioni comuni
         self.embeddings_root = Path(settings.RAG_EMBEDDINGS_ROOT)
         self.embeddings_root.mkdir(exist_ok=True)
+        self.storage_dtype = getattr(settings, 'RAG_EMBEDDING_STORAGE_DTYPE', 'float32')
+        
+        # Indici persistenti per knowledge base e per utente, nel namespace del motore
+        self.index_store = VectorIndexStore(
+            self.embeddings_root / 'indices' / config.namespace,
+            vector_loader=self.load_document_vectors,
+            ann_min_vectors=getattr(settings, 'RAG_ANN_MIN_VECTORS', 10000),
+            default_nprobe=getattr(settings, 'RAG_ANN_NPROBE', 16),
+            default_ef_search=getattr(settings, 'RAG_ANN_EF_SEARCH', 64)
+        )
         
-        # Cache per gli indici FAISS
-        self._faiss_indices = {}
-        self._chunk_mappings = {}
+        # Cache degli embeddings delle query (LRU in-process + SQLite condiviso tra i worker)
+        cache_path = getattr(settings, 'RAG_QUERY_EMBEDDING_CACHE_PATH', None)
+        self.query_cache = EmbeddingCache(
+            cache_path,
+            max_memory_entries=getattr(settings, 'RAG_QUERY_EMBEDDING_CACHE_MEMORY_ENTRIES', 2048),
+            max_disk_entries=getattr(settings, 'RAG_QUERY_EMBEDDING_CACHE_MAX_ENTRIES', 200000),
+            ttl_seconds=getattr(settings, 'RAG_QUERY_EMBEDDING_CACHE_TTL', 7 * 24 * 3600)
+        )
         
-        logger.info(f"Provider attivo: {self.provider}, Dimensioni: {self.dimension}")
+        # Archivio dei vettori dei chunk indirizzato per contenuto (deduplica in ingestione)
+        self.chunk_vector_store = EmbeddingCache(
+            getattr(settings, 'RAG_CHUNK_EMBEDDING_STORE_PATH', None),
+            max_memory_entries=getattr(settings, 'RAG_CHUNK_EMBEDDING_STORE_MEMORY_ENTRIES', 256),
+            max_disk_entries=getattr(settings, 'RAG_CHUNK_EMBEDDING_STORE_MAX_ENTRIES', 2000000),
+            ttl_seconds=getattr(settings, 'RAG_CHUNK_EMBEDDING_STORE_TTL', 0)
+        )
+        
+        logger.info(f"Motore di embedding inizializzato: {self.provider} {self.model_name} ({self.dimension}D)")
     
     def _load_model(self):
         """
         Carica il modello Sentence Transformers se non è già caricato.
         """
-        if self.model_instance is None:
-            try:
-                logger.info(f"Caricamento modello Sentence Transformers: {self.model_name}")
-                self.model_instance = SentenceTransformer(self.model_name)
-                logger.info("Modello caricato con successo")
-            except Exception as e:
-                logger.error(f"Errore nel caricamento del modello: {str(e)}")
-                raise Exception(f"Impossibile caricare il modello {self.model_name}: {str(e)}")
+        with self._model_lock:
+            if self.model_instance is None:
+                try:
+                    logger.info(f"Caricamento modello Sentence Transformers: {self.model_name}")
+                    self.model_instance = SentenceTransformer(self.model_name)
+                    logger.info("Modello caricato con successo")
+                except Exception as e:
+                    logger.error(f"Errore nel caricamento del modello: {str(e)}")
+                    raise Exception(f"Impossibile caricare il modello {self.model_name}: {str(e)}")
+    
+    def _cache_key(self, text: str) -> str:
+        """
+        Chiave di cache del testo per provider, modello e dimensioni attivi.
+        """
+        return make_cache_key(self.provider, self._current_model_name(), self.dimension, text)
     
+    @traced('query_embedding')
     def get_embedding(self, text: str) -> List[float]:
         """
-        Genera l'embedding per un testo usando il provider configurato.
+        Genera l'embedding per un testo usando il provider configurato (con cache).
         """
         try:
+            key = self._cache_key(text)
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                return cached.tolist()
+            
             if self.provider == 'openai' and self.openai_embedding_client:
-                return self.openai_embedding_client.create_embedding(text)
+                embedding = self.openai_embedding_client.create_embedding(text)
             else:
                 # Fallback a Sentence Transformers
                 self._load_model()
-                embedding = self.model_instance.encode(text)
-                return embedding.tolist()
+                embedding = self.model_instance.encode(text).tolist()
+            
+            self.query_cache.put(key, np.asarray(embedding, dtype=np.float32))
+            return embedding
         except Exception as e:
             logger.error(f"Errore nella generazione dell'embedding: {str(e)}")
             raise
@@ -84,15 +196,35 @@ class EmbeddingManager:
     def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
         """
         Genera gli embedding per una lista di testi usando il provider configurato.
+        
+        Solo i testi non presenti in cache (e senza duplicati) vengono inviati al provider.
         """
         try:
-            if self.provider == 'openai' and self.openai_embedding_client:
-                return self.openai_embedding_client.create_embeddings_batch(texts)
-            else:
-                # Fallback a Sentence Transformers
-                self._load_model()
-                embeddings = self.model_instance.encode(texts)
-                return [emb.tolist() for emb in embeddings]
+            keys = [self._cache_key(text) for text in texts]
+            cached = self.query_cache.get_many(keys)
+            
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached and key not in missing:
+                    missing[key] = text
+            
+            if missing:
+                missing_texts = list(missing.values())
+                if self.provider == 'openai' and self.openai_embedding_client:
+                    new_embeddings = self.openai_embedding_client.create_embeddings_batch(missing_texts)
+                else:
+                    # Fallback a Sentence Transformers
+                    self._load_model()
+                    new_embeddings = self.model_instance.encode(missing_texts)
+                
+                new_vectors = {
+                    key: np.asarray(embedding, dtype=np.float32)
+                    for key, embedding in zip(missing.keys(), new_embeddings)
+                }
+                self.query_cache.put_many(new_vectors)
+                cached.update(new_vectors)
+            
+            return [cached[key].tolist() for key in keys]
         except Exception as e:
             logger.error(f"Errore nella generazione degli embedding in batch: {str(e)}")
             raise
@@ -150,35 +282,91 @@ class EmbeddingManager:
             logger.error(f"Errore nella creazione degli embeddings: {str(e)}")
             raise Exception(f"Errore nella creazione degli embeddings: {str(e)}")
     
+    def ingestion_batch_size(self, minimum: int) -> int:
+        """
+        Chunk per batch della pipeline di ingestione.
+        
+        Con OpenAI un batch viene diviso in richieste da EMBEDDING_TEXTS_PER_REQUEST testi
+        inviate in parallelo: il batch deve poterle riempire tutte
+        (OPENAI_EMBEDDING_MAX_WORKERS), altrimenti la concorrenza del client resta inutilizzata.
+        """
+        if self.provider == 'openai' and self.openai_embedding_client:
+            return max(minimum, self.openai_embedding_client.max_workers * EMBEDDING_TEXTS_PER_REQUEST)
+        return minimum
+    
+    def _current_model_name(self) -> str:
+        """
+        Nome del modello di embedding del motore (per il manifest dei documenti).
+        """
+        return self.model_name
+    
+    def _document_dir(self, document_id: int) -> Path:
+        """
+        Directory degli embeddings di un documento, convertita al formato a shard se ancora legacy.
+        """
+        doc_dir = self.embeddings_root / str(document_id)
+        if embedding_store.is_legacy(doc_dir):
+            embedding_store.upgrade_legacy(doc_dir, dtype=self.storage_dtype)
+        return doc_dir
+    
+    @traced('chunk_embeddings')
+    def create_chunk_embeddings(self, chunks: List[str]) -> Tuple[np.ndarray, int]:
+        """
+        Crea gli embeddings dei chunk riusando quelli già calcolati per lo stesso testo.
+        
+        I vettori sono indirizzati per (provider, modello, dimensioni, testo): riprocessare
+        un documento o caricare lo stesso file più volte non richiede nuovi embeddings.
+        
+        Args:
+            chunks (List[str]): Lista dei chunk di testo
+            
+        Returns:
+            Tuple[np.ndarray, int]: Embeddings nell'ordine dei chunk e numero di chunk riusati
+        """
+        if not chunks:
+            return np.array([]), 0
+        
+        keys = [self._cache_key(chunk) for chunk in chunks]
+        known = self.chunk_vector_store.get_many(keys)
+        
+        missing = {}
+        for key, chunk in zip(keys, chunks):
+            if key not in known and key not in missing:
+                missing[key] = chunk
+        
+        if missing:
+            new_embeddings = self.create_embeddings(list(missing.values()))
+            new_vectors = {
+                key: np.asarray(embedding, dtype=np.float32)
+                for key, embedding in zip(missing.keys(), new_embeddings)
+            }
+            self.chunk_vector_store.put_many(new_vectors)
+            known.update(new_vectors)
+        
+        # Chunk non inviati al provider: già in archivio o duplicati nello stesso documento
+        reused = len(chunks) - len(missing)
+        logger.info(f"Embeddings chunk: {len(chunks) - reused} calcolati, {reused} riusati")
+        return np.vstack([known[key] for key in keys]), reused
+    
     def save_embeddings(self, document_id: int, embeddings: np.ndarray, 
                        chunks: List[str], metadata: Dict[str, Any] = None):
         """
-        Salva gli embeddings su disco.
+        Salva gli embeddings su disco (manifest JSON + shard .npy leggibili in mmap).
         
         Args:
             document_id (int): ID del documento
             embeddings (np.ndarray): Array di embeddings
             chunks (List[str]): Lista dei chunk di testo corrispondenti
-            metadata (Dict): Metadati aggiuntivi
+            metadata (Dict): Metadati aggiuntivi (devono essere serializzabili in JSON)
         """
         try:
             doc_dir = self.embeddings_root / str(document_id)
-            doc_dir.mkdir(exist_ok=True)
-            
-            # Salva embeddings
-            embeddings_path = doc_dir / "embeddings.npy"
-            np.save(embeddings_path, embeddings)
-            
-            # Salva chunks
-            chunks_path = doc_dir / "chunks.pkl"
-            with open(chunks_path, 'wb') as f:
-                pickle.dump(chunks, f)
-            
-            # Salva metadata
-            if metadata:
-                metadata_path = doc_dir / "metadata.pkl"
-                with open(metadata_path, 'wb') as f:
-                    pickle.dump(metadata, f)
+            embedding_store.write_document(
+                doc_dir, embeddings, chunks, metadata,
+                dtype=self.storage_dtype,
+                model=self._current_model_name(),
+                provider=self.provider
+            )
             
             logger.info(f"Embeddings salvati per documento {document_id}")
             
@@ -186,6 +374,26 @@ class EmbeddingManager:
             logger.error(f"Errore nel salvataggio degli embeddings per documento {document_id}: {str(e)}")
             raise Exception(f"Errore nel salvataggio degli embeddings: {str(e)}")
     
+    def open_document_writer(self, document_id: int) -> embedding_store.DocumentWriter:
+        """
+        Apre un writer incrementale per gli embeddings di un documento.
+        
+        Usato dalla pipeline di ingestione per salvare i vettori a blocchi man mano
+        che vengono creati, invece di tenerli tutti in memoria fino alla fine.
+        
+        Args:
+            document_id (int): ID del documento
+            
+        Returns:
+            embedding_store.DocumentWriter: Writer da chiudere con ``close(metadata)``
+        """
+        return embedding_store.DocumentWriter(
+            self.embeddings_root / str(document_id),
+            dtype=self.storage_dtype,
+            model=self._current_model_name(),
+            provider=self.provider
+        )
+    
     def load_embeddings(self, document_id: int) -> Tuple[np.ndarray, List[str], Dict[str, Any]]:
         """
         Carica gli embeddings dal disco.
@@ -194,7 +402,7 @@ class EmbeddingManager:
             document_id (int): ID del documento
             
         Returns:
-            Tuple[np.ndarray, List[str], Dict]: Embeddings, chunks e metadata
+            Tuple[np.ndarray, List[str], Dict]: Embeddings (normalizzati), chunks e metadata
         """
         try:
             doc_dir = self.embeddings_root / str(document_id)
@@ -202,21 +410,9 @@ class EmbeddingManager:
             if not doc_dir.exists():
                 raise FileNotFoundError(f"Embeddings non trovati per documento {document_id}")
             
-            # Carica embeddings
-            embeddings_path = doc_dir / "embeddings.npy"
-            embeddings = np.load(embeddings_path)
-            
-            # Carica chunks
-            chunks_path = doc_dir / "chunks.pkl"
-            with open(chunks_path, 'rb') as f:
-                chunks = pickle.load(f)
-            
-            # Carica metadata (opzionale)
-            metadata_path = doc_dir / "metadata.pkl"
-            metadata = {}
-            if metadata_path.exists():
-                with open(metadata_path, 'rb') as f:
-                    metadata = pickle.load(f)
+            doc_dir = self._document_dir(document_id)
+            embeddings, chunks, manifest = embedding_store.read_document(doc_dir)
+            metadata = manifest.get('metadata', {})
             
             logger.info(f"Embeddings caricati per documento {document_id}")
             return embeddings, chunks, metadata
@@ -225,12 +421,57 @@ class EmbeddingManager:
             logger.error(f"Errore nel caricamento degli embeddings per documento {document_id}: {str(e)}")
             raise Exception(f"Errore nel caricamento degli embeddings: {str(e)}")
     
-    def delete_embeddings(self, document_id: int):
+    def load_document_vectors(self, document_id: int) -> np.ndarray:
+        """
+        Carica solo i vettori di un documento (memmap in sola lettura), senza i testi dei chunk.
+        """
+        if not (self.embeddings_root / str(document_id)).exists():
+            raise FileNotFoundError(f"Embeddings non trovati per documento {document_id}")
+        return embedding_store.load_vectors(self._document_dir(document_id))
+    
+    def document_generation(self, document_id: int) -> str:
+        """
+        Generazione pubblicata degli embeddings di un documento ('' se non esistono).
+        """
+        try:
+            return embedding_store.read_manifest(self.embeddings_root / str(document_id)).get('generation', '')
+        except (OSError, ValueError):
+            return ''
+    
+    @traced('chunk_resolution')
+    def get_chunk_texts(self, chunk_refs: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], str]:
         """
-        Elimina gli embeddings di un documento.
+        Risolve i testi di più chunk con una sola lettura per documento.
+        
+        Args:
+            chunk_refs (Iterable[Tuple[int, int]]): Coppie (document_id, chunk_index)
+            
+        Returns:
+            Dict[Tuple[int, int], str]: Mappa (document_id, chunk_index) -> testo
+        """
+        by_document: Dict[int, List[int]] = {}
+        for doc_id, chunk_idx in chunk_refs:
+            by_document.setdefault(doc_id, []).append(chunk_idx)
+        
+        texts = {}
+        for doc_id, chunk_indices in by_document.items():
+            try:
+                doc_chunks = embedding_store.read_chunks(self._document_dir(doc_id), chunk_indices)
+            except Exception as e:
+                logger.warning(f"Errore nel caricamento dei chunk del documento {doc_id}: {str(e)}")
+                continue
+            for chunk_idx, text in doc_chunks.items():
+                texts[(doc_id, chunk_idx)] = text
+        
+        return texts
+    
+    def delete_embeddings(self, document_id: int, scopes: Optional[List[str]] = None):
+        """
+        Elimina gli embeddings di un documento e lo rimuove dagli indici persistenti.
         
         Args:
             document_id (int): ID del documento
+            scopes (List[str]): Scope degli indici da aggiornare (default: tutti quelli che lo contengono)
         """
         try:
             doc_dir = self.embeddings_root / str(document_id)
@@ -240,72 +481,202 @@ class EmbeddingManager:
                 shutil.rmtree(doc_dir)
                 logger.info(f"Embeddings eliminati per documento {document_id}")
             
-            # Rimuovi dalla cache
-            if document_id in self._faiss_indices:
-                del self._faiss_indices[document_id]
-            if document_id in self._chunk_mappings:
-                del self._chunk_mappings[document_id]
+            # Rimuovi il documento dagli indici persistenti
+            if scopes is None:
+                scopes = self.index_store.scopes_containing(document_id)
+            for scope in scopes:
+                self.remove_documents_from_index(scope, [document_id])
                 
         except Exception as e:
             logger.error(f"Errore nell'eliminazione degli embeddings per documento {document_id}: {str(e)}")
             raise Exception(f"Errore nell'eliminazione degli embeddings: {str(e)}")
     
-    def create_faiss_index(self, document_ids: List[int]) -> Tuple[faiss.IndexFlatIP, List[Tuple[int, int]]]:
+    @traced('exact_search')
+    def search_documents(self, query_embedding: np.ndarray, document_ids: List[int],
+                         top_k: int) -> List[Tuple[int, int, float]]:
         """
-        Crea un indice FAISS per la ricerca di similarità.
+        Ricerca esatta tra i vettori di documenti specifici, senza costruire indici.
+        
+        I vettori di ogni documento sono letti in memory-map dalla generazione pubblicata:
+        niente copie per processo da tenere in cache o invalidare, e i risultati riflettono
+        sempre l'ultima versione dei documenti.
         
         Args:
-            document_ids (List[int]): Lista degli ID dei documenti
+            query_embedding (np.ndarray): Query normalizzata, shape (1, dimension)
+            document_ids (List[int]): ID dei documenti
+            top_k (int): Numero di risultati
             
         Returns:
-            Tuple[faiss.Index, List[Tuple[int, int]]]: Indice FAISS e mapping chunk->documento
+            List[Tuple[int, int, float]]: Lista di (document_id, chunk_index, score)
         """
-        try:
-            all_embeddings = []
-            chunk_to_doc_mapping = []  # (doc_id, chunk_index)
+        query = query_embedding[0]
+        hits = []
+        for doc_id in document_ids:
+            try:
+                vectors = self.load_document_vectors(doc_id)
+            except Exception as e:
+                logger.warning(f"Impossibile caricare embeddings per documento {doc_id}: {str(e)}")
+                continue
+            if vectors.size == 0:
+                continue
+            if vectors.shape[1] != query.shape[0]:
+                logger.warning(f"Documento {doc_id} con dimensione {vectors.shape[1]} "
+                               f"diversa dalla query ({query.shape[0]}): saltato")
+                continue
+            
+            # Solo i migliori top_k di ogni documento possono entrare nel risultato
+            scores = vectors @ query
+            best = np.argpartition(-scores, top_k - 1)[:top_k] if len(scores) > top_k else np.arange(len(scores))
+            hits.extend((doc_id, int(chunk_idx), float(scores[chunk_idx])) for chunk_idx in best)
+        
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        return hits[:top_k]
+    
+    @staticmethod
+    def user_scope(user_id: Optional[int]) -> str:
+        """
+        Nome dello scope dell'indice con tutti i documenti di un utente.
+        """
+        return f"user_{user_id if user_id is not None else 'anonymous'}"
+    
+    @staticmethod
+    def kb_scope(knowledge_base_id: int) -> str:
+        """
+        Nome dello scope dell'indice di una knowledge base.
+        """
+        return f"kb_{knowledge_base_id}"
+    
+    def add_documents_to_index(self, scope: str, document_ids: List[int],
+                               index_type: Optional[str] = None) -> int:
+        """
+        Aggiunge (o aggiorna) i documenti nell'indice persistente di uno scope.
+        
+        I documenti che non si possono indicizzare (vettori assenti, vuoti o di dimensione
+        diversa dall'indice) vengono registrati nello scope con la generazione dei loro
+        embeddings, così ``sync_index`` non li ritenta a ogni ricerca.
+        
+        Args:
+            scope (str): Scope dell'indice (vedi user_scope/kb_scope)
+            document_ids (List[int]): ID dei documenti da aggiungere
+            index_type (str): Tipo di indice dello scope (None per mantenere quello attuale)
             
-            for doc_id in document_ids:
-                try:
-                    embeddings, chunks, _ = self.load_embeddings(doc_id)
+        Returns:
+            int: Numero di documenti aggiunti
+        """
+        added = 0
+        try:
+            with self.index_store.update(scope) as index:
+                if index_type:
+                    index.set_index_type(index_type)
+                for doc_id in document_ids:
+                    try:
+                        embeddings = self.load_document_vectors(doc_id)
+                    except Exception as e:
+                        logger.warning(f"Impossibile indicizzare il documento {doc_id} in {scope}: {str(e)}")
+                        index.mark_skipped(doc_id, self.document_generation(doc_id))
+                        continue
                     
-                    if embeddings.size > 0:
-                        all_embeddings.append(embeddings)
-                        for i in range(len(chunks)):
-                            chunk_to_doc_mapping.append((doc_id, i))
-                            
-                except Exception as e:
-                    logger.warning(f"Impossibile caricare embeddings per documento {doc_id}: {str(e)}")
-                    continue
-            
-            if not all_embeddings:
-                raise Exception("Nessun embedding trovato per i documenti specificati")
-            
-            # Concatena tutti gli embeddings
-            combined_embeddings = np.vstack(all_embeddings)
-            
-            # Assicurati che sia float32 e contiguoso per FAISS
-            combined_embeddings = np.ascontiguousarray(combined_embeddings, dtype=np.float32)
-            
-            # Normalizza gli embeddings per la ricerca coseno
-            faiss.normalize_L2(combined_embeddings)
+                    if embeddings.size == 0:
+                        index.mark_skipped(doc_id, self.document_generation(doc_id))
+                        continue
+                    if index.dimension is not None and embeddings.shape[1] != index.dimension:
+                        logger.warning(f"Documento {doc_id} con dimensione {embeddings.shape[1]} "
+                                       f"diversa dall'indice {scope} ({index.dimension}): saltato")
+                        index.mark_skipped(doc_id, self.document_generation(doc_id))
+                        continue
+                    
+                    index.add_document(doc_id, embeddings)
+                    added += 1
             
-            # Crea indice FAISS (Inner Product per coseno con embeddings normalizzati)
-            dimension = combined_embeddings.shape[1]
-            index = faiss.IndexFlatIP(dimension)
+            if added:
+                logger.info(f"Indice {scope}: aggiunti {added} documenti")
+            return added
             
-            # Aggiungi embeddings all'indice
-            index.add(combined_embeddings)
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornamento dell'indice {scope}: {str(e)}")
+            raise Exception(f"Errore nell'aggiornamento dell'indice: {str(e)}")
+    
+    def remove_documents_from_index(self, scope: str, document_ids: List[int]) -> int:
+        """
+        Rimuove i documenti dall'indice persistente di uno scope.
+        
+        Returns:
+            int: Numero di vettori rimossi
+        """
+        try:
+            with self.index_store.update(scope) as index:
+                removed = index.remove_documents(document_ids)
             
-            logger.info(f"Indice FAISS creato con {index.ntotal} embeddings da {len(document_ids)} documenti")
+            if removed:
+                logger.info(f"Indice {scope}: rimossi {removed} vettori")
+            return removed
             
-            return index, chunk_to_doc_mapping
+        except Exception as e:
+            logger.error(f"Errore nella rimozione di documenti dall'indice {scope}: {str(e)}")
+            raise Exception(f"Errore nell'aggiornamento dell'indice: {str(e)}")
+    
+    def set_index_type(self, scope: str, index_type: str):
+        """
+        Cambia il tipo dell'indice persistente di uno scope, ricostruendolo se necessario.
+        """
+        try:
+            with self.index_store.update(scope) as index:
+                index.set_index_type(index_type)
+            logger.info(f"Indice {scope}: tipo impostato a {index_type}")
             
         except Exception as e:
-            logger.error(f"Errore nella creazione dell'indice FAISS: {str(e)}")
-            raise Exception(f"Errore nella creazione dell'indice FAISS: {str(e)}")
+            logger.error(f"Errore nel cambio di tipo dell'indice {scope}: {str(e)}")
+            raise Exception(f"Errore nell'aggiornamento dell'indice: {str(e)}")
+    
+    def drop_index(self, scope: str):
+        """
+        Elimina l'indice persistente di uno scope.
+        """
+        self.index_store.drop(scope)
+        logger.info(f"Indice {scope} eliminato")
+    
+    @traced('index_sync')
+    def sync_index(self, scope: str, document_ids: List[int], index_type: Optional[str] = None):
+        """
+        Allinea l'indice di uno scope all'elenco di documenti atteso.
+        
+        Solo la differenza viene applicata: i documenti mancanti vengono aggiunti
+        e quelli non più presenti rimossi, senza ricostruire l'indice. I documenti già
+        risultati non indicizzabili sono ritentati solo quando i loro embeddings cambiano
+        generazione. Con ``index_type``
+        (il tipo della knowledge base) anche un indice appena creato o ricreato, ad esempio
+        dopo un cambio di dimensione, nasce del tipo richiesto invece che flat.
+        """
+        index = self.index_store.get(scope)
+        expected = set(document_ids)
+        
+        if index.index is not None and index.dimension != self.dimension:
+            logger.warning(f"Indice {scope} con dimensione {index.dimension} diversa dal provider "
+                           f"({self.dimension}): ricostruzione")
+            self.drop_index(scope)
+            index = self.index_store.get(scope)
+        
+        missing = {
+            doc_id for doc_id in expected - index.document_ids
+            if doc_id not in index.skipped or index.skipped[doc_id] != self.document_generation(doc_id)
+        }
+        stale = (index.document_ids | set(index.skipped)) - expected
+        if stale:
+            self.remove_documents_from_index(scope, list(stale))
+        retype = bool(index_type) and index.index_type != index_type
+        if missing:
+            self.add_documents_to_index(scope, sorted(missing), index_type=index_type)
+        elif retype:
+            self.set_index_type(scope, index_type)
+        if missing or stale or retype:
+            index = self.index_store.get(scope)
+        
+        return index
     
     def search_similar_chunks(self, query: str, document_ids: List[int], 
-                            top_k: int = 5) -> List[Tuple[str, float, int]]:
+                            top_k: int = 5, scope: Optional[str] = None,
+                            nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                            index_type: Optional[str] = None) -> List[ChunkHit]:
         """
         Cerca i chunk più simili alla query.
         
@@ -313,9 +684,14 @@ class EmbeddingManager:
             query (str): Query di ricerca
             document_ids (List[int]): Lista degli ID dei documenti da cercare
             top_k (int): Numero di risultati da restituire
+            scope (str): Scope dell'indice persistente da usare (None per una ricerca esatta
+                sui soli ``document_ids``)
+            nprobe (int): Liste visitate negli indici IVF dello scope (None = default)
+            ef_search (int): Ampiezza di ricerca negli indici HNSW dello scope (None = default)
+            index_type (str): Tipo di indice dello scope (None per mantenere quello attuale)
             
         Returns:
-            List[Tuple[str, float, int]]: Lista di (chunk_text, score, document_id)
+            List[ChunkHit]: Lista di (chunk_text, score, document_id, chunk_index)
         """
         try:
             if not document_ids:
@@ -327,33 +703,24 @@ class EmbeddingManager:
             query_embedding = np.ascontiguousarray(query_embedding)
             faiss.normalize_L2(query_embedding)
             
-            # Crea o recupera l'indice FAISS
-            index_key = tuple(sorted(document_ids))
-            if index_key not in self._faiss_indices:
-                index, chunk_mapping = self.create_faiss_index(document_ids)
-                self._faiss_indices[index_key] = index
-                self._chunk_mappings[index_key] = chunk_mapping
+            if scope is not None:
+                # Indice persistente aggiornato in modo incrementale
+                index = self.sync_index(scope, document_ids, index_type=index_type)
+                with span('index_search'):
+                    hits = index.search(query_embedding, top_k, nprobe=nprobe, ef_search=ef_search)
             else:
-                index = self._faiss_indices[index_key]
-                chunk_mapping = self._chunk_mappings[index_key]
+                hits = self.search_documents(query_embedding, document_ids, top_k)
             
-            # Ricerca
-            scores, indices = index.search(query_embedding, top_k)
+            # Risolve i testi di tutti gli hit con una lettura per documento
+            texts = self.get_chunk_texts((doc_id, chunk_idx) for doc_id, chunk_idx, _ in hits)
             
             results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx >= 0 and idx < len(chunk_mapping):
-                    doc_id, chunk_idx = chunk_mapping[idx]
-                    
-                    # Carica il chunk specifico
-                    try:
-                        _, chunks, _ = self.load_embeddings(doc_id)
-                        if chunk_idx < len(chunks):
-                            chunk_text = chunks[chunk_idx]
-                            results.append((chunk_text, float(score), doc_id))
-                    except Exception as e:
-                        logger.warning(f"Errore nel caricamento del chunk {chunk_idx} del documento {doc_id}: {str(e)}")
-                        continue
+            for doc_id, chunk_idx, score in hits:
+                chunk_text = texts.get((doc_id, chunk_idx))
+                if chunk_text is None:
+                    logger.warning(f"Chunk {chunk_idx} del documento {doc_id} non trovato")
+                    continue
+                results.append(ChunkHit(chunk_text, float(score), doc_id, chunk_idx))
             
             logger.info(f"Trovati {len(results)} chunk simili per la query")
             return results
@@ -362,6 +729,43 @@ class EmbeddingManager:
             logger.error(f"Errore nella ricerca di chunk simili: {str(e)}")
             raise Exception(f"Errore nella ricerca di chunk simili: {str(e)}")
     
+    @traced('vector_scoring')
+    def score_chunks(self, query: str, chunk_refs: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], float]:
+        """
+        Calcola la similarità coseno tra la query e chunk specifici.
+        
+        Serve a dare un punteggio confrontabile a chunk trovati per altre vie
+        (es. ricerca lessicale); i vettori vengono letti in memory-map, un documento alla volta.
+        
+        Args:
+            query (str): Query di ricerca
+            chunk_refs (Iterable[Tuple[int, int]]): Coppie (document_id, chunk_index)
+            
+        Returns:
+            Dict[Tuple[int, int], float]: Punteggio per ogni chunk disponibile
+        """
+        by_document: Dict[int, List[int]] = {}
+        for doc_id, chunk_idx in chunk_refs:
+            by_document.setdefault(doc_id, []).append(chunk_idx)
+        if not by_document:
+            return {}
+        
+        query_embedding = np.array([self.get_embedding(query)], dtype=np.float32)
+        faiss.normalize_L2(query_embedding)
+        query_embedding = query_embedding[0]
+        
+        scores = {}
+        for doc_id, chunk_indices in by_document.items():
+            try:
+                vectors = self.load_document_vectors(doc_id)
+            except Exception as e:
+                logger.warning(f"Vettori del documento {doc_id} non disponibili: {str(e)}")
+                continue
+            for chunk_idx in chunk_indices:
+                if 0 <= chunk_idx < len(vectors):
+                    scores[(doc_id, chunk_idx)] = float(np.dot(vectors[chunk_idx], query_embedding))
+        return scores
+    
     def get_document_embeddings_info(self, document_id: int) -> Dict[str, Any]:
         """
         Ottieni informazioni sugli embeddings di un documento.
@@ -378,14 +782,17 @@ class EmbeddingManager:
             if not doc_dir.exists():
                 return {"exists": False}
             
-            embeddings, chunks, metadata = self.load_embeddings(document_id)
+            manifest = embedding_store.read_manifest(self._document_dir(document_id))
             
             return {
                 "exists": True,
-                "num_chunks": len(chunks),
-                "embedding_dimension": embeddings.shape[1] if embeddings.size > 0 else 0,
-                "total_embeddings": embeddings.shape[0] if embeddings.size > 0 else 0,
-                "metadata": metadata
+                "num_chunks": manifest['count'],
+                "embedding_dimension": manifest['dimension'],
+                "total_embeddings": manifest['count'],
+                "dtype": manifest['dtype'],
+                "model": manifest.get('model', ''),
+                "provider": manifest.get('provider', ''),
+                "metadata": manifest.get('metadata', {})
             }
             
         except Exception as e:
@@ -394,10 +801,9 @@ class EmbeddingManager:
     
     def clear_cache(self):
         """
-        Pulisce la cache degli indici FAISS.
+        Pulisce la cache degli indici FAISS (gli indici persistenti restano su disco).
         """
-        self._faiss_indices.clear()
-        self._chunk_mappings.clear()
+        self.index_store.clear_cache()
         logger.info("Cache degli indici FAISS pulita")
     
     def get_embedding_info(self) -> Dict[str, Any]:
@@ -408,9 +814,11 @@ class EmbeddingManager:
             Dict[str, Any]: Informazioni dettagliate sul sistema di embedding
         """
         info = {
+            'engine': self.key,
             'provider': self.provider,
             'dimensions': self.dimension,
             'embeddings_root': str(self.embeddings_root),
+            'query_cache': self.query_cache.stats(),
         }
         
         if self.provider == 'openai' and self.openai_embedding_client:
@@ -427,68 +835,119 @@ class EmbeddingManager:
             info.update({
                 'model': self.model_name,
                 'supports_custom_dimensions': False,
-                'default_dimensions': self.dimension,
-                'fallback_reason': 'OpenAI non disponibile' if hasattr(self, '_openai_fallback') else None
+                'default_dimensions': self.dimension
             })
         
         return info
+
+
+def default_engine_config() -> EngineConfig:
+    """
+    Configurazione del motore predefinito dai settings (EMBEDDING_PROVIDER), con
+    Sentence Transformers come ripiego se OpenAI non è disponibile.
+    """
+    provider = getattr(settings, 'EMBEDDING_PROVIDER', 'openai')
+    try:
+        return engine_config_for_provider(provider)
+    except Exception as e:
+        if provider != 'openai':
+            raise
+        logger.warning(f"Fallback a Sentence Transformers per errore OpenAI: {str(e)}")
+        return engine_config_for_provider('sentence_transformers')
+
+
+class EngineRegistry:
+    """
+    Registro dei motori di embedding del processo: un motore per configurazione, mai
+    modificato dopo la creazione (le sue cache restano sempre valide).
     
-    def switch_provider(self, provider: str) -> bool:
+    Il motore predefinito è quello usato per i nuovi documenti e le nuove knowledge base;
+    cambiarlo non tocca i motori già in uso dalle richieste in corso.
+    """
+    
+    def __init__(self):
+        self._engines: Dict[str, EmbeddingManager] = {}
+        self._default_key: Optional[str] = None
+        self._lock = threading.RLock()
+    
+    def get(self, engine) -> EmbeddingManager:
         """
-        Cambia il provider di embedding a runtime.
-        
-        Args:
-            provider (str): 'openai' o 'sentence_transformers'
-            
-        Returns:
-            bool: True se il cambio è riuscito
+        Motore per una configurazione o per il suo identificativo (creato al primo uso).
         """
-        if provider == self.provider:
-            logger.info(f"Provider già impostato su: {provider}")
-            return True
-        
-        try:
-            if provider == 'openai':
-                # Prova a inizializzare OpenAI
-                if self.openai_embedding_client is None:
-                    self.openai_embedding_client = get_openai_embedding_client()
-                model_info = self.openai_embedding_client.get_model_info()
-                old_dimension = self.dimension
-                self.dimension = model_info['dimensions']
-                self.provider = 'openai'
-                logger.info(f"Switched to OpenAI: {model_info['model']} ({self.dimension}D)")
-                
-                # Avvisa se le dimensioni sono cambiate
-                if old_dimension != self.dimension:
-                    logger.warning(f"Dimensioni cambiate da {old_dimension} a {self.dimension}. "
-                                 "Potrebbero essere necessari nuovi embeddings.")
-                
-            elif provider == 'sentence_transformers':
-                self.provider = 'sentence_transformers'
-                # Ricarica il modello se necessario
-                if self.model_instance is None:
-                    self._load_model()
-                logger.info(f"Switched to Sentence Transformers: {self.model_name}")
-            
-            else:
-                raise ValueError(f"Provider non supportato: {provider}")
-            
-            # Pulisci la cache perché potrebbe non essere più valida
-            self.clear_cache()
-            return True
-            
-        except Exception as e:
-            logger.error(f"Errore nel cambio provider a {provider}: {str(e)}")
-            return False
+        config = EngineConfig.from_key(engine) if isinstance(engine, str) else engine
+        engine_key = config.key
+        with self._lock:
+            manager = self._engines.get(engine_key)
+            if manager is None:
+                manager = EmbeddingManager(config)
+                self._engines[engine_key] = manager
+            return manager
+    
+    def default(self) -> EmbeddingManager:
+        """
+        Motore predefinito (dai settings finché non viene cambiato con set_default_provider).
+        """
+        with self._lock:
+            if self._default_key is None:
+                self._default_key = default_engine_config().key
+            return self.get(self._default_key)
+    
+    def for_provider(self, provider: str) -> EmbeddingManager:
+        """
+        Motore configurato nei settings per un provider, senza cambiare il predefinito.
+        """
+        return self.get(engine_config_for_provider(provider))
+    
+    def set_default_provider(self, provider: str) -> EmbeddingManager:
+        """
+        Rende predefinito il motore di un provider per i nuovi documenti e knowledge base.
+        """
+        manager = self.for_provider(provider)
+        with self._lock:
+            previous = self._default_key
+            self._default_key = manager.key
+        if previous != manager.key:
+            logger.info(f"Motore di embedding predefinito: {previous} -> {manager.key}")
+        return manager
+    
+    def engines(self) -> List[EmbeddingManager]:
+        with self._lock:
+            return list(self._engines.values())
+
 
-# Istanza globale del manager degli embeddings
-_embedding_manager = None
+def engine_config_from_document(document_id: int) -> Optional[EngineConfig]:
+    """
+    Configurazione del motore che ha creato i vettori di un documento, dal suo manifest
+    (per i documenti processati prima che il motore venisse registrato nel database).
+    """
+    doc_dir = Path(settings.RAG_EMBEDDINGS_ROOT) / str(document_id)
+    if not doc_dir.exists():
+        return None
+    try:
+        if embedding_store.is_legacy(doc_dir):
+            embedding_store.upgrade_legacy(doc_dir, dtype=getattr(settings, 'RAG_EMBEDDING_STORAGE_DTYPE', 'float32'))
+        manifest = embedding_store.read_manifest(doc_dir)
+    except Exception as e:
+        logger.warning(f"Manifest degli embeddings del documento {document_id} non leggibile: {str(e)}")
+        return None
+    if manifest.get('provider') not in PROVIDERS or not manifest.get('model') or not manifest.get('dimension'):
+        return None
+    return EngineConfig(manifest['provider'], manifest['model'], int(manifest['dimension']))
+
+
+# Registro globale dei motori di embedding
+_engine_registry = EngineRegistry()
+
+def get_engine_registry() -> EngineRegistry:
+    """
+    Registro dei motori di embedding del processo.
+    """
+    return _engine_registry
 
-def get_embedding_manager() -> EmbeddingManager:
+def get_embedding_manager(engine=None) -> EmbeddingManager:
     """
-    Factory function per ottenere un'istanza di EmbeddingManager.
+    Motore di embedding per una configurazione o un identificativo (default: motore predefinito).
     """
-    global _embedding_manager
-    if _embedding_manager is None:
-        _embedding_manager = EmbeddingManager()
-    return _embedding_manager 
\ No newline at end of file
+    if engine:
+        return _engine_registry.get(engine)
+    return _engine_registry.default()
@@ -0,0 +1,185 @@
+"""
+Ricerca ibrida lessicale + vettoriale sui chunk dei documenti.
+
+La parte lessicale usa il full-text search di Postgres: ogni chunk ha una colonna
+``search_vector`` (tsvector con indice GIN) popolata in ingestione, quindi le query
+per parole chiave, sigle e codici non richiedono più la scansione dei testi.
+I due ranking (FAISS e full-text) vengono fusi con Reciprocal Rank Fusion.
+
+Su database diversi da Postgres (es. SQLite in sviluppo) la parte lessicale è
+disattivata e la ricerca resta solo vettoriale.
+"""
+import re
+import logging
+import operator
+from functools import reduce
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from .embedding_utils import ChunkHit
+from .tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Costante di smorzamento della Reciprocal Rank Fusion (valore standard in letteratura)
+RRF_K = 60
+
+# Candidati letti da ciascun ranking per ogni risultato finale
+CANDIDATES_PER_RESULT = 3
+
+# Lunghezza minima dei termini usati nella query full-text
+MIN_TERM_LENGTH = 2
+
+ChunkKey = Tuple[int, int]
+
+
+def _text_search_config() -> str:
+    return getattr(settings, 'RAG_TEXT_SEARCH_CONFIG', 'italian')
+
+
+def lexical_search_available() -> bool:
+    """
+    Indica se il database supporta la ricerca full-text sui chunk.
+    """
+    return connection.vendor == 'postgresql'
+
+
+def update_search_vectors(document_id: int):
+    """
+    Popola la colonna full-text dei chunk di un documento con una sola UPDATE.
+
+    Args:
+        document_id (int): ID del documento
+    """
+    if not lexical_search_available():
+        return
+
+    from django.contrib.postgres.search import SearchVector
+    from ..models import RAGChunk
+
+    RAGChunk.objects.filter(document_id=document_id).update(
+        search_vector=SearchVector('text', config=_text_search_config())
+    )
+
+
+@traced('lexical_search')
+def lexical_search(query: str, document_ids: Sequence[int], top_k: int) -> List[Tuple[int, int, str]]:
+    """
+    Cerca i chunk che contengono i termini della query, ordinati per rank full-text.
+
+    I termini sono combinati in OR: le domande in linguaggio naturale raramente
+    contengono tutte le parole presenti nel chunk.
+
+    Args:
+        query (str): Query di ricerca
+        document_ids (Sequence[int]): Documenti in cui cercare
+        top_k (int): Numero massimo di risultati
+
+    Returns:
+        List[Tuple[int, int, str]]: Lista di (document_id, chunk_index, testo)
+    """
+    if not document_ids or not lexical_search_available():
+        return []
+
+    terms = [term for term in dict.fromkeys(re.findall(r'\w+', query.lower())) if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        return []
+
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+    from ..models import RAGChunk
+
+    config = _text_search_config()
+    search_query = reduce(operator.or_, (SearchQuery(term, config=config) for term in terms))
+
+    rows = (
+        RAGChunk.objects
+        .filter(document_id__in=list(document_ids), search_vector=search_query)
+        .annotate(rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-rank')
+        .values_list('document_id', 'chunk_index', 'text')[:top_k]
+    )
+    return list(rows)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[ChunkKey]], k: int = RRF_K) -> List[Tuple[ChunkKey, float]]:
+    """
+    Fonde più ranking con Reciprocal Rank Fusion: score = somma di 1 / (k + rank).
+
+    Args:
+        rankings (Iterable[Sequence[ChunkKey]]): Ranking di chunk, dal più rilevante
+        k (int): Costante di smorzamento
+
+    Returns:
+        List[Tuple[ChunkKey, float]]: Chunk con score fuso, in ordine decrescente
+    """
+    fused: Dict[ChunkKey, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(embedding_manager, query: str, document_ids: List[int], top_k: int = 5,
+                  scope: Optional[str] = None, nprobe: Optional[int] = None,
+                  ef_search: Optional[int] = None, index_type: Optional[str] = None) -> List[ChunkHit]:
+    """
+    Ricerca ibrida: fonde i risultati FAISS e full-text e restituisce i migliori ``top_k``.
+
+    L'ordine è quello della fusione; lo score di ogni risultato resta la similarità
+    coseno con la query (calcolata anche per i chunk trovati solo lessicalmente),
+    così le soglie di similarità esistenti mantengono il loro significato.
+
+    Args:
+        embedding_manager (EmbeddingManager): Manager degli embeddings
+        query (str): Query di ricerca
+        document_ids (List[int]): Documenti in cui cercare
+        top_k (int): Numero di risultati da restituire
+        scope (str): Scope dell'indice persistente (None per la ricerca esatta sui soli document_ids)
+        nprobe (int): Liste visitate negli indici IVF
+        ef_search (int): Ampiezza di ricerca negli indici HNSW
+        index_type (str): Tipo di indice dello scope (None per mantenere quello attuale)
+
+    Returns:
+        List[ChunkHit]: Lista di (chunk_text, score, document_id, chunk_index)
+    """
+    candidates = top_k * CANDIDATES_PER_RESULT
+    vector_hits = embedding_manager.search_similar_chunks(
+        query, document_ids, top_k=candidates, scope=scope, nprobe=nprobe, ef_search=ef_search,
+        index_type=index_type
+    )
+
+    try:
+        lexical_hits = lexical_search(query, document_ids, candidates)
+    except Exception as e:
+        logger.warning(f"Ricerca full-text non disponibile, uso solo la ricerca vettoriale: {str(e)}")
+        lexical_hits = []
+
+    if not lexical_hits:
+        return vector_hits[:top_k]
+
+    vector_by_key = {(hit.document_id, hit.chunk_index): hit for hit in vector_hits}
+    lexical_texts = {(doc_id, chunk_idx): text for doc_id, chunk_idx, text in lexical_hits}
+
+    fused = reciprocal_rank_fusion([
+        list(vector_by_key),
+        list(lexical_texts),
+    ])[:top_k]
+
+    lexical_only = [key for key, _ in fused if key not in vector_by_key]
+    lexical_scores = embedding_manager.score_chunks(query, lexical_only) if lexical_only else {}
+
+    results = []
+    for key, _ in fused:
+        hit = vector_by_key.get(key)
+        if hit is None:
+            hit = ChunkHit(lexical_texts[key], lexical_scores.get(key, 0.0), key[0], key[1])
+        results.append(hit)
+
+    logger.info(
+        f"Ricerca ibrida: {len(vector_hits)} risultati vettoriali, {len(lexical_hits)} lessicali, "
+        f"{len(results)} dopo la fusione"
+    )
+    return results
@@ -0,0 +1,100 @@
+"""
+Persistenza dell'ingestione dei documenti.
+
+I chunk di un documento vengono sostituiti in un'unica transazione con INSERT a blocchi
+(``bulk_create`` con ``batch_size``): chi legge vede i chunk precedenti fino al commit e
+un errore a metà non lascia chunk parziali. I log di processamento vengono accumulati in
+memoria e scritti con un solo INSERT per gruppo di step, invece di una riga in autocommit
+per ogni step.
+"""
+import logging
+from itertools import islice
+from typing import Any, Dict, Iterable
+
+from django.conf import settings
+from django.db import transaction
+
+from .hybrid_search import update_search_vectors
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessingLogBuffer:
+    """
+    Buffer dei log di processamento di un documento.
+
+    Args:
+        document (RAGDocument): Documento a cui si riferiscono i log
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self._entries = []
+
+    def add(self, level: str, message: str, step: str = '', extra_data: Dict[str, Any] = None):
+        """
+        Accoda un log (scritto al prossimo ``flush``).
+
+        Args:
+            level (str): Livello del log ('debug', 'info', 'warning', 'error')
+            message (str): Messaggio del log
+            step (str): Step del processamento
+            extra_data (Dict): Dati aggiuntivi
+        """
+        from ..models import RAGProcessingLog
+        self._entries.append(RAGProcessingLog(
+            document=self.document,
+            level=level,
+            message=message,
+            step=step,
+            extra_data=extra_data or {}
+        ))
+
+    def flush(self):
+        """
+        Scrive i log accodati con un solo INSERT. Un errore non interrompe il processamento.
+        """
+        if not self._entries:
+            return
+        from ..models import RAGProcessingLog
+        try:
+            RAGProcessingLog.objects.bulk_create(self._entries)
+        except Exception as e:
+            logger.error(f"Errore nella scrittura dei log di processamento: {str(e)}")
+        finally:
+            self._entries = []
+
+
+def replace_document_chunks(document, chunks: Iterable) -> int:
+    """
+    Sostituisce i chunk di un documento in un'unica transazione.
+
+    Elimina i chunk esistenti, inserisce i nuovi a blocchi di RAG_DB_BULK_BATCH_SIZE righe
+    e aggiorna l'indice full-text. Se chiamata dentro un ``transaction.atomic`` esterno,
+    il commit avviene con quello. I chunk possono essere un generatore: ne viene
+    materializzato un blocco alla volta.
+
+    Args:
+        document (RAGDocument): Documento
+        chunks (Iterable[RAGChunk]): Chunk non ancora salvati, in ordine di chunk_index
+
+    Returns:
+        int: Numero di chunk inseriti
+    """
+    from ..models import RAGChunk
+    batch_size = getattr(settings, 'RAG_DB_BULK_BATCH_SIZE', 1000)
+
+    inserted = 0
+    chunks = iter(chunks)
+    with transaction.atomic():
+        RAGChunk.objects.filter(document=document).delete()
+        while True:
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                break
+            RAGChunk.objects.bulk_create(batch)
+            inserted += len(batch)
+        # Indice full-text per la ricerca ibrida (una sola UPDATE per documento)
+        update_search_vectors(document.id)
+
+    return inserted
@@ -0,0 +1,197 @@
+"""
+Estrazione del testo parallela per pagine.
+
+Il parsing dei PDF con PyPDF2 è Python puro e non sfrutta più core: le pagine vengono
+quindi divise in intervalli ed estratte da un pool di processi, ognuno con il proprio
+``PdfReader``. L'OCR invece lancia già un processo ``tesseract`` per ogni immagine, per
+cui basta un pool di thread per elaborare più pagine (frame) in parallelo.
+
+I risultati vengono restituiti sempre nell'ordine delle pagine, con un numero limitato
+di intervalli in volo, così l'estrazione resta compatibile con la pipeline a stream.
+
+Il pool di processi è creato una volta per processo e riusato tra i documenti, così il
+costo di avvio dei worker (start method ``spawn``, sicuro anche con thread attivi) non
+si ripete. È un pool di ``billiard``, il fork di multiprocessing usato da Celery: a
+differenza di multiprocessing consente di creare processi anche dai figli daemon dei
+worker prefork, dove gira l'ingestione dei documenti. Nei worker il pool viene chiuso
+dal segnale ``worker_process_shutdown`` (vedi service_config.celery).
+"""
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+import billiard
+import PyPDF2
+from billiard.exceptions import WorkerLostError
+import pytesseract
+from PIL import Image, ImageSequence
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Lingue usate per l'OCR
+OCR_LANGUAGES = 'ita+eng'
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _max_workers() -> int:
+    configured = getattr(settings, 'RAG_EXTRACTION_MAX_WORKERS', 0)
+    return configured if configured > 0 else min(4, os.cpu_count() or 1)
+
+
+def _pages_per_task() -> int:
+    return max(1, getattr(settings, 'RAG_EXTRACTION_PAGES_PER_TASK', 16))
+
+
+class ProcessPool(Executor):
+    """
+    Pool di processi ``billiard`` con l'interfaccia di ``concurrent.futures.Executor``.
+    """
+
+    def __init__(self, max_workers: int):
+        self._pool = billiard.get_context('spawn').Pool(processes=max_workers)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        # I task inviati al pool non sono più annullabili
+        future.set_running_or_notify_cancel()
+        self._pool.apply_async(
+            fn, args, kwargs,
+            callback=future.set_result,
+            # billiard passa un ExceptionInfo con l'eccezione originale
+            error_callback=lambda info: future.set_exception(getattr(info, 'exception', info))
+        )
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if wait and not cancel_futures:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+
+
+def get_process_pool() -> ProcessPool:
+    """
+    Restituisce il pool di processi condiviso per l'estrazione (creato alla prima richiesta).
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPool(max_workers=_max_workers())
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """
+    Termina il pool di processi (se esiste); verrà ricreato alla prossima estrazione.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """
+    Estrae il testo delle pagine [start, end) di un PDF (eseguita nei processi del pool).
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[page_num].extract_text() for page_num in range(start, end)]
+
+
+def _ordered_results(executor: Executor, tasks: Iterator[Tuple], window: int) -> Iterator[object]:
+    """
+    Esegue i task (funzione, *argomenti) sull'executor restituendo i risultati in ordine,
+    con al più ``window`` task in volo.
+    """
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(executor.submit(task[0], *task[1:]))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def count_pdf_pages(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[str]:
+    """
+    Estrae il testo di un PDF pagina per pagina, parallelizzando su più processi.
+
+    I PDF con poche pagine vengono estratti direttamente nel processo corrente,
+    dove il costo di avvio del pool non sarebbe ripagato.
+
+    Args:
+        file_path (str): Percorso del file PDF
+
+    Yields:
+        str: Testo di una pagina, nell'ordine del documento
+    """
+    num_pages = count_pdf_pages(file_path)
+    pages_per_task = _pages_per_task()
+    max_workers = min(_max_workers(), -(-num_pages // pages_per_task))
+
+    if max_workers <= 1:
+        with open(file_path, 'rb') as file:
+            for page in PyPDF2.PdfReader(file).pages:
+                yield page.extract_text()
+        return
+
+    tasks = (
+        (_extract_pdf_page_range, file_path, start, min(start + pages_per_task, num_pages))
+        for start in range(0, num_pages, pages_per_task)
+    )
+
+    logger.info(f"Estrazione PDF parallela: {num_pages} pagine, {max_workers} processi")
+    try:
+        for pages in _ordered_results(get_process_pool(), tasks, window=max_workers * 2):
+            yield from pages
+    except WorkerLostError:
+        # Un worker è terminato in modo anomalo: il pool verrà ricreato alla prossima estrazione
+        shutdown_process_pool()
+        raise
+
+
+def _ocr_image(image: Image.Image) -> str:
+    return pytesseract.image_to_string(image, lang=OCR_LANGUAGES)
+
+
+def iter_image_pages(file_path: str) -> Iterator[str]:
+    """
+    Esegue l'OCR di un'immagine, in parallelo sui frame delle immagini multi-pagina (es. TIFF).
+
+    Args:
+        file_path (str): Percorso del file immagine
+
+    Yields:
+        str: Testo di una pagina (frame), nell'ordine del documento
+    """
+    with Image.open(file_path) as image:
+        num_frames = getattr(image, 'n_frames', 1)
+        if num_frames <= 1:
+            yield _ocr_image(image)
+            return
+
+        max_workers = min(_max_workers(), num_frames)
+        logger.info(f"OCR parallelo: {num_frames} pagine, {max_workers} worker")
+
+        # Ogni chiamata a pytesseract è un processo tesseract separato: bastano i thread
+        tasks = ((_ocr_image, frame.copy()) for frame in ImageSequence.Iterator(image))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rag-ocr') as executor:
+            yield from _ordered_results(executor, tasks, window=max_workers * 2)
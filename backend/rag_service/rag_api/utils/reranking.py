@@ -0,0 +1,125 @@
+"""
+Riordinamento (rerank) dei chunk recuperati con un cross-encoder locale.
+
+La ricerca vettoriale/ibrida recupera un numero più ampio di candidati a basso costo;
+il cross-encoder di sentence-transformers valuta ogni coppia (domanda, chunk) insieme,
+in un'unica chiamata a blocchi, e si tengono solo i top_k migliori. Contesti più piccoli
+e più pertinenti riducono i token del prompt.
+
+Il rerank è configurabile per knowledge base (RAGKnowledgeBase.rerank_*) con i default
+nelle impostazioni RAG_RERANK_*; se il modello non è disponibile si usano i primi
+top_k candidati nell'ordine originale.
+"""
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+
+from .embedding_utils import ChunkHit
+from .tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class RerankConfig(NamedTuple):
+    """
+    Configurazione del rerank per una richiesta.
+    """
+    enabled: bool
+    model_name: str
+    candidates: int
+
+
+def resolve_rerank_config(knowledge_base=None, enabled: Optional[bool] = None,
+                          candidates: Optional[int] = None) -> RerankConfig:
+    """
+    Combina i parametri della richiesta, la configurazione della knowledge base e i default.
+
+    Args:
+        knowledge_base (RAGKnowledgeBase): Knowledge base interrogata (opzionale)
+        enabled (bool): Attiva/disattiva il rerank per questa richiesta (None = configurazione)
+        candidates (int): Candidati da recuperare prima del rerank (None = configurazione)
+
+    Returns:
+        RerankConfig: Configurazione effettiva
+    """
+    if enabled is None:
+        if knowledge_base is not None and knowledge_base.rerank_enabled is not None:
+            enabled = knowledge_base.rerank_enabled
+        else:
+            enabled = getattr(settings, 'RAG_RERANK_ENABLED', False)
+
+    model_name = (knowledge_base.rerank_model if knowledge_base is not None else '') or \
+        getattr(settings, 'RAG_RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+
+    if candidates is None and knowledge_base is not None:
+        candidates = knowledge_base.rerank_candidates
+    if candidates is None:
+        candidates = getattr(settings, 'RAG_RERANK_CANDIDATES', 20)
+
+    return RerankConfig(bool(enabled), model_name, candidates)
+
+
+class CrossEncoderReranker:
+    """
+    Cross-encoder di sentence-transformers caricato al primo utilizzo.
+
+    Args:
+        model_name (str): Nome o percorso del modello cross-encoder
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Caricamento cross-encoder per il rerank: {self.model_name}")
+                    self._model = CrossEncoder(
+                        self.model_name, max_length=getattr(settings, 'RAG_RERANK_MAX_LENGTH', 512)
+                    )
+        return self._model
+
+    @traced('rerank')
+    def rerank(self, query: str, hits: List[ChunkHit], top_k: int) -> List[ChunkHit]:
+        """
+        Ordina i chunk per pertinenza rispetto alla query e tiene i primi top_k.
+
+        Args:
+            query (str): Domanda dell'utente
+            hits (List[ChunkHit]): Candidati recuperati
+            top_k (int): Numero di chunk da restituire
+
+        Returns:
+            List[ChunkHit]: Chunk riordinati, con il punteggio del cross-encoder
+        """
+        if not hits:
+            return []
+
+        scores = self._get_model().predict(
+            [(query, hit.text) for hit in hits],
+            batch_size=getattr(settings, 'RAG_RERANK_BATCH_SIZE', 32),
+            show_progress_bar=False
+        )
+        ranked = sorted(zip(hits, scores), key=lambda pair: pair[1], reverse=True)
+        return [hit._replace(score=float(score)) for hit, score in ranked[:top_k]]
+
+
+_rerankers: Dict[str, CrossEncoderReranker] = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name: str) -> CrossEncoderReranker:
+    """
+    Restituisce il reranker per il modello indicato (singleton per modello).
+    """
+    with _rerankers_lock:
+        reranker = _rerankers.get(model_name)
+        if reranker is None:
+            reranker = _rerankers[model_name] = CrossEncoderReranker(model_name)
+        return reranker
@@ -0,0 +1,116 @@
+"""
+Lettura della cache condivisa dei testi estratti del Resource Manager.
+
+Il Resource Manager estrae il testo di ogni file caricato e lo salva in una cache
+indirizzata per SHA-256 del contenuto. Per i documenti importati da una risorsa, il
+servizio RAG calcola l'hash del file ricevuto e riusa quei segmenti invece di
+ri-estrarre il file; se la cache non risponde si estrae localmente come prima.
+
+I segmenti sono riusati solo se estratti con la stessa versione della libreria PDF
+installata qui (``pdf_extractor``), così il testo non cambia a seconda del servizio
+che ha visto il file per primo.
+
+La voce arriva in JSON-lines (intestazione, poi un segmento per riga) e viene letta in
+streaming: i segmenti entrano nella pipeline di ingestione man mano che arrivano, senza
+tenere in memoria l'intero testo del documento.
+"""
+import json
+import hashlib
+import logging
+from typing import Iterator, Optional
+
+import PyPDF2
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Versione del formato dei segmenti concordata con il Resource Manager
+EXTRACTION_FORMAT_VERSION = 3
+
+# Libreria (e versione) con cui vengono estratti i PDF, come nel Resource Manager
+PDF_EXTRACTOR = f"PyPDF2/{PyPDF2.__version__}"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Byte letti per volta dalla risposta in streaming dei segmenti
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def compute_file_sha256(file_path: str) -> str:
+    """
+    Calcola lo SHA-256 di un file leggendolo a blocchi.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_response_segments(response, lines: Iterator[bytes]) -> Iterator[str]:
+    """
+    Segmenti della risposta in streaming, uno per riga; chiude la risposta alla fine.
+    """
+    try:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise Exception(f"Lettura interrotta dei segmenti dalla cache di estrazione condivisa: {str(e)}")
+    finally:
+        response.close()
+
+
+def fetch_cached_segments(content_hash: str) -> Optional[Iterator[str]]:
+    """
+    Recupera dal Resource Manager, in streaming, i segmenti di testo già estratti per il
+    contenuto indicato.
+
+    L'intestazione viene letta e verificata subito; i segmenti vengono letti dalla rete
+    solo mentre l'iteratore viene consumato.
+
+    Args:
+        content_hash (str): SHA-256 del contenuto del file
+
+    Returns:
+        Optional[Iterator[str]]: Segmenti di testo, o None se non disponibili
+    """
+    base_url = getattr(settings, 'RESOURCE_MANAGER_INTERNAL_URL', None)
+    if not base_url:
+        return None
+
+    headers = {}
+    secret = getattr(settings, 'INTERNAL_API_SECRET_VALUE', None)
+    if secret:
+        headers[settings.INTERNAL_API_SECRET_HEADER_NAME] = secret
+
+    response = None
+    try:
+        response = requests.get(
+            f"{base_url}/api/internal/extractions/{content_hash}/",
+            headers=headers,
+            stream=True,
+            timeout=getattr(settings, 'RAG_SHARED_EXTRACTION_TIMEOUT', 10)
+        )
+        if response.status_code == 404:
+            response.close()
+            return None
+        response.raise_for_status()
+        lines = response.iter_lines(chunk_size=STREAM_CHUNK_SIZE)
+        header = json.loads(next(lines, b'') or b'null')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Cache di estrazione condivisa non disponibile: {str(e)}")
+        if response is not None:
+            response.close()
+        return None
+
+    if not isinstance(header, dict) or header.get('format_version') != EXTRACTION_FORMAT_VERSION \
+            or header.get('sha256') != content_hash:
+        response.close()
+        return None
+    if header.get('pdf_extractor') != PDF_EXTRACTOR:
+        logger.info(f"Segmenti in cache estratti con {header.get('pdf_extractor')}, locale {PDF_EXTRACTOR}: ri-estrazione")
+        response.close()
+        return None
+    return _iter_response_segments(response, lines)
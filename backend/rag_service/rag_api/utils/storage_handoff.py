@@ -0,0 +1,109 @@
+"""
+Passaggio locale dei file delle risorse dal Resource Manager.
+
+Quando lo storage del Resource Manager è montato in sola lettura anche qui
+(RESOURCE_MANAGER_SHARED_STORAGE_ROOT), il file di una risorsa non viene né scaricato
+via HTTP né copiato: il documento RAG punta direttamente al file nel volume condiviso.
+Lo SHA-256 fornito dal Resource Manager viene salvato sul documento e riusato per la
+cache di estrazione, senza rileggere il file; per qualsiasi problema il chiamante
+ripiega sull'HTTP.
+"""
+import logging
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+from django.conf import settings
+
+from .shared_extraction import compute_file_sha256
+
+logger = logging.getLogger(__name__)
+
+
+class SharedFile(NamedTuple):
+    """
+    File di una risorsa letto sul posto dal volume condiviso.
+    """
+    path: str
+    size: int
+    sha256: str     # SHA-256 indicato dal Resource Manager (vuoto se assente)
+
+
+def get_shared_storage_root() -> Optional[Path]:
+    """
+    Radice del volume condiviso del Resource Manager (None se il passaggio locale è disattivato).
+    """
+    root = getattr(settings, 'RESOURCE_MANAGER_SHARED_STORAGE_ROOT', '')
+    if not root:
+        return None
+    root = Path(root)
+    return root if root.is_dir() else None
+
+
+def resolve_shared_path(storage_path: str) -> Optional[Path]:
+    """
+    Risolve un percorso relativo allo storage del Resource Manager nel volume condiviso.
+
+    Args:
+        storage_path (str): Percorso relativo (FileField.name) restituito dal Resource Manager
+
+    Returns:
+        Optional[Path]: Percorso assoluto del file, o None se non valido o non presente
+    """
+    root = get_shared_storage_root()
+    if root is None or not storage_path:
+        return None
+
+    root = root.resolve()
+    source = (root / storage_path).resolve()
+    # Il percorso arriva da un altro servizio: non deve uscire dal volume condiviso
+    if root not in source.parents or not source.is_file():
+        return None
+    return source
+
+
+def is_shared_path(file_path: str) -> bool:
+    """
+    Indica se il percorso è nel volume condiviso (file del Resource Manager, da non modificare).
+    """
+    root = get_shared_storage_root()
+    if root is None or not file_path:
+        return False
+    return root.resolve() in Path(file_path).resolve().parents
+
+
+def open_shared_file(handoff: Dict) -> Optional[SharedFile]:
+    """
+    Individua nel volume condiviso il file di una risorsa, da usare sul posto.
+
+    Args:
+        handoff (Dict): Dati di passaggio del Resource Manager (storage_path, sha256, size)
+
+    Returns:
+        Optional[SharedFile]: File nel volume condiviso, o None per ripiegare sull'HTTP
+    """
+    if not handoff:
+        return None
+
+    source = resolve_shared_path(handoff.get('storage_path'))
+    if source is None:
+        return None
+
+    try:
+        size = source.stat().st_size
+        expected_size = handoff.get('size')
+        if expected_size is not None and size != expected_size:
+            logger.warning(f"Dimensione di {handoff.get('storage_path')} diversa da quella attesa "
+                           f"({size} != {expected_size}), uso il download HTTP")
+            return None
+
+        sha256 = handoff.get('sha256') or ''
+        if sha256 and getattr(settings, 'RAG_SHARED_STORAGE_VERIFY_CHECKSUM', False):
+            if compute_file_sha256(str(source)) != sha256:
+                logger.warning(f"Checksum di {handoff.get('storage_path')} non corrispondente, uso il download HTTP")
+                return None
+    except OSError as e:
+        logger.warning(f"Passaggio locale di {handoff.get('storage_path')} non riuscito: {str(e)}")
+        return None
+
+    logger.info(f"File {handoff.get('storage_path')} letto dal volume condiviso ({size} byte)")
+    return SharedFile(str(source), size, sha256)
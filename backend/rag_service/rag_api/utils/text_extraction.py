@@ -4,17 +4,20 @@ Utility per l'estrazione del testo da diversi formati di documenti.
 import os
 import logging
 import magic
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Iterator
 from pathlib import Path
 from django.conf import settings
-import PyPDF2
 import docx
 import pandas as pd
-from PIL import Image
-import pytesseract
+
+from . import parallel_extraction
+from .chunking import TextChunker
 
 logger = logging.getLogger(__name__)
 
+# Dimensione dei blocchi letti dai file di testo in streaming
+TEXT_STREAM_BLOCK_SIZE = 64 * 1024
+
 class TextExtractor:
     """
     Classe per estrarre testo da diversi formati di documenti.
@@ -37,8 +40,6 @@ class TextExtractor:
         """
         Inizializza l'estrattore di testo.
         """
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
     
     def detect_file_type(self, file_path: str) -> str:
         """
@@ -97,21 +98,27 @@ class TextExtractor:
             str: Testo estratto
         """
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text()
-                
-                logger.info(f"Estratto testo da PDF: {len(text)} caratteri")
-                return text.strip()
+            text = "".join(self.iter_pdf_pages(file_path))
+            
+            logger.info(f"Estratto testo da PDF: {len(text)} caratteri")
+            return text.strip()
                 
         except Exception as e:
             logger.error(f"Errore nell'estrazione da PDF {file_path}: {str(e)}")
             raise Exception(f"Errore nell'estrazione da PDF: {str(e)}")
     
+    def iter_pdf_pages(self, file_path: str) -> Iterator[str]:
+        """
+        Estrae il testo di un PDF una pagina alla volta (pagine estratte in parallelo).
+        
+        Args:
+            file_path (str): Percorso del file PDF
+            
+        Yields:
+            str: Testo di una pagina
+        """
+        yield from parallel_extraction.iter_pdf_pages(file_path)
+    
     def extract_text_from_docx(self, file_path: str) -> str:
         """
         Estrae testo da file DOCX.
@@ -123,18 +130,7 @@ class TextExtractor:
             str: Testo estratto
         """
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            # Estrai anche il testo dalle tabelle
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        text += cell.text + " "
-                    text += "\n"
+            text = "".join(self.iter_docx_blocks(file_path))
             
             logger.info(f"Estratto testo da DOCX: {len(text)} caratteri")
             return text.strip()
@@ -143,6 +139,57 @@ class TextExtractor:
             logger.error(f"Errore nell'estrazione da DOCX {file_path}: {str(e)}")
             raise Exception(f"Errore nell'estrazione da DOCX: {str(e)}")
     
+    def iter_docx_blocks(self, file_path: str) -> Iterator[str]:
+        """
+        Estrae il testo di un DOCX un paragrafo (o una riga di tabella) alla volta.
+        
+        Args:
+            file_path (str): Percorso del file DOCX
+            
+        Yields:
+            str: Testo di un paragrafo o di una riga di tabella
+        """
+        doc = docx.Document(file_path)
+        
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n"
+        
+        # Estrai anche il testo dalle tabelle
+        for table in doc.tables:
+            for row in table.rows:
+                yield "".join(cell.text + " " for cell in row.cells) + "\n"
+    
+    def _detect_text_encoding(self, file_path: str) -> str:
+        """
+        Individua l'encoding di un file di testo senza caricarlo in memoria.
+        """
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                while file.read(TEXT_STREAM_BLOCK_SIZE):
+                    pass
+            return 'utf-8'
+        except UnicodeDecodeError:
+            # latin-1 decodifica qualsiasi sequenza di byte
+            return 'latin-1'
+    
+    def iter_txt_blocks(self, file_path: str) -> Iterator[str]:
+        """
+        Legge un file di testo a blocchi.
+        
+        Args:
+            file_path (str): Percorso del file TXT
+            
+        Yields:
+            str: Blocco di testo
+        """
+        encoding = self._detect_text_encoding(file_path)
+        with open(file_path, 'r', encoding=encoding) as file:
+            while True:
+                block = file.read(TEXT_STREAM_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+    
     def extract_text_from_txt(self, file_path: str) -> str:
         """
         Estrae testo da file TXT.
@@ -187,8 +234,7 @@ class TextExtractor:
             str: Testo estratto
         """
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image, lang='ita+eng')
+            text = "".join(parallel_extraction.iter_image_pages(file_path))
             
             logger.info(f"Estratto testo da immagine: {len(text)} caratteri")
             return text.strip()
@@ -266,62 +312,64 @@ class TextExtractor:
             logger.error(f"Errore nell'estrazione del testo da {file_path}: {str(e)}")
             raise
     
-    def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+    def iter_text(self, file_path: str) -> Iterator[str]:
         """
-        Divide il testo in chunk di dimensione specifica con overlap.
+        Estrae il testo dal file come stream di segmenti (pagine, paragrafi, blocchi).
+        
+        Concatenando i segmenti si ottiene lo stesso testo di ``extract_text``
+        (a meno degli spazi iniziali e finali). Per immagini e fogli di calcolo
+        il testo è prodotto in un unico segmento.
         
         Args:
-            text (str): Testo da dividere
-            chunk_size (int): Dimensione del chunk (default: self.chunk_size)
-            overlap (int): Sovrapposizione tra chunk (default: self.chunk_overlap)
+            file_path (str): Percorso del file
             
-        Returns:
-            List[str]: Lista di chunk di testo
+        Yields:
+            str: Segmento di testo
+            
+        Raises:
+            Exception: Se il formato non è supportato o si verifica un errore
         """
-        if chunk_size is None:
-            chunk_size = self.chunk_size
-        if overlap is None:
-            overlap = self.chunk_overlap
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File non trovato: {file_path}")
         
-        if len(text) <= chunk_size:
-            return [text]
+        mime_type = self.detect_file_type(file_path)
         
-        chunks = []
-        start = 0
+        if mime_type not in self.SUPPORTED_FORMATS:
+            raise Exception(f"Formato file non supportato: {mime_type}")
         
-        while start < len(text):
-            end = start + chunk_size
-            
-            if end < len(text):
-                # Cerca il punto di divisione migliore (fine di frase o paragrafo)
-                chunk = text[start:end]
-                
-                # Trova l'ultimo punto, new line o spazio
-                last_sentence = max(
-                    chunk.rfind('.'),
-                    chunk.rfind('\n'),
-                    chunk.rfind('!'),
-                    chunk.rfind('?')
-                )
-                
-                if last_sentence > chunk_size * 0.5:  # Solo se non troppo piccolo
-                    chunk = text[start:start + last_sentence + 1]
-                    end = start + last_sentence + 1
-                else:
-                    # Trova l'ultimo spazio
-                    last_space = chunk.rfind(' ')
-                    if last_space > chunk_size * 0.5:
-                        chunk = text[start:start + last_space]
-                        end = start + last_space
+        format_type = self.SUPPORTED_FORMATS[mime_type]
+        
+        try:
+            if format_type == 'pdf':
+                yield from self.iter_pdf_pages(file_path)
+            elif format_type == 'docx':
+                yield from self.iter_docx_blocks(file_path)
+            elif format_type == 'txt':
+                yield from self.iter_txt_blocks(file_path)
+            elif format_type == 'image':
+                yield from parallel_extraction.iter_image_pages(file_path)
+            elif format_type in ['xlsx', 'xls']:
+                yield self.extract_text_from_excel(file_path)
             else:
-                chunk = text[start:]
-            
-            chunks.append(chunk.strip())
-            
-            if end >= len(text):
-                break
+                raise Exception(f"Handler non implementato per il formato: {format_type}")
                 
-            start = end - overlap
+        except Exception as e:
+            logger.error(f"Errore nell'estrazione del testo da {file_path}: {str(e)}")
+            raise
+    
+    def chunk_text(self, text: str, max_tokens: int = None, overlap_tokens: int = None) -> List[str]:
+        """
+        Divide il testo in chunk di token con overlap (vedi utils.chunking.TextChunker).
+        
+        Args:
+            text (str): Testo da dividere
+            max_tokens (int): Token massimi per chunk (default: RAG_CHUNK_MAX_TOKENS)
+            overlap_tokens (int): Sovrapposizione tra chunk in token (default: RAG_CHUNK_OVERLAP_TOKENS)
+            
+        Returns:
+            List[str]: Lista di chunk di testo
+        """
+        chunks = [chunk.text for chunk in TextChunker(max_tokens, overlap_tokens).chunk(text)]
         
         logger.info(f"Testo diviso in {len(chunks)} chunk")
         return chunks
@@ -353,13 +401,8 @@ def extract_from_pdf(file_path: str) -> str:
     """
     Estrae il testo da un file PDF.
     """
-    text = ""
     try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+        return "".join(page + "\n" for page in parallel_extraction.iter_pdf_pages(file_path))
     except Exception as e:
         logger.error(f"Errore nell'estrazione del testo dal PDF {file_path}: {str(e)}")
         raise
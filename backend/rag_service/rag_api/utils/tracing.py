@@ -0,0 +1,225 @@
+"""
+Tracing per fasi delle richieste RAG e metriche Prometheus.
+
+Ogni operazione (una richiesta di chat, un task di processamento) apre una traccia con
+``start_trace``; il codice strumentato misura le proprie fasi con ``span``. Ogni span:
+- viene osservato nell'istogramma ``rag_stage_duration_seconds{stage}``;
+- se c'è una traccia attiva (contextvar) vi viene registrato, per restituire il dettaglio
+  dei tempi nella risposta (``debug``) o nei log di processamento.
+
+La traccia non passa automaticamente ai thread di un executor: per propagarla si
+sottomette il lavoro con ``contextvars.copy_context().run``.
+
+Le metriche usano prometheus_client se installato (altrimenti sono disattivate). Con più
+processi (gunicorn con più worker, Celery prefork) va impostata la variabile d'ambiente
+PROMETHEUS_MULTIPROC_DIR su una directory condivisa tra i processi.
+"""
+import os
+import time
+import functools
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Histogram
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    prometheus_client = None
+
+# Bucket (secondi) da pochi millisecondi (ricerca su indice) a minuti (ingestione di documenti grandi)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0, 120.0, 300.0)
+
+if prometheus_client is not None:
+    STAGE_DURATION = Histogram(
+        'rag_stage_duration_seconds', 'Durata delle fasi delle operazioni RAG',
+        ['stage'], buckets=DURATION_BUCKETS
+    )
+    OPERATION_DURATION = Histogram(
+        'rag_operation_duration_seconds', 'Durata complessiva delle operazioni RAG (richieste e task)',
+        ['operation', 'outcome'], buckets=DURATION_BUCKETS
+    )
+else:
+    STAGE_DURATION = OPERATION_DURATION = None
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('rag_trace', default=None)
+
+
+class Trace:
+    """
+    Fasi misurate durante un'operazione, in ordine di chiusura.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.failed = False
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, duration: float):
+        with self._lock:
+            self.spans.append({
+                'stage': stage,
+                'start': round(start - self.started, 6),
+                'duration': round(duration, 6),
+            })
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished or time.perf_counter()
+        with self._lock:
+            # Le fasi di una risposta in streaming terminano dopo la chiusura della traccia
+            last_span = max((item['start'] + item['duration'] for item in self.spans), default=0.0)
+        return max(end - self.started, last_span)
+
+    def stage_totals(self) -> Dict[str, Dict[str, float]]:
+        """
+        Tempo totale e numero di chiamate per fase.
+        """
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for item in self.spans:
+                stage = totals.setdefault(item['stage'], {'seconds': 0.0, 'calls': 0})
+                stage['seconds'] += item['duration']
+                stage['calls'] += 1
+        for stage in totals.values():
+            stage['seconds'] = round(stage['seconds'], 6)
+        return totals
+
+    def breakdown(self) -> Dict[str, Any]:
+        """
+        Dettaglio dei tempi da restituire nella risposta.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item['start'])
+        return {
+            'operation': self.operation,
+            'total_seconds': round(self.elapsed, 6),
+            'stages': self.stage_totals(),
+            'spans': spans,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def record_stage(stage: str, duration: float, start: Optional[float] = None, trace: Optional[Trace] = None):
+    """
+    Registra una fase già misurata (es. tempo accumulato su più iterazioni).
+    """
+    if STAGE_DURATION is not None:
+        STAGE_DURATION.labels(stage).observe(duration)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.add(stage, start if start is not None else time.perf_counter() - duration, duration)
+
+
+@contextmanager
+def span(stage: str, trace: Optional[Trace] = None) -> Iterator[None]:
+    """
+    Misura una fase.
+
+    Args:
+        stage (str): Nome della fase (etichetta ``stage`` dell'istogramma)
+        trace (Trace): Traccia a cui aggiungerla (default: quella attiva)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, start=start, trace=trace)
+
+
+def traced(stage: str):
+    """
+    Decoratore che misura ogni chiamata della funzione come fase ``stage``.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def start_trace(operation: str) -> Iterator[Trace]:
+    """
+    Apre una traccia per un'operazione e la rende attiva nel contesto corrente.
+
+    La durata complessiva viene osservata in ``rag_operation_duration_seconds`` con
+    l'esito: 'error' se l'operazione solleva un'eccezione o imposta ``trace.failed``.
+    Il nome dell'operazione può essere precisato durante la traccia (``trace.operation``).
+    """
+    trace = Trace(operation)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException:
+        trace.failed = True
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finished = time.perf_counter()
+        if OPERATION_DURATION is not None:
+            OPERATION_DURATION.labels(trace.operation, 'error' if trace.failed else 'ok').observe(trace.elapsed)
+
+
+def metrics_available() -> bool:
+    return prometheus_client is not None
+
+
+def _registry():
+    """
+    Registro da esportare: aggregato da tutti i processi in modalità multiprocess.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def render_metrics():
+    """
+    Metriche nel formato di esposizione di Prometheus.
+
+    Returns:
+        Tuple[bytes, str]: Contenuto e content type
+    """
+    return prometheus_client.generate_latest(_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int):
+    """
+    Espone le metriche su una porta HTTP dedicata (processi senza server web, es. worker Celery).
+    """
+    if prometheus_client is None:
+        logger.warning("prometheus_client non disponibile: metriche del worker disattivate")
+        return
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        logger.warning("PROMETHEUS_MULTIPROC_DIR non impostata: le metriche registrate nei processi "
+                       "figli del worker non verranno esportate")
+    prometheus_client.start_http_server(port, registry=_registry())
+    logger.info(f"Metriche Prometheus esposte sulla porta {port}")
+
+
+def mark_process_dead(pid: int):
+    """
+    Segnala l'uscita di un processo figlio in modalità multiprocess, così i suoi file
+    dei gauge live non vengono più letti.
+    """
+    if prometheus_client is None or not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(pid)
@@ -0,0 +1,607 @@
+"""
+Indici FAISS persistenti per scope (knowledge base o "tutti i documenti" di un utente).
+
+Ogni scope ha una directory sotto ``RAG_EMBEDDINGS_ROOT/indices`` con l'indice FAISS
+serializzato e un manifest JSON con i documenti indicizzati. Gli indici vengono
+aggiornati in modo incrementale (aggiunta/rimozione per documento) invece di essere
+ricostruiti ad ogni query, e vengono condivisi tra i processi tramite il disco.
+
+Oltre all'indice esatto (``flat``) sono disponibili indici approssimati (IVF-Flat,
+HNSW, IVF-PQ): finché lo scope ha meno di ``ann_min_vectors`` vettori si usa comunque
+l'indice esatto, oltre la soglia l'indice viene ricostruito e addestrato su un campione.
+"""
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# Gli ID FAISS codificano (document_id, chunk_index): fino a ~1M chunk per documento
+CHUNK_ID_BITS = 20
+CHUNK_INDEX_MASK = (1 << CHUNK_ID_BITS) - 1
+
+# Tipi di indice supportati
+INDEX_FLAT = 'flat'
+INDEX_IVF_FLAT = 'ivf_flat'
+INDEX_HNSW = 'hnsw'
+INDEX_IVF_PQ = 'ivf_pq'
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF_FLAT, INDEX_HNSW, INDEX_IVF_PQ)
+IVF_INDEX_TYPES = (INDEX_IVF_FLAT, INDEX_IVF_PQ)
+
+# Parametri di costruzione degli indici approssimati
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_MAX_SUBQUANTIZERS = 64
+PQ_BITS = 8
+TRAIN_POINTS_PER_CENTROID = 64
+
+# Un indice IVF viene riaddestrato quando cresce oltre questo fattore rispetto al training
+IVF_RETRAIN_GROWTH = 4
+
+
+def encode_chunk_id(document_id: int, chunk_index: int) -> int:
+    """
+    Codifica la coppia (documento, chunk) in un ID FAISS a 64 bit.
+    """
+    return (int(document_id) << CHUNK_ID_BITS) | int(chunk_index)
+
+
+def decode_chunk_id(chunk_id: int) -> Tuple[int, int]:
+    """
+    Decodifica un ID FAISS nella coppia (document_id, chunk_index).
+    """
+    chunk_id = int(chunk_id)
+    return chunk_id >> CHUNK_ID_BITS, chunk_id & CHUNK_INDEX_MASK
+
+
+def _ivf_nlist(num_vectors: int) -> int:
+    """
+    Numero di liste IVF per il numero di vettori indicato (~4*sqrt(n)).
+    """
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39, 65536))
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """
+    Numero di sottoquantizzatori PQ: il più grande divisore della dimensione entro il limite.
+    """
+    for m in range(min(PQ_MAX_SUBQUANTIZERS, dimension), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def _pq_bits(num_vectors: int) -> int:
+    """
+    Bit per codice PQ: ogni sottoquantizzatore ha 2**bits centroidi da addestrare,
+    quindi per scope piccoli (soglia ANN bassa) si riducono i centroidi ai vettori disponibili.
+    """
+    return max(1, min(PQ_BITS, int(math.log2(max(num_vectors, 2)))))
+
+
+def build_base_index(index_type: str, dimension: int, num_vectors: int):
+    """
+    Crea l'indice FAISS (non ancora addestrato) per il tipo richiesto.
+
+    Tutti gli indici usano il prodotto scalare: con vettori normalizzati equivale al coseno.
+    """
+    if index_type == INDEX_HNSW:
+        base = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return base
+
+    if index_type in IVF_INDEX_TYPES:
+        nlist = _ivf_nlist(num_vectors)
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == INDEX_IVF_PQ:
+            return faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, _pq_subquantizers(dimension), _pq_bits(num_vectors),
+                faiss.METRIC_INNER_PRODUCT
+            )
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+
+    return faiss.IndexFlatIP(dimension)
+
+
+class PersistentFaissIndex:
+    """
+    Indice FAISS di uno scope, salvato su disco e aggiornabile per documento.
+
+    ``index_type`` è il tipo richiesto per lo scope, ``built_type`` quello della
+    struttura effettivamente costruita (flat finché lo scope è sotto soglia).
+    ``skipped`` registra i documenti che non è stato possibile indicizzare, con la
+    generazione dei loro embeddings: non vengono ritentati finché questa non cambia.
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, directory: Path, ann_min_vectors: int = 10000,
+                 default_nprobe: int = 16, default_ef_search: int = 64):
+        self.directory = Path(directory)
+        self.index = None
+        self.dimension = None
+        self.documents: Dict[int, int] = {}  # document_id -> numero di chunk
+        self.skipped: Dict[int, str] = {}  # document_id -> generazione non indicizzabile
+        self.version = 0
+        self.index_filename = None
+        self.dirty = False
+        self.index_type = INDEX_FLAT
+        self.built_type = INDEX_FLAT
+        self.trained_ntotal = 0
+        self.stale = False  # vettori di documenti rimossi ancora presenti (HNSW)
+        self.ann_min_vectors = ann_min_vectors
+        self.default_nprobe = default_nprobe
+        self.default_ef_search = default_ef_search
+        self._search_lock = threading.Lock()
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / self.MANIFEST_NAME
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def document_ids(self) -> set:
+        return set(self.documents.keys())
+
+    @property
+    def live_count(self) -> int:
+        """
+        Numero di vettori dei documenti indicizzati (esclusi quelli rimossi ma non ancora compattati).
+        """
+        return sum(self.documents.values())
+
+    def _base_index(self):
+        if hasattr(self.index, 'id_map'):
+            return faiss.downcast_index(self.index.index)
+        return self.index
+
+    def manifest_signature(self) -> Optional[Tuple[int, int]]:
+        """
+        Restituisce (inode, mtime) del manifest, None se l'indice non esiste su disco.
+
+        Il manifest viene sempre sostituito con os.replace, quindi l'inode cambia
+        ad ogni salvataggio anche se il mtime ha una granularità grossolana.
+        """
+        try:
+            stat = self.manifest_path.stat()
+            return stat.st_ino, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self, mmap: bool = False) -> bool:
+        """
+        Carica indice e manifest dal disco.
+
+        Args:
+            mmap (bool): Apre il file dell'indice in memory-map (solo per la lettura):
+                i worker sullo stesso host ne condividono le pagine tramite la page cache
+                invece di tenerne ciascuno una copia. L'indice così caricato non va modificato.
+
+        Returns:
+            bool: True se l'indice esisteva ed è stato caricato
+        """
+        if not self.manifest_path.exists():
+            return False
+
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        if manifest['index_file'] is not None:
+            flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+            self.index = faiss.read_index(str(self.directory / manifest['index_file']), flags)
+        self.dimension = manifest['dimension']
+        self.documents = {int(doc_id): count for doc_id, count in manifest['documents'].items()}
+        self.skipped = {int(doc_id): generation for doc_id, generation in manifest.get('skipped', {}).items()}
+        self.version = manifest.get('version', 0)
+        self.index_filename = manifest['index_file']
+        self.index_type = manifest.get('index_type', INDEX_FLAT)
+        self.built_type = manifest.get('built_type', INDEX_FLAT)
+        self.trained_ntotal = manifest.get('trained_ntotal', 0)
+        self.stale = manifest.get('stale', False)
+        self.dirty = False
+        return True
+
+    def save(self):
+        """
+        Salva l'indice su disco in modo atomico.
+
+        L'indice viene scritto in un nuovo file versionato e solo dopo il manifest
+        viene sostituito, così i lettori concorrenti vedono sempre una coppia coerente.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.version += 1
+
+        old_index_filename = self.index_filename
+        if self.index is not None:
+            self.index_filename = f"index-{self.version}-{uuid.uuid4().hex[:8]}.faiss"
+            faiss.write_index(self.index, str(self.directory / self.index_filename))
+        else:
+            # Scope senza vettori (solo documenti non indicizzabili): basta il manifest
+            self.index_filename = None
+
+        manifest = {
+            'version': self.version,
+            'dimension': self.dimension,
+            'index_file': self.index_filename,
+            'ntotal': self.ntotal,
+            'index_type': self.index_type,
+            'built_type': self.built_type,
+            'trained_ntotal': self.trained_ntotal,
+            'stale': self.stale,
+            'documents': {str(doc_id): count for doc_id, count in self.documents.items()},
+            'skipped': {str(doc_id): generation for doc_id, generation in self.skipped.items()},
+        }
+        tmp_manifest = self.directory / f"{self.MANIFEST_NAME}.tmp"
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        if old_index_filename and old_index_filename != self.index_filename:
+            try:
+                (self.directory / old_index_filename).unlink()
+            except FileNotFoundError:
+                pass
+        self.dirty = False
+
+    def reset(self, dimension: int):
+        """
+        Svuota l'indice e lo reinizializza con la dimensione indicata.
+        """
+        self.dimension = dimension
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self.documents = {}
+        self.skipped = {}
+        self.built_type = INDEX_FLAT
+        self.trained_ntotal = 0
+        self.stale = False
+        self.dirty = True
+
+    def set_index_type(self, index_type: str):
+        """
+        Imposta il tipo di indice richiesto; la struttura viene ricostruita da ``rebuild``.
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Tipo di indice non supportato: {index_type}")
+        if index_type != self.index_type:
+            self.index_type = index_type
+            self.dirty = True
+
+    def needs_rebuild(self) -> bool:
+        """
+        Indica se la struttura dell'indice va ricostruita.
+
+        Succede quando ci sono vettori obsoleti non rimovibili (HNSW), quando lo scope
+        supera (o scende ben sotto) la soglia per gli indici approssimati, o quando un
+        indice IVF è cresciuto molto rispetto al campione su cui è stato addestrato.
+        """
+        if self.index is None:
+            return False
+        if self.stale:
+            return True
+
+        count = self.live_count
+        desired = self.index_type if count >= self.ann_min_vectors else INDEX_FLAT
+        if desired != self.built_type:
+            # Isteresi: non tornare all'indice esatto per piccole oscillazioni attorno alla soglia
+            if desired == INDEX_FLAT and self.index_type == self.built_type and count >= self.ann_min_vectors // 2:
+                return False
+            return True
+
+        if self.built_type in IVF_INDEX_TYPES and count > IVF_RETRAIN_GROWTH * self.trained_ntotal:
+            return True
+        return False
+
+    def rebuild(self, load_vectors: Callable[[int], np.ndarray]):
+        """
+        Ricostruisce l'indice dai vettori dei documenti, addestrandolo se necessario.
+
+        Args:
+            load_vectors (Callable): Funzione document_id -> embeddings del documento
+        """
+        doc_vectors = []
+        for document_id in sorted(self.documents):
+            try:
+                vectors = load_vectors(document_id)
+            except Exception as e:
+                logger.warning(f"Documento {document_id} escluso dalla ricostruzione di {self.directory.name}: {str(e)}")
+                continue
+            if vectors.ndim == 2 and vectors.shape[0] > 0 and vectors.shape[1] == self.dimension:
+                doc_vectors.append((document_id, vectors))
+
+        num_vectors = sum(vectors.shape[0] for _, vectors in doc_vectors)
+        target = self.index_type if num_vectors >= self.ann_min_vectors else INDEX_FLAT
+        base = build_base_index(target, self.dimension, num_vectors)
+
+        if not base.is_trained:
+            base.train(self._training_sample(doc_vectors, num_vectors, base))
+
+        # Gli IVF gestiscono gli ID nativamente (e li rimuovono correttamente),
+        # flat e HNSW passano da IndexIDMap2
+        self.index = base if target in IVF_INDEX_TYPES else faiss.IndexIDMap2(base)
+        self.documents = {}
+        for document_id, vectors in doc_vectors:
+            self._add_vectors(document_id, vectors)
+
+        self.built_type = target
+        self.trained_ntotal = num_vectors
+        self.stale = False
+        self.dirty = True
+        logger.info(f"Indice {self.directory.name} ricostruito come {target} con {num_vectors} vettori")
+
+    @staticmethod
+    def _training_sample(doc_vectors, num_vectors: int, base) -> np.ndarray:
+        """
+        Estrae un campione casuale di vettori per l'addestramento, senza copiare l'intero scope.
+        """
+        nlist = getattr(base, 'nlist', 1)
+        sample_size = min(num_vectors, max(nlist, 2 ** PQ_BITS) * TRAIN_POINTS_PER_CENTROID)
+        picks = np.sort(np.random.default_rng(0).choice(num_vectors, size=sample_size, replace=False))
+
+        parts = []
+        start = 0
+        for _, vectors in doc_vectors:
+            end = start + vectors.shape[0]
+            local = picks[(picks >= start) & (picks < end)] - start
+            if local.size:
+                parts.append(np.asarray(vectors[local], dtype=np.float32))
+            start = end
+
+        sample = np.ascontiguousarray(np.vstack(parts), dtype=np.float32)
+        faiss.normalize_L2(sample)
+        return sample
+
+    def add_document(self, document_id: int, embeddings: np.ndarray):
+        """
+        Aggiunge (o sostituisce) gli embeddings di un documento.
+
+        Args:
+            document_id (int): ID del documento
+            embeddings (np.ndarray): Embeddings dei chunk, nell'ordine dei chunk
+        """
+        if document_id in self.documents:
+            self.remove_documents([document_id])
+        if self.skipped.pop(document_id, None) is not None:
+            self.dirty = True
+
+        # Copia esplicita: gli embeddings possono essere un memmap in sola lettura
+        vectors = np.array(embeddings, dtype=np.float32, order='C')
+        if vectors.ndim != 2 or vectors.shape[0] == 0:
+            return
+
+        if self.index is None:
+            self.reset(vectors.shape[1])
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Dimensione embeddings {vectors.shape[1]} incompatibile con l'indice ({self.dimension})"
+            )
+
+        self._add_vectors(document_id, vectors)
+
+    def _add_vectors(self, document_id: int, embeddings: np.ndarray):
+        vectors = np.array(embeddings, dtype=np.float32, order='C')
+        faiss.normalize_L2(vectors)
+        ids = np.array(
+            [encode_chunk_id(document_id, i) for i in range(vectors.shape[0])],
+            dtype=np.int64
+        )
+        self.index.add_with_ids(vectors, ids)
+        self.documents[document_id] = vectors.shape[0]
+        self.dirty = True
+
+    def mark_skipped(self, document_id: int, generation: str):
+        """
+        Registra un documento non indicizzabile (vettori assenti, vuoti o di dimensione diversa).
+
+        Args:
+            document_id (int): ID del documento
+            generation (str): Generazione dei suoi embeddings ('' se non esistono)
+        """
+        if self.skipped.get(document_id) != generation:
+            self.skipped[document_id] = generation
+            self.dirty = True
+
+    def remove_documents(self, document_ids: Iterable[int]) -> int:
+        """
+        Rimuove dall'indice tutti i chunk dei documenti indicati.
+
+        Returns:
+            int: Numero di vettori rimossi
+        """
+        removed = 0
+        for document_id in document_ids:
+            if self.skipped.pop(document_id, None) is not None:
+                self.dirty = True
+            if document_id not in self.documents:
+                continue
+            if self.index is not None and self.built_type == INDEX_HNSW:
+                # HNSW non supporta la rimozione: i vettori restano fino alla ricostruzione
+                # e vengono filtrati in ricerca
+                self.stale = True
+            elif self.index is not None:
+                selector = faiss.IDSelectorRange(
+                    encode_chunk_id(document_id, 0),
+                    encode_chunk_id(document_id + 1, 0)
+                )
+                removed += self.index.remove_ids(selector)
+            del self.documents[document_id]
+            self.dirty = True
+        return removed
+
+    def search(self, query_embedding: np.ndarray, top_k: int,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """
+        Cerca i chunk più simili.
+
+        Args:
+            query_embedding (np.ndarray): Query normalizzata, shape (1, dimension)
+            top_k (int): Numero di risultati
+            nprobe (int): Liste IVF da visitare (solo indici IVF; più alto = recall maggiore)
+            ef_search (int): Ampiezza della ricerca HNSW (solo indici HNSW)
+
+        Returns:
+            List[Tuple[int, int, float]]: Lista di (document_id, chunk_index, score)
+        """
+        if self.index is None or self.ntotal == 0:
+            return []
+
+        k = top_k
+        if self.stale:
+            # Alcuni risultati possono appartenere a documenti rimossi
+            k += self.ntotal - self.live_count
+        k = min(k, self.ntotal)
+
+        # I parametri di ricerca sono attributi dell'indice condiviso: vanno impostati
+        # insieme alla ricerca per non interferire con le query concorrenti
+        with self._search_lock:
+            base = self._base_index()
+            if isinstance(base, faiss.IndexIVF):
+                base.nprobe = min(nprobe or self.default_nprobe, base.nlist)
+            elif isinstance(base, faiss.IndexHNSW):
+                base.hnsw.efSearch = max(ef_search or self.default_ef_search, k)
+            scores, ids = self.index.search(query_embedding, k)
+
+        results = []
+        for score, chunk_id in zip(scores[0], ids[0]):
+            if chunk_id < 0:
+                continue
+            document_id, chunk_index = decode_chunk_id(chunk_id)
+            if document_id not in self.documents:
+                continue
+            results.append((document_id, chunk_index, float(score)))
+        return results[:top_k]
+
+
+class VectorIndexStore:
+    """
+    Registro degli indici persistenti per scope, con cache in-process.
+
+    Le letture usano la copia in cache finché il manifest su disco non cambia;
+    le scritture avvengono sotto lock di file, così worker Celery e processi
+    web possono aggiornare lo stesso indice senza corrompersi a vicenda.
+
+    ``vector_loader`` (document_id -> embeddings) serve a ricostruire gli indici
+    quando cambia il tipo o quando superano la soglia per gli indici approssimati.
+    """
+
+    def __init__(self, root: Path, vector_loader: Optional[Callable[[int], np.ndarray]] = None,
+                 ann_min_vectors: int = 10000, default_nprobe: int = 16, default_ef_search: int = 64):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.vector_loader = vector_loader
+        self.index_options = {
+            'ann_min_vectors': ann_min_vectors,
+            'default_nprobe': default_nprobe,
+            'default_ef_search': default_ef_search,
+        }
+        self._cache: Dict[str, Tuple[PersistentFaissIndex, Optional[Tuple[int, int]]]] = {}
+        self._lock = threading.RLock()
+
+    def _scope_dir(self, scope: str) -> Path:
+        return self.root / scope
+
+    def _new_index(self, scope: str) -> PersistentFaissIndex:
+        return PersistentFaissIndex(self._scope_dir(scope), **self.index_options)
+
+    @contextmanager
+    def _file_lock(self, scope: str):
+        scope_dir = self._scope_dir(scope)
+        scope_dir.mkdir(parents=True, exist_ok=True)
+        with open(scope_dir / '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, scope: str) -> PersistentFaissIndex:
+        """
+        Restituisce l'indice di uno scope, ricaricandolo se è cambiato su disco.
+        """
+        with self._lock:
+            cached = self._cache.get(scope)
+            if cached is not None:
+                index, signature = cached
+                if index.manifest_signature() == signature:
+                    return index
+
+            index = self._new_index(scope)
+            try:
+                index.load(mmap=True)
+            except FileNotFoundError:
+                # Il manifest è stato sostituito durante la lettura: riprova una volta
+                index = self._new_index(scope)
+                index.load(mmap=True)
+            self._cache[scope] = (index, index.manifest_signature())
+            return index
+
+    @contextmanager
+    def update(self, scope: str):
+        """
+        Context manager per modificare l'indice di uno scope in modo esclusivo.
+
+        L'indice viene ricaricato dal disco dentro il lock e salvato all'uscita,
+        ricostruendolo prima se la sua struttura non è più adeguata.
+        """
+        with self._file_lock(scope):
+            index = self._new_index(scope)
+            index.load()
+            yield index
+            if self.vector_loader is not None and index.needs_rebuild():
+                index.rebuild(self.vector_loader)
+            if index.dirty:
+                index.save()
+            with self._lock:
+                self._cache[scope] = (index, index.manifest_signature())
+
+    def drop(self, scope: str):
+        """
+        Elimina l'indice di uno scope dal disco e dalla cache.
+        """
+        with self._lock:
+            self._cache.pop(scope, None)
+            scope_dir = self._scope_dir(scope)
+            if scope_dir.exists():
+                shutil.rmtree(scope_dir, ignore_errors=True)
+
+    def scopes(self) -> List[str]:
+        """
+        Elenca gli scope con un indice su disco.
+        """
+        return [p.name for p in self.root.iterdir() if (p / PersistentFaissIndex.MANIFEST_NAME).exists()]
+
+    def scopes_containing(self, document_id: int) -> List[str]:
+        """
+        Elenca gli scope il cui indice contiene il documento indicato
+        (anche solo come documento non indicizzabile).
+        """
+        result = []
+        for scope in self.scopes():
+            try:
+                with open(self._scope_dir(scope) / PersistentFaissIndex.MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if str(document_id) in manifest.get('documents', {}) or str(document_id) in manifest.get('skipped', {}):
+                    result.append(scope)
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def clear_cache(self):
+        """
+        Svuota la cache in-process (gli indici su disco restano validi).
+        """
+        with self._lock:
+            self._cache.clear()
@@ -2,18 +2,24 @@
 Views per l'API RAG - Endpoint principali per chat, upload e gestione documenti.
 """
 import os
+import re
+import hmac
+import json
 import time
 import logging
+import contextvars
 from pathlib import Path
 from django.conf import settings
 from django.http import StreamingHttpResponse, HttpResponse, Http404
 from django.utils import timezone
+from django.db.models.functions import Substr
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, JSONParser
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import ValidationError
 from django.core.files.storage import default_storage
@@ -22,24 +28,127 @@ import mimetypes
 import requests
 import tempfile
 
-from .models import RAGDocument, RAGChunk, RAGProcessingLog, RAGKnowledgeBase, RAGChatSession, RAGChatMessage
+from .models import (
+    RAGDocument, RAGChunk, RAGProcessingLog, RAGKnowledgeBase, RAGChatSession, RAGChatMessage, RAGImportJob
+)
 from .serializers import (
     RAGDocumentSerializer, RAGDocumentDetailSerializer, RAGChatSerializer,
     RAGDocumentUploadSerializer, RAGStatusSerializer, BulkDeleteSerializer,
     RAGKnowledgeBaseSerializer, RAGKnowledgeBaseDetailSerializer,
-    RAGChatSessionSerializer, RAGChatSessionDetailSerializer, RAGChatMessageSerializer
+    RAGChatSessionSerializer, RAGChatSessionDetailSerializer, RAGChatMessageSerializer,
+    RAGBulkImportSerializer, RAGImportJobSerializer
 )
-from .tasks import process_rag_document_task
-from .utils.embedding_utils import get_embedding_manager
-from config.llm_clients import get_openai_client
+from .tasks import process_rag_document_task, rebuild_knowledge_base_index_task, dispatch_import_items
+from .utils.embedding_utils import get_embedding_manager, get_engine_registry
+from .utils.hybrid_search import hybrid_search
+from .utils.reranking import get_reranker, resolve_rerank_config
+from .utils.answer_cache import get_answer_cache, make_namespace, knowledge_base_corpus, documents_corpus
+from .utils.context_packing import ContextPacker, context_budget
+from .utils.document_metadata import DocumentMetadataResolver
+from .utils.tracing import start_trace, current_trace, span, traced, metrics_available, render_metrics
+from .utils.document_import import create_uploaded_document, import_resource_document
+from config.llm_clients import get_openai_client, count_rag_prompt_tokens
 from .authentication import JWTCustomAuthentication
+from .renderers import EventStreamRenderer
 
 logger = logging.getLogger(__name__)
 
-class RAGChatView(APIView):
+def _sse_event(event, data):
+    """
+    Formatta un evento Server-Sent Events.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _run_in_context(events, context):
+    """
+    Itera gli eventi nel contesto indicato: la traccia della richiesta resta attiva
+    anche durante lo streaming, che avviene dopo la fine della view.
+    """
+    iterator = iter(events)
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(iterator.close)
+
+
+def _event_stream_response(events):
+    """
+    Risposta SSE senza buffering (anche dietro nginx).
+    """
+    response = StreamingHttpResponse(
+        _run_in_context(events, contextvars.copy_context()), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _metrics_request_allowed(request) -> bool:
+    """
+    Le metriche sono riservate ai servizi interni: header X-Internal-Secret valido o
+    indirizzo in RAG_METRICS_ALLOWED_IPS.
+    """
+    expected_secret = getattr(settings, 'INTERNAL_API_SECRET_VALUE', None)
+    provided_secret = request.headers.get(settings.INTERNAL_API_SECRET_HEADER_NAME)
+    if expected_secret and provided_secret and hmac.compare_digest(expected_secret, provided_secret):
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'RAG_METRICS_ALLOWED_IPS', [])
+
+
+def metrics_view(request):
+    """
+    Metriche Prometheus del servizio (durata delle operazioni e delle fasi RAG).
+    """
+    if not _metrics_request_allowed(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    if not metrics_available():
+        return HttpResponse('prometheus_client non installato', status=503, content_type='text/plain')
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
+class TracedViewMixin:
+    """
+    Apre una traccia per ogni richiesta: le fasi misurate durante la richiesta vi
+    vengono registrate e la durata finisce in ``rag_operation_duration_seconds``.
+    
+    L'operazione è ``trace_operation`` (più l'azione per i ViewSet); le risposte 5xx
+    contano come errori. Per le risposte in streaming la durata dell'operazione copre
+    la preparazione della risposta, la generazione è misurata nelle sue fasi.
+    """
+    trace_operation = 'rag'
+    
+    def dispatch(self, request, *args, **kwargs):
+        with start_trace(self.trace_operation) as trace:
+            response = super().dispatch(request, *args, **kwargs)
+            action_name = getattr(self, 'action', None)
+            if action_name:
+                trace.operation = f"{self.trace_operation}.{action_name}"
+            trace.failed = response.status_code >= 500
+            return response
+    
+    @staticmethod
+    def _debug_trace(debug):
+        """
+        Dettaglio dei tempi per fase da aggiungere alla risposta se richiesto (``debug``).
+        """
+        trace = current_trace()
+        if not debug or trace is None:
+            return {}
+        return {'trace': trace.breakdown()}
+
+
+class RAGChatView(TracedViewMixin, APIView):
     """
     View principale per la chat RAG con integrazione OpenAI.
     """
+    trace_operation = 'chat'
     
     def post(self, request):
         """
@@ -64,44 +173,89 @@ class RAGChatView(APIView):
             document_ids = serializer.validated_data.get('document_ids', [])
             top_k = serializer.validated_data.get('top_k', 5)
             max_tokens = serializer.validated_data.get('max_tokens', 1000)
+            nprobe = serializer.validated_data.get('nprobe')
+            ef_search = serializer.validated_data.get('ef_search')
+            debug = serializer.validated_data.get('debug', False)
             
             logger.info(f"Richiesta chat RAG: '{message[:50]}...'")
             
-            # Determina i documenti da cercare
-            search_document_ids = self._get_search_document_ids(request.user, document_ids)
+            # Determina il motore di embedding e i documenti da cercare
+            engine, search_document_ids = self._resolve_search_documents(request.user, document_ids)
             
             if not search_document_ids:
                 return Response({
                     'error': 'Nessun documento processato disponibile per la ricerca'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
+            # Senza documenti espliciti si usa l'indice persistente dell'utente
+            search_scope = None
+            if not document_ids:
+                search_scope = engine.user_scope(
+                    request.user.id if request.user.is_authenticated else None
+                )
+            
+            # Risposta già data alla stessa domanda (o a una molto simile) sugli stessi documenti
+            timings = {}
+            rerank = resolve_rerank_config(
+                enabled=serializer.validated_data.get('rerank'),
+                candidates=serializer.validated_data.get('rerank_candidates')
+            )
+            cache_namespace = self._answer_cache_namespace(
+                documents_corpus(search_document_ids), top_k, max_tokens, rerank,
+                nprobe=nprobe, ef_search=ef_search, engine=engine
+            )
+            cached = self._lookup_cached_answer(cache_namespace, message, timings, engine=engine)
+            if cached is not None:
+                return Response({
+                    **self._cached_response_data(message, cached, start_time, timings),
+                    **self._debug_trace(debug)
+                }, status=status.HTTP_200_OK)
+            
             # Cerca i chunk più rilevanti
-            relevant_chunks = self._search_relevant_chunks(message, search_document_ids, top_k)
+            relevant_chunks = self._search_relevant_chunks(
+                message, search_document_ids, top_k, scope=search_scope,
+                nprobe=nprobe, ef_search=ef_search, rerank=rerank, timings=timings, engine=engine
+            )
             
             if not relevant_chunks:
                 # Per domande senza contesto rilevante, usa comunque l'AI con prompt appropriato
                 context_empty = "Nessun documento rilevante trovato nella knowledge base."
-                response_text = self._generate_openai_response(context_empty, message, max_tokens)
+                response_text = self._generate_timed_response(context_empty, message, max_tokens, timings)
+                
+                answer = {
+                    'response': response_text,
+                    'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo'),
+                    'note': 'Risposta basata su conoscenza generale (nessun documento rilevante trovato)'
+                }
+                self._store_cached_answer(cache_namespace, message, answer, engine=engine)
                 
                 return Response({
                     'message': message,
-                    'response': response_text,
                     'context_chunks': [],
                     'sources': [],
                     'processing_time': time.time() - start_time,
-                    'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo'),
-                    'note': 'Risposta basata su conoscenza generale (nessun documento rilevante trovato)'
+                    'timings': timings,
+                    **self._prompt_usage(context_empty, message),
+                    **answer,
+                    **self._debug_trace(debug)
                 }, status=status.HTTP_200_OK)
             
-            # Crea il contesto dai chunk trovati
-            context = self._build_context_from_chunks(relevant_chunks)
+            # Crea il contesto dai chunk trovati, entro il budget di token
+            packed = self._build_context_from_chunks(relevant_chunks, message, max_tokens)
             
             # Genera la risposta con OpenAI
-            response_text = self._generate_openai_response(context, message, max_tokens)
+            response_text = self._generate_timed_response(packed.text, message, max_tokens, timings)
             
-            # Prepara le informazioni sui chunk e le fonti
-            context_chunks_info = self._prepare_context_chunks_info(relevant_chunks)
-            sources_info = self._prepare_sources_info(relevant_chunks)
+            # Prepara le informazioni sui chunk e le fonti effettivamente usati
+            context_chunks_info = self._prepare_context_chunks_info(packed.hits)
+            sources_info = self._prepare_sources_info(packed.hits)
+            
+            self._store_cached_answer(cache_namespace, message, {
+                'response': response_text,
+                'context_chunks': context_chunks_info,
+                'sources': sources_info,
+                'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+            }, engine=engine)
             
             processing_time = time.time() - start_time
             
@@ -114,7 +268,10 @@ class RAGChatView(APIView):
                 'context_chunks': context_chunks_info,
                 'sources': sources_info,
                 'processing_time': processing_time,
-                'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+                'timings': timings,
+                **self._prompt_usage(packed.text, message, packed),
+                'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo'),
+                **self._debug_trace(debug)
             }
             
             return Response(response_data, status=status.HTTP_200_OK)
@@ -125,49 +282,278 @@ class RAGChatView(APIView):
                 'error': 'Errore interno nella generazione della risposta'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    def _get_search_document_ids(self, user, document_ids):
+    def _stream_chat_events(self, message, relevant_chunks, max_tokens, start_time,
+                            empty_context='', fixed_response=None, extra_data=None,
+                            on_complete=None, on_error=None, debug=False):
         """
-        Determina gli ID dei documenti in cui cercare.
+        Generatore degli eventi SSE di una risposta in streaming.
+        
+        Eventi emessi, nell'ordine:
+        - ``sources``: chunk di contesto e fonti usati nel prompt e relativi token (prima della generazione)
+        - ``token``: frammenti della risposta man mano che arrivano da OpenAI
+        - ``done``: risposta completa, tempo di elaborazione, token del prompt e modello
+        - ``error``: in caso di errore durante la generazione
+        
+        Args:
+            message (str): Domanda dell'utente
+            relevant_chunks (List[ChunkHit]): Chunk recuperati
+            max_tokens (int): Numero massimo di token della risposta
+            start_time (float): Inizio dell'elaborazione della richiesta
+            empty_context (str): Contesto da usare se non ci sono chunk rilevanti
+            fixed_response (str): Risposta da inviare senza chiamare OpenAI
+            extra_data (dict): Campi aggiuntivi per l'evento ``sources``
+            on_complete (callable): Chiamata con (risposta, fonti, tempo) a fine stream;
+                può restituire campi aggiuntivi per l'evento ``done``
+            on_error (callable): Chiamata con il tempo trascorso in caso di errore
+            debug (bool): Aggiunge all'evento ``done`` il dettaglio dei tempi per fase
+        """
+        response_parts = []
+        sources_info = []
+        try:
+            if relevant_chunks:
+                packed = self._build_context_from_chunks(relevant_chunks, message, max_tokens)
+                context = packed.text
+                sources_info = self._prepare_sources_info(packed.hits)
+                context_chunks_info = self._prepare_context_chunks_info(packed.hits)
+            else:
+                packed = None
+                context = empty_context
+                context_chunks_info = []
+            prompt_usage = self._prompt_usage(context, message, packed, stream=True) if fixed_response is None else {}
+            
+            yield _sse_event('sources', {
+                'message': message,
+                'context_chunks': context_chunks_info,
+                'sources': sources_info,
+                **prompt_usage,
+                **(extra_data or {})
+            })
+            
+            if fixed_response is not None:
+                tokens = [fixed_response]
+            else:
+                tokens = get_openai_client().generate_rag_response_stream(context, message, max_tokens)
+            
+            with span('llm_completion_stream'):
+                for token in tokens:
+                    response_parts.append(token)
+                    yield _sse_event('token', {'content': token})
+            
+            response_text = ''.join(response_parts).strip()
+            processing_time = time.time() - start_time
+            done_data = {
+                'response': response_text,
+                'processing_time': processing_time,
+                **prompt_usage,
+                'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+            }
+            if on_complete:
+                done_data.update(on_complete(response_text, sources_info, processing_time) or {})
+            done_data.update(self._debug_trace(debug))
+            
+            logger.info(f"Chat RAG in streaming completata in {processing_time:.2f}s")
+            yield _sse_event('done', done_data)
+            
+        except GeneratorExit:
+            # Il client si è disconnesso: si salva comunque la risposta parziale
+            logger.info("Client disconnesso durante lo streaming della risposta")
+            if on_complete and response_parts:
+                on_complete(''.join(response_parts).strip(), sources_info, time.time() - start_time)
+            raise
+        except Exception as e:
+            logger.error(f"Errore nella chat RAG in streaming: {str(e)}", exc_info=True)
+            extra_error = on_error(time.time() - start_time) if on_error else None
+            yield _sse_event('error', {
+                'error': 'Errore interno nella generazione della risposta',
+                **(extra_error or {})
+            })
+    
+    def _answer_cache_namespace(self, corpus, top_k, max_tokens, rerank, nprobe=None, ef_search=None,
+                                engine=None):
+        """
+        Namespace della cache delle risposte: corpus interrogato e parametri che cambiano la risposta.
+        """
+        embedding_manager = engine or get_embedding_manager()
+        return make_namespace(
+            corpus,
+            top_k=top_k,
+            max_tokens=max_tokens,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            rerank=[rerank.model_name, rerank.candidates] if rerank.enabled else None,
+            embeddings=embedding_manager.key,
+            chat_model=getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo'),
+            context_tokens=getattr(settings, 'RAG_CONTEXT_MAX_TOKENS', 3000)
+        )
+    
+    @traced('answer_cache_lookup')
+    def _lookup_cached_answer(self, namespace, message, timings=None, engine=None):
         """
-        if document_ids:
-            return document_ids
-        else:
-            # Usa tutti i documenti dell'utente
-            return list(RAGDocument.objects.filter(
-                user_id=user.id if user.is_authenticated else None,
-                status='processed',
-                embeddings_created=True
-            ).values_list('id', flat=True))
+        Cerca una risposta in cache per la domanda (None se assente o se la cache non è disponibile).
+        
+        Con la ricerca semantica attiva (RAG_ANSWER_CACHE_SEMANTIC) le domande vengono confrontate
+        con gli embeddings del motore della ricerca (``engine``).
+        """
+        lookup_start = time.perf_counter()
+        try:
+            return get_answer_cache().lookup(namespace, message, embed=(engine or get_embedding_manager()).get_embedding)
+        except Exception as e:
+            logger.warning(f"Errore nella cache delle risposte: {str(e)}")
+            return None
+        finally:
+            if timings is not None:
+                timings['cache_lookup'] = round(time.perf_counter() - lookup_start, 4)
     
-    def _search_relevant_chunks(self, query, document_ids, top_k):
+    def _store_cached_answer(self, namespace, message, payload, engine=None):
         """
-        Cerca i chunk più rilevanti per la query.
+        Salva in cache la risposta generata (risposta, chunk di contesto, fonti, modello).
         """
         try:
-            embedding_manager = get_embedding_manager()
-            return embedding_manager.search_similar_chunks(query, document_ids, top_k)
+            get_answer_cache().store(namespace, message, payload, embed=(engine or get_embedding_manager()).get_embedding)
+        except Exception as e:
+            logger.warning(f"Errore nel salvataggio della risposta in cache: {str(e)}")
+    
+    def _cached_response_data(self, message, cached, start_time, timings):
+        """
+        Dati della risposta per una risposta trovata in cache.
+        """
+        return {
+            'message': message,
+            'context_chunks': [],
+            'sources': [],
+            **cached.payload,
+            'processing_time': time.time() - start_time,
+            'timings': timings,
+            'cached': True,
+            'cache_match': cached.match,
+            'cache_similarity': cached.similarity
+        }
+    
+    def _resolve_search_documents(self, user, document_ids):
+        """
+        Determina il motore di embedding e gli ID dei documenti in cui cercare.
+        
+        Con documenti espliciti si usa il motore della maggior parte di essi (gli altri hanno
+        vettori non confrontabili e vengono esclusi); altrimenti il motore predefinito con
+        tutti i documenti dell'utente creati da quel motore.
+        
+        Returns:
+            Tuple[EmbeddingManager, List[int]]: Motore e documenti della ricerca
+        """
+        if document_ids:
+            by_engine = RAGDocument.group_by_engine(document_ids)
+            if not by_engine:
+                return get_embedding_manager(), []
+            engine_key, engine_document_ids = max(by_engine.items(), key=lambda item: len(item[1]))
+            if len(by_engine) > 1:
+                logger.warning(f"Documenti di più motori di embedding: ricerca con {engine_key}, "
+                               f"esclusi {len(document_ids) - len(engine_document_ids)} documenti")
+            return get_embedding_manager(engine_key), engine_document_ids
+        
+        # Usa tutti i documenti dell'utente
+        engine = get_embedding_manager()
+        return engine, list(RAGDocument.objects.filter(
+            user_id=user.id if user.is_authenticated else None,
+            status='processed',
+            embeddings_created=True,
+            embedding_engine__in=[engine.key, '']
+        ).values_list('id', flat=True))
+    
+    def _search_relevant_chunks(self, query, document_ids, top_k, scope=None, nprobe=None, ef_search=None,
+                                rerank=None, timings=None, engine=None, index_type=None):
+        """
+        Cerca i chunk più rilevanti per la query con il motore di embedding ``engine``
+        (default: motore predefinito). ``index_type`` è il tipo di indice della knowledge
+        base a cui appartiene ``scope``.
+        
+        Con il rerank attivo recupera ``rerank.candidates`` chunk e li riordina con il
+        cross-encoder tenendo i primi top_k. Se ``timings`` è un dict vi registra i tempi
+        (in secondi) delle fasi 'retrieval' e 'rerank'.
+        """
+        if timings is None:
+            timings = {}
+        use_rerank = rerank is not None and rerank.enabled
+        fetch_k = max(top_k, rerank.candidates) if use_rerank else top_k
+        
+        retrieval_start = time.perf_counter()
+        try:
+            embedding_manager = engine or get_embedding_manager()
+            if getattr(settings, 'RAG_HYBRID_SEARCH', True):
+                hits = hybrid_search(
+                    embedding_manager, query, document_ids, fetch_k, scope=scope,
+                    nprobe=nprobe, ef_search=ef_search, index_type=index_type
+                )
+            else:
+                hits = embedding_manager.search_similar_chunks(
+                    query, document_ids, fetch_k, scope=scope,
+                    nprobe=nprobe, ef_search=ef_search, index_type=index_type
+                )
         except Exception as e:
             logger.error(f"Errore nella ricerca di chunk rilevanti: {str(e)}")
             return []
+        finally:
+            timings['retrieval'] = round(time.perf_counter() - retrieval_start, 4)
+        
+        if not use_rerank or not hits:
+            return hits[:top_k]
+        
+        rerank_start = time.perf_counter()
+        try:
+            return get_reranker(rerank.model_name).rerank(query, hits, top_k)
+        except Exception as e:
+            logger.error(f"Errore nel rerank dei chunk, uso l'ordine della ricerca: {str(e)}")
+            return hits[:top_k]
+        finally:
+            timings['rerank'] = round(time.perf_counter() - rerank_start, 4)
     
-    def _build_context_from_chunks(self, relevant_chunks):
+    def _generate_timed_response(self, context, question, max_tokens, timings):
         """
-        Costruisce il contesto concatenando i chunk rilevanti.
+        Genera la risposta registrando in ``timings`` il tempo della fase 'generation'.
+        """
+        generation_start = time.perf_counter()
+        try:
+            return self._generate_openai_response(context, question, max_tokens)
+        finally:
+            timings['generation'] = round(time.perf_counter() - generation_start, 4)
+    
+    @property
+    def document_resolver(self):
         """
-        context_parts = []
+        Resolver dei metadati dei documenti condiviso da contesto e fonti della richiesta.
+        """
+        if getattr(self, '_document_resolver', None) is None:
+            self._document_resolver = DocumentMetadataResolver()
+        return self._document_resolver
+    
+    @traced('context_build')
+    def _build_context_from_chunks(self, relevant_chunks, question, max_tokens):
+        """
+        Costruisce il contesto dai chunk rilevanti entro il budget di token del modello.
         
-        for i, (chunk_text, score, doc_id) in enumerate(relevant_chunks):
-            # Ottieni informazioni sul documento
-            try:
-                document = RAGDocument.objects.get(id=doc_id)
-                source_info = f"[Fonte: {document.original_filename}]"
-            except RAGDocument.DoesNotExist:
-                source_info = f"[Fonte: Documento {doc_id}]"
-            
-            context_parts.append(f"{source_info}\n{chunk_text}")
+        I chunk duplicati vengono saltati, quelli adiacenti dello stesso documento uniti
+        senza la sovrapposizione e quelli oltre il budget esclusi (vedi ContextPacker).
         
-        return "\n\n---\n\n".join(context_parts)
+        Returns:
+            PackedContext: Testo del contesto, chunk inclusi e token usati
+        """
+        documents = self.document_resolver.get_many(hit.document_id for hit in relevant_chunks)
+        source_labels = {
+            doc_id: f"[Fonte: {document.original_filename}]" for doc_id, document in documents.items()
+        }
+        
+        packer = ContextPacker(context_budget(question, max_tokens))
+        return packer.pack(relevant_chunks, source_labels)
     
+    def _prompt_usage(self, context, question, packed=None, stream=False):
+        """
+        Token del prompt inviato al modello (e del solo contesto, se costruito dai chunk).
+        """
+        return {
+            'prompt_tokens': count_rag_prompt_tokens(context, question, stream=stream),
+            'context_tokens': packed.tokens if packed is not None else 0
+        }
+    
+    @traced('llm_completion')
     def _generate_openai_response(self, context, question, max_tokens):
         """
         Genera la risposta usando OpenAI.
@@ -185,11 +571,12 @@ class RAGChatView(APIView):
         """
         chunks_info = []
         
-        for chunk_text, score, doc_id in relevant_chunks:
+        for chunk_text, score, doc_id, chunk_index in relevant_chunks:
             chunks_info.append({
                 'text': chunk_text[:200] + "..." if len(chunk_text) > 200 else chunk_text,
                 'score': round(score, 4),
-                'document_id': doc_id
+                'document_id': doc_id,
+                'chunk_index': chunk_index
             })
         
         return chunks_info
@@ -198,13 +585,11 @@ class RAGChatView(APIView):
         """
         Prepara le informazioni sulle fonti per la risposta.
         """
-        # Ottieni i documenti unici referenziati
-        referenced_doc_ids = list(set(doc_id for _, _, doc_id in relevant_chunks))
+        # Ottieni i documenti unici referenziati (stesso ordine del queryset: più recenti prima)
+        documents = self.document_resolver.get_many(hit.document_id for hit in relevant_chunks)
         
         sources = []
-        documents = RAGDocument.objects.filter(id__in=referenced_doc_ids)
-        
-        for document in documents:
+        for document in sorted(documents.values(), key=lambda doc: doc.created_at, reverse=True):
             sources.append({
                 'document_id': document.id,
                 'filename': document.original_filename,
@@ -214,10 +599,74 @@ class RAGChatView(APIView):
         
         return sources
 
-class RAGDocumentViewSet(viewsets.ModelViewSet):
+class RAGChatStreamView(RAGChatView):
+    """
+    Variante in streaming (SSE) della chat RAG: invia prima le fonti, poi i token della risposta.
+    """
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+    trace_operation = 'chat_stream'
+    
+    def post(self, request):
+        """
+        Gestisce una richiesta di chat RAG restituendo uno stream di eventi.
+        """
+        start_time = time.time()
+        
+        try:
+            serializer = RAGChatSerializer(data=request.data, context={'request': request})
+            
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            
+            message = serializer.validated_data['message']
+            document_ids = serializer.validated_data.get('document_ids', [])
+            top_k = serializer.validated_data.get('top_k', 5)
+            max_tokens = serializer.validated_data.get('max_tokens', 1000)
+            
+            engine, search_document_ids = self._resolve_search_documents(request.user, document_ids)
+            
+            if not search_document_ids:
+                return Response({
+                    'error': 'Nessun documento processato disponibile per la ricerca'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            search_scope = None
+            if not document_ids:
+                search_scope = engine.user_scope(
+                    request.user.id if request.user.is_authenticated else None
+                )
+            
+            timings = {}
+            relevant_chunks = self._search_relevant_chunks(
+                message, search_document_ids, top_k, scope=search_scope,
+                nprobe=serializer.validated_data.get('nprobe'),
+                ef_search=serializer.validated_data.get('ef_search'),
+                rerank=resolve_rerank_config(
+                    enabled=serializer.validated_data.get('rerank'),
+                    candidates=serializer.validated_data.get('rerank_candidates')
+                ),
+                timings=timings,
+                engine=engine
+            )
+            
+            return _event_stream_response(self._stream_chat_events(
+                message, relevant_chunks, max_tokens, start_time,
+                empty_context="Nessun documento rilevante trovato nella knowledge base.",
+                extra_data={'timings': timings},
+                debug=serializer.validated_data.get('debug', False)
+            ))
+            
+        except Exception as e:
+            logger.error(f"Errore nella chat RAG in streaming: {str(e)}", exc_info=True)
+            return Response({
+                'error': 'Errore interno nella generazione della risposta'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class RAGDocumentViewSet(TracedViewMixin, viewsets.ModelViewSet):
     """
     ViewSet per la gestione dei documenti RAG.
     """
+    trace_operation = 'documents'
     serializer_class = RAGDocumentSerializer
     parser_classes = [MultiPartParser, JSONParser]
     authentication_classes = [JWTCustomAuthentication]
@@ -293,200 +742,17 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
         """
         Processa un file caricato direttamente.
         """
-        # Salva il file
-        file_path = self._save_uploaded_file(uploaded_file)
-        
-        # Crea il documento nel database
-        document = RAGDocument.objects.create(
-            user_id=request.user.id if request.user.is_authenticated else None,
-            resource_id=None,  # Nessuna risorsa del Resource Manager
-            filename=os.path.basename(file_path),
-            original_filename=uploaded_file.name,
-            file_path=file_path,
-            file_size=uploaded_file.size,
-            file_type=uploaded_file.content_type or 'application/octet-stream',
-            status='uploaded'
+        return create_uploaded_document(
+            request.user.id if request.user.is_authenticated else None, uploaded_file
         )
-        
-        return document
     
     def _process_resource_from_manager(self, request, resource_id):
         """
         Processa una risorsa esistente dal Resource Manager.
         """
-        from django.conf import settings
-        import requests
-        import tempfile
-        
-        # Costanti per header interno
-        INTERNAL_API_HEADER = settings.INTERNAL_API_SECRET_HEADER_NAME
-        INTERNAL_API_SECRET = settings.INTERNAL_API_SECRET_VALUE
-        
-        try:
-            user_id = request.user.id if request.user.is_authenticated else None
-            
-            logger.info(f"Recupero risorsa {resource_id} dal Resource Manager per utente {user_id}")
-            
-            # Chiama l'endpoint interno del Resource Manager per ottenere il contenuto
-            resource_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/rag/resources/{resource_id}/content/"
-            internal_headers = {}
-            if INTERNAL_API_SECRET:
-                internal_headers[INTERNAL_API_HEADER] = INTERNAL_API_SECRET
-            
-            response = requests.get(resource_url, headers=internal_headers, timeout=30)
-            response.raise_for_status()
-            
-            # Ottieni informazioni dal Resource Manager sulla risorsa specifica
-            # Prima prova a ottenere tutte le risorse RAG per trovare quella specifica
-            resource_info_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/internal/rag/resources/"
-            info_params = {'user_id': user_id}  # Rimuovi il limit per ottenere tutte le risorse
-            
-            info_response = requests.get(resource_info_url, headers=internal_headers, params=info_params, timeout=30)
-            info_response.raise_for_status()
-            
-            resource_info_data = info_response.json()
-            resource_info = None
-            
-            # Trova la risorsa specifica
-            for res in resource_info_data.get('resources', []):
-                if res['id'] == resource_id:
-                    resource_info = res
-                    break
-            
-            if not resource_info:
-                # Se non trovata, prova a chiamare l'endpoint generale delle risorse (non solo RAG)
-                general_resource_url = f"{settings.RESOURCE_MANAGER_INTERNAL_URL}/api/resources/{resource_id}/"
-                general_headers = internal_headers.copy()
-                # Per l'endpoint pubblico, usa l'autenticazione JWT invece dell'header interno
-                if hasattr(request, 'user') and request.user.is_authenticated:
-                    # Ottieni il token dalla richiesta corrente
-                    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-                    if auth_header.startswith('Bearer '):
-                        general_headers['Authorization'] = auth_header
-                        # Rimuovi l'header interno per l'endpoint pubblico
-                        if INTERNAL_API_HEADER in general_headers:
-                            del general_headers[INTERNAL_API_HEADER]
-                
-                try:
-                    general_response = requests.get(general_resource_url, headers=general_headers, timeout=30)
-                    general_response.raise_for_status()
-                    resource_info = general_response.json()
-                    
-                    # Verifica che la risorsa appartenga all'utente
-                    if resource_info.get('owner_id') != user_id:
-                        raise Exception(f"Resource {resource_id} not accessible for user {user_id}")
-                        
-                except requests.exceptions.RequestException:
-                    raise Exception(f"Resource {resource_id} not found or not accessible")
-            
-            # Verifica che sia compatibile con RAG (dovrebbe già essere filtrata, ma double-check)
-            rag_compatible_types = {
-                'application/pdf',
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                'application/msword',
-                'text/plain',
-                'text/markdown',
-                'text/rtf',
-                'application/rtf',
-                'text/x-markdown',
-            }
-            
-            if resource_info['mime_type'] not in rag_compatible_types:
-                raise Exception(f"Resource type '{resource_info['mime_type']}' is not compatible with RAG")
-            
-            # Salva temporaneamente il file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{resource_info['original_filename']}") as temp_file:
-                temp_file.write(response.content)
-                temp_file_path = temp_file.name
-            
-            # Sposta il file nella directory di upload del RAG
-            final_file_path = self._save_file_content(
-                response.content, 
-                resource_info['original_filename'],
-                resource_info['mime_type']
-            )
-            
-            # Pulisci il file temporaneo
-            os.unlink(temp_file_path)
-            
-            # Crea il documento nel database
-            document = RAGDocument.objects.create(
-                user_id=user_id,
-                resource_id=resource_id,  # Referenzia la risorsa del Resource Manager
-                filename=os.path.basename(final_file_path),
-                original_filename=resource_info['original_filename'],
-                file_path=final_file_path,
-                file_size=resource_info['size'],
-                file_type=resource_info['mime_type'],
-                status='uploaded'
-            )
-            
-            logger.info(f"Documento RAG creato dal Resource Manager: {document.id} (risorsa {resource_id})")
-            
-            return document
-            
-        except requests.exceptions.HTTPError as http_err:
-            error_msg = f"HTTP error accessing Resource Manager: {http_err.response.status_code if http_err.response else 'N/A'}"
-            if http_err.response:
-                try:
-                    error_data = http_err.response.json()
-                    error_msg += f" - {error_data.get('error', 'Unknown error')}"
-                except:
-                    error_msg += f" - {http_err.response.text[:200]}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-            
-        except requests.exceptions.RequestException as req_exc:
-            error_msg = f"Request error accessing Resource Manager: {req_exc}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-            
-        except Exception as e:
-            error_msg = f"Unexpected error processing resource from Resource Manager: {e}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-    
-    def _save_file_content(self, content, filename, content_type):
-        """
-        Salva il contenuto del file nella directory di upload del RAG.
-        """
-        import uuid
-        from pathlib import Path
-        
-        # Crea directory se non esiste
-        upload_dir = Path(settings.RAG_UPLOADS_ROOT)
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Genera nome file unico
-        file_extension = Path(filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        
-        # Salva il contenuto
-        with open(file_path, 'wb') as f:
-            f.write(content)
-        
-        return str(file_path)
-    
-    def _save_uploaded_file(self, uploaded_file):
-        """
-        Salva il file caricato nella directory di upload.
-        """
-        # Crea la directory di upload se non esiste
-        upload_dir = Path(settings.RAG_UPLOADS_ROOT)
-        upload_dir.mkdir(exist_ok=True)
-        
-        # Genera un nome file unico
-        timestamp = int(time.time())
-        filename = f"{timestamp}_{uploaded_file.name}"
-        file_path = upload_dir / filename
-        
-        # Salva il file
-        with open(file_path, 'wb') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-        
-        return str(file_path)
+        return import_resource_document(
+            request.user.id if request.user.is_authenticated else None, resource_id
+        )
     
     @action(detail=False, methods=['post'])
     def bulk_delete(self, request):
@@ -546,8 +812,9 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Verifica che il documento esista e appartenga all'utente
+            # Il testo completo non viene caricato: bastano text_length e, dopo, delle finestre
             try:
-                document = RAGDocument.objects.get(
+                document = RAGDocument.objects.defer('extracted_text').get(
                     id=document_id,
                     user_id=request.user.id if request.user.is_authenticated else None
                 )
@@ -556,25 +823,28 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
                     'error': 'Documento non trovato'
                 }, status=status.HTTP_404_NOT_FOUND)
             
-            if not document.extracted_text:
+            if not document.text_length:
                 return Response({
                     'error': 'Contenuto del documento non disponibile'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # 🚀 RICERCA AI ULTRA-INTELLIGENTE
             try:
-                embedding_manager = get_embedding_manager()
+                embedding_manager = document.get_embedding_engine()
                 
                 # ⚡ Verifica provider OpenAI
                 provider_info = embedding_manager.get_embedding_info()
                 logger.info(f"🔥 Ricerca con provider: {provider_info['provider']} - Modello: {provider_info.get('model', 'N/A')}")
                 
-                # 🧠 Ricerca semantica potenziata
-                relevant_chunks = embedding_manager.search_similar_chunks(
-                    query=query,
-                    document_ids=[document.id],
-                    top_k=top_k
-                )
+                # 🧠 Ricerca ibrida: semantica (FAISS) + full-text (indice GIN)
+                if getattr(settings, 'RAG_HYBRID_SEARCH', True):
+                    relevant_chunks = hybrid_search(embedding_manager, query, [document.id], top_k)
+                else:
+                    relevant_chunks = embedding_manager.search_similar_chunks(
+                        query=query,
+                        document_ids=[document.id],
+                        top_k=top_k
+                    )
                 
                 if not relevant_chunks:
                     # 🔄 Fallback intelligente
@@ -589,7 +859,7 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
                 
                 # 📊 Log dettagliato dei chunk trovati
                 logger.info(f"🔍 Chunk trovati: {len(relevant_chunks)}")
-                for i, (chunk_text, score, doc_id) in enumerate(relevant_chunks[:3]):  # Log primi 3
+                for i, (chunk_text, score, doc_id, _) in enumerate(relevant_chunks[:3]):  # Log primi 3
                     logger.info(f"  Chunk {i+1}: score={score:.4f}, text_preview='{chunk_text[:100]}...'")
                 logger.info(f"🎯 Soglia similarità: {similarity_threshold}")
                 
@@ -646,7 +916,12 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
         
         logger.info(f"🎯 Processamento {len(relevant_chunks)} chunk con soglia {similarity_threshold}")
         
-        for i, (chunk_text, score, doc_id) in enumerate(relevant_chunks):
+        # 📍 Posizioni e contesto dagli offset salvati, senza scansionare il testo completo
+        windows = self._load_chunk_windows(
+            document, relevant_chunks, context_length=200 if include_context else 0
+        )
+        
+        for i, (chunk_text, score, doc_id, chunk_index) in enumerate(relevant_chunks):
             # 🔍 Analisi chunk
             chunk_analysis = self._analyze_chunk_relevance(chunk_text, query, score)
             
@@ -656,7 +931,7 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
                 cluster_id = self._assign_semantic_cluster(chunk_text, clusters)
             
             # 📍 Posizione nel documento
-            position_info = self._find_chunk_position(chunk_text, document.extracted_text)
+            position_info = windows.get(chunk_index) or {'start': -1, 'end': -1, 'snippet': None}
             
             # 🎯 Converti highlight spans da posizioni relative a assolute
             absolute_highlight_spans = []
@@ -679,7 +954,7 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
                 'cluster_id': cluster_id,
                 'semantic_score': chunk_analysis['semantic_score'],
                 'keyword_matches': chunk_analysis['keyword_matches'],
-                'context_snippet': self._extract_context_snippet(chunk_text, document.extracted_text) if include_context else None,
+                'context_snippet': (position_info['snippet'] or self._truncate_snippet(chunk_text)) if include_context else None,
                 'highlight_spans': absolute_highlight_spans  # Posizioni assolute nel documento
             }
             
@@ -716,7 +991,7 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
                     keyword_matches.append({
                         'word': word,
                         'count': matches,
-                        'positions': [i for i in range(len(chunk_text)) if chunk_text.lower().startswith(word, i)]
+                        'positions': [m.start() for m in re.finditer(re.escape(word), chunk_lower)]
                     })
                     total_matches += matches
         
@@ -775,70 +1050,68 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
         
         return 0  # Cluster generale
     
-    def _find_chunk_position(self, chunk_text, full_text):
+    def _load_chunk_windows(self, document, relevant_chunks, context_length=200):
         """
-        📍 Trova la posizione del chunk nel testo completo con ricerca intelligente.
+        📍 Posizioni e snippet di contesto dei chunk dagli offset salvati su RAGChunk.
+        
+        Dal database arriva solo una finestra di testo attorno a ogni chunk (SUBSTR),
+        mai l'intero extracted_text. Se gli offset non corrispondono al testo del chunk
+        (chunk creati prima degli offset esatti) la posizione resta -1.
+        
+        Args:
+            document (RAGDocument): Documento
+            relevant_chunks (list): Chunk trovati (text, score, document_id, chunk_index)
+            context_length (int): Caratteri di contesto prima e dopo il chunk
+            
+        Returns:
+            dict: chunk_index -> {'start', 'end', 'snippet'}
         """
-        try:
-            # Ricerca diretta
-            start_pos = full_text.find(chunk_text)
-            if start_pos != -1:
-                return {
-                    'start': start_pos,
-                    'end': start_pos + len(chunk_text)
-                }
+        hits = {chunk_index: chunk_text for chunk_text, _, doc_id, chunk_index in relevant_chunks if doc_id == document.id}
+        if not hits:
+            return {}
+        
+        offsets = {
+            chunk_index: (start, end)
+            for chunk_index, start, end in RAGChunk.objects.filter(
+                document_id=document.id, chunk_index__in=hits
+            ).values_list('chunk_index', 'start_position', 'end_position')
+        }
+        
+        # Una sola query con una finestra per chunk (SUBSTR è 1-based)
+        window_starts = {}
+        annotations = {}
+        for chunk_index, (start, end) in offsets.items():
+            window_starts[chunk_index] = max(0, start - context_length)
+            annotations[f'window_{chunk_index}'] = Substr(
+                'extracted_text', window_starts[chunk_index] + 1, end + context_length - window_starts[chunk_index]
+            )
+        if not annotations:
+            return {}
+        row = RAGDocument.objects.filter(id=document.id).annotate(**annotations).values(*annotations).first() or {}
+        
+        windows = {}
+        for chunk_index, (start, end) in offsets.items():
+            window = row.get(f'window_{chunk_index}') or ''
+            window_start = window_starts[chunk_index]
+            local_start = start - window_start
+            if window[local_start:local_start + end - start] != hits[chunk_index]:
+                continue
             
-            # 🔍 Ricerca parziale se il chunk non è trovato esattamente
-            # Prova con le prime e ultime parole del chunk
-            chunk_words = chunk_text.strip().split()
-            if len(chunk_words) >= 3:
-                # Cerca usando le prime 3 parole
-                first_words = ' '.join(chunk_words[:3])
-                start_pos = full_text.find(first_words)
-                if start_pos != -1:
-                    return {
-                        'start': start_pos,
-                        'end': start_pos + len(chunk_text)
-                    }
-                
-                # Cerca usando le ultime 3 parole
-                last_words = ' '.join(chunk_words[-3:])
-                end_pos = full_text.find(last_words)
-                if end_pos != -1:
-                    estimated_start = max(0, end_pos - len(chunk_text) + len(last_words))
-                    return {
-                        'start': estimated_start,
-                        'end': estimated_start + len(chunk_text)
-                    }
+            # Aggiungi indicatori se il contesto è troncato
+            snippet = window
+            if window_start > 0:
+                snippet = "..." + snippet
+            if window_start + len(window) < document.text_length:
+                snippet = snippet + "..."
             
-        except Exception as e:
-            logger.warning(f"Errore nella ricerca posizione chunk: {e}")
+            windows[chunk_index] = {'start': start, 'end': end, 'snippet': snippet}
         
-        # Fallback: posizione non trovata
-        return {'start': -1, 'end': -1}
+        return windows
     
-    def _extract_context_snippet(self, chunk_text, full_text, context_length=200):
+    def _truncate_snippet(self, chunk_text, context_length=200):
         """
-        📝 Estrae snippet di contesto attorno al chunk.
+        📝 Snippet di ripiego quando la posizione del chunk non è nota.
         """
-        try:
-            start_pos = full_text.find(chunk_text)
-            if start_pos != -1:
-                context_start = max(0, start_pos - context_length)
-                context_end = min(len(full_text), start_pos + len(chunk_text) + context_length)
-                
-                context = full_text[context_start:context_end]
-                
-                # Aggiungi indicatori se il contesto è troncato
-                if context_start > 0:
-                    context = "..." + context
-                if context_end < len(full_text):
-                    context = context + "..."
-                
-                return context
-        except:
-            pass
-        
         return chunk_text[:context_length] + "..." if len(chunk_text) > context_length else chunk_text
     
     def _analyze_query_intent(self, query):
@@ -875,7 +1148,6 @@ class RAGDocumentViewSet(viewsets.ModelViewSet):
         query_words = query_lower.split()
         
         # 📚 Divide in frasi più intelligentemente
-        import re
         sentences = re.split(r'[.!?]+', text)
         results = []
         
@@ -1070,17 +1342,10 @@ class RAGClearKnowledgeBaseView(APIView):
                     'message': 'Nessun documento da eliminare'
                 }, status=status.HTTP_200_OK)
             
-            # Elimina i documenti (questo eliminerà anche file ed embeddings)
+            # Elimina i documenti (questo eliminerà anche file, embeddings e voci negli indici)
             for document in documents_to_delete:
                 document.delete()
             
-            # Pulisce la cache degli embeddings
-            try:
-                embedding_manager = get_embedding_manager()
-                embedding_manager.clear_cache()
-            except Exception as e:
-                logger.warning(f"Errore nella pulizia della cache embeddings: {str(e)}")
-            
             return Response({
                 'message': f'{count} documenti eliminati. Knowledge base svuotata.',
                 'deleted_count': count
@@ -1092,10 +1357,11 @@ class RAGClearKnowledgeBaseView(APIView):
                 'error': 'Errore nello svuotamento della knowledge base'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
+class RAGKnowledgeBaseViewSet(TracedViewMixin, viewsets.ModelViewSet):
     """
     ViewSet per la gestione delle Knowledge Base.
     """
+    trace_operation = 'knowledge_bases'
     serializer_class = RAGKnowledgeBaseSerializer
     authentication_classes = [JWTCustomAuthentication]
     permission_classes = [IsAuthenticated]
@@ -1119,9 +1385,33 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """
-        Assegna l'utente corrente alla knowledge base.
+        Assegna l'utente corrente alla knowledge base e la lega al motore di embedding predefinito.
         """
-        serializer.save(user_id=self.request.user.id)
+        serializer.save(user_id=self.request.user.id, embedding_engine=get_embedding_manager().key)
+    
+    def perform_update(self, serializer):
+        """
+        Aggiorna la knowledge base; se cambia il tipo di indice lo ricostruisce in background.
+        """
+        previous_index_type = serializer.instance.index_type
+        kb = serializer.save()
+        # La configurazione (es. rerank) può cambiare le risposte: invalida la cache della KB
+        RAGKnowledgeBase.bump_content_version([kb.id])
+        if kb.index_type != previous_index_type:
+            rebuild_knowledge_base_index_task.delay(kb.id)
+    
+    def perform_destroy(self, instance):
+        """
+        Elimina la knowledge base e il suo indice persistente.
+        """
+        kb_id = instance.id
+        embedding_manager = instance.get_embedding_engine()
+        RAGKnowledgeBase.bump_content_version([kb_id])
+        instance.delete()
+        try:
+            embedding_manager.drop_index(embedding_manager.kb_scope(kb_id))
+        except Exception as e:
+            logger.warning(f"Errore nell'eliminazione dell'indice della KB {kb_id}: {str(e)}")
     
     @action(detail=True, methods=['post'])
     def add_documents(self, request, pk=None):
@@ -1151,11 +1441,40 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
             # Aggiunge i documenti alla KB
             kb.documents.add(*user_documents)
             kb.update_statistics()
+            RAGKnowledgeBase.bump_content_version([kb.id])
             
-            return Response({
+            # Aggiorna l'indice della KB con i soli documenti già processati;
+            # gli altri vengono aggiunti al termine del loro processamento
+            processed_ids = list(user_documents.filter(
+                status='processed',
+                embeddings_created=True
+            ).values_list('id', flat=True))
+            # Solo i documenti creati con il motore della KB sono confrontabili con il suo indice
+            engine_mismatch_ids = []
+            if processed_ids:
+                try:
+                    embedding_manager = kb.get_embedding_engine()
+                    by_engine = RAGDocument.group_by_engine(processed_ids)
+                    kb_document_ids = by_engine.pop(embedding_manager.key, [])
+                    engine_mismatch_ids = [doc_id for ids in by_engine.values() for doc_id in ids]
+                    if kb_document_ids:
+                        embedding_manager.add_documents_to_index(
+                            embedding_manager.kb_scope(kb.id), kb_document_ids, index_type=kb.index_type
+                        )
+                except Exception as e:
+                    logger.warning(f"Errore nell'aggiornamento dell'indice della KB {kb.id}: {str(e)}")
+            
+            response_data = {
                 'message': f'{user_documents.count()} documenti aggiunti alla knowledge base',
                 'added_count': user_documents.count()
-            }, status=status.HTTP_200_OK)
+            }
+            if engine_mismatch_ids:
+                response_data['engine_mismatch_document_ids'] = engine_mismatch_ids
+                response_data['warning'] = (
+                    'Alcuni documenti sono stati creati con un motore di embedding diverso da quello '
+                    'della knowledge base: vanno riprocessati per essere cercati'
+                )
+            return Response(response_data, status=status.HTTP_200_OK)
             
         except Exception as e:
             logger.error(f"Errore nell'aggiunta di documenti alla KB: {str(e)}")
@@ -1163,6 +1482,75 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
                 'error': 'Errore nell\'aggiunta dei documenti'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, JSONParser])
+    def bulk_import(self, request, pk=None):
+        """
+        Importa in blocco file e/o risorse del Resource Manager nella knowledge base.
+        
+        Crea un job di importazione: i documenti vengono processati in parallelo dai worker
+        (entro il limite per utente) e aggiunti alla KB e al suo indice alla fine, con
+        un'unica operazione. L'avanzamento si segue con GET import_jobs/{job_id}/.
+        """
+        try:
+            kb = self.get_object()
+            serializer = RAGBulkImportSerializer(data=request.data)
+            
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            
+            job = RAGImportJob.objects.create(user_id=request.user.id, knowledge_base=kb)
+            
+            # I file vanno salvati durante la richiesta; le risorse vengono recuperate dai worker
+            items = []
+            for uploaded_file in serializer.validated_data['files']:
+                document = create_uploaded_document(request.user.id, uploaded_file, import_job=job)
+                items.append({'document_id': document.id})
+            items.extend({'resource_id': resource_id} for resource_id in serializer.validated_data['resource_ids'])
+            
+            job.items = items
+            job.total_items = len(items)
+            job.save(update_fields=['items', 'total_items'])
+            
+            dispatch_import_items(request.user.id)
+            
+            return Response({
+                'message': f'Importazione di {len(items)} elementi avviata',
+                'job': RAGImportJobSerializer(job).data
+            }, status=status.HTTP_202_ACCEPTED)
+            
+        except Exception as e:
+            logger.error(f"Errore nell'avvio dell'importazione in blocco: {str(e)}")
+            return Response({
+                'error': 'Errore nell\'avvio dell\'importazione'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @action(detail=True, methods=['get'])
+    def import_jobs(self, request, pk=None):
+        """
+        Elenca i job di importazione recenti della knowledge base.
+        """
+        kb = self.get_object()
+        jobs = kb.import_jobs.all()[:20]
+        return Response({'jobs': RAGImportJobSerializer(jobs, many=True).data}, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['get'], url_path=r'import_jobs/(?P<job_id>\d+)')
+    def import_job_status(self, request, pk=None, job_id=None):
+        """
+        Stato e avanzamento di un job di importazione (da interrogare periodicamente).
+        """
+        kb = self.get_object()
+        try:
+            job = kb.import_jobs.get(id=job_id)
+        except RAGImportJob.DoesNotExist:
+            return Response({
+                'error': 'Job di importazione non trovato'
+            }, status=status.HTTP_404_NOT_FOUND)
+        if job.status == 'running':
+            # Libera gli elementi rimasti senza esito (worker terminato) e invia i successivi
+            dispatch_import_items(job.user_id)
+            job.refresh_from_db()
+        return Response(RAGImportJobSerializer(job).data, status=status.HTTP_200_OK)
+    
     @action(detail=True, methods=['post'])
     def remove_documents(self, request, pk=None):
         """
@@ -1179,16 +1567,26 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
             
             # Rimuove i documenti dalla KB
             removed_count = 0
+            removed_ids = []
             for doc_id in document_ids:
                 try:
                     document = kb.documents.get(id=doc_id)
                     kb.documents.remove(document)
+                    removed_ids.append(document.id)
                     removed_count += 1
                 except RAGDocument.DoesNotExist:
                     continue
             
             kb.update_statistics()
             
+            if removed_ids:
+                RAGKnowledgeBase.bump_content_version([kb.id])
+                try:
+                    embedding_manager = kb.get_embedding_engine()
+                    embedding_manager.remove_documents_from_index(embedding_manager.kb_scope(kb.id), removed_ids)
+                except Exception as e:
+                    logger.warning(f"Errore nell'aggiornamento dell'indice della KB {kb.id}: {str(e)}")
+            
             return Response({
                 'message': f'{removed_count} documenti rimossi dalla knowledge base',
                 'removed_count': removed_count
@@ -1245,6 +1643,8 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
         """
         Chat specifica per questa knowledge base.
         """
+        start_time = time.time()
+        
         try:
             kb = self.get_object()
             
@@ -1257,12 +1657,13 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
             message = serializer.validated_data['message']
             top_k = serializer.validated_data.get('top_k', 5)
             max_tokens = serializer.validated_data.get('max_tokens', 1000)
+            nprobe = serializer.validated_data.get('nprobe')
+            ef_search = serializer.validated_data.get('ef_search')
+            debug = serializer.validated_data.get('debug', False)
             
-            # Usa solo i documenti di questa KB
-            kb_document_ids = list(kb.documents.filter(
-                status='processed',
-                embeddings_created=True
-            ).values_list('id', flat=True))
+            # Usa solo i documenti di questa KB, con il motore di embedding con cui è costruita
+            engine = kb.get_embedding_engine()
+            kb_document_ids = list(kb.engine_documents(engine).values_list('id', flat=True))
             
             if not kb_document_ids:
                 return Response({
@@ -1272,49 +1673,93 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
             # Usa la logica di chat esistente ma limitata a questa KB
             chat_view = RAGChatView()
             
-            # Cerca i chunk più rilevanti
-            relevant_chunks = chat_view._search_relevant_chunks(message, kb_document_ids, top_k)
+            timings = {}
+            rerank = resolve_rerank_config(
+                kb,
+                enabled=serializer.validated_data.get('rerank'),
+                candidates=serializer.validated_data.get('rerank_candidates')
+            )
+            kb_info = {
+                'id': kb.id,
+                'name': kb.name,
+                'description': kb.description
+            }
+            
+            # Risposta già data a una domanda uguale o molto simile sulla stessa versione della KB
+            cache_namespace = chat_view._answer_cache_namespace(
+                knowledge_base_corpus(kb), top_k, max_tokens, rerank,
+                nprobe=nprobe, ef_search=ef_search, engine=engine
+            )
+            cached = chat_view._lookup_cached_answer(cache_namespace, message, timings, engine=engine)
+            if cached is not None:
+                return Response({
+                    **chat_view._cached_response_data(message, cached, start_time, timings),
+                    'knowledge_base': kb_info,
+                    **self._debug_trace(debug)
+                }, status=status.HTTP_200_OK)
+            
+            # Cerca i chunk più rilevanti nell'indice persistente della KB
+            relevant_chunks = chat_view._search_relevant_chunks(
+                message, kb_document_ids, top_k,
+                scope=engine.kb_scope(kb.id), index_type=kb.index_type,
+                nprobe=nprobe, ef_search=ef_search, rerank=rerank, timings=timings, engine=engine
+            )
             
             if not relevant_chunks:
                 # Per domande senza contesto rilevante nella KB, usa comunque l'AI
                 context_empty = f'Nessun documento rilevante trovato nella knowledge base "{kb.name}" per questa domanda.'
-                response_text = chat_view._generate_openai_response(context_empty, message, max_tokens)
+                response_text = chat_view._generate_timed_response(context_empty, message, max_tokens, timings)
+                
+                answer = {
+                    'response': response_text,
+                    'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo'),
+                    'note': f'Risposta basata su conoscenza generale (nessun documento rilevante nella KB "{kb.name}")'
+                }
+                chat_view._store_cached_answer(cache_namespace, message, answer, engine=engine)
                 
                 return Response({
                     'message': message,
-                    'response': response_text,
                     'context_chunks': [],
                     'sources': [],
+                    'processing_time': time.time() - start_time,
+                    'timings': timings,
+                    **chat_view._prompt_usage(context_empty, message),
                     'knowledge_base': {
                         'id': kb.id,
                         'name': kb.name
                     },
-                    'note': f'Risposta basata su conoscenza generale (nessun documento rilevante nella KB "{kb.name}")'
+                    **answer,
+                    **self._debug_trace(debug)
                 }, status=status.HTTP_200_OK)
             
-            # Crea il contesto dai chunk trovati
-            context = chat_view._build_context_from_chunks(relevant_chunks)
+            # Crea il contesto dai chunk trovati, entro il budget di token
+            packed = chat_view._build_context_from_chunks(relevant_chunks, message, max_tokens)
             
             # Genera la risposta con OpenAI
-            response_text = chat_view._generate_openai_response(context, message, max_tokens)
+            response_text = chat_view._generate_timed_response(packed.text, message, max_tokens, timings)
             
-            # Prepara le informazioni sui chunk e le fonti
-            context_chunks_info = chat_view._prepare_context_chunks_info(relevant_chunks)
-            sources_info = chat_view._prepare_sources_info(relevant_chunks)
+            # Prepara le informazioni sui chunk e le fonti effettivamente usati
+            context_chunks_info = chat_view._prepare_context_chunks_info(packed.hits)
+            sources_info = chat_view._prepare_sources_info(packed.hits)
             
-            # Restituisci la risposta
-            response_data = {
-                'message': message,
+            answer = {
                 'response': response_text,
                 'context_chunks': context_chunks_info,
                 'sources': sources_info,
-                'knowledge_base': {
-                    'id': kb.id,
-                    'name': kb.name,
-                    'description': kb.description
-                },
                 'model_used': getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
             }
+            chat_view._store_cached_answer(cache_namespace, message, answer, engine=engine)
+            
+            # Restituisci la risposta
+            response_data = {
+                'message': message,
+                **answer,
+                'knowledge_base': kb_info,
+                'processing_time': time.time() - start_time,
+                'timings': timings,
+                **chat_view._prompt_usage(packed.text, message, packed),
+                **self._debug_trace(debug)
+            }
             
             return Response(response_data, status=status.HTTP_200_OK)
             
@@ -1323,11 +1768,69 @@ class RAGKnowledgeBaseViewSet(viewsets.ModelViewSet):
             return Response({
                 'error': 'Errore nella generazione della risposta'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @action(detail=True, methods=['post'], url_path='chat/stream',
+            renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def chat_stream(self, request, pk=None):
+        """
+        Chat in streaming (SSE) specifica per questa knowledge base.
+        """
+        start_time = time.time()
+        
+        try:
+            kb = self.get_object()
+            
+            serializer = RAGChatSerializer(data=request.data, context={'request': request})
+            
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            
+            message = serializer.validated_data['message']
+            top_k = serializer.validated_data.get('top_k', 5)
+            max_tokens = serializer.validated_data.get('max_tokens', 1000)
+            
+            engine = kb.get_embedding_engine()
+            kb_document_ids = list(kb.engine_documents(engine).values_list('id', flat=True))
+            
+            if not kb_document_ids:
+                return Response({
+                    'error': f'Nessun documento processato nella knowledge base "{kb.name}"'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            chat_view = RAGChatView()
+            timings = {}
+            relevant_chunks = chat_view._search_relevant_chunks(
+                message, kb_document_ids, top_k,
+                scope=engine.kb_scope(kb.id), index_type=kb.index_type,
+                nprobe=serializer.validated_data.get('nprobe'),
+                ef_search=serializer.validated_data.get('ef_search'),
+                rerank=resolve_rerank_config(
+                    kb,
+                    enabled=serializer.validated_data.get('rerank'),
+                    candidates=serializer.validated_data.get('rerank_candidates')
+                ),
+                timings=timings,
+                engine=engine
+            )
+            
+            return _event_stream_response(chat_view._stream_chat_events(
+                message, relevant_chunks, max_tokens, start_time,
+                empty_context=f'Nessun documento rilevante trovato nella knowledge base "{kb.name}" per questa domanda.',
+                extra_data={'knowledge_base': {'id': kb.id, 'name': kb.name}, 'timings': timings},
+                debug=serializer.validated_data.get('debug', False)
+            ))
+            
+        except Exception as e:
+            logger.error(f"Errore nella chat KB in streaming: {str(e)}")
+            return Response({
+                'error': 'Errore nella generazione della risposta'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class RAGChatSessionViewSet(viewsets.ModelViewSet):
+class RAGChatSessionViewSet(TracedViewMixin, viewsets.ModelViewSet):
     """
     ViewSet per la gestione delle sessioni di chat RAG.
     """
+    trace_operation = 'chat_sessions'
     serializer_class = RAGChatSessionSerializer
     authentication_classes = [JWTCustomAuthentication]
     permission_classes = [IsAuthenticated]
@@ -1367,6 +1870,7 @@ class RAGChatSessionViewSet(viewsets.ModelViewSet):
         try:
             session = self.get_object()
             message_content = request.data.get('message', '').strip()
+            debug = bool(request.data.get('debug'))
             
             if not message_content:
                 return Response({
@@ -1390,29 +1894,52 @@ class RAGChatSessionViewSet(viewsets.ModelViewSet):
                         'error': 'Ogni chat deve essere associata a una Knowledge Base specifica. La chat globale è stata eliminata per migliorare la contestualizzazione.'
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
-                # Chat specifica per KB
-                document_ids = list(session.knowledge_base.documents.filter(
-                    status='processed',
-                    embeddings_created=True
-                ).values_list('id', flat=True))
+                # Chat specifica per KB, con il motore di embedding della KB
+                engine = session.knowledge_base.get_embedding_engine()
+                document_ids = list(session.knowledge_base.engine_documents(engine).values_list('id', flat=True))
                 
+                model_used = getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
                 if not document_ids:
                     ai_response = f'Non ci sono documenti processati nella knowledge base "{session.knowledge_base.name}". Aggiungi e processa alcuni documenti per iniziare a chattare!'
                     sources = []
                 else:
-                    # Usa la logica di chat esistente
+                    # Usa la logica di chat esistente (stessa cache delle risposte della chat della KB)
                     chat_view = RAGChatView()
-                    relevant_chunks = chat_view._search_relevant_chunks(message_content, document_ids, 5)
+                    rerank = resolve_rerank_config(session.knowledge_base)
+                    cache_namespace = chat_view._answer_cache_namespace(
+                        knowledge_base_corpus(session.knowledge_base), 5, 1000, rerank, engine=engine
+                    )
+                    cached = chat_view._lookup_cached_answer(cache_namespace, message_content, engine=engine)
                     
-                    if relevant_chunks:
-                        context = chat_view._build_context_from_chunks(relevant_chunks)
-                        ai_response = chat_view._generate_openai_response(context, message_content, 1000)
-                        sources = chat_view._prepare_sources_info(relevant_chunks)
+                    if cached is not None:
+                        ai_response = cached.payload['response']
+                        sources = cached.payload.get('sources', [])
+                        model_used = cached.payload.get('model_used', model_used)
                     else:
-                        # Usa l'AI anche senza contesto specifico dalla KB
-                        context_empty = f'Nessun documento rilevante trovato nella knowledge base "{session.knowledge_base.name}" per questa domanda.'
-                        ai_response = chat_view._generate_openai_response(context_empty, message_content, 1000)
-                        sources = []
+                        relevant_chunks = chat_view._search_relevant_chunks(
+                            message_content, document_ids, 5,
+                            scope=engine.kb_scope(session.knowledge_base.id),
+                            index_type=session.knowledge_base.index_type,
+                            rerank=rerank, engine=engine
+                        )
+                        
+                        if relevant_chunks:
+                            packed = chat_view._build_context_from_chunks(relevant_chunks, message_content, 1000)
+                            relevant_chunks = packed.hits
+                            ai_response = chat_view._generate_openai_response(packed.text, message_content, 1000)
+                            sources = chat_view._prepare_sources_info(relevant_chunks)
+                        else:
+                            # Usa l'AI anche senza contesto specifico dalla KB
+                            context_empty = f'Nessun documento rilevante trovato nella knowledge base "{session.knowledge_base.name}" per questa domanda.'
+                            ai_response = chat_view._generate_openai_response(context_empty, message_content, 1000)
+                            sources = []
+                        
+                        chat_view._store_cached_answer(cache_namespace, message_content, {
+                            'response': ai_response,
+                            'context_chunks': chat_view._prepare_context_chunks_info(relevant_chunks),
+                            'sources': sources,
+                            'model_used': model_used
+                        }, engine=engine)
                 
                 processing_time = time.time() - start_time
                 
@@ -1423,7 +1950,7 @@ class RAGChatSessionViewSet(viewsets.ModelViewSet):
                     is_user=False,
                     sources=sources,
                     processing_time=processing_time,
-                    model_used=getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+                    model_used=model_used
                 )
                 
                 # Aggiorna statistiche sessione
@@ -1439,7 +1966,8 @@ class RAGChatSessionViewSet(viewsets.ModelViewSet):
                 return Response({
                     'user_message': user_msg_data,
                     'ai_message': ai_msg_data,
-                    'session': RAGChatSessionSerializer(session).data
+                    'session': RAGChatSessionSerializer(session).data,
+                    **self._debug_trace(debug)
                 }, status=status.HTTP_200_OK)
                 
             except Exception as e:
@@ -1472,6 +2000,99 @@ class RAGChatSessionViewSet(viewsets.ModelViewSet):
                 'error': 'Errore nell\'invio del messaggio'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=True, methods=['post'], url_path='send_message/stream',
+            renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def send_message_stream(self, request, pk=None):
+        """
+        Invia un messaggio in questa sessione ricevendo la risposta in streaming (SSE).
+        
+        Il messaggio AI viene salvato al termine dello stream; l'evento ``done``
+        contiene il messaggio salvato e la sessione aggiornata.
+        """
+        start_time = time.time()
+        
+        try:
+            session = self.get_object()
+            message_content = request.data.get('message', '').strip()
+            
+            if not message_content:
+                return Response({
+                    'error': 'Il messaggio non può essere vuoto'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            if not session.knowledge_base:
+                return Response({
+                    'error': 'Ogni chat deve essere associata a una Knowledge Base specifica. La chat globale è stata eliminata per migliorare la contestualizzazione.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            user_message = RAGChatMessage.objects.create(
+                session=session,
+                content=message_content,
+                is_user=True
+            )
+            
+            engine = session.knowledge_base.get_embedding_engine()
+            document_ids = list(session.knowledge_base.engine_documents(engine).values_list('id', flat=True))
+            
+            chat_view = RAGChatView()
+            relevant_chunks = []
+            fixed_response = None
+            if document_ids:
+                relevant_chunks = chat_view._search_relevant_chunks(
+                    message_content, document_ids, 5,
+                    scope=engine.kb_scope(session.knowledge_base.id),
+                    index_type=session.knowledge_base.index_type,
+                    rerank=resolve_rerank_config(session.knowledge_base),
+                    engine=engine
+                )
+            else:
+                fixed_response = f'Non ci sono documenti processati nella knowledge base "{session.knowledge_base.name}". Aggiungi e processa alcuni documenti per iniziare a chattare!'
+            
+            def save_ai_message(response_text, sources, processing_time):
+                ai_message = RAGChatMessage.objects.create(
+                    session=session,
+                    content=response_text,
+                    is_user=False,
+                    sources=sources,
+                    processing_time=processing_time,
+                    model_used=getattr(settings, 'OPENAI_CHAT_MODEL_NAME', 'gpt-3.5-turbo')
+                )
+                session.message_count = session.messages.count()
+                if not session.title:
+                    session.generate_title()
+                session.save()
+                return {
+                    'ai_message': RAGChatMessageSerializer(ai_message).data,
+                    'session': RAGChatSessionSerializer(session).data
+                }
+            
+            def save_error_message(processing_time):
+                error_message = RAGChatMessage.objects.create(
+                    session=session,
+                    content='Mi dispiace, si è verificato un errore nella generazione della risposta. Riprova più tardi.',
+                    is_user=False,
+                    processing_time=processing_time
+                )
+                session.message_count = session.messages.count()
+                session.save()
+                return {'ai_message': RAGChatMessageSerializer(error_message).data}
+            
+            return _event_stream_response(chat_view._stream_chat_events(
+                message_content, relevant_chunks, 1000, start_time,
+                empty_context=f'Nessun documento rilevante trovato nella knowledge base "{session.knowledge_base.name}" per questa domanda.',
+                fixed_response=fixed_response,
+                extra_data={'user_message': RAGChatMessageSerializer(user_message).data},
+                on_complete=save_ai_message,
+                on_error=save_error_message,
+                debug=bool(request.data.get('debug'))
+            ))
+            
+        except Exception as e:
+            logger.error(f"Errore nell'invio messaggio in streaming: {str(e)}")
+            return Response({
+                'error': 'Errore nell\'invio del messaggio'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
     @action(detail=True, methods=['delete'])
     def clear_messages(self, request, pk=None):
         """
@@ -1556,6 +2177,8 @@ class RAGEmbeddingInfoView(APIView):
         try:
             embedding_manager = get_embedding_manager()
             info = embedding_manager.get_embedding_info()
+            info['answer_cache'] = get_answer_cache().stats()
+            info['loaded_engines'] = [engine.key for engine in get_engine_registry().engines()]
             
             # Aggiungi statistiche sui documenti
             total_documents = RAGDocument.objects.filter(
@@ -1613,7 +2236,10 @@ class RAGEmbeddingInfoView(APIView):
     
     def post(self, request):
         """
-        Cambia il provider di embedding a runtime.
+        Cambia il provider di embedding predefinito a runtime.
+        
+        Vale per i nuovi documenti e le nuove knowledge base: quelle esistenti restano
+        legate al motore con cui sono state costruite (e ai loro indici).
         """
         try:
             provider = request.data.get('provider')
@@ -1627,19 +2253,18 @@ class RAGEmbeddingInfoView(APIView):
                     'error': 'Provider non supportato. Utilizza "openai" o "sentence_transformers"'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            embedding_manager = get_embedding_manager()
-            success = embedding_manager.switch_provider(provider)
-            
-            if success:
-                new_info = embedding_manager.get_embedding_info()
-                return Response({
-                    'message': f'Provider cambiato con successo a: {provider}',
-                    'embedding_info': new_info
-                }, status=status.HTTP_200_OK)
-            else:
+            try:
+                embedding_manager = get_engine_registry().set_default_provider(provider)
+            except Exception as e:
+                logger.error(f"Errore nel cambio provider a {provider}: {str(e)}")
                 return Response({
                     'error': f'Impossibile cambiare provider a: {provider}'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            
+            return Response({
+                'message': f'Provider cambiato con successo a: {provider}',
+                'embedding_info': embedding_manager.get_embedding_info()
+            }, status=status.HTTP_200_OK)
                 
         except Exception as e:
             logger.error(f"Errore nel cambio provider embedding: {str(e)}")
@@ -1667,61 +2292,29 @@ class RAGEmbeddingBenchmarkView(APIView):
                     'error': 'Testo di test troppo lungo (max 1000 caratteri)'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            embedding_manager = get_embedding_manager()
-            current_provider = embedding_manager.provider
+            registry = get_engine_registry()
+            current_provider = registry.default().provider
             
+            # Ogni provider usa il proprio motore: il predefinito (e le richieste in corso) non cambia
             results = {}
-            
-            # Test OpenAI se disponibile
-            try:
-                if embedding_manager.switch_provider('openai'):
-                    start_time = time.time()
-                    openai_embedding = embedding_manager.get_embedding(test_text)
-                    openai_time = time.time() - start_time
-                    
-                    results['openai'] = {
-                        'success': True,
-                        'dimensions': len(openai_embedding),
-                        'processing_time': round(openai_time, 3),
-                        'model_info': embedding_manager.get_embedding_info()
-                    }
-                else:
-                    results['openai'] = {
-                        'success': False,
-                        'error': 'OpenAI non disponibile'
-                    }
-            except Exception as e:
-                results['openai'] = {
-                    'success': False,
-                    'error': str(e)
-                }
-            
-            # Test Sentence Transformers
-            try:
-                if embedding_manager.switch_provider('sentence_transformers'):
+            for provider in ('openai', 'sentence_transformers'):
+                try:
+                    embedding_manager = registry.for_provider(provider)
                     start_time = time.time()
-                    st_embedding = embedding_manager.get_embedding(test_text)
-                    st_time = time.time() - start_time
+                    embedding = embedding_manager.get_embedding(test_text)
+                    elapsed = time.time() - start_time
                     
-                    results['sentence_transformers'] = {
+                    results[provider] = {
                         'success': True,
-                        'dimensions': len(st_embedding),
-                        'processing_time': round(st_time, 3),
+                        'dimensions': len(embedding),
+                        'processing_time': round(elapsed, 3),
                         'model_info': embedding_manager.get_embedding_info()
                     }
-                else:
-                    results['sentence_transformers'] = {
+                except Exception as e:
+                    results[provider] = {
                         'success': False,
-                        'error': 'Sentence Transformers non disponibile'
+                        'error': str(e)
                     }
-            except Exception as e:
-                results['sentence_transformers'] = {
-                    'success': False,
-                    'error': str(e)
-                }
-            
-            # Ripristina il provider originale
-            embedding_manager.switch_provider(current_provider)
             
             return Response({
                 'test_text': test_text,
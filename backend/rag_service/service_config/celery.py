@@ -3,6 +3,7 @@ Celery configuration per rag_service.
 """
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'service_config.settings')
@@ -26,4 +27,33 @@ app.conf.update(
     worker_prefetch_multiplier=1,
     task_acks_late=True,
     worker_max_tasks_per_child=50,
-) 
\ No newline at end of file
+) 
+
+
+@worker_init.connect
+def start_worker_metrics(**kwargs):
+    """
+    Espone le metriche dei task (fasi del processamento) se RAG_WORKER_METRICS_PORT è impostata.
+
+    Il server gira nel processo principale, i task nei figli prefork: le metriche vengono
+    aggregate dai file di PROMETHEUS_MULTIPROC_DIR.
+    """
+    from django.conf import settings
+    from rag_api.utils.tracing import start_metrics_server
+
+    port = getattr(settings, 'RAG_WORKER_METRICS_PORT', 0)
+    if port:
+        start_metrics_server(port)
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(pid=None, **kwargs):
+    """
+    Rimuove dalle metriche aggregate i gauge live del processo figlio che termina
+    e chiude il suo pool di processi per l'estrazione dei PDF.
+    """
+    from rag_api.utils.parallel_extraction import shutdown_process_pool
+    from rag_api.utils.tracing import mark_process_dead
+
+    mark_process_dead(pid or os.getpid())
+    shutdown_process_pool()
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'rag_api',
@@ -172,9 +173,105 @@ CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
 RAG_UPLOADS_ROOT = os.path.join(MEDIA_ROOT, 'rag_uploads')
 RAG_EMBEDDINGS_ROOT = os.path.join(MEDIA_ROOT, 'rag_embeddings')
 
-# Configurazioni RAG per chunking
-RAG_MAX_CHUNK_SIZE = int(os.getenv('RAG_MAX_CHUNK_SIZE', '1000'))
-RAG_CHUNK_OVERLAP = int(os.getenv('RAG_CHUNK_OVERLAP', '200'))
+# Configurazioni RAG per chunking: dimensione e sovrapposizione in token (tokenizer cl100k_base)
+RAG_CHUNK_MAX_TOKENS = int(os.getenv('RAG_CHUNK_MAX_TOKENS', '256'))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv('RAG_CHUNK_OVERLAP_TOKENS', '48'))
+
+# Pipeline di ingestione: chunk per batch di embeddings (minimo: con OpenAI un batch copre
+# OPENAI_EMBEDDING_MAX_WORKERS richieste parallele) e batch in volo durante l'estrazione
+RAG_INGESTION_BATCH_SIZE = int(os.getenv('RAG_INGESTION_BATCH_SIZE', '128'))
+RAG_INGESTION_MAX_PENDING_BATCHES = int(os.getenv('RAG_INGESTION_MAX_PENDING_BATCHES', '2'))
+# Righe per INSERT nella scrittura in blocco dei chunk
+RAG_DB_BULK_BATCH_SIZE = int(os.getenv('RAG_DB_BULK_BATCH_SIZE', '1000'))
+
+# Importazione in blocco nelle knowledge base: elementi massimi per job e documenti
+# processati in parallelo per utente (il resto resta in coda nel job)
+RAG_IMPORT_MAX_ITEMS = int(os.getenv('RAG_IMPORT_MAX_ITEMS', '500'))
+RAG_IMPORT_MAX_CONCURRENCY_PER_USER = int(os.getenv('RAG_IMPORT_MAX_CONCURRENCY_PER_USER', '2'))
+# Durata massima di un elemento (poi il task viene interrotto e l'elemento fallisce) ed età
+# oltre cui un elemento in corso senza esito (worker terminato) viene segnato come fallito
+RAG_IMPORT_ITEM_TIME_LIMIT = int(os.getenv('RAG_IMPORT_ITEM_TIME_LIMIT', '1800'))
+RAG_IMPORT_ITEM_STALE_SECONDS = int(os.getenv('RAG_IMPORT_ITEM_STALE_SECONDS', '3600'))
+
+# Blocchi del download in streaming delle risorse dal Resource Manager
+RAG_RESOURCE_DOWNLOAD_BLOCK_SIZE = int(os.getenv('RAG_RESOURCE_DOWNLOAD_BLOCK_SIZE', str(1024 * 1024)))
+
+# Storage del Resource Manager montato in sola lettura (vuoto: file sempre scaricati via HTTP)
+RESOURCE_MANAGER_SHARED_STORAGE_ROOT = os.getenv('RESOURCE_MANAGER_SHARED_STORAGE_ROOT', '')
+# I file del volume condiviso vengono letti sul posto e ci si fida dello SHA-256 del Resource
+# Manager; con True il file viene riletto per verificarlo (una lettura completa in più)
+RAG_SHARED_STORAGE_VERIFY_CHECKSUM = os.getenv('RAG_SHARED_STORAGE_VERIFY_CHECKSUM', 'False') == 'True'
+
+# Estrazione parallela per pagine (PDF in un pool di processi billiard, OCR in un pool di thread).
+# Ogni figlio dei worker Celery prefork ha il proprio pool: con RAG_WORKER_CONCURRENCY task
+# in parallelo i processi di estrazione possono arrivare a RAG_WORKER_CONCURRENCY * max_workers
+RAG_EXTRACTION_MAX_WORKERS = int(os.getenv('RAG_EXTRACTION_MAX_WORKERS', '0'))  # 0 = min(4, CPU)
+RAG_EXTRACTION_PAGES_PER_TASK = int(os.getenv('RAG_EXTRACTION_PAGES_PER_TASK', '16'))
+
+# Tipo dei vettori salvati su disco: 'float32' o 'float16' (dimezza spazio e page cache)
+RAG_EMBEDDING_STORAGE_DTYPE = os.getenv('RAG_EMBEDDING_STORAGE_DTYPE', 'float32')
+
+# Indici approssimati (IVF/HNSW/PQ): usati solo oltre questa soglia di vettori per scope
+RAG_ANN_MIN_VECTORS = int(os.getenv('RAG_ANN_MIN_VECTORS', '10000'))
+RAG_ANN_NPROBE = int(os.getenv('RAG_ANN_NPROBE', '16'))
+RAG_ANN_EF_SEARCH = int(os.getenv('RAG_ANN_EF_SEARCH', '64'))
+
+# Ricerca ibrida: full-text Postgres (tsvector/GIN) fusa con la ricerca vettoriale (RRF)
+RAG_HYBRID_SEARCH = os.getenv('RAG_HYBRID_SEARCH', 'True') == 'True'
+RAG_TEXT_SEARCH_CONFIG = os.getenv('RAG_TEXT_SEARCH_CONFIG', 'italian')
+
+# Rerank con cross-encoder locale: si recuperano RAG_RERANK_CANDIDATES chunk e si tengono i top_k
+# (default per le knowledge base che non lo configurano)
+RAG_RERANK_ENABLED = os.getenv('RAG_RERANK_ENABLED', 'False') == 'True'
+RAG_RERANK_MODEL = os.getenv('RAG_RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RAG_RERANK_CANDIDATES = int(os.getenv('RAG_RERANK_CANDIDATES', '20'))
+RAG_RERANK_BATCH_SIZE = int(os.getenv('RAG_RERANK_BATCH_SIZE', '32'))
+RAG_RERANK_MAX_LENGTH = int(os.getenv('RAG_RERANK_MAX_LENGTH', '512'))
+
+# Contesto dei prompt RAG: token massimi dei chunk inviati al modello (ridotti se la finestra
+# del modello, meno domanda e risposta, è più piccola); RAG_CONTEXT_WINDOW_TOKENS=0 la ricava dal modello
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv('RAG_CONTEXT_MAX_TOKENS', '3000'))
+RAG_CONTEXT_WINDOW_TOKENS = int(os.getenv('RAG_CONTEXT_WINDOW_TOKENS', '0'))
+
+# Porta su cui i worker Celery espongono le metriche Prometheus (0 = disattivate); il servizio
+# web le espone su /metrics. I processi figli (prefork, worker gunicorn) scrivono le metriche in
+# PROMETHEUS_MULTIPROC_DIR, impostata e svuotata all'avvio da entrypoint.sh
+RAG_WORKER_METRICS_PORT = int(os.getenv('RAG_WORKER_METRICS_PORT', '0'))
+# /metrics risponde solo con l'header X-Internal-Secret o agli indirizzi elencati qui
+# (es. "10.0.0.5,10.0.0.6" per uno scraper Prometheus che non invia header)
+RAG_METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('RAG_METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# Cache delle risposte della chat nello stesso corpus (knowledge base alla stessa versione dei
+# contenuti). Di default solo corrispondenza esatta sulla domanda normalizzata.
+# RAG_ANSWER_CACHE_SEMANTIC riusa anche la risposta di una domanda simile (similarità coseno
+# >= RAG_ANSWER_CACHE_SIMILARITY): più hit, ma domande vicine con significato diverso
+# ("aumentare" / "ridurre" il timeout) possono ricevere la risposta sbagliata e ogni domanda
+# salvata richiede un embedding
+RAG_ANSWER_CACHE_ENABLED = os.getenv('RAG_ANSWER_CACHE_ENABLED', 'True') == 'True'
+RAG_ANSWER_CACHE_SEMANTIC = os.getenv('RAG_ANSWER_CACHE_SEMANTIC', 'False') == 'True'
+RAG_ANSWER_CACHE_PATH = os.getenv(
+    'RAG_ANSWER_CACHE_PATH', os.path.join(RAG_EMBEDDINGS_ROOT, 'answer_cache.sqlite3')
+)
+RAG_ANSWER_CACHE_SIMILARITY = float(os.getenv('RAG_ANSWER_CACHE_SIMILARITY', '0.95'))
+RAG_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('RAG_ANSWER_CACHE_MAX_ENTRIES', '20000'))
+RAG_ANSWER_CACHE_MAX_CANDIDATES = int(os.getenv('RAG_ANSWER_CACHE_MAX_CANDIDATES', '1000'))
+RAG_ANSWER_CACHE_TTL = int(os.getenv('RAG_ANSWER_CACHE_TTL', str(24 * 3600)))
+
+# Cache degli embeddings delle query: LRU in-process + file SQLite condiviso tra i worker
+# (RAG_QUERY_EMBEDDING_CACHE_PATH vuoto = solo in memoria)
+RAG_QUERY_EMBEDDING_CACHE_PATH = os.getenv(
+    'RAG_QUERY_EMBEDDING_CACHE_PATH', os.path.join(RAG_EMBEDDINGS_ROOT, 'query_embedding_cache.sqlite3')
+)
+RAG_QUERY_EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_MEMORY_ENTRIES', '2048'))
+RAG_QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+RAG_QUERY_EMBEDDING_CACHE_TTL = int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_TTL', str(7 * 24 * 3600)))
+
+# Archivio dei vettori dei chunk indirizzato per contenuto: evita di ri-embeddare
+# chunk già visti (riprocessamento, stesso file caricato da più utenti)
+RAG_CHUNK_EMBEDDING_STORE_PATH = os.getenv(
+    'RAG_CHUNK_EMBEDDING_STORE_PATH', os.path.join(RAG_EMBEDDINGS_ROOT, 'chunk_embeddings.sqlite3')
+)
+RAG_CHUNK_EMBEDDING_STORE_MAX_ENTRIES = int(os.getenv('RAG_CHUNK_EMBEDDING_STORE_MAX_ENTRIES', '2000000'))
 
 # OpenAI settings
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or get_secret('OPENAI_API_KEY', '')
@@ -186,6 +283,11 @@ OPENAI_EMBEDDING_DIMENSIONS = os.getenv('OPENAI_EMBEDDING_DIMENSIONS')  # None =
 if OPENAI_EMBEDDING_DIMENSIONS:
     OPENAI_EMBEDDING_DIMENSIONS = int(OPENAI_EMBEDDING_DIMENSIONS)
 
+# Batching concorrente degli embeddings: richieste parallele, token per richiesta, retry su 429/5xx
+OPENAI_EMBEDDING_MAX_WORKERS = int(os.getenv('OPENAI_EMBEDDING_MAX_WORKERS', '4'))
+OPENAI_EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('OPENAI_EMBEDDING_BATCH_MAX_TOKENS', '100000'))
+OPENAI_EMBEDDING_MAX_RETRIES = int(os.getenv('OPENAI_EMBEDDING_MAX_RETRIES', '5'))
+
 # Embedding Provider Configuration
 EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'openai')  # 'openai' o 'sentence_transformers'
 
@@ -198,6 +300,9 @@ RESOURCE_MANAGER_INTERNAL_URL = os.getenv('RESOURCE_MANAGER_INTERNAL_URL')
 INTERNAL_API_SECRET_HEADER_NAME = 'X-Internal-Secret'
 INTERNAL_API_SECRET_VALUE = os.getenv('INTERNAL_API_SECRET')
 
+# Timeout (secondi) per la lettura dei testi già estratti dal Resource Manager
+RAG_SHARED_EXTRACTION_TIMEOUT = int(os.getenv('RAG_SHARED_EXTRACTION_TIMEOUT', '10'))
+
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
@@ -6,9 +6,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from rag_api.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('rag_api.urls')),
+    # Metriche Prometheus: fuori da /api/, per lo scraping interno
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Serve media files in development
@@ -0,0 +1,246 @@
+"""
+Cache su disco dei testi estratti, indirizzata per hash SHA-256 del contenuto del file.
+
+Il testo di ogni file viene estratto una sola volta (durante ``process_uploaded_resource``)
+e salvato come lista di segmenti (pagine per i PDF, paragrafi/righe di tabella per i DOCX,
+testo intero per i file di testo). Gli altri servizi (es. rag_service) lo leggono tramite
+l'endpoint interno ``internal/extractions/<sha256>/`` invece di ri-estrarre il file.
+
+Formato di una voce (``<root>/<hash[:2]>/<hash>.jsonl``), JSON-lines: un'intestazione
+seguita da un segmento (stringa JSON) per riga, così la voce può essere letta e inviata
+in streaming senza caricare tutto il testo in memoria::
+
+    {"format_version": 3, "sha256": "...", "mime_type": "...", "pdf_extractor": "PyPDF2/3.0.1"}
+    "testo della pagina 1"
+    "testo della pagina 2"
+
+Concatenando i segmenti con ``"".join`` si ottiene il testo estratto. Il testo dei PDF
+dipende dalla versione della libreria: le voci estratte con una versione diversa da
+quella installata (``pdf_extractor``) non vengono riusate, e rag_service applica lo
+stesso controllo (le due versioni sono fissate uguali nei requirements dei due servizi).
+
+I PDF grandi su storage locale vengono estratti per intervalli di pagine in un pool di
+processi ``billiard`` (il fork di multiprocessing usato da Celery, che consente di creare
+processi anche dai figli daemon dei worker prefork); il risultato è identico a quello
+dell'estrazione sequenziale.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import billiard
+import PyPDF2
+from billiard.exceptions import WorkerLostError
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+# Versione del formato dei segmenti: va incrementata se cambia il modo di estrarre il testo
+FORMAT_VERSION = 3
+
+# Libreria (e versione) con cui vengono estratti i PDF
+PDF_EXTRACTOR = f"PyPDF2/{PyPDF2.__version__}"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+CONTENT_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _cache_root() -> Path:
+    return Path(getattr(settings, 'EXTRACTION_CACHE_ROOT', Path(settings.MEDIA_ROOT) / 'extraction_cache'))
+
+
+def _entry_path(content_hash: str) -> Path:
+    return _cache_root() / content_hash[:2] / f"{content_hash}.jsonl"
+
+
+def is_valid_hash(content_hash: str) -> bool:
+    return bool(CONTENT_HASH_RE.match(content_hash or ''))
+
+
+def compute_storage_file_hash(file_name: str) -> str:
+    """
+    Calcola lo SHA-256 di un file nello storage leggendolo a blocchi.
+    """
+    digest = hashlib.sha256()
+    with default_storage.open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdf_segments(file) -> List[str]:
+    """
+    Estrae il testo di un PDF (file-like binario), un segmento per pagina.
+
+    Deve restare identica all'estrazione per pagine di rag_service, che riusa questi segmenti.
+    """
+    reader = PyPDF2.PdfReader(file)
+    return [page.extract_text() for page in reader.pages]
+
+
+def _max_workers() -> int:
+    configured = getattr(settings, 'EXTRACTION_MAX_WORKERS', 0)
+    return configured if configured > 0 else min(4, os.cpu_count() or 1)
+
+
+def _pages_per_task() -> int:
+    return max(1, getattr(settings, 'EXTRACTION_PAGES_PER_TASK', 16))
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = billiard.get_context('spawn').Pool(processes=_max_workers())
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """
+    Termina il pool di processi per l'estrazione (se esiste); verrà ricreato alla prossima richiesta.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.terminate()
+            _process_pool.join()
+            _process_pool = None
+
+
+def _extract_pdf_page_range(path: str, start: int, end: int) -> List[str]:
+    """
+    Estrae il testo delle pagine [start, end) di un PDF (eseguita nei processi del pool).
+    """
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[page_num].extract_text() for page_num in range(start, end)]
+
+
+def extract_pdf_file_segments(path: str) -> List[str]:
+    """
+    Estrae il testo di un PDF su disco, un segmento per pagina, in parallelo per intervalli di pagine.
+
+    I PDF con poche pagine vengono estratti nel processo corrente, dove il costo del pool
+    non sarebbe ripagato. Il risultato coincide con ``extract_pdf_segments``.
+    """
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        num_pages = len(reader.pages)
+        pages_per_task = _pages_per_task()
+        if min(_max_workers(), -(-num_pages // pages_per_task)) <= 1:
+            return [page.extract_text() for page in reader.pages]
+
+    logger.info(f"Estrazione PDF parallela: {num_pages} pagine")
+    pool = _get_process_pool()
+    results = [
+        pool.apply_async(_extract_pdf_page_range, (path, start, min(start + pages_per_task, num_pages)))
+        for start in range(0, num_pages, pages_per_task)
+    ]
+    try:
+        return [page for result in results for page in result.get()]
+    except WorkerLostError:
+        # Un worker è terminato in modo anomalo: il pool verrà ricreato alla prossima estrazione
+        shutdown_process_pool()
+        raise
+
+
+def open_entry(content_hash: str) -> Optional[Tuple[Dict, object]]:
+    """
+    Apre la voce in cache per l'hash indicato e ne legge l'intestazione.
+
+    Returns:
+        Optional[Tuple[Dict, file]]: Intestazione e file binario posizionato sul primo
+            segmento (da chiudere a cura del chiamante), o None se assente o in un formato diverso
+    """
+    if not is_valid_hash(content_hash):
+        return None
+    path = _entry_path(content_hash)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"Voce della cache di estrazione non leggibile ({path}): {e}")
+        return None
+
+    try:
+        header = json.loads(f.readline())
+    except ValueError as e:
+        logger.warning(f"Voce della cache di estrazione non leggibile ({path}): {e}")
+        header = None
+    if not isinstance(header, dict) or header.get('format_version') != FORMAT_VERSION \
+            or header.get('pdf_extractor') != PDF_EXTRACTOR:
+        f.close()
+        return None
+    return header, f
+
+
+def get_entry(content_hash: str) -> Optional[Dict]:
+    """
+    Restituisce l'intestazione della voce in cache (None se assente o in un formato diverso).
+    """
+    opened = open_entry(content_hash)
+    if opened is None:
+        return None
+    header, f = opened
+    f.close()
+    return header
+
+
+def iter_segments(f) -> Iterator[str]:
+    """
+    Segmenti di una voce aperta con ``open_entry``, uno alla volta.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def get_segments(content_hash: str) -> Optional[List[str]]:
+    opened = open_entry(content_hash)
+    if opened is None:
+        return None
+    _, f = opened
+    with f:
+        try:
+            return list(iter_segments(f))
+        except ValueError as e:
+            logger.warning(f"Voce della cache di estrazione non leggibile ({content_hash}): {e}")
+            return None
+
+
+def put_segments(content_hash: str, mime_type: str, segments: Iterable[str]):
+    """
+    Salva i segmenti estratti di un file (scrittura atomica, idempotente).
+    """
+    if not is_valid_hash(content_hash):
+        raise ValueError(f"Invalid content hash: {content_hash}")
+
+    path = _entry_path(content_hash)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = {
+        'format_version': FORMAT_VERSION,
+        'sha256': content_hash,
+        'mime_type': mime_type,
+        'pdf_extractor': PDF_EXTRACTOR,
+    }
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for segment in segments:
+                # json.dumps codifica i newline del testo: ogni segmento resta su una riga
+                f.write(json.dumps(segment, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
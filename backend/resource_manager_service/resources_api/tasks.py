@@ -3,7 +3,6 @@ import magic  # python-magic
 import pandas as pd
 import docx   # python-docx
 from io import BytesIO
-from PyPDF2 import PdfReader  # pypdf2
 from PIL import Image as PillowImage, UnidentifiedImageError
 from celery import shared_task
 from django.core.files.base import ContentFile
@@ -12,6 +11,7 @@ from django.conf import settings
 from django.db import transaction
 
 from .models import Resource
+from . import extraction_cache
 
 # --- Costanti per Analisi ---
 CSV_SAMPLE_ROWS = 1000  # Leggi le prime N righe per analisi CSV
@@ -19,6 +19,60 @@ TEXT_WORD_THRESHOLD_RAG = 50 # Minimo parole per suggerire RAG
 CATEGORICAL_THRESHOLD_RATIO = 0.2 # Max % di valori unici per considerare una colonna categorica
 MAX_CATEGORIES_SAMPLE = 10 # Max categorie da elencare nei metadati
 
+def _get_or_extract_segments(content_hash, mime_type, extract_segments):
+    """
+    Restituisce i segmenti di testo del file dalla cache di estrazione condivisa,
+    estraendoli (e salvandoli in cache) solo se il contenuto non è mai stato visto.
+    """
+    if content_hash:
+        segments = extraction_cache.get_segments(content_hash)
+        if segments is not None:
+            print(f"    Extraction cache hit for {content_hash[:12]}")
+            return segments
+
+    segments = extract_segments()
+
+    if content_hash:
+        try:
+            extraction_cache.put_segments(content_hash, mime_type, segments)
+        except Exception as cache_exc:
+            print(f"    Warning: could not store extraction cache entry: {cache_exc}")
+    return segments
+
+def _extract_pdf_segments(file_name):
+    # Su storage locale le pagine vengono estratte in parallelo dal file su disco
+    try:
+        path = default_storage.path(file_name)
+    except NotImplementedError:
+        path = None
+    if path is not None:
+        return extraction_cache.extract_pdf_file_segments(path)
+    with default_storage.open(file_name, 'rb') as f:
+        return extraction_cache.extract_pdf_segments(f)
+
+def _extract_docx_segments(file_name):
+    with default_storage.open(file_name, 'rb') as f:
+        # python-docx legge direttamente dal file-like object
+        document = docx.Document(f)
+        segments = [para.text + "\n" for para in document.paragraphs]
+        # Testo delle tabelle, una riga per segmento
+        for table in document.tables:
+            for row in table.rows:
+                segments.append("".join(cell.text + " " for cell in row.cells) + "\n")
+        return segments
+
+def _extract_text_segments(file_name):
+    with default_storage.open(file_name, 'rb') as f:
+        # Leggi come bytes e decodifica manualmente
+        content_bytes = f.read()
+    try:
+        text_content = content_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        # Fallback con latin-1 se UTF-8 fallisce
+        text_content = content_bytes.decode('latin-1', errors='ignore')
+    # Newline normalizzati come nella lettura in modalità testo
+    return [text_content.replace('\r\n', '\n').replace('\r', '\n')]
+
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def process_uploaded_resource(self, resource_id):
     """
@@ -102,8 +156,17 @@ def process_uploaded_resource(self, resource_id):
                  processing_errors.append(f"MIME detection failed: {mime_exc}")
                  resource.mime_type = 'application/octet-stream' # Fallback
 
+            # --- Hash del contenuto (chiave della cache di estrazione condivisa) ---
+            content_hash = None
+            try:
+                content_hash = extraction_cache.compute_storage_file_hash(resource.file.name)
+            except Exception as hash_exc:
+                print(f"[Task ID: {self.request.id}]   Warning: content hash failed: {hash_exc}")
+
             # --- Analisi Contenuto e Suggerimenti ---
             metadata_extracted = {}
+            if content_hash:
+                metadata_extracted['content_sha256'] = content_hash
             content_buffer = None # Riusato per diversi tipi
 
             # 1. Analisi CSV
@@ -212,13 +275,12 @@ def process_uploaded_resource(self, resource_id):
             elif resource.mime_type == 'application/pdf':
                 print(f"[Task ID: {self.request.id}]   Processing as PDF...")
                 try:
-                    text_content = ""
-                    page_count = 0
-                    with default_storage.open(resource.file.name, 'rb') as f:
-                        reader = PdfReader(f)
-                        page_count = len(reader.pages)
-                        for page in reader.pages:
-                            text_content += page.extract_text() + "\n"
+                    pages = _get_or_extract_segments(
+                        content_hash, resource.mime_type,
+                        lambda: _extract_pdf_segments(resource.file.name)
+                    )
+                    page_count = len(pages)
+                    text_content = "".join(page + "\n" for page in pages)
 
                     word_count = len(text_content.split())
                     metadata_extracted['page_count'] = page_count
@@ -233,13 +295,10 @@ def process_uploaded_resource(self, resource_id):
             elif resource.mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword'] or resource.original_filename.lower().endswith(('.docx')):
                 print(f"[Task ID: {self.request.id}]   Processing as DOCX...")
                 try:
-                     text_content = ""
-                     with default_storage.open(resource.file.name, 'rb') as f:
-                         # python-docx legge direttamente dal file-like object
-                         document = docx.Document(f)
-                         for para in document.paragraphs:
-                             text_content += para.text + "\n"
-                         # TODO: Estrarre testo da tabelle se necessario
+                     text_content = "".join(_get_or_extract_segments(
+                         content_hash, resource.mime_type,
+                         lambda: _extract_docx_segments(resource.file.name)
+                     ))
                      word_count = len(text_content.split())
                      # page_count non facilmente ottenibile da python-docx
                      metadata_extracted['word_count_approx'] = word_count
@@ -253,14 +312,10 @@ def process_uploaded_resource(self, resource_id):
             elif resource.mime_type and resource.mime_type.startswith('text/'):
                 print(f"[Task ID: {self.request.id}]   Processing as generic TEXT...")
                 try:
-                     with default_storage.open(resource.file.name, 'rb') as f:
-                         # Leggi come bytes e decodifica manualmente
-                         content_bytes = f.read()
-                         try:
-                             text_content = content_bytes.decode('utf-8')
-                         except UnicodeDecodeError:
-                             # Fallback con latin-1 se UTF-8 fallisce
-                             text_content = content_bytes.decode('latin-1', errors='ignore')
+                     text_content = "".join(_get_or_extract_segments(
+                         content_hash, resource.mime_type,
+                         lambda: _extract_text_segments(resource.file.name)
+                     ))
                      
                      word_count = len(text_content.split())
                      metadata_extracted['word_count_approx'] = word_count
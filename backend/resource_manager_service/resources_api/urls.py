@@ -20,11 +20,16 @@ urlpatterns = [
     path('storage-info/', views.UserStorageInfoView.as_view(), name='storage-info'),
     path('internal/resources/upload-synthetic-content/', views.InternalSyntheticContentUploadView.as_view(), name='internal-synthetic-upload'),
     path('internal/resources/<int:resource_id>/content/', views.InternalContentView.as_view(), name='internal-resource-content'),
+    path('internal/resources/<int:resource_id>/handoff/', views.InternalResourceHandoffView.as_view(), name='internal-resource-handoff'),
     
     # Nuovi endpoint interni per RAG
     path('internal/rag/resources/', views.InternalRagResourcesView.as_view(), name='internal-rag-resources'),
+    path('internal/rag/resources/<int:resource_id>/', views.InternalRagResourceDetailView.as_view(), name='internal-rag-resource-detail'),
     path('internal/rag/resources/<int:resource_id>/content/', views.InternalRagContentView.as_view(), name='internal-rag-content'),
 
+    # Cache condivisa dei testi estratti (chiave: SHA-256 del contenuto)
+    path('internal/extractions/<str:content_hash>/', views.InternalExtractionView.as_view(), name='internal-extraction'),
+
     # Endpoint per aggiornare i tag di una risorsa specifica
     path('<int:resource_id>/tags/', views.ResourceTagsUpdateView.as_view(), name='resource-tags-update'),
 
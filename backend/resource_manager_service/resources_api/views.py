@@ -27,6 +27,7 @@ from .models import Resource, Tag
 from .serializers import ResourceSerializer, UploadRequestSerializer, UploadResponseSerializer, InternalSyntheticContentUploadSerializer, TagSerializer
 from .authentication import JWTCustomAuthentication
 from .tasks import process_uploaded_resource # Importa il task Celery
+from . import extraction_cache
 from .permissions import AllowInternalOnly # <-- Importa il nuovo permesso
 
 class UploadView(views.APIView):
@@ -146,6 +147,47 @@ class PassthroughRenderer(BaseRenderer):
         # Altrimenti, non fare nulla (o solleva errore se non previsto)
         return data
 
+def _stream_resource_file(resource):
+    """
+    Risposta in streaming con il contenuto del file di una risorsa.
+    FileResponse legge e invia il file a blocchi: non viene mai caricato tutto in memoria.
+    """
+    response = FileResponse(
+        default_storage.open(resource.file.name, 'rb'),
+        content_type=resource.mime_type or 'application/octet-stream'
+    )
+    response['Content-Disposition'] = f'inline; filename="{resource.original_filename}"'
+    try: response['Content-Length'] = default_storage.size(resource.file.name)
+    except NotImplementedError: pass
+    return response
+
+def _storage_handoff_info(resource):
+    """
+    Percorso relativo allo storage e checksum di una risorsa, per i servizi che montano
+    lo storage in sola lettura e aprono il file direttamente invece di scaricarlo.
+    Restituisce None se il passaggio locale è disattivato o lo storage non è su file system.
+    """
+    if not getattr(settings, 'INTERNAL_STORAGE_HANDOFF_ENABLED', False) or not resource.file:
+        return None
+    try:
+        default_storage.path(resource.file.name)
+    except NotImplementedError:
+        return None # Storage remoto (es. S3): solo HTTP
+
+    metadata = resource.metadata or {}
+    content_hash = metadata.get('content_sha256')
+    if not content_hash:
+        # Risorse processate prima dell'hash in metadata: lo calcola una volta e lo salva
+        content_hash = extraction_cache.compute_storage_file_hash(resource.file.name)
+        metadata['content_sha256'] = content_hash
+        Resource.objects.filter(pk=resource.pk).update(metadata=metadata)
+
+    return {
+        'storage_path': resource.file.name,
+        'sha256': content_hash,
+        'size': resource.size if resource.size is not None else default_storage.size(resource.file.name),
+    }
+
 class InternalContentView(views.APIView):
     """
     Endpoint INTERNO per ottenere il contenuto raw.
@@ -168,21 +210,7 @@ class InternalContentView(views.APIView):
                              status=status.HTTP_404_NOT_FOUND)
 
         try:
-            with default_storage.open(resource.file.name, 'rb') as f:
-                file_content = f.read()
-
-            content_type = resource.mime_type or 'application/octet-stream'
-
-            # --- Usa ANCORA HttpResponse per impostare Content-Type e Disposition ---
-            # Il PassthroughRenderer estrarrà il contenuto da questo oggetto
-            response = HttpResponse(file_content, content_type=content_type)
-            response['Content-Disposition'] = f'inline; filename="{resource.original_filename}"'
-            try: response['Content-Length'] = default_storage.size(resource.file.name)
-            except NotImplementedError: pass
-
-            # Restituisci l'oggetto HttpResponse. Il renderer lo gestirà.
-            return response
-            # --- FINE MODIFICA ---
+            return _stream_resource_file(resource)
 
         except Exception as e:
             print(f"Error serving internal content for resource {resource_id}: {e}")
@@ -430,6 +458,72 @@ class InternalRagResourcesView(views.APIView):
                 'details': str(e) if settings.DEBUG else 'Dettagli non disponibili'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class InternalRagResourceDetailView(views.APIView):
+    """
+    Endpoint INTERNO per i metadati di una singola risorsa (senza elencare tutte quelle dell'utente).
+    Con ?user_id= verifica anche che la risorsa appartenga all'utente.
+    """
+    permission_classes = [AllowInternalOnlyWithSecret]
+    authentication_classes = []
+
+    def get(self, request, resource_id, *args, **kwargs):
+        resource = get_object_or_404(Resource.objects.prefetch_related('tags'), pk=resource_id)
+
+        user_id = request.GET.get('user_id')
+        if user_id and str(resource.owner_id) != str(user_id):
+            # Stessa risposta di una risorsa inesistente: non rivela risorse di altri utenti
+            return Response({"error": "Resource not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if resource.status != Resource.Status.COMPLETED:
+            return Response({
+                "error": f"Resource not processed (status: {resource.status})."
+            }, status=status.HTTP_409_CONFLICT)
+
+        serializer = ResourceSerializer(resource, context={'request': request})
+        data = serializer.data
+        try:
+            data['storage_handoff'] = _storage_handoff_info(resource)
+        except Exception as e:
+            logger.warning(f"Storage handoff non disponibile per la risorsa {resource_id}: {e}")
+            data['storage_handoff'] = None
+        return Response(data, status=status.HTTP_200_OK)
+
+class InternalResourceHandoffView(views.APIView):
+    """
+    Endpoint INTERNO per il passaggio locale di un file: restituisce percorso relativo allo
+    storage, SHA-256 e dimensione. Il chiamante apre il file dal volume condiviso montato in
+    sola lettura; se riceve 404 (passaggio disattivato) usa l'endpoint /content/.
+    Con ?user_id= verifica anche che la risorsa appartenga all'utente.
+    """
+    permission_classes = [AllowInternalOnlyWithSecret]
+    authentication_classes = []
+
+    def get(self, request, resource_id, *args, **kwargs):
+        resource = get_object_or_404(Resource, pk=resource_id)
+
+        user_id = request.GET.get('user_id')
+        if user_id and str(resource.owner_id) != str(user_id):
+            return Response({"error": "Resource not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if resource.status != Resource.Status.COMPLETED:
+            return Response({
+                "error": f"Resource not processed (status: {resource.status})."
+            }, status=status.HTTP_409_CONFLICT)
+
+        if not resource.file or not default_storage.exists(resource.file.name):
+            return Response({"error": "Resource file not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        handoff = _storage_handoff_info(resource)
+        if handoff is None:
+            return Response({"error": "Local storage handoff not available."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'id': resource.id,
+            'original_filename': resource.original_filename,
+            'mime_type': resource.mime_type,
+            **handoff,
+        }, status=status.HTTP_200_OK)
+
 class TagViewSet(viewsets.ModelViewSet):
     """
     ViewSet per gestire i tag delle risorse.
@@ -536,25 +630,33 @@ class InternalRagContentView(views.APIView):
         
         try:
             logger.info(f"  Serving RAG-compatible file: {resource.original_filename} ({resource.mime_type})")
-            
-            with default_storage.open(resource.file.name, 'rb') as f:
-                file_content = f.read()
-            
-            content_type = resource.mime_type or 'application/octet-stream'
-            
-            # Usa HttpResponse per impostare Content-Type e Disposition
-            response = HttpResponse(file_content, content_type=content_type)
-            response['Content-Disposition'] = f'inline; filename="{resource.original_filename}"'
-            
-            try:
-                response['Content-Length'] = default_storage.size(resource.file.name)
-            except NotImplementedError:
-                pass
-            
-            return response
+            return _stream_resource_file(resource)
             
         except Exception as e:
             logger.error(f"  Error serving RAG content for resource {resource_id}: {e}")
             return Response({
                 "error": "Could not serve file content."
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class InternalExtractionView(views.APIView):
+    """
+    Endpoint INTERNO per leggere il testo estratto di un file dalla cache condivisa.
+    La chiave è lo SHA-256 del contenuto del file: il chiamante calcola l'hash dei byte
+    che possiede e, se il file è già stato estratto qui, ne riceve i segmenti di testo.
+    """
+    permission_classes = [AllowInternalOnlyWithSecret]
+    authentication_classes = []
+
+    def get(self, request, content_hash, *args, **kwargs):
+        if not extraction_cache.is_valid_hash(content_hash):
+            return Response({"error": "Invalid content hash."}, status=status.HTTP_400_BAD_REQUEST)
+
+        opened = extraction_cache.open_entry(content_hash)
+        if opened is None:
+            return Response({"error": "Extraction not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # La voce è già in JSON-lines (intestazione + un segmento per riga): si invia il file
+        # in streaming, senza caricarne il testo in memoria
+        _, entry_file = opened
+        entry_file.seek(0)
+        return FileResponse(entry_file, content_type='application/x-ndjson')
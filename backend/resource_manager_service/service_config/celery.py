@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 from django.conf import settings
 
 # Imposta il modulo delle impostazioni di Django per il programma 'celery'.
@@ -24,4 +25,14 @@ app.autodiscover_tasks()
 # Task di esempio (utile per testare se il worker funziona)
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+
+@worker_process_shutdown.connect
+def shutdown_extraction_pool(**kwargs):
+    """
+    Chiude il pool di processi per l'estrazione dei PDF del processo figlio che termina.
+    """
+    from resources_api.extraction_cache import shutdown_process_pool
+
+    shutdown_process_pool()
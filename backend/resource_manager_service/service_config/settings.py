@@ -272,3 +272,13 @@ THUMBNAIL_SIZE = (256, 256) # Dimensione thumbnail (larghezza, altezza)
 INTERNAL_API_SECRET_HEADER_NAME = 'X-Internal-Secret' # Puoi cambiare il nome se preferisci
 INTERNAL_API_SECRET_VALUE = os.getenv('INTERNAL_API_SECRET', None)
 RESOURCE_MANAGER_INTERNAL_URL = os.getenv('RESOURCE_MANAGER_INTERNAL_URL', 'http://pl-ai-resource-manager-service:8000')
+
+# Cache su disco dei testi estratti, indirizzata per SHA-256 del contenuto
+EXTRACTION_CACHE_ROOT = os.getenv('EXTRACTION_CACHE_ROOT', str(MEDIA_ROOT / 'extraction_cache'))
+# Estrazione dei PDF per intervalli di pagine in un pool di processi (per figlio dei worker Celery)
+EXTRACTION_MAX_WORKERS = int(os.getenv('EXTRACTION_MAX_WORKERS', '0'))  # 0 = min(4, CPU)
+EXTRACTION_PAGES_PER_TASK = int(os.getenv('EXTRACTION_PAGES_PER_TASK', '16'))
+
+# Passaggio dei file ad altri servizi tramite volume condiviso (sola lettura): gli endpoint
+# interni restituiscono il percorso relativo allo storage e lo SHA-256 del file
+INTERNAL_STORAGE_HANDOFF_ENABLED = os.getenv('INTERNAL_STORAGE_HANDOFF_ENABLED', 'False') == 'True'